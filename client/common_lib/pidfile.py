@@ -2,18 +2,52 @@ import os
 import logging
 
 
+# If set in the environment, the path of a log to which the contents of our
+# pidfile are appended whenever it is written, so that the scheduler does not
+# need to read the pidfile itself.
+EVENT_LOG_ENVIRONMENT_VAR = 'AUTOTEST_PIDFILE_EVENT_LOG'
+
+
 class PidFileManager(object):
     def __init__(self, label, results_dir):
         self.path = os.path.join(results_dir, ".%s_execute" % label)
         self.pid_file = None
         self.num_tests_failed = 0
+        self._pid = None
+
+
+    def _report_event(self, *pidfile_lines):
+        """Append the pidfile contents to the event log, if there is one.
+
+        Each event is a single line holding the absolute pidfile path followed
+        by the lines of the pidfile, separated by tabs. A single write to a
+        file opened for appending keeps events from concurrent processes from
+        interleaving. Events are reported before the pidfile is written, so
+        whoever sees new pidfile contents can also find the event.
+        """
+        event_log = os.environ.get(EVENT_LOG_ENVIRONMENT_VAR)
+        if not event_log:
+            return
+        event = '\t'.join((os.path.abspath(self.path),) + pidfile_lines)
+        try:
+            fd = os.open(event_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0644)
+            try:
+                os.write(fd, event + '\n')
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logging.warning('Failed to report pidfile event to %s: %s',
+                            event_log, e)
 
 
     def open_file(self):
+        self._pid = os.getpid()
+        self._report_event(str(self._pid))
         self.pid_file = open(self.path, "w")
-        self.pid_file.write("%s\n" % os.getpid())
+        self.pid_file.write("%s\n" % self._pid)
         self.pid_file.flush()
-        logging.info("Logged pid %s to %s", os.getpid(), self.path)
+        logging.info("Logged pid %s to %s", self._pid, self.path)
 
 
     def close_file(self, exit_code, signal_code=0):
@@ -22,6 +56,8 @@ class PidFileManager(object):
         pid_file = self.pid_file
         self.pid_file = None
         encoded_exit_code = ((exit_code & 0xFF) << 8) | (signal_code & 0xFF)
+        self._report_event(str(self._pid), str(encoded_exit_code),
+                           str(self.num_tests_failed))
         pid_file.write("%s\n" % encoded_exit_code)
         pid_file.write("%s\n" % self.num_tests_failed)
         pid_file.close()
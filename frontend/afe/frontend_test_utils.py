@@ -1,6 +1,7 @@
-import atexit, datetime, os, tempfile, unittest
+import atexit, contextlib, datetime, os, tempfile, unittest
 import common
 from autotest_lib.frontend import setup_test_environment
+from django.db import connections
 from autotest_lib.frontend import thread_local
 from autotest_lib.frontend.afe import models, model_attributes
 from autotest_lib.client.common_lib import global_config
@@ -81,6 +82,31 @@ class FrontendTestMixin(object):
         self.god.unstub_all()
 
 
+    @contextlib.contextmanager
+    def assert_num_queries(self, num_queries, using='default'):
+        """Assert the enclosed code makes num_queries database queries.
+
+        Use it to check a code path makes a fixed number of queries, rather
+        than one or more per object it handles.
+
+        @param num_queries: The number of queries expected.
+        @param using: The name of the database connection to count on.
+        """
+        connection = connections[using]
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        first_query = len(connection.queries)
+        try:
+            yield
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+        queries = [query['sql'] for query in connection.queries[first_query:]]
+        self.assertEqual(len(queries), num_queries,
+                         '%d queries made, %d expected:\n%s' % (
+                                 len(queries), num_queries,
+                                 '\n'.join(queries)))
+
+
     def _create_job(self, hosts=[], metahosts=[], priority=0, active=False,
                     synchronous=False, atomic_group=None, hostless=False,
                     drone_set=None, control_file='control',
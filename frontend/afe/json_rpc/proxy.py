@@ -20,8 +20,10 @@
 """
 
 import os
-import urllib2
+import threading
 from autotest_lib.client.common_lib import error as exceptions
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.frontend.afe.json_rpc import transport as rpc_transport
 
 from json import decoder
 
@@ -47,6 +49,31 @@ except ImportError:
     pass
 
 
+# Number of idle connections to each server kept open for the next RPCs.
+# 0 makes every RPC on a new connection.
+CONNECTION_POOL_SIZE = global_config.global_config.get_config_value(
+        'SERVER', 'rpc_connection_pool_size', type=int, default=4)
+# Whether to ask for gzipped responses.
+ACCEPT_GZIP = global_config.global_config.get_config_value(
+        'SERVER', 'rpc_accept_gzip', type=bool, default=True)
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport():
+    """Get the transport shared by the proxies not given one."""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            if CONNECTION_POOL_SIZE > 0:
+                _default_transport = rpc_transport.KeepAliveTransport(
+                        CONNECTION_POOL_SIZE, accept_gzip=ACCEPT_GZIP)
+            else:
+                _default_transport = rpc_transport.UrllibTransport()
+        return _default_transport
+
+
 class JSONRPCException(Exception):
     pass
 
@@ -88,23 +115,25 @@ def BuildException(error):
     return JSONRPCException(error_message)
 
 class ServiceProxy(object):
-    def __init__(self, serviceURL, serviceName=None, headers=None):
+    def __init__(self, serviceURL, serviceName=None, headers=None,
+                 transport=None):
         self.__serviceURL = serviceURL
         self.__serviceName = serviceName
         self.__headers = headers or {}
+        self.__transport = transport or get_default_transport()
 
     def __getattr__(self, name):
         if self.__serviceName is not None:
             name = "%s.%s" % (self.__serviceName, name)
-        return ServiceProxy(self.__serviceURL, name, self.__headers)
+        return ServiceProxy(self.__serviceURL, name, self.__headers,
+                            self.__transport)
 
     def __call__(self, *args, **kwargs):
         postdata = json_encoder_class().encode({'method': self.__serviceName,
                                                 'params': args + (kwargs,),
                                                 'id': 'jsonrpc'})
-        request = urllib2.Request(self.__serviceURL, data=postdata,
-                                  headers=self.__headers)
-        respdata = urllib2.urlopen(request).read()
+        respdata = self.__transport.request(self.__serviceURL, postdata,
+                                            self.__headers)
         try:
             resp = decoder.JSONDecoder().decode(respdata)
         except ValueError:
@@ -113,3 +142,36 @@ class ServiceProxy(object):
             raise BuildException(resp['error'])
         else:
             return resp['result']
+
+    def _call_batch(self, calls):
+        """Make several RPCs in a single request.
+
+        The name starts with an underscore so it can't hide an RPC, RPC names
+        never do.
+
+        @param calls: A list of (method, args, kwargs) tuples.
+
+        @returns: A list of (result, exception) tuples, one per call, in
+                  order. exception is None if the call succeeded, else it is
+                  the exception raised on the server, as built by
+                  BuildException.
+        """
+        postdata = json_encoder_class().encode(
+                [{'method': method, 'params': tuple(args) + (kwargs,),
+                  'id': index}
+                 for index, (method, args, kwargs) in enumerate(calls)])
+        respdata = self.__transport.request(self.__serviceURL, postdata,
+                                            self.__headers)
+        try:
+            resps = decoder.JSONDecoder().decode(respdata)
+        except ValueError:
+            raise JSONRPCException('Error decoding JSON reponse:\n' + respdata)
+        if not isinstance(resps, list) or len(resps) != len(calls):
+            raise JSONRPCException('Bad batch response:\n' + respdata)
+        results = [None] * len(calls)
+        for resp in resps:
+            if resp['error'] is not None:
+                results[resp['id']] = (None, BuildException(resp['error']))
+            else:
+                results[resp['id']] = (resp['result'], None)
+        return results
@@ -18,6 +18,8 @@
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
+import collections
+import itertools
 import traceback
 
 from json import decoder
@@ -64,6 +66,20 @@ def ServiceMethod(fn):
     fn.IsServiceMethod = True
     return fn
 
+
+def StreamedServiceMethod(iterRows):
+    """
+    Decorate a method returning a list with a function taking the same
+    arguments, and returning an iterator of the same rows. Streaming requests
+    call iterRows instead, so that the rows are encoded as they are produced,
+    see dispatchRequest and translateResultChunks.
+    """
+    def decorator(fn):
+        fn.iterRows = iterRows
+        return fn
+    return decorator
+
+
 class ServiceException(Exception):
     pass
 
@@ -87,10 +103,13 @@ class ServiceHandler(object):
     def blank_result_dict(cls):
         return {'id': None, 'result': None, 'err': None, 'err_traceback': None}
 
-    def dispatchRequest(self, request):
+    def dispatchRequest(self, request, streaming=False):
         """
         Invoke a json RPC call from a decoded json request.
         @param request: a decoded json_request
+        @param streaming: if True, methods decorated by StreamedServiceMethod
+                          return an iterator of their rows, to be translated
+                          with translateResultChunks.
         @returns a dictionary with keys id, result, err and err_traceback
         """
         results = self.blank_result_dict()
@@ -111,6 +130,8 @@ class ServiceHandler(object):
         try:
             timer.start()
             meth = self.findServiceEndpoint(methName)
+            if streaming and hasattr(meth, 'iterRows'):
+                meth = meth.iterRows
             results['result'] = self.invokeServiceEndpoint(meth, args)
         except Exception, err:
             results['err_traceback'] = traceback.format_exc()
@@ -128,9 +149,24 @@ class ServiceHandler(object):
             raise BadServiceRequest(request)
 
 
+    def dispatchBatchRequest(self, requests):
+        """
+        Invoke a batch of json RPC calls, one after the other.
+        @param requests: a list of decoded json requests
+        @returns a list of dictionaries, as returned by dispatchRequest, in
+                 the order of the requests
+        """
+        if not requests:
+            raise BadServiceRequest(requests)
+        return [self.dispatchRequest(request) for request in requests]
+
+
     def handleRequest(self, jsonRequest):
         request = self.translateRequest(jsonRequest)
-        results = self.dispatchRequest(request)
+        if isinstance(request, list):
+            results = self.dispatchBatchRequest(request)
+        else:
+            results = self.dispatchRequest(request)
         return self.translateResult(results)
 
 
@@ -154,12 +190,7 @@ class ServiceHandler(object):
         return meth(*args)
 
     @staticmethod
-    def translateResult(result_dict):
-        """
-        @param result_dict: a dictionary containing the result, error, traceback
-                            and id.
-        @returns translated json result
-        """
+    def _translateError(result_dict):
         if result_dict['err'] is not None:
             error_name = result_dict['err'].__class__.__name__
             result_dict['err'] = {'name': error_name,
@@ -167,6 +198,77 @@ class ServiceHandler(object):
                                   'traceback': result_dict['err_traceback']}
             result_dict['result'] = None
 
+
+    @staticmethod
+    def isLargeResult(result_dict, max_rows):
+        """
+        @param result_dict: a dictionary containing the result, error,
+                            traceback and id.
+        @param max_rows: number of rows above which a list result is large.
+        @returns True if the result is a list of more than max_rows rows, or
+                 an iterator of rows, whose number isn't known.
+        """
+        result = result_dict['result']
+        if result_dict['err'] is not None:
+            return False
+        if isinstance(result, list):
+            return len(result) > max_rows
+        return isinstance(result, collections.Iterator)
+
+
+    @staticmethod
+    def translateResultChunks(result_dict, rows_per_chunk):
+        """
+        Translate a result to json piece by piece, for results too large to
+        be held in memory as a single json string.
+
+        A list result, or an iterator of rows, is encoded rows_per_chunk rows
+        at a time, taking the rows of an iterator only as they are encoded.
+        An error producing the first chunk is translated as the error of the
+        call. Since the first chunks are sent before the last ones are
+        produced and encoded, a later error truncates the output instead.
+
+        @param result_dict: a dictionary containing the result, error,
+                            traceback and id.
+        @param rows_per_chunk: number of rows of a list result per chunk.
+        @returns an iterator of the strings of the json result
+        """
+        result = result_dict['result']
+        if result_dict['err'] is not None or not isinstance(
+                result, (list, collections.Iterator)):
+            yield ServiceHandler.translateResult(result_dict)
+            return
+        rows = iter(result)
+        try:
+            chunk = list(itertools.islice(rows, rows_per_chunk))
+        except Exception, err:
+            result_dict['err_traceback'] = traceback.format_exc()
+            result_dict['err'] = err
+            yield ServiceHandler.translateResult(result_dict)
+            return
+        yield '{"result": ['
+        separator = ''
+        while chunk:
+            yield separator + ', '.join(json_encoder.encode(row)
+                                        for row in chunk)
+            separator = ', '
+            chunk = list(itertools.islice(rows, rows_per_chunk))
+        yield '], "id": %s, "error": null}' % json_encoder.encode(
+                result_dict['id'])
+
+
+    @staticmethod
+    def translateResult(result_dict):
+        """
+        @param result_dict: a dictionary containing the result, error, traceback
+                            and id, or a list of them for a batch request.
+        @returns translated json result
+        """
+        if isinstance(result_dict, list):
+            return '[%s]' % ', '.join(ServiceHandler.translateResult(result)
+                                      for result in result_dict)
+        ServiceHandler._translateError(result_dict)
+
         try:
             json_dict = {'result': result_dict['result'],
                          'id': result_dict['id'],
@@ -6,11 +6,20 @@ from autotest_lib.frontend import setup_django_environment
 import serviceHandler
 
 
+def _iter_range(n):
+    return ({'x': i} for i in range(n))
+
+
 class RpcMethodHolder(object):
     @staticmethod
     def service_1(x, y):
         return x + y
 
+    @staticmethod
+    @serviceHandler.StreamedServiceMethod(_iter_range)
+    def service_range(n):
+        return list(_iter_range(n))
+
     @staticmethod
     def service_2(path):
         return path.split('/')[-1]
@@ -45,6 +54,9 @@ json_request3 = """
 }
 """
 
+json_batch_request = '[%s, %s, %s]' % (json_request1, json_request3,
+                                       json_request2)
+
 
 class TestServiceHandler(unittest.TestCase):
     def setUp(self):
@@ -68,5 +80,103 @@ class TestServiceHandler(unittest.TestCase):
         self.assertNotEquals(response_obj['error'], 'None')
 
 
+    def test_handleBatchRequest(self):
+        response = self.serviceHandler.handleRequest(json_batch_request)
+        response_obj = eval(response.replace('null', 'None'))
+        self.assertEquals(len(response_obj), 3)
+        self.assertEquals(str(response_obj[0]).replace('None', 'null'),
+                          str(eval(expected_response1.replace('null',
+                                                              'None'))
+                              ).replace('None', 'null'))
+        self.assertEquals(response_obj[1]['error']['name'],
+                          'ServiceMethodNotFound')
+        self.assertEquals(response_obj[2]['result'], 'package.rpm')
+
+
+    def test_handleEmptyBatchRequest(self):
+        self.assertRaises(serviceHandler.BadServiceRequest,
+                          self.serviceHandler.handleRequest, '[]')
+
+
+    def test_translateResultChunks(self):
+        result_dict = {'id': 3, 'err': None, 'err_traceback': None,
+                       'result': [{'x': i} for i in range(5)]}
+        self.assertFalse(serviceHandler.ServiceHandler.isLargeResult(
+                result_dict, 5))
+        self.assertTrue(serviceHandler.ServiceHandler.isLargeResult(
+                result_dict, 2))
+        chunks = list(serviceHandler.ServiceHandler.translateResultChunks(
+                dict(result_dict), 2))
+        # The opening, 3 chunks of rows and the closing.
+        self.assertEquals(len(chunks), 5)
+        self.assertEquals(
+                serviceHandler.json_decoder.decode(''.join(chunks)),
+                serviceHandler.json_decoder.decode(
+                        serviceHandler.ServiceHandler.translateResult(
+                                dict(result_dict))))
+
+
+    def test_translateResultChunksError(self):
+        result_dict = {'id': None, 'err': ValueError('bad'),
+                       'err_traceback': 'traceback', 'result': None}
+        self.assertFalse(serviceHandler.ServiceHandler.isLargeResult(
+                result_dict, 0))
+        chunks = list(serviceHandler.ServiceHandler.translateResultChunks(
+                result_dict, 2))
+        self.assertEquals(len(chunks), 1)
+        response = serviceHandler.json_decoder.decode(chunks[0])
+        self.assertEquals(response['error']['name'], 'ValueError')
+
+
+    def test_dispatchStreamingRequest(self):
+        request = {'method': 'service_range', 'params': [3], 'id': 1}
+        result_dict = self.serviceHandler.dispatchRequest(request)
+        self.assertEquals(result_dict['result'], [{'x': 0}, {'x': 1}, {'x': 2}])
+        self.assertFalse(serviceHandler.ServiceHandler.isLargeResult(
+                result_dict, 5))
+        result_dict = self.serviceHandler.dispatchRequest(request,
+                                                          streaming=True)
+        self.assertTrue(serviceHandler.ServiceHandler.isLargeResult(
+                result_dict, 5))
+        chunks = list(serviceHandler.ServiceHandler.translateResultChunks(
+                result_dict, 2))
+        self.assertEquals(len(chunks), 4)
+        self.assertEquals(serviceHandler.json_decoder.decode(''.join(chunks)),
+                          {'result': [{'x': 0}, {'x': 1}, {'x': 2}],
+                           'id': 1, 'error': None})
+
+
+    def test_translateResultChunksIterator(self):
+        produced = []
+        def iter_rows():
+            for i in range(5):
+                produced.append(i)
+                yield {'x': i}
+        result_dict = {'id': 3, 'err': None, 'err_traceback': None,
+                       'result': iter_rows()}
+        chunks = serviceHandler.ServiceHandler.translateResultChunks(
+                result_dict, 2)
+        self.assertEquals(chunks.next(), '{"result": [')
+        # Rows are only produced as their chunk is encoded.
+        self.assertEquals(produced, [0, 1])
+        self.assertEquals(chunks.next(), '{"x": 0}, {"x": 1}')
+        self.assertEquals(produced, [0, 1])
+        self.assertEquals(chunks.next(), ', {"x": 2}, {"x": 3}')
+        self.assertEquals(produced, [0, 1, 2, 3])
+
+
+    def test_translateResultChunksIteratorError(self):
+        def iter_rows():
+            raise ValueError('bad')
+            yield
+        result_dict = {'id': 3, 'err': None, 'err_traceback': None,
+                       'result': iter_rows()}
+        chunks = list(serviceHandler.ServiceHandler.translateResultChunks(
+                result_dict, 2))
+        self.assertEquals(len(chunks), 1)
+        response = serviceHandler.json_decoder.decode(chunks[0])
+        self.assertEquals(response['error']['name'], 'ValueError')
+
+
 if __name__ == "__main__":
     unittest.main()
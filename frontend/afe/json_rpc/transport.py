@@ -0,0 +1,194 @@
+"""HTTP transports of the JSON-RPC ServiceProxy.
+
+urllib2 closes the connection after every request, so each RPC pays for a new
+TCP connection, and its HTTP setup. KeepAliveTransport keeps the connections
+to each server open between requests, and can ask for gzipped responses.
+
+Both transports report failures the way urllib2 does: urllib2.HTTPError for
+non 2xx responses, and urllib2.URLError when the server can't be reached.
+"""
+
+import collections
+import httplib
+import os
+import socket
+import StringIO
+import threading
+import urllib2
+import urlparse
+import zlib
+
+
+# The lines of the BadStatusLine raised by httplib when the server closed the
+# connection without sending anything, depending on the python version.
+_NO_STATUS_LINES = ('', repr(''), 'No status line received - the server has '
+                    'closed the connection')
+
+
+class UrllibTransport(object):
+    """Makes every request on a new connection, through urllib2."""
+
+    def request(self, url, data, headers):
+        """POST data to url.
+
+        @param url: The url to post to.
+        @param data: The request body.
+        @param headers: A dictionary of the request headers.
+
+        @returns: The response body.
+        """
+        request = urllib2.Request(url, data=data, headers=headers)
+        return urllib2.urlopen(request).read()
+
+
+    def close(self):
+        """Close all connections."""
+        pass
+
+
+class _HTTPConnection(httplib.HTTPConnection):
+    """An HTTP connection sending small requests without delay."""
+
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        # The requests are answered before the server acknowledges them, so
+        # Nagle's algorithm would hold back the next request on the
+        # connection until the delayed ACK.
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _HTTPSConnection(httplib.HTTPSConnection):
+    """An HTTPS connection sending small requests without delay."""
+
+    def connect(self):
+        httplib.HTTPSConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class KeepAliveTransport(object):
+    """Makes requests on keep-alive connections, reused between requests.
+
+    Any number of requests can run at the same time, each on its own
+    connection. Once done, up to pool_size connections to every server are
+    kept open for the next requests.
+    """
+
+    def __init__(self, pool_size, accept_gzip=False):
+        """
+        @param pool_size: The number of idle connections kept open to every
+                server.
+        @param accept_gzip: If True, ask for gzipped responses.
+        """
+        self._pool_size = pool_size
+        self._accept_gzip = accept_gzip
+        self._lock = threading.Lock()
+        # Idle connections by (scheme, netloc).
+        self._idle = collections.defaultdict(list)
+        self._pid = os.getpid()
+
+
+    def _get_connection(self, key):
+        """Get an idle connection to a server, or a new one.
+
+        @param key: A (scheme, netloc) tuple.
+
+        @returns: A tuple (connection, reused).
+        """
+        with self._lock:
+            # Sockets inherited through a fork are shared with the parent.
+            if self._pid != os.getpid():
+                self._idle = collections.defaultdict(list)
+                self._pid = os.getpid()
+            idle = self._idle[key]
+            if idle:
+                return idle.pop(), True
+        scheme, netloc = key
+        if scheme == 'https':
+            return _HTTPSConnection(netloc), False
+        return _HTTPConnection(netloc), False
+
+
+    def _put_connection(self, key, connection):
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self._pool_size and self._pid == os.getpid():
+                idle.append(connection)
+                return
+        connection.close()
+
+
+    def request(self, url, data, headers):
+        """POST data to url.
+
+        @param url: The url to post to.
+        @param data: The request body.
+        @param headers: A dictionary of the request headers.
+
+        @returns: The response body, decompressed.
+
+        @raises urllib2.HTTPError: If the response status is not 2xx.
+        @raises urllib2.URLError: If the server could not be reached.
+        """
+        parsed = urlparse.urlsplit(url)
+        key = (parsed.scheme, parsed.netloc)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        headers = dict(headers)
+        headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        if self._accept_gzip:
+            headers['Accept-Encoding'] = 'gzip'
+
+        while True:
+            connection, reused = self._get_connection(key)
+            # The server may have closed an idle connection before getting
+            # the request, which is then tried again on another connection.
+            # Once the request is sent, it may have run, so it is only tried
+            # again if the server closed the connection without answering.
+            try:
+                connection.request('POST', path, data, headers)
+            except socket.timeout as e:
+                connection.close()
+                raise urllib2.URLError(e)
+            except socket.error as e:
+                connection.close()
+                if reused:
+                    continue
+                raise urllib2.URLError(e)
+            try:
+                response = connection.getresponse()
+            except httplib.BadStatusLine as e:
+                connection.close()
+                if reused and e.line in _NO_STATUS_LINES:
+                    continue
+                raise
+            except socket.error as e:
+                connection.close()
+                raise urllib2.URLError(e)
+            break
+
+        try:
+            body = response.read()
+        except:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._put_connection(key, connection)
+
+        if response.getheader('content-encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if not 200 <= response.status < 300:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, StringIO.StringIO(body))
+        return body
+
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, collections.defaultdict(list)
+        for connections in idle.itervalues():
+            for connection in connections:
+                connection.close()
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+import BaseHTTPServer
+import gzip
+import httplib
+import socket
+import StringIO
+import threading
+import unittest
+import urllib2
+
+import common
+from autotest_lib.frontend.afe.json_rpc import proxy
+from autotest_lib.frontend.afe.json_rpc import serviceHandler
+from autotest_lib.frontend.afe.json_rpc import transport
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Echoes the request body, and records the connection of each request."""
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.clients.append(self.client_address)
+        if body == 'garbage':
+            # Answer with a bad status line after handling the request.
+            self.wfile.write('HTTP/1.1 garbage\r\n')
+            self.close_connection = 1
+            return
+        status = 500 if body == 'fail' else 200
+        headers = {}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=data, mode='w') as gzip_file:
+                gzip_file.write(body)
+            body = data.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop the connection without telling the client, like a server
+        # timing out an idle keep-alive connection.
+        if self.server.drop_connections:
+            self.close_connection = 1
+
+
+    def log_message(self, *args):
+        pass
+
+
+class _JsonRpcHandler(_Handler):
+    """Answers RPCs with their parameters."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.clients.append(self.client_address)
+        request = proxy.decoder.JSONDecoder().decode(body)
+        body = proxy.json_encoder_class().encode(
+                {'result': request['params'], 'error': None,
+                 'id': request['id']})
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Service(object):
+    """RPCs of the ServiceHandler answering _ServiceHandlerHandler requests.
+
+    ServiceProxy passes the keyword arguments as a last dictionary argument.
+    """
+
+    @staticmethod
+    def add(x, y, kwargs):
+        return x + y
+
+
+    @staticmethod
+    def fail(kwargs):
+        raise ValueError('fail')
+
+
+class _ServiceHandlerHandler(_Handler):
+    """Answers RPCs through a ServiceHandler."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.clients.append(self.client_address)
+        body = serviceHandler.ServiceHandler(_Service()).handleRequest(body)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class KeepAliveTransportTest(unittest.TestCase):
+    """Tests KeepAliveTransport against a local server."""
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.clients = []
+        self.server.drop_connections = False
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.url = 'http://127.0.0.1:%d/afe/server/rpc/' % (
+                self.server.server_address[1])
+        self.transport = transport.KeepAliveTransport(pool_size=2)
+
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_reuses_connection(self):
+        """Ensure consecutive requests are made on the same connection."""
+        for i in range(3):
+            self.assertEqual(self.transport.request(self.url, str(i), {}),
+                             str(i))
+        self.assertEqual(len(set(self.server.clients)), 1)
+
+
+    def test_retries_dropped_connection(self):
+        """Ensure requests on connections closed by the server are retried."""
+        self.server.drop_connections = True
+        for i in range(3):
+            self.assertEqual(self.transport.request(self.url, str(i), {}),
+                             str(i))
+        self.assertEqual(len(set(self.server.clients)), 3)
+
+
+    def test_answered_request_not_retried(self):
+        """Ensure requests the server answered badly are not sent again."""
+        self.transport.request(self.url, 'data', {})
+        self.assertRaises(httplib.BadStatusLine,
+                          self.transport.request, self.url, 'garbage', {})
+        self.assertEqual(len(self.server.clients), 2)
+
+
+    def test_gzip(self):
+        """Ensure gzipped responses are decompressed."""
+        gzip_transport = transport.KeepAliveTransport(pool_size=1,
+                                                      accept_gzip=True)
+        try:
+            self.assertEqual(gzip_transport.request(self.url, 'data', {}),
+                             'data')
+        finally:
+            gzip_transport.close()
+
+
+    def test_http_error(self):
+        """Ensure a failed request raises HTTPError, and keeps the connection."""
+        self.assertRaises(urllib2.HTTPError,
+                          self.transport.request, self.url, 'fail', {})
+        self.transport.request(self.url, 'data', {})
+        self.assertEqual(len(set(self.server.clients)), 1)
+
+
+    def test_url_error(self):
+        """Ensure an unreachable server raises URLError."""
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % unused.getsockname()[1]
+        unused.close()
+        self.assertRaises(urllib2.URLError,
+                          self.transport.request, url, 'data', {})
+
+
+    def test_service_proxy(self):
+        """Ensure ServiceProxy sends its RPCs through its transport."""
+        self.server.RequestHandlerClass = _JsonRpcHandler
+        service = proxy.ServiceProxy(self.url, transport=self.transport)
+        self.assertEqual(service.echo(1, x=2), [1, {'x': 2}])
+        self.assertEqual(service.echo(3), [3, {}])
+        self.assertEqual(len(set(self.server.clients)), 1)
+
+
+    def test_service_proxy_batch(self):
+        """Ensure ServiceProxy makes batches of RPCs in a single request."""
+        self.server.RequestHandlerClass = _ServiceHandlerHandler
+        service = proxy.ServiceProxy(self.url, transport=self.transport)
+        results = service._call_batch([('add', (1, 2), {}),
+                                       ('fail', (), {}),
+                                       ('add', ('a', 'b'), {})])
+        self.assertEqual(len(self.server.clients), 1)
+        self.assertEqual(results[0], (3, None))
+        self.assertEqual(results[1][0], None)
+        self.assertTrue(isinstance(results[1][1], proxy.JSONRPCException))
+        self.assertTrue('ValueError: fail' in str(results[1][1]))
+        self.assertEqual(results[2], ('ab', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,15 @@
 Extensions to Django's model logic.
 """
 
+import collections
+
 import django.core.exceptions
 from django.db import backend
 from django.db import connection
 from django.db import connections
 from django.db import models as dbmodels
 from django.db import transaction
+from django.db.models.fields import related as related_fields
 from django.db.models.sql import query
 import django.db.models.sql.where
 from django.utils import datastructures
@@ -479,6 +482,109 @@ class ExtendedManager(dbmodels.Manager):
             getattr(base_object, related_list_name).append(related_object)
 
 
+    def populate_foreign_keys(self, base_objects, field_names):
+        """
+        For each instance of this model in base_objects, load the objects its
+        foreign keys named field_names refer to, with one query per foreign
+        key.  Accessing these foreign keys then doesn't query the database.
+        @param base_objects - list of instances of this model
+        @param field_names - names of foreign key fields of this model
+        """
+        for field_name in field_names:
+            field = self.model._meta.get_field(field_name)
+            related_ids = set(getattr(base_object, field.attname)
+                              for base_object in base_objects)
+            related_ids.discard(None)
+            if not related_ids:
+                continue
+            related_objects_by_id = field.rel.to._base_manager.in_bulk(
+                    list(related_ids))
+            for base_object in base_objects:
+                related_id = getattr(base_object, field.attname)
+                # leave dangling references to fail as they would without
+                # prefetching
+                if related_id in related_objects_by_id:
+                    setattr(base_object, field.get_cache_name(),
+                            related_objects_by_id[related_id])
+
+
+    def get_foreign_key_names(self, nested_foreign_keys=()):
+        """
+        @param nested_foreign_keys - names of foreign keys of this model whose
+        related objects are serialised too.
+        @returns the names of the foreign keys of this model, followed by those
+        of the related models of nested_foreign_keys in the form
+        'job__parent_job', for prefetch_relationships().  get_object_dict()
+        looks up the names of the objects all foreign keys refer to.
+        """
+        names = [field.name for field in self.model._meta.fields if field.rel]
+        for field_name in nested_foreign_keys:
+            related_model = self.model._meta.get_field(field_name).rel.to
+            names.extend('%s__%s' % (field_name, field.name)
+                         for field in related_model._meta.fields if field.rel)
+        return names
+
+
+    def prefetch_relationships(self, base_objects, foreign_keys=(),
+                               related_lists=()):
+        """
+        Load all the related objects an RPC serialises for base_objects, with
+        a number of queries independent of the number of base_objects.
+        @param base_objects - list of instances of this model
+        @param foreign_keys - names of foreign key fields of this model, see
+        populate_foreign_keys().  A name can go on through foreign keys of the
+        related model, separated by '__', like 'job__parent_job'.
+        @param related_lists - sequence of (related_model, related_list_name)
+        tuples, see populate_relationships().  A tuple can have a third item,
+        a sequence of foreign keys to load on the related objects.
+        """
+        if not base_objects:
+            return
+
+        nested_foreign_keys = {}
+        for name in foreign_keys:
+            field_name, _, nested_name = name.partition('__')
+            nested = nested_foreign_keys.setdefault(field_name, [])
+            if nested_name:
+                nested.append(nested_name)
+        self.populate_foreign_keys(base_objects, nested_foreign_keys.keys())
+        for field_name, nested in nested_foreign_keys.iteritems():
+            if not nested:
+                continue
+            field = self.model._meta.get_field(field_name)
+            related_objects = _unique_objects(
+                    getattr(base_object, field_name)
+                    for base_object in base_objects
+                    if getattr(base_object, field.attname) is not None)
+            field.rel.to.objects.prefetch_relationships(related_objects,
+                                                        foreign_keys=nested)
+
+        for related_list in related_lists:
+            related_model, related_list_name = related_list[:2]
+            self.populate_relationships(base_objects, related_model,
+                                        related_list_name)
+            if len(related_list) > 2:
+                related_objects = _unique_objects(
+                        related_object for base_object in base_objects
+                        for related_object in getattr(base_object,
+                                                      related_list_name))
+                related_model.objects.prefetch_relationships(
+                        related_objects, foreign_keys=related_list[2])
+
+
+def _unique_objects(objects):
+    """
+    @returns a list of the distinct model instances in objects, in order.
+    """
+    seen = set()
+    unique = []
+    for model_object in objects:
+        if id(model_object) not in seen:
+            seen.add(id(model_object))
+            unique.append(model_object)
+    return unique
+
+
 class ModelWithInvalidQuerySet(dbmodels.query.QuerySet):
     """
     QuerySet that handles delete() properly for models with an "invalid" bit
@@ -544,9 +650,14 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
     will only be updated, if their name is in this set.
     """
 
+    BULK_UPDATE_CHUNK_SIZE = 500
+    """Maximum number of objects bulk_update_from_serialized updates with one
+    statement."""
+
 
     @classmethod
-    def convert_human_readable_values(cls, data, to_human_readable=False):
+    def convert_human_readable_values(cls, data, to_human_readable=False,
+                                      related_objects=None):
         """\
         Performs conversions on user-supplied field data, to make it
         easier for users to pass human-readable data.
@@ -563,6 +674,9 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         If to_human_readable=True, perform the inverse - i.e. convert
         numeric values to human readable values.
 
+        related_objects optionally maps foreign key field names to objects
+        already loaded, used rather than looked up when their ID matches.
+
         This method modifies data in-place.
         """
         field_dict = cls.get_field_dict()
@@ -583,8 +697,11 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
                         break
             # convert foreign key values
             elif field_obj.rel:
-                dest_obj = field_obj.rel.to.smart_get(data[field_name],
-                                                      valid_only=False)
+                dest_obj = (related_objects or {}).get(field_name)
+                if (dest_obj is None or
+                    dest_obj._get_pk_val() != data[field_name]):
+                    dest_obj = field_obj.rel.to.smart_get(data[field_name],
+                                                          valid_only=False)
                 if to_human_readable:
                     # parameterized_jobs do not have a name_field
                     if (field_name != 'parameterized_job' and
@@ -703,8 +820,9 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
 
 
     # see query_objects()
-    _SPECIAL_FILTER_KEYS = ('query_start', 'query_limit', 'sort_by',
-                            'extra_args', 'extra_where', 'no_distinct')
+    _SPECIAL_FILTER_KEYS = ('query_start', 'query_limit', 'query_after',
+                            'sort_by', 'extra_args', 'extra_where',
+                            'no_distinct')
 
 
     @classmethod
@@ -737,6 +855,16 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
 
         query_start = special_params.get('query_start', None)
         query_limit = special_params.get('query_limit', None)
+        if 'query_after' in special_params:
+            if sort_by or query_start is not None:
+                raise ValueError('Cannot pass query_after with sort_by or '
+                                 'query_start')
+            # Pages of a query sorted by primary key don't shift when rows
+            # are added or removed before them, unlike offsets.
+            query = query.order_by('pk')
+            query_after = special_params['query_after']
+            if query_after is not None:
+                query = query.filter(pk__gt=query_after)
         if query_start is not None:
             if query_limit is None:
                 raise ValueError('Cannot pass query_start without query_limit')
@@ -754,6 +882,11 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         filter_data include:
         -query_start: index of first return to return
         -query_limit: maximum number of results to return
+        -query_after: return the objects with a primary key above this one,
+         sorted by primary key. None returns them from the first one. Paging
+         through a query with query_after and query_limit, each page starting
+         after the last primary key of the previous one, is stable while
+         objects are added to or removed from it.
         -sort_by: list of fields to sort on.  prefixing a '-' onto a
          field name changes the sort to descending order.
         -extra_args: keyword args to pass to query.extra() (see Django
@@ -801,6 +934,7 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         """
         filter_data.pop('query_start', None)
         filter_data.pop('query_limit', None)
+        filter_data.pop('query_after', None)
         query = cls.query_objects(filter_data, initial_query=initial_query)
         return query.count()
 
@@ -826,8 +960,10 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         """
         query = cls.query_objects(filter_data, initial_query=initial_query)
         extra_fields = query.query.extra_select.keys()
+        # Don't keep the model objects around in the query cache, only their
+        # dictionaries are returned.
         field_dicts = [model_object.get_object_dict(extra_fields=extra_fields)
-                       for model_object in query]
+                       for model_object in query.iterator()]
         return field_dicts
 
 
@@ -873,16 +1009,37 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         extra_fields: list of extra attribute names to include, in addition to
         the fields defined on this object.
         """
-        fields = self.get_field_dict().keys()
-        if extra_fields:
-            fields += extra_fields
-        object_dict = dict((field_name, getattr(self, field_name))
-                           for field_name in fields)
-        self.clean_object_dicts([object_dict])
+        # Read foreign keys as IDs, rather than loading the objects they refer
+        # to only to replace them with their IDs.
+        object_dict = dict((field_name, getattr(self, field.attname))
+                           for field_name, field
+                           in self.get_field_dict().iteritems())
+        for field_name in extra_fields or ():
+            object_dict[field_name] = getattr(self, field_name)
+        self.clean_foreign_keys(object_dict)
+        self._convert_booleans(object_dict)
+        # Use the objects loaded by ExtendedManager.prefetch_relationships()
+        # or select_related() to find the names of the foreign keys.
+        self.convert_human_readable_values(
+                object_dict, to_human_readable=True,
+                related_objects=self._get_loaded_related_objects())
         self._postprocess_object_dict(object_dict)
         return object_dict
 
 
+    def _get_loaded_related_objects(self):
+        """
+        @returns a dictionary of the objects the foreign keys of this object
+        refer to which are already loaded, by field name.
+        """
+        related_objects = {}
+        for field in self._meta.fields:
+            if field.rel and hasattr(self, field.get_cache_name()):
+                related_objects[field.name] = getattr(self,
+                                                      field.get_cache_name())
+        return related_objects
+
+
     def _postprocess_object_dict(self, object_dict):
         """For subclasses to override."""
         pass
@@ -1074,6 +1231,9 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         @param data: List of tuples like returned by
                      _split_local_from_foreign_values.
         """
+        if not data:
+            return
+
         for link, value in data:
             self._deserialize_relation(link, value)
         # See comment in _deserialize_local
@@ -1137,6 +1297,218 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         return instance
 
 
+    @classmethod
+    def get_record_key(cls, data):
+        """Get the key get_records identifies a serialized object by.
+
+        Models overriding get_record must override this and get_records
+        accordingly.
+
+        @param data: Representation of an object, as returned by serialize.
+        """
+        return data['id']
+
+
+    @classmethod
+    def get_records(cls, serialized_list):
+        """Retrieve the records of many serialized objects with one query.
+
+        @param serialized_list: A list of representations of objects, as
+                                returned by serialize.
+
+        @returns: A dictionary mapping the keys returned by get_record_key to
+                  the objects that exist.
+        """
+        return cls.objects.in_bulk(
+                [cls.get_record_key(data) for data in serialized_list])
+
+
+    @classmethod
+    def deserialize_many(cls, serialized_list):
+        """Deserializes and saves many objects with their dependencies.
+
+        This is equivalent to calling deserialize on every item, but the
+        objects that exist already are retrieved with one query, new objects
+        are inserted with one query, and updates of existing objects are
+        grouped into one query per field and value. The related objects of
+        all the objects are deserialized together, with one deserialize_many
+        per relation, see _deserialize_many_relation.
+
+        New objects that are serialized without an id, but with related
+        objects to-many, are still saved one by one, as relating objects to
+        them needs their id, which bulk inserts don't set.
+
+        Like deserialize, which saves through the base model's save(), this
+        doesn't run the save() method of the model, e.g. Host.save() doesn't
+        strip the hostname or record the lock. New objects and relations are
+        also added without sending the post_save and m2m_changed signals, and
+        to-one relations are set without custom_deserialize_relation.
+
+        Errors are not isolated, so this should run in a transaction that is
+        retried object by object if it fails.
+
+        @param serialized_list: A list of representations of objects, as
+                                returned by serialize.
+
+        @returns: A list of the objects represented by serialized_list.
+        """
+        existing = cls.get_records(serialized_list)
+        instances = []
+        new_instances = []
+        new_keys = set()
+        instances_to_save = []
+        to_one_values = collections.defaultdict(list)
+        to_many_values = collections.defaultdict(list)
+        pks_to_update = collections.defaultdict(list)
+        timer = autotest_stats.Timer('deserialize_latency.%s' % cls.__name__)
+        with timer.get_client('bulk_local'):
+            for data in serialized_list:
+                local, related = cls._split_local_from_foreign_values(data)
+                key = cls.get_record_key(data)
+                instance = existing.get(key)
+                if instance is None:
+                    instance = cls()
+                    for link, value in local:
+                        setattr(instance, link, value)
+                    if instance.pk is None and any(
+                            not cls._is_to_one_link(link)
+                            for link, _ in related):
+                        # Relations need the id, which bulk inserts don't set.
+                        instances_to_save.append(instance)
+                    else:
+                        new_instances.append(instance)
+                    new_keys.add(key)
+                    existing[key] = instance
+                else:
+                    for link, value in cls._filter_update_allowed_fields(
+                            local):
+                        if getattr(instance, link) == value:
+                            continue
+                        setattr(instance, link, value)
+                        if key not in new_keys:
+                            pks_to_update[link, value].append(instance.pk)
+                for link, value in related:
+                    if cls._is_to_one_link(link):
+                        to_one_values[link].append(
+                                (instance, value, key in new_keys))
+                    else:
+                        to_many_values[link].append((instance, value))
+                instances.append(instance)
+
+        with timer.get_client('bulk_related'):
+            for link, values in to_one_values.iteritems():
+                field = getattr(cls, link).field
+                related_objects = iter(field.rel.to.deserialize_many(
+                        [value for _, value, _ in values if value is not None]))
+                for instance, value, is_new in values:
+                    related_object = (None if value is None
+                                      else next(related_objects))
+                    related_pk = related_object and related_object.pk
+                    if is_new:
+                        setattr(instance, link, related_object)
+                    elif getattr(instance, field.attname) != related_pk:
+                        setattr(instance, link, related_object)
+                        pks_to_update[field.attname, related_pk].append(
+                                instance.pk)
+
+        with timer.get_client('bulk_local'):
+            for instance in instances_to_save:
+                # See comment in _deserialize_local
+                super(type(instance), instance).save()
+            if new_instances:
+                cls.objects.bulk_create(new_instances)
+                # Unlike save(), bulk_create doesn't mark the instances as
+                # saved, which relating other objects to them requires.
+                for instance in new_instances:
+                    instance._state.db = cls.objects.db
+                    instance._state.adding = False
+            for (link, value), pks in pks_to_update.iteritems():
+                cls.objects.filter(pk__in=pks).update(**{link: value})
+
+        with timer.get_client('bulk_related'):
+            for link, values in to_many_values.iteritems():
+                cls._deserialize_many_relation(link, values)
+        return instances
+
+
+    @classmethod
+    def _is_to_one_link(cls, link):
+        """Whether a link to follow is the foreign key of a related object.
+
+        @param link: Name of the relation.
+        """
+        return isinstance(
+                getattr(cls, link),
+                related_fields.ReverseSingleRelatedObjectDescriptor)
+
+
+    @classmethod
+    def _deserialize_many_relation(cls, link, values):
+        """Deserialize the related objects of many objects for a to-many link.
+
+        The related objects of all the objects are deserialized with one
+        deserialize_many. For a one-to-many relation, the foreign key of each
+        related object is set in its data, and the existing related objects
+        that point to another object are moved with one query per object,
+        like _deserialize_2m_relation does. For a many-to-many relation,
+        the missing pairs are inserted with one query, which requires the
+        related objects to be serialized with their ids.
+
+        @param link: Name of the relation.
+        @param values: A list of tuples (instance, data), of the saved objects
+                       and the serialized representations of their related
+                       objects.
+        """
+        descriptor = getattr(cls, link)
+        if isinstance(descriptor,
+                      related_fields.ForeignRelatedObjectsDescriptor):
+            field = descriptor.related.field
+            related_class = descriptor.related.model
+            pks = [instance.pk for instance, _ in values]
+            if related_class == cls.get_attribute_model():
+                # See comment in _deserialize_2m_relation
+                related_class.objects.filter(
+                        **{'%s__in' % field.name: pks}).delete()
+            owner_pks = []
+            serialized_list = []
+            for instance, data in values:
+                for serialized in data:
+                    serialized[field.attname] = instance.pk
+                    owner_pks.append(instance.pk)
+                    serialized_list.append(serialized)
+            related_objects = related_class.deserialize_many(serialized_list)
+            moved_pks = collections.defaultdict(list)
+            for owner_pk, related_object in zip(owner_pks, related_objects):
+                if getattr(related_object, field.attname) != owner_pk:
+                    setattr(related_object, field.attname, owner_pk)
+                    moved_pks[owner_pk].append(related_object.pk)
+            for owner_pk, pks in moved_pks.iteritems():
+                related_class.objects.filter(pk__in=pks).update(
+                        **{field.attname: owner_pk})
+            return
+
+        manager = getattr(values[0][0], link)
+        related_objects = iter(manager.model.deserialize_many(
+                [serialized for _, data in values for serialized in data]))
+        pairs = set()
+        for instance, data in values:
+            for _ in data:
+                pairs.add((instance.pk, next(related_objects).pk))
+        if not pairs:
+            return
+        source = manager.through._meta.get_field(manager.source_field_name)
+        target = manager.through._meta.get_field(manager.target_field_name)
+        source_pks, target_pks = zip(*pairs)
+        pairs.difference_update(manager.through.objects.filter(
+                **{'%s__in' % source.name: set(source_pks),
+                   '%s__in' % target.name: set(target_pks)}).values_list(
+                        source.attname, target.attname))
+        manager.through.objects.bulk_create(
+                [manager.through(**{source.attname: source_pk,
+                                    target.attname: target_pk})
+                 for source_pk, target_pk in sorted(pairs)])
+
+
     def sanity_check_update_from_shard(self, shard, updated_serialized,
                                        *args, **kwargs):
         """Check if an update sent from a shard is legitimate.
@@ -1176,6 +1548,71 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         self._deserialize_local(local)
 
 
+    @classmethod
+    def bulk_update_from_serialized(cls, serialized_list):
+        """Updates local fields of many existing objects from serialized forms.
+
+        This is equivalent to calling update_from_serialized on every object,
+        but updates BULK_UPDATE_CHUNK_SIZE objects per UPDATE statement, which
+        sets every column to a CASE over the ids of the objects.
+
+        Like update_from_serialized, this doesn't run the save() method of the
+        model. Columns that save() derives from others, like the active and
+        complete columns of a HostQueueEntry, are written as serialized, and
+        the changes of recorded attributes are not logged. Callers must send
+        consistent representations, like the serialize() of the objects.
+
+        @param serialized_list: Representations of objects, as returned by
+                                serialize. If an object is represented more
+                                than once, the last representation wins.
+
+        @raises ValueError: if any representation contains related objects,
+                            i.e. not only local fields.
+        """
+        values_by_pk = {}
+        for serialized in serialized_list:
+            local, related = cls._split_local_from_foreign_values(serialized)
+            if related:
+                raise ValueError('Serialized must not contain foreign '
+                                 'objects: %s' % related)
+            values_by_pk[serialized['id']] = dict(local)
+
+        fields = {}
+        for field in cls._meta.local_fields:
+            fields[field.name] = field
+            fields[field.attname] = field
+        pk_column = _quote_name(cls._meta.pk.column)
+        pks = sorted(values_by_pk)
+        cursor = connections[cls.objects.db].cursor()
+        for start in xrange(0, len(pks), cls.BULK_UPDATE_CHUNK_SIZE):
+            chunk = pks[start:start + cls.BULK_UPDATE_CHUNK_SIZE]
+            links = set()
+            for pk in chunk:
+                links.update(values_by_pk[pk])
+            links.discard(cls._meta.pk.name)
+
+            assignments = []
+            params = []
+            for link in sorted(links):
+                field = fields[link]
+                column = _quote_name(field.column)
+                cases = []
+                for pk in chunk:
+                    if link in values_by_pk[pk]:
+                        cases.append('WHEN %s THEN %s')
+                        params.extend([pk, field.get_db_prep_save(
+                                values_by_pk[pk][link],
+                                connection=connections[cls.objects.db])])
+                assignments.append('%s = CASE %s %s ELSE %s END' % (
+                        column, pk_column, ' '.join(cases), column))
+            if not assignments:
+                continue
+            params.extend(chunk)
+            cursor.execute('UPDATE %s SET %s WHERE %s IN (%s)' % (
+                    _quote_name(cls._meta.db_table), ', '.join(assignments),
+                    pk_column, ', '.join(['%s'] * len(chunk))), params)
+
+
     def custom_deserialize_relation(self, link, data):
         """Allows overriding the deserialization behaviour by subclasses."""
         raise NotImplementedError(
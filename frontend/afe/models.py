@@ -187,6 +187,23 @@ class Shard(dbmodels.Model, model_logic.ModelExtensions):
         return self.hostname
 
 
+class ShardHeartbeat(dbmodels.Model, model_logic.ModelExtensions):
+    """Heartbeat bookkeeping of a shard.
+
+    Required:
+    shard: The shard this record belongs to.
+    sequence: The sequence number of the last heartbeat response the master
+              sent to the shard. See site_rpc_interface.shard_heartbeat.
+    """
+
+    shard = dbmodels.OneToOneField(Shard)
+    sequence = dbmodels.IntegerField(default=0)
+
+    class Meta:
+        """Metadata for class ShardHeartbeat."""
+        db_table = 'afe_shard_heartbeats'
+
+
 class Drone(dbmodels.Model, model_logic.ModelExtensions):
     """
     A scheduler drone
@@ -420,6 +437,33 @@ class User(dbmodels.Model, model_logic.ModelExtensions):
             raise
 
 
+    @classmethod
+    def get_records(cls, serialized_list):
+        """Retrieve the records of many serialized users, see get_record.
+
+        Existing users with the id or the login of a serialized user, but not
+        both, are deleted.
+
+        @param serialized_list: A list of dictionaries of data to deserialize.
+
+        @returns: A dictionary mapping ids to the users that exist.
+        """
+        logins_by_id = dict((data['id'], data['login'])
+                            for data in serialized_list)
+        records = {}
+        conflicting_ids = []
+        for user in cls.objects.filter(
+                dbmodels.Q(id__in=logins_by_id.keys()) |
+                dbmodels.Q(login__in=logins_by_id.values())):
+            if logins_by_id.get(user.id) == user.login:
+                records[user.id] = user
+            else:
+                conflicting_ids.append(user.id)
+        if conflicting_ids:
+            cls.objects.filter(id__in=conflicting_ids).delete()
+        return records
+
+
     class Meta:
         """Metadata for class User."""
         db_table = 'afe_users'
@@ -525,6 +569,8 @@ class Host(model_logic.ModelWithInvalid, rdb_model_extensions.AbstractHostModel,
                           failed persisting them.
                           The number of hosts usually lies in O(100), so the
                           overhead is acceptable.
+                          None if the shard knows all hosts assigned to it,
+                          i.e. it acknowledged the last heartbeat.
 
         @returns the hosts objects that should be sent to the shard.
         """
@@ -543,12 +589,12 @@ class Host(model_logic.ModelWithInvalid, rdb_model_extensions.AbstractHostModel,
         #   hosts for the shard, this is overhead
         # - SELECT and then UPDATE only selected without requerying afterwards:
         #   returns the old state of the records.
-        host_ids = set(Host.objects.filter(
-            labels__in=shard.labels.all(),
-            leased=False
-            ).exclude(
-            id__in=known_ids,
-            ).values_list('pk', flat=True))
+        hosts = Host.objects.filter(labels__in=shard.labels.all(), leased=False)
+        if known_ids is None:
+            hosts = hosts.exclude(shard=shard)
+        else:
+            hosts = hosts.exclude(id__in=known_ids)
+        host_ids = set(hosts.values_list('pk', flat=True))
 
         if host_ids:
             Host.objects.filter(pk__in=host_ids).update(shard=shard)
@@ -765,6 +811,46 @@ class HostAttribute(dbmodels.Model, model_logic.ModelExtensions):
         return super(HostAttribute, cls).deserialize(data)
 
 
+    @classmethod
+    def get_record_key(cls, data):
+        """Get the key get_records identifies a serialized attribute by.
+
+        @param data: A dictionary of data to deserialize.
+
+        @returns: A tuple (host_id, attribute).
+        """
+        return data['host_id'], data['attribute']
+
+
+    @classmethod
+    def get_records(cls, serialized_list):
+        """Retrieve the attributes of the hosts of many serialized attributes.
+
+        @param serialized_list: A list of dictionaries of data to deserialize.
+
+        @returns: A dictionary mapping (host_id, attribute) tuples to
+                  attributes.
+        """
+        host_ids = set(data['host_id'] for data in serialized_list)
+        return dict(((attribute.host_id, attribute.attribute), attribute)
+                    for attribute in cls.objects.filter(host_id__in=host_ids))
+
+
+    @classmethod
+    def deserialize_many(cls, serialized_list):
+        """Override deserialize_many in parent class.
+
+        Do not deserialize ids, see deserialize.
+
+        @param serialized_list: A list of dictionaries of data to deserialize.
+
+        @returns: A list of HostAttribute objects.
+        """
+        for data in serialized_list:
+            data.pop('id', None)
+        return super(HostAttribute, cls).deserialize_many(serialized_list)
+
+
 class Test(dbmodels.Model, model_logic.ModelExtensions):
     """\
     Required:
@@ -1256,6 +1342,11 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
     #     - Active jobs
     #     - Jobs without host_queue_entries
     NON_ABORTED_KNOWN_JOBS = '(t2.aborted = 0 AND t1.id IN (%(known_ids)s))'
+    # shard_id is checked for NULL, so NOT of the condition holds for jobs
+    # that aren't assigned to any shard.
+    NON_ABORTED_SHARD_JOBS = (
+        '(t2.aborted = 0 AND t1.shard_id IS NOT NULL '
+        ' AND t1.shard_id = %(shard_id)s)')
 
     SQL_SHARD_JOBS = (
         'SELECT DISTINCT(t1.id) FROM afe_jobs t1 '
@@ -1544,6 +1635,10 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
                           Assuming one id takes 8 chars in the json, this means
                           overhead that lies in the lower kilobyte range.
                           A not in query with 5000 id's takes about 30ms.
+                          None if the shard knows all incomplete jobs
+                          assigned to it, i.e. it acknowledged the last
+                          heartbeat. The jobs assigned to the shard are used
+                          then, which spares the list of ids.
 
         @returns The job objects that should be sent to the shard.
         """
@@ -1555,10 +1650,15 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
         check_known_jobs_exclude = ''
         check_known_jobs_include = ''
 
-        if known_ids:
+        check_known_jobs = None
+        if known_ids is None:
+            check_known_jobs = (cls.NON_ABORTED_SHARD_JOBS %
+                                {'shard_id': shard.id})
+        elif known_ids:
             check_known_jobs = (
                     cls.NON_ABORTED_KNOWN_JOBS %
                     {'known_ids': ','.join([str(i) for i in known_ids])})
+        if check_known_jobs:
             check_known_jobs_exclude = 'AND NOT ' + check_known_jobs
             check_known_jobs_include = 'OR ' + check_known_jobs
 
@@ -1723,6 +1823,45 @@ class JobKeyval(dbmodels.Model, model_logic.ModelExtensions):
         return super(JobKeyval, cls).deserialize(data)
 
 
+    @classmethod
+    def get_record_key(cls, data):
+        """Get the key get_records identifies a serialized keyval by.
+
+        @param data: A dictionary of data to deserialize.
+
+        @returns: A tuple (job_id, key).
+        """
+        return data['job_id'], data['key']
+
+
+    @classmethod
+    def get_records(cls, serialized_list):
+        """Retrieve the keyvals of the jobs of many serialized keyvals.
+
+        @param serialized_list: A list of dictionaries of data to deserialize.
+
+        @returns: A dictionary mapping (job_id, key) tuples to keyvals.
+        """
+        job_ids = set(data['job_id'] for data in serialized_list)
+        return dict(((keyval.job_id, keyval.key), keyval)
+                    for keyval in cls.objects.filter(job_id__in=job_ids))
+
+
+    @classmethod
+    def deserialize_many(cls, serialized_list):
+        """Override deserialize_many in parent class.
+
+        Do not deserialize ids, see deserialize.
+
+        @param serialized_list: A list of dictionaries of data to deserialize.
+
+        @returns: A list of JobKeyval objects.
+        """
+        for data in serialized_list:
+            data.pop('id', None)
+        return super(JobKeyval, cls).deserialize_many(serialized_list)
+
+
     class Meta:
         """Metadata for class JobKeyval."""
         db_table = 'afe_job_keyvals'
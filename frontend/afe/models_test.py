@@ -598,6 +598,95 @@ class SerializationTest(unittest.TestCase,
         self.assertEqual(generated_heartbeat_response, example_response)
 
 
+    def test_response_deserialize_many(self):
+        """Bulk deserializing the response is the same as one by one."""
+        heartbeat_response = self._get_example_response()
+        hosts = models.Host.deserialize_many(heartbeat_response['hosts'])
+        jobs = models.Job.deserialize_many(heartbeat_response['jobs'])
+
+        generated_heartbeat_response = {
+            'hosts': [host.serialize() for host in hosts],
+            'jobs': [job.serialize() for job in jobs]
+        }
+        example_response = self._get_example_response()
+        for r in [generated_heartbeat_response, example_response]:
+            for job in r['jobs']:
+                for keyval in job['jobkeyval_set']:
+                    keyval.pop('id')
+        self.assertEqual(generated_heartbeat_response, example_response)
+
+        # Deserializing existing objects again doesn't add any.
+        counts = [model.objects.count() for model in
+                  (models.Job, models.HostQueueEntry, models.JobKeyval)]
+        models.Job.deserialize_many(self._get_example_response()['jobs'])
+        self.assertEqual(counts, [2, 2, 6])
+        self.assertEqual(counts, [model.objects.count() for model in
+                                  (models.Job, models.HostQueueEntry,
+                                   models.JobKeyval)])
+
+
+    def test_deserialize_many_batches_related_objects(self):
+        """The related objects of all the objects are deserialized together."""
+        heartbeat_response = self._get_example_response()
+        with self.assert_num_queries(16):
+            models.Host.deserialize_many(heartbeat_response['hosts'])
+        with self.assert_num_queries(12):
+            models.Job.deserialize_many(heartbeat_response['jobs'])
+        # Existing jobs aren't saved again, only their keyvals are replaced.
+        with self.assert_num_queries(9):
+            models.Job.deserialize_many(self._get_example_response()['jobs'])
+
+
+    def test_deserialize_many_updates_allowed_fields(self):
+        """Only whitelisted fields of existing objects are updated."""
+        job = self._create_job(hosts=[1])
+        models.JobKeyval.objects.create(job=job, key='suite', value='dummy')
+        keyvals = [{'id': 1, 'job_id': job.id, 'key': 'suite',
+                    'value': 'bvt'},
+                   {'id': 2, 'job_id': job.id, 'key': 'build',
+                    'value': 'daisy-release'}]
+
+        models.JobKeyval.deserialize_many(keyvals)
+        self.assertEqual(
+                dict(models.JobKeyval.objects.values_list('key', 'value')),
+                {'suite': 'bvt', 'build': 'daisy-release'})
+
+        serialized = job.serialize()
+        serialized['owner'] = 'some_other_owner'
+        serialized['hostqueueentry_set'][0]['aborted'] = True
+        models.Job.deserialize_many([serialized])
+        job = models.Job.objects.get(pk=job.id)
+        self.assertNotEqual(job.owner, 'some_other_owner')
+        self.assertTrue(job.hostqueueentry_set.all()[0].aborted)
+
+
+    def test_deserialize_many_updates_existing_hosts_and_jobs(self):
+        """Allowed fields of a chunk of existing hosts and jobs are updated."""
+        heartbeat_response = self._get_example_response()
+        models.Host.deserialize_many(heartbeat_response['hosts'])
+        models.Job.deserialize_many(heartbeat_response['jobs'])
+
+        heartbeat_response = self._get_example_response()
+        for host in heartbeat_response['hosts']:
+            host['invalid'] = True
+        for job in heartbeat_response['jobs']:
+            for hqe in job['hostqueueentry_set']:
+                hqe['aborted'] = True
+        models.Host.deserialize_many(heartbeat_response['hosts'])
+        models.Job.deserialize_many(heartbeat_response['jobs'])
+
+        host_ids = [host['id'] for host in heartbeat_response['hosts']]
+        self.assertEqual(
+                [host.invalid for host in
+                 models.Host.objects.filter(id__in=host_ids)],
+                [True] * len(host_ids))
+        job_ids = [job['id'] for job in heartbeat_response['jobs']]
+        self.assertEqual(
+                [hqe.aborted for hqe in
+                 models.HostQueueEntry.objects.filter(job__id__in=job_ids)],
+                [True, True])
+
+
     def test_update(self):
         job = self._create_job(hosts=[1])
         serialized = job.serialize(include_dependencies=False)
@@ -612,6 +701,48 @@ class SerializationTest(unittest.TestCase,
             job.update_from_serialized, serialized)
 
 
+    def test_bulk_update_from_serialized(self):
+        """Updates many objects like update_from_serialized does each."""
+        bulk_job = self._create_job(hosts=[1, 2, 3])
+        single_job = self._create_job(hosts=[1, 2, 3])
+
+        def update(job, update_function):
+            hqes = list(job.hostqueueentry_set.order_by('id'))
+            serialized = [hqe.serialize(include_dependencies=False)
+                          for hqe in hqes]
+            serialized[0].update(status='Completed', active=False,
+                                 complete=True,
+                                 finished_on='2015-01-02T03:04:05')
+            serialized[1].update(status='Running', active=True)
+            del serialized[2]['status']
+            serialized[2]['aborted'] = True
+            update_function(hqes, serialized)
+            return [(hqe.status, hqe.active, hqe.complete, hqe.aborted,
+                     hqe.finished_on)
+                    for hqe in job.hostqueueentry_set.order_by('id')]
+
+        def update_each(hqes, serialized):
+            for hqe, serialized_hqe in zip(hqes, serialized):
+                hqe.update_from_serialized(serialized_hqe)
+
+        self.god.stub_with(models.HostQueueEntry, 'BULK_UPDATE_CHUNK_SIZE', 2)
+        bulk_updated = update(
+                bulk_job,
+                lambda hqes, serialized:
+                        models.HostQueueEntry.bulk_update_from_serialized(
+                                serialized))
+        self.assertEqual(bulk_updated, update(single_job, update_each))
+        self.assertEqual(
+                bulk_updated,
+                [('Completed', False, True, False,
+                  datetime.datetime(2015, 1, 2, 3, 4, 5)),
+                 ('Running', True, False, False, None),
+                 ('Queued', False, False, True, None)])
+        self.assertRaises(ValueError,
+                          models.HostQueueEntry.bulk_update_from_serialized,
+                          [bulk_job.hostqueueentry_set.all()[0].serialize()])
+
+
     def test_sync_aborted(self):
         job = self._create_job(hosts=[1])
         serialized = job.serialize()
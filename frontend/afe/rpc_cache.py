@@ -0,0 +1,260 @@
+"""\
+Cache of the results of read-mostly RPCs.
+
+The results of RPCs decorated with cached() are kept in a backend for a time
+to live, keyed on the RPC, its normalized arguments and, for per-user RPCs,
+the user. A result depends on the tables of the models it is built from.
+When a model of one of these tables is saved or deleted, or one of its many
+to many relationships changes, the results depending on the table are
+invalidated. Writes bypassing the Django models, like the scheduler's, are
+only caught by the time to live.
+
+Invalidation changes a generation token per table, kept in the backend and
+part of the cache keys, which makes the previous results unreachable. With a
+backend shared by the server processes, like memcached through Django's
+cache framework, a change made through any of them invalidates the results
+of all of them. The memory backend only invalidates the results of the
+process making the change, the others keep theirs for their time to live.
+"""
+
+import copy
+from functools import wraps
+import hashlib
+import inspect
+import json
+import threading
+import time
+import uuid
+
+from django.core import cache as django_cache
+from django.db.models import signals
+
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.frontend import thread_local
+from autotest_lib.frontend.afe import model_logic, rpcserver_logging
+
+
+# '' disables the cache, 'memory' keeps results in each process, 'django'
+# keeps them in the default cache of Django's cache framework.
+BACKEND = global_config.global_config.get_config_value(
+        'SERVER', 'rpc_cache_backend', default='')
+# Maximum number of results kept by the memory backend.
+MAX_ENTRIES = global_config.global_config.get_config_value(
+        'SERVER', 'rpc_cache_max_entries', type=int, default=10000)
+
+_KEY_PREFIX = 'rpc_cache:'
+_TOKEN_PREFIX = 'rpc_cache_table:'
+# Time to live of the generation tokens in the django backend. A token
+# expiring is replaced by a new one, which invalidates the table.
+_TOKEN_TTL_SEC = 24 * 60 * 60
+
+_backend = None
+_backend_lock = threading.Lock()
+# Tables cached results depend on. Changes to other tables are not tracked.
+_cached_tables = set()
+
+
+class MemoryBackend(object):
+    """Keeps results in the memory of the process."""
+
+    def __init__(self, max_entries):
+        """
+        @param max_entries: Maximum number of results to keep.
+        """
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # (expiration time or None, value) by key.
+        self._entries = {}
+
+
+    def get_many(self, keys):
+        """Get values from the cache.
+
+        @param keys: A list of keys.
+
+        @returns: A dictionary of the values found, by key.
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expiration, value = entry
+                if expiration is not None and expiration <= now:
+                    del self._entries[key]
+                    continue
+                found[key] = value
+        # Callers may modify the values they get.
+        return copy.deepcopy(found)
+
+
+    def set(self, key, value, ttl_sec=None):
+        """Store a value in the cache.
+
+        @param key: The key of the value.
+        @param value: The value.
+        @param ttl_sec: Seconds to keep the value, None keeps it until it is
+                replaced.
+        """
+        now = time.time()
+        expiration = now + ttl_sec if ttl_sec is not None else None
+        value = copy.deepcopy(value)
+        with self._lock:
+            if (key not in self._entries and
+                len(self._entries) >= self._max_entries):
+                self._evict(now)
+            self._entries[key] = (expiration, value)
+
+
+    def _evict(self, now):
+        """Drop the expired results, or all of them if none has expired."""
+        expiring = [(key, expiration) for key, (expiration, _)
+                    in self._entries.iteritems() if expiration is not None]
+        expired = [key for key, expiration in expiring if expiration <= now]
+        for key in expired or [key for key, _ in expiring]:
+            del self._entries[key]
+
+
+class DjangoBackend(object):
+    """Keeps results in a cache of Django's cache framework."""
+
+    def __init__(self, alias='default'):
+        """
+        @param alias: Name of the cache in the CACHES setting.
+        """
+        self._cache = django_cache.get_cache(alias)
+
+
+    def get_many(self, keys):
+        """See MemoryBackend.get_many."""
+        return self._cache.get_many(keys)
+
+
+    def set(self, key, value, ttl_sec=None):
+        """See MemoryBackend.set."""
+        if ttl_sec is None:
+            ttl_sec = _TOKEN_TTL_SEC
+        self._cache.set(key, value, ttl_sec)
+
+
+def get_backend():
+    """Get the backend of the cache.
+
+    @returns: The backend set through set_backend, or else the one configured
+              by SERVER rpc_cache_backend. None if the cache is disabled.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if BACKEND == 'memory':
+                _backend = MemoryBackend(MAX_ENTRIES)
+            elif BACKEND == 'django':
+                _backend = DjangoBackend()
+            elif BACKEND:
+                raise ValueError('Unknown rpc_cache_backend: %s' % BACKEND)
+        return _backend
+
+
+def set_backend(backend):
+    """Replace the backend of the cache.
+
+    @param backend: A backend, None to use the configured one.
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def _get_tokens(backend, tables):
+    keys = [_TOKEN_PREFIX + table for table in tables]
+    tokens = backend.get_many(keys)
+    for key in keys:
+        if key not in tokens:
+            tokens[key] = uuid.uuid4().hex
+            backend.set(key, tokens[key])
+    return [tokens[key] for key in keys]
+
+
+def invalidate(*model_classes):
+    """Invalidate the cached results depending on models.
+
+    @param model_classes: The classes of the models that changed.
+    """
+    backend = get_backend()
+    if backend is None:
+        return
+    for model_class in model_classes:
+        table = model_class._meta.db_table
+        if table in _cached_tables:
+            backend.set(_TOKEN_PREFIX + table, uuid.uuid4().hex)
+
+
+def cached(ttl_sec, depends_on, per_user=False, should_cache=None):
+    """Cache the results of an RPC.
+
+    Only use on RPCs that don't modify anything.
+
+    @param ttl_sec: Seconds to keep the results.
+    @param depends_on: The model classes the results are built from.
+    @param per_user: Whether the results depend on the user making the RPC.
+    @param should_cache: A function called with the dictionary of the
+            arguments of a call, returning False if it must not be cached.
+
+    @returns: A decorator of RPC functions.
+    """
+    tables = sorted(set(model_class._meta.db_table
+                        for model_class in depends_on))
+    _cached_tables.update(tables)
+
+    def decorator(func):
+        @wraps(func)
+        def replacement(*args, **kwargs):
+            backend = get_backend()
+            if backend is None:
+                return func(*args, **kwargs)
+            call_args = inspect.getcallargs(func, *args, **kwargs)
+            if should_cache and not should_cache(call_args):
+                return func(*args, **kwargs)
+
+            key_data = [func.__module__, func.__name__, call_args,
+                        _get_tokens(backend, tables)]
+            if per_user:
+                user = thread_local.get_user()
+                key_data.append(user.login if user else None)
+            key = _KEY_PREFIX + hashlib.md5(json.dumps(
+                    key_data, sort_keys=True, default=repr)).hexdigest()
+
+            found = backend.get_many([key])
+            rpcserver_logging.record_cache_lookup(func.__name__, key in found)
+            if key in found:
+                return found[key]
+            result = func(*args, **kwargs)
+            backend.set(key, result, ttl_sec)
+            return result
+        return replacement
+    return decorator
+
+
+def _invalidate_changed_model(sender, **kwargs):
+    """Invalidate the results depending on a saved or deleted model."""
+    if issubclass(sender, model_logic.ModelExtensions):
+        invalidate(sender)
+
+
+def _invalidate_changed_relationship(sender, instance, action, model,
+                                     **kwargs):
+    """Invalidate the results depending on a changed many to many relation."""
+    if action.startswith('post_'):
+        invalidate(type(instance), model)
+
+
+# Most models list dbmodels.Model before ModelExtensions in their bases, so
+# ModelExtensions can't see their save() and delete() calls.
+signals.post_save.connect(_invalidate_changed_model,
+                          dispatch_uid='rpc_cache.post_save')
+signals.post_delete.connect(_invalidate_changed_model,
+                            dispatch_uid='rpc_cache.post_delete')
+signals.m2m_changed.connect(_invalidate_changed_relationship,
+                            dispatch_uid='rpc_cache.m2m_changed')
@@ -0,0 +1,193 @@
+#!/usr/bin/python
+
+import time
+import unittest
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import thread_local
+from autotest_lib.frontend.afe import frontend_test_utils
+from autotest_lib.frontend.afe import models, rpc_cache, rpc_interface
+from autotest_lib.frontend.afe import rpcserver_logging
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.client.common_lib.test_utils import mock
+
+
+class MemoryBackendTest(unittest.TestCase):
+    """Tests MemoryBackend."""
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.now = 1000.0
+        self.god.stub_with(time, 'time', lambda: self.now)
+        self.backend = rpc_cache.MemoryBackend(max_entries=3)
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+
+
+    def test_copies_values(self):
+        """Ensure callers can't modify the cached values."""
+        value = {'hosts': ['host1']}
+        self.backend.set('key', value, 10)
+        value['hosts'].append('host2')
+        self.backend.get_many(['key'])['key']['hosts'].append('host3')
+        self.assertEqual(self.backend.get_many(['key']),
+                         {'key': {'hosts': ['host1']}})
+
+
+    def test_expiration(self):
+        """Ensure values are dropped after their time to live."""
+        self.backend.set('key', 'value', 10)
+        self.backend.set('token', 'value')
+        self.now += 10
+        self.assertEqual(self.backend.get_many(['key', 'token']),
+                         {'token': 'value'})
+
+
+    def test_eviction(self):
+        """Ensure a full cache drops results, but not the tokens."""
+        self.backend.set('token', 'value')
+        self.backend.set('key1', 'value', 10)
+        self.backend.set('key2', 'value', 20)
+        self.now += 15
+        self.backend.set('key3', 'value', 10)
+        self.assertEqual(sorted(self.backend.get_many(
+                ['token', 'key1', 'key2', 'key3'])), ['key2', 'key3', 'token'])
+        self.backend.set('key4', 'value', 10)
+        self.assertEqual(sorted(self.backend.get_many(
+                ['token', 'key2', 'key3', 'key4'])), ['key4', 'token'])
+
+
+class RpcCacheTest(unittest.TestCase,
+                   frontend_test_utils.FrontendTestMixin):
+    """Tests caching the results of RPCs."""
+
+    def setUp(self):
+        self._frontend_common_setup()
+        self.god = mock.mock_god()
+        rpc_cache.set_backend(rpc_cache.MemoryBackend(max_entries=100))
+        self.calls = 0
+
+
+    def tearDown(self):
+        rpc_cache.set_backend(None)
+        self.god.unstub_all()
+        self._frontend_common_teardown()
+        global_config.global_config.reset_config_values()
+
+
+    def _lookups(self, rpc_name):
+        return (rpcserver_logging.cache_hits[rpc_name],
+                rpcserver_logging.cache_misses[rpc_name])
+
+
+    def test_hit(self):
+        """Ensure a repeated RPC is answered from the cache."""
+        hits, misses = self._lookups('get_labels')
+        labels = rpc_interface.get_labels(name__startswith='label')
+        self.assertEqual(rpc_interface.get_labels(name__startswith='label'),
+                         labels)
+        self.assertEqual(self._lookups('get_labels'), (hits + 1, misses + 1))
+
+
+    def test_arguments(self):
+        """Ensure RPCs with different arguments are cached separately."""
+        self.assertEqual(
+                [label['name'] for label in
+                 rpc_interface.get_labels(name='label1')], ['label1'])
+        self.assertEqual(
+                [label['name'] for label in
+                 rpc_interface.get_labels(name='label2')], ['label2'])
+
+
+    def test_invalidated_on_save(self):
+        """Ensure saving a model invalidates the results depending on it."""
+        label = models.Label.smart_get('label1')
+        self.assertEqual(
+                rpc_interface.get_labels(name='label1')[0]['kernel_config'],
+                '')
+        label.kernel_config = 'config'
+        label.save()
+        self.assertEqual(
+                rpc_interface.get_labels(name='label1')[0]['kernel_config'],
+                'config')
+
+
+    def test_invalidated_on_delete(self):
+        """Ensure deleting a model invalidates the results depending on it."""
+        rpc_interface.add_acl_group(name='doomed')
+        self.assertEqual(len(rpc_interface.get_acl_groups(name='doomed')), 1)
+        models.AclGroup.smart_get('doomed').delete()
+        self.assertEqual(rpc_interface.get_acl_groups(name='doomed'), [])
+
+
+    def test_invalidated_on_relationship_change(self):
+        """Ensure many to many changes invalidate the results depending on
+        either side."""
+        self.assertEqual(rpc_interface.get_hosts(hostname='host3')[0]['labels'],
+                         ['myplatform'])
+        self.labels[0].host_set.add(self.hosts[2])
+        self.assertEqual(rpc_interface.get_hosts(hostname='host3')[0]['labels'],
+                         ['label1', 'myplatform'])
+
+
+    def test_expiration(self):
+        """Ensure results are recomputed after their time to live."""
+        hits, misses = self._lookups('get_labels')
+        rpc_interface.get_labels(name='label1')
+        now = time.time()
+        self.god.stub_with(time, 'time', lambda: now + 60)
+        rpc_interface.get_labels(name='label1')
+        self.assertEqual(self._lookups('get_labels'), (hits, misses + 2))
+
+
+    def test_should_cache(self):
+        """Ensure calls should_cache rejects are not cached."""
+        hits, misses = self._lookups('get_hosts')
+        rpc_interface.get_hosts(hostname='host1', include_current_job=True)
+        rpc_interface.get_hosts(hostname='host1', include_current_job=True)
+        self.assertEqual(self._lookups('get_hosts'), (hits, misses))
+
+
+    @rpc_cache.cached(ttl_sec=60, depends_on=[models.User], per_user=True)
+    def _count_calls(self):
+        self.calls += 1
+        return self.calls
+
+
+    def test_per_user(self):
+        """Ensure per-user RPCs are cached separately for each user."""
+        other_user = models.User.objects.create(login='other_user')
+        self.assertEqual(self._count_calls(), 1)
+        self.assertEqual(self._count_calls(), 1)
+        thread_local.set_user(other_user)
+        self.assertEqual(self._count_calls(), 2)
+        self.assertEqual(self._count_calls(), 2)
+
+
+    def test_exceptions_not_cached(self):
+        """Ensure failed calls are made again."""
+        @rpc_cache.cached(ttl_sec=60, depends_on=[models.Label])
+        def fail():
+            self.calls += 1
+            raise ValueError('fail')
+
+        self.assertRaises(ValueError, fail)
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.calls, 2)
+
+
+    def test_disabled(self):
+        """Ensure nothing is cached without a backend."""
+        self.god.stub_with(rpc_cache, 'BACKEND', '')
+        rpc_cache.set_backend(None)
+        hits, misses = self._lookups('get_labels')
+        rpc_interface.get_labels(name='label1')
+        rpc_interface.get_labels(name='label1')
+        self.assertEqual(self._lookups('get_labels'), (hits, misses))
+
+
+if __name__ == '__main__':
+    unittest.main()
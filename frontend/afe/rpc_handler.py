@@ -63,8 +63,9 @@ class RpcHandler(object):
         return self._dispatcher.translateRequest(json_request)
 
 
-    def dispatch_request(self, decoded_request):
-        return self._dispatcher.dispatchRequest(decoded_request)
+    def dispatch_request(self, decoded_request, streaming=False):
+        return self._dispatcher.dispatchRequest(decoded_request,
+                                                streaming=streaming)
 
 
     def log_request(self, user, decoded_request, decoded_result,
@@ -83,18 +84,41 @@ class RpcHandler(object):
         return self._dispatcher.translateResult(results)
 
 
+    def dispatch_batch_request(self, decoded_requests):
+        return self._dispatcher.dispatchBatchRequest(decoded_requests)
+
+
     def handle_rpc_request(self, request):
         remote_ip = self._get_remote_ip(request)
         user = models.User.current_user()
         json_request = self.raw_request_data(request)
         decoded_request = self.decode_request(json_request)
 
-        decoded_request['remote_ip'] = remote_ip
-        decoded_result = self.dispatch_request(decoded_request)
-        result = self.encode_result(decoded_result)
+        # A list is a batch of requests, answered by a list of results.
+        if isinstance(decoded_request, list):
+            decoded_requests = decoded_request
+            for decoded_request in decoded_requests:
+                decoded_request['remote_ip'] = remote_ip
+            decoded_results = self.dispatch_batch_request(decoded_requests)
+            result = self.encode_result(decoded_results)
+        else:
+            decoded_request['remote_ip'] = remote_ip
+            decoded_requests = [decoded_request]
+            decoded_results = [self.dispatch_request(decoded_request,
+                                                     streaming=True)]
+            result = None
+            if not self._dispatcher.isLargeResult(decoded_results[0],
+                                                  rpc_utils.STREAMING_ROWS):
+                result = self.encode_result(decoded_results[0])
         if rpcserver_logging.LOGGING_ENABLED:
-            self.log_request(user, decoded_request, decoded_result,
-                             remote_ip)
+            for decoded_request, decoded_result in zip(decoded_requests,
+                                                       decoded_results):
+                self.log_request(user, decoded_request, decoded_result,
+                                 remote_ip)
+        if result is None:
+            return rpc_utils.streaming_http_response(
+                    self._dispatcher.translateResultChunks(
+                            decoded_results[0], rpc_utils.STREAMING_ROWS))
         return rpc_utils.raw_http_response(result)
 
 
@@ -124,6 +148,8 @@ class RpcHandler(object):
             args = args[:-1]
             return f(*args, **keyword_args)
         new_fn.func_name = f.func_name
+        if hasattr(f, 'iterRows'):
+            new_fn.iterRows = RpcHandler._allow_keyword_args(f.iterRows)
         return new_fn
 
 
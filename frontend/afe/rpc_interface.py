@@ -42,6 +42,8 @@ from autotest_lib.client.common_lib.cros import dev_server
 from autotest_lib.client.common_lib.cros.graphite import autotest_stats
 from autotest_lib.frontend.afe import control_file, rpc_utils
 from autotest_lib.frontend.afe import models, model_logic, model_attributes
+from autotest_lib.frontend.afe import rpc_cache
+from autotest_lib.frontend.afe.json_rpc import serviceHandler
 from autotest_lib.frontend.afe import site_rpc_interface
 from autotest_lib.frontend.tko import models as tko_models
 from autotest_lib.frontend.tko import rpc_interface as tko_rpc_interface
@@ -216,6 +218,7 @@ def label_remove_hosts(id, hosts):
     rpc_utils.fanout_rpc(host_objs, 'remove_label_from_hosts', id=id)
 
 
+@rpc_cache.cached(ttl_sec=60, depends_on=[models.Label, models.AtomicGroup])
 def get_labels(exclude_filters=(), **filter_data):
     """\
     @param exclude_filters: A sequence of dictionaries of filters.
@@ -487,6 +490,11 @@ def delete_host(id):
     models.Host.smart_get(id).delete()
 
 
+# The current jobs and special tasks of hosts change too often to be cached.
+@rpc_cache.cached(ttl_sec=15,
+                  depends_on=[models.Host, models.Label, models.AclGroup,
+                              models.HostAttribute, models.Shard],
+                  should_cache=lambda args: not args['include_current_job'])
 def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
               exclude_atomic_group_hosts=False, valid_only=True,
               include_current_job=False, **filter_data):
@@ -506,12 +514,11 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
                                      exclude_atomic_group_hosts,
                                      valid_only, filter_data)
     hosts = list(hosts)
-    models.Host.objects.populate_relationships(hosts, models.Label,
-                                               'label_list')
-    models.Host.objects.populate_relationships(hosts, models.AclGroup,
-                                               'acl_list')
-    models.Host.objects.populate_relationships(hosts, models.HostAttribute,
-                                               'attribute_list')
+    models.Host.objects.prefetch_relationships(
+            hosts, foreign_keys=models.Host.objects.get_foreign_key_names(),
+            related_lists=[(models.Label, 'label_list', ['atomic_group']),
+                           (models.AclGroup, 'acl_list'),
+                           (models.HostAttribute, 'attribute_list')])
     host_dicts = []
     for host_obj in hosts:
         host_dict = host_obj.get_object_dict()
@@ -704,6 +711,8 @@ def delete_acl_group(id):
     models.AclGroup.smart_get(id).delete()
 
 
+@rpc_cache.cached(ttl_sec=60,
+                  depends_on=[models.AclGroup, models.User, models.Host])
 def get_acl_groups(**filter_data):
     acl_groups = models.AclGroup.list_objects(filter_data)
     for acl_group in acl_groups:
@@ -1144,9 +1153,10 @@ def get_jobs(not_yet_run=False, running=False, finished=False,
                                                                  standalone)
     job_dicts = []
     jobs = list(models.Job.query_objects(filter_data))
-    models.Job.objects.populate_relationships(jobs, models.Label,
-                                              'dependencies')
-    models.Job.objects.populate_relationships(jobs, models.JobKeyval, 'keyvals')
+    models.Job.objects.prefetch_relationships(
+            jobs, foreign_keys=models.Job.objects.get_foreign_key_names(),
+            related_lists=[(models.Label, 'dependencies'),
+                           (models.JobKeyval, 'keyvals')])
     for job in jobs:
         job_dict = job.get_object_dict()
         job_dict['dependencies'] = ','.join(label.name
@@ -1188,15 +1198,40 @@ def get_jobs_summary(**filter_data):
     jobs = get_jobs(**filter_data)
     ids = [job['id'] for job in jobs]
     all_status_counts = models.Job.objects.get_status_counts(ids)
+    all_result_counts = _get_result_counts(ids)
     for job in jobs:
         job['status_counts'] = all_status_counts[job['id']]
-        job['result_counts'] = tko_rpc_interface.get_status_counts(
-                ['afe_job_id', 'afe_job_id'],
-                header_groups=[['afe_job_id'], ['afe_job_id']],
-                **{'afe_job_id': job['id']})
+        job['result_counts'] = all_result_counts[job['id']]
     return rpc_utils.prepare_for_serialization(jobs)
 
 
+def _get_result_counts(job_ids):
+    """Get the TKO result counts of jobs, with a single query.
+
+    @param job_ids: A list of AFE job ids.
+
+    @returns: A dictionary of the result counts of each job, as
+              tko_rpc_interface.get_status_counts returns them for the job
+              alone, by job id.
+    """
+    if not job_ids:
+        return {}
+    counts = tko_rpc_interface.get_status_counts(
+            ['afe_job_id', 'afe_job_id'],
+            header_groups=[['afe_job_id'], ['afe_job_id']],
+            afe_job_id__in=job_ids)
+    result_counts = dict((job_id, {'header_values': [[], []], 'groups': []})
+                         for job_id in job_ids)
+    # There is one group per job, its header is the job id.
+    for group in counts['groups']:
+        header = counts['header_values'][0][group['header_indices'][0]]
+        group['header_indices'] = [0, 0]
+        job_result_counts = result_counts[header[0]]
+        job_result_counts['header_values'] = [[header], [header]]
+        job_result_counts['groups'].append(group)
+    return result_counts
+
+
 def get_info_for_clone(id, preserve_metahosts, queue_entry_filter_data=None):
     """\
     Retrieves all the information needed to clone a job.
@@ -1245,17 +1280,32 @@ def get_info_for_clone(id, preserve_metahosts, queue_entry_filter_data=None):
 
 # host queue entries
 
-def get_host_queue_entries(start_time=None, end_time=None, **filter_data):
-    """\
-    @returns A sequence of nested dictionaries of host and job information.
-    """
+def _get_host_queue_entry_query(start_time, end_time, filter_data):
     filter_data = rpc_utils.inject_times_to_filter('started_on__gte',
                                                    'started_on__lte',
                                                    start_time,
                                                    end_time,
                                                    **filter_data)
+    return models.HostQueueEntry.query_objects(filter_data)
+
+
+def _iter_host_queue_entries(start_time=None, end_time=None, **filter_data):
+    """\
+    Like get_host_queue_entries, but the entries are read from the database
+    as they are iterated.
+    """
+    return rpc_utils.iter_rows_as_nested_dicts(
+            _get_host_queue_entry_query(start_time, end_time, filter_data),
+            ('host', 'atomic_group', 'job'))
+
+
+@serviceHandler.StreamedServiceMethod(_iter_host_queue_entries)
+def get_host_queue_entries(start_time=None, end_time=None, **filter_data):
+    """\
+    @returns A sequence of nested dictionaries of host and job information.
+    """
     return rpc_utils.prepare_rows_as_nested_dicts(
-            models.HostQueueEntry.query_objects(filter_data),
+            _get_host_queue_entry_query(start_time, end_time, filter_data),
             ('host', 'atomic_group', 'job'))
 
 
@@ -1550,6 +1600,9 @@ def get_motd():
     return rpc_utils.get_motd()
 
 
+@rpc_cache.cached(ttl_sec=60, per_user=True,
+                  depends_on=[models.User, models.Label, models.AtomicGroup,
+                              models.Test, models.Profiler, models.DroneSet])
 def get_static_data():
     """\
     Returns a dictionary containing a bunch of data that shouldn't change
@@ -2,12 +2,14 @@
 #!/usr/bin/python
 
 import datetime
+import threading
 import common
 
 from autotest_lib.frontend import setup_django_environment
 from autotest_lib.frontend.afe import frontend_test_utils
 from autotest_lib.frontend.afe import models, rpc_interface, frontend_test_utils
 from autotest_lib.frontend.afe import model_logic, model_attributes
+from autotest_lib.frontend.afe import rpc_utils
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import control_data
 from autotest_lib.client.common_lib import error
@@ -84,6 +86,94 @@ class RpcInterfaceTest(unittest.TestCase,
         self.assertEquals(host['attributes'], {})
 
 
+    def test_get_hosts_paged(self):
+        all_ids = sorted(host.id for host in self.hosts)
+        page_ids = []
+        query_after = None
+        while True:
+            page = rpc_interface.get_hosts(query_after=query_after,
+                                           query_limit=2)
+            page_ids.extend(host['id'] for host in page)
+            if len(page) < 2:
+                break
+            query_after = page[-1]['id']
+        self.assertEquals(page_ids, all_ids)
+
+        # Pages don't shift when hosts before them are removed.
+        first_page = rpc_interface.get_hosts(query_after=None, query_limit=2)
+        models.Host.objects.get(id=first_page[0]['id']).delete()
+        second_page = rpc_interface.get_hosts(
+                query_after=first_page[-1]['id'], query_limit=2)
+        self.assertEquals([host['id'] for host in second_page], all_ids[2:4])
+
+        self.assertEquals(rpc_interface.get_num_hosts(query_after=all_ids[0]),
+                          len(all_ids) - 1)
+        self.assertRaises(ValueError, rpc_interface.get_hosts,
+                          query_after=None, query_limit=2, sort_by=['hostname'])
+
+
+    def test_get_host_queue_entries_paged(self):
+        self._create_job(hosts=[1, 2, 3])
+        entries = rpc_interface.get_host_queue_entries(query_after=None,
+                                                       query_limit=2)
+        entries += rpc_interface.get_host_queue_entries(
+                query_after=entries[-1]['id'], query_limit=2)
+        self.assertEquals([entry['host']['hostname'] for entry in entries],
+                          ['host1', 'host2', 'host3'])
+
+
+    def test_get_hosts_query_count(self):
+        # Hosts refer to other objects through foreign keys, and atomic groups
+        # through their labels.
+        user = models.User.current_user()
+        for host in self.hosts[:2]:
+            host.locked = True
+            host.locked_by = user
+            host.save()
+        self.hosts[0].set_attribute('attr', 'value')
+        with self.assert_num_queries(8):
+            hosts = rpc_interface.get_hosts()
+        self.assertEquals(len(hosts), len(self.hosts))
+        self.assertEquals(
+                [host['atomic_group'] for host in hosts
+                 if host['hostname'] == 'host5'], ['atomic1'])
+
+        for hostname in ('host10', 'host11', 'host12'):
+            host = models.Host.objects.create(hostname=hostname)
+            host.labels.add(self.label4)
+        with self.assert_num_queries(8):
+            rpc_interface.get_hosts()
+
+
+    def test_get_host_queue_entries_query_count(self):
+        # One query for the entries, one per type of object they refer to.
+        self._create_job(hosts=[1, 2])
+        with self.assert_num_queries(3):
+            entries = rpc_interface.get_host_queue_entries()
+        self._create_job(hosts=[3, 4], metahosts=[self.label6.id],
+                         atomic_group=1)
+        self.hosts[2].locked = True
+        self.hosts[2].save()
+        with self.assert_num_queries(6):
+            entries = rpc_interface.get_host_queue_entries()
+        self.assertEquals(len(entries), 5)
+        self.assertEquals(sorted(entry['host']['hostname']
+                                 for entry in entries if entry['host']),
+                          ['host1', 'host2', 'host3', 'host4'])
+
+
+    def test_get_host_queue_entries_streamed(self):
+        self._create_job(hosts=[1, 2, 3])
+        self.god.stub_with(rpc_utils, 'STREAMING_ROWS', 2)
+        with self.assert_num_queries(0):
+            entries = rpc_interface.get_host_queue_entries.iterRows()
+        # One query for the entries, and per chunk one per type of object
+        # they refer to.
+        with self.assert_num_queries(5):
+            entries = list(entries)
+        self.assertEquals(entries, rpc_interface.get_host_queue_entries())
+
+
     def test_get_hosts_multiple_labels(self):
         hosts = rpc_interface.get_hosts(
                 multiple_labels=['myplatform', 'label1'])
@@ -147,16 +237,32 @@ class RpcInterfaceTest(unittest.TestCase,
         entries[2].aborted = True
         entries[2].save()
 
-        # Mock up tko_rpc_interface.get_status_counts.
-        self.god.stub_function_to_return(rpc_interface.tko_rpc_interface,
-                                         'get_status_counts',
-                                         None)
-
-        job_summaries = rpc_interface.get_jobs_summary(id=job.id)
-        self.assertEquals(len(job_summaries), 1)
+        job_without_results = self._create_job(hosts=[4])
+
+        # Mock up tko_rpc_interface.get_status_counts, called once for all the
+        # jobs.
+        job_ids = [job.id, job_without_results.id]
+        group = {'id': '[%d]' % job.id, 'group_count': 3, 'pass_count': 1}
+        self.god.stub_function(rpc_interface.tko_rpc_interface,
+                               'get_status_counts')
+        rpc_interface.tko_rpc_interface.get_status_counts.expect_call(
+                ['afe_job_id', 'afe_job_id'],
+                header_groups=[['afe_job_id'], ['afe_job_id']],
+                afe_job_id__in=job_ids).and_return(
+                        {'header_values': [[[job.id]], [[job.id]]],
+                         'groups': [dict(group, header_indices=[0, 0])]})
+
+        job_summaries = rpc_interface.get_jobs_summary(id__in=job_ids)
+        self.god.check_playback()
+        self.assertEquals(len(job_summaries), 2)
         summary = job_summaries[0]
         self.assertEquals(summary['status_counts'], {'Queued': 1,
                                                      'Failed': 2})
+        self.assertEquals(summary['result_counts'],
+                          {'header_values': [[[job.id]], [[job.id]]],
+                           'groups': [dict(group, header_indices=[0, 0])]})
+        self.assertEquals(job_summaries[1]['result_counts'],
+                          {'header_values': [[], []], 'groups': []})
 
 
     def _check_job_ids(self, actual_job_dicts, expected_jobs):
@@ -458,7 +564,8 @@ class RpcInterfaceTest(unittest.TestCase,
             self.god.stub_with(frontend_wrappers, 'RetryingAFE', mock_afe)
 
             mock_afe2 = frontend_wrappers.RetryingAFE.expect_new(
-                    server=shard_hostname, user=None)
+                    server=shard_hostname, user=None,
+                    timeout_min=rpc_utils.SHARD_RPC_FANOUT_TIMEOUT_SEC / 60.0)
             mock_afe2.run.expect_call('modify_host_local', id=host.id,
                     locked=True, lock_reason='_modify_host_helper lock',
                     lock_time=datetime.datetime(2015, 12, 15))
@@ -520,6 +627,8 @@ class RpcInterfaceTest(unittest.TestCase,
         mock_afe = self.god.create_mock_class_obj(frontend_wrappers.RetryingAFE,
                                                   'MockAFE')
         self.god.stub_with(frontend_wrappers, 'RetryingAFE', mock_afe)
+        # Forward one RPC at a time, so they are made in the expected order.
+        self.god.stub_with(rpc_utils, 'SHARD_RPC_FANOUT_WORKERS', 1)
 
         # The statuses of one host might differ on master and shard.
         # Filters are always applied on the master. So the host on the shard
@@ -527,7 +636,8 @@ class RpcInterfaceTest(unittest.TestCase,
         filters_to_use = {'status': 'Ready'}
 
         mock_afe2 = frontend_wrappers.RetryingAFE.expect_new(
-                server='shard2', user=None)
+                server='shard2', user=None,
+                timeout_min=rpc_utils.SHARD_RPC_FANOUT_TIMEOUT_SEC / 60.0)
         mock_afe2.run.expect_call(
             'modify_hosts_local',
             host_filter_data={'id__in': [shard1.id, shard2.id]},
@@ -536,7 +646,8 @@ class RpcInterfaceTest(unittest.TestCase,
                          'lock_time' : datetime.datetime(2015, 12, 15) })
 
         mock_afe1 = frontend_wrappers.RetryingAFE.expect_new(
-                server='shard1', user=None)
+                server='shard1', user=None,
+                timeout_min=rpc_utils.SHARD_RPC_FANOUT_TIMEOUT_SEC / 60.0)
         mock_afe1.run.expect_call(
             'modify_hosts_local',
             host_filter_data={'id__in': [shard1.id, shard2.id]},
@@ -557,6 +668,121 @@ class RpcInterfaceTest(unittest.TestCase,
         self.god.check_playback()
 
 
+    def _stub_shard_afe(self, run):
+        """Replace RetryingAFE with a class calling run(server, rpc_call)."""
+        class FakeAFE(object):
+            def __init__(self, server, user, timeout_min):
+                self.server = server
+
+            def run(self, rpc_call, **dargs):
+                return run(self.server, rpc_call)
+
+        self.god.stub_with(frontend_wrappers, 'RetryingAFE', FakeAFE)
+
+
+    def test_run_rpc_on_multiple_hostnames_concurrently(self):
+        """Ensure an RPC forwarded to shards is made on all at the same time."""
+        shards = ['shard1', 'shard2', 'shard3']
+        started = []
+        all_started = threading.Event()
+        lock = threading.Lock()
+
+        def run(server, rpc_call):
+            with lock:
+                started.append(server)
+                if len(started) == len(shards):
+                    all_started.set()
+            # Only returns in time if all the calls are in flight together.
+            self.assertTrue(all_started.wait(10))
+
+        self._stub_shard_afe(run)
+        rpc_utils.run_rpc_on_multiple_hostnames('delete_host', shards, id=1)
+        self.assertEqual(sorted(started), shards)
+
+
+    def test_run_rpc_on_multiple_hostnames_reports_all_failures(self):
+        """Ensure the failures of all shards are reported together."""
+        called = []
+
+        def run(server, rpc_call):
+            called.append(server)
+            if server != 'shard2':
+                raise error.AutoservError('%s is down' % server)
+
+        self._stub_shard_afe(run)
+        try:
+            rpc_utils.run_rpc_on_multiple_hostnames(
+                    'delete_host', ['shard1', 'shard2', 'shard3'], id=1)
+        except error.RPCException as e:
+            message = str(e)
+        else:
+            self.fail('RPCException not raised')
+        self.assertEqual(sorted(called), ['shard1', 'shard2', 'shard3'])
+        self.assertEqual(message,
+                         'RPC delete_host failed on shard shard1 due to '
+                         'AutoservError: shard1 is down; '
+                         'RPC delete_host failed on shard shard3 due to '
+                         'AutoservError: shard3 is down')
+
+
+    def test_run_rpc_on_multiple_hostnames_timeout(self):
+        """Ensure shards not answering in time are reported as failures."""
+        release = threading.Event()
+        finished = []
+        all_finished = threading.Event()
+        lock = threading.Lock()
+
+        def run(server, rpc_call):
+            if server == 'shard2':
+                release.wait(10)
+            with lock:
+                finished.append(server)
+                if len(finished) == 2:
+                    all_finished.set()
+
+        self._stub_shard_afe(run)
+        self.god.stub_with(rpc_utils, 'SHARD_RPC_FANOUT_TIMEOUT_SEC', 0)
+        try:
+            self.assertRaises(error.RPCException,
+                              rpc_utils.run_rpc_on_multiple_hostnames,
+                              'delete_host', ['shard1', 'shard2'], id=1)
+        finally:
+            release.set()
+            # Keep RetryingAFE stubbed until the calls left running in the
+            # pool are done.
+            self.assertTrue(all_finished.wait(10))
+
+
+    def test_run_rpc_on_multiple_hostnames_timeout_frees_workers(self):
+        """Ensure calls left running after a timeout don't block new calls."""
+        release = threading.Event()
+        finished = []
+        all_finished = threading.Event()
+        lock = threading.Lock()
+
+        def run(server, rpc_call):
+            if server in ('shard1', 'shard2'):
+                release.wait(10)
+            with lock:
+                finished.append(server)
+                if len(finished) == 4:
+                    all_finished.set()
+
+        self._stub_shard_afe(run)
+        self.god.stub_with(rpc_utils, 'SHARD_RPC_FANOUT_WORKERS', 2)
+        self.god.stub_with(rpc_utils, 'SHARD_RPC_FANOUT_TIMEOUT_SEC', 0)
+        try:
+            self.assertRaises(error.RPCException,
+                              rpc_utils.run_rpc_on_multiple_hostnames,
+                              'delete_host', ['shard1', 'shard2'], id=1)
+            rpc_utils.SHARD_RPC_FANOUT_TIMEOUT_SEC = 10
+            rpc_utils.run_rpc_on_multiple_hostnames(
+                    'delete_host', ['shard3', 'shard4'], id=1)
+        finally:
+            release.set()
+            self.assertTrue(all_finished.wait(10))
+
+
     def test_delete_host(self):
         """Ensure an RPC is made on delete a host, if it is on a shard."""
         host1 = models.Host.objects.all()[0]
@@ -570,7 +796,8 @@ class RpcInterfaceTest(unittest.TestCase,
         self.god.stub_with(frontend_wrappers, 'RetryingAFE', mock_afe)
 
         mock_afe1 = frontend_wrappers.RetryingAFE.expect_new(
-                server='shard1', user=None)
+                server='shard1', user=None,
+                timeout_min=rpc_utils.SHARD_RPC_FANOUT_TIMEOUT_SEC / 60.0)
         mock_afe1.run.expect_call('delete_host', id=host1.id)
 
         rpc_interface.delete_host(id=host1.id)
@@ -596,7 +823,8 @@ class RpcInterfaceTest(unittest.TestCase,
         self.god.stub_with(frontend_wrappers, 'RetryingAFE', mock_afe)
 
         mock_afe1 = frontend_wrappers.RetryingAFE.expect_new(
-                server='shard1', user=None)
+                server='shard1', user=None,
+                timeout_min=rpc_utils.SHARD_RPC_FANOUT_TIMEOUT_SEC / 60.0)
         mock_afe1.run.expect_call('modify_label', id=label1.id, invalid=1)
 
         rpc_interface.modify_label(label1.id, invalid=1)
@@ -619,7 +847,8 @@ class RpcInterfaceTest(unittest.TestCase,
         self.god.stub_with(frontend_wrappers, 'RetryingAFE', mock_afe)
 
         mock_afe1 = frontend_wrappers.RetryingAFE.expect_new(
-                server='shard1', user=None)
+                server='shard1', user=None,
+                timeout_min=rpc_utils.SHARD_RPC_FANOUT_TIMEOUT_SEC / 60.0)
         mock_afe1.run.expect_call('delete_label', id=label1.id)
 
         rpc_interface.delete_label(id=label1.id)
@@ -6,13 +6,22 @@ only RPC interface functions go into that file.
 
 __author__ = 'showard@google.com (Steve Howard)'
 
+import base64
 import datetime
 from functools import wraps
 import inspect
+import itertools
+import json
+import multiprocessing
+from multiprocessing import pool as multiprocessing_pool
 import os
 import sys
+import time
+import zlib
 import django.db.utils
 import django.http
+from django.core.serializers import json as django_json
+from django.db import transaction
 
 from autotest_lib.frontend import thread_local
 from autotest_lib.frontend.afe import models, model_logic
@@ -28,6 +37,18 @@ NULL_DATETIME = datetime.datetime.max
 NULL_DATE = datetime.date.max
 DUPLICATE_KEY_MSG = 'Duplicate entry'
 
+# Maximum number of shards an RPC is forwarded to at the same time.
+SHARD_RPC_FANOUT_WORKERS = global_config.global_config.get_config_value(
+        'SHARD', 'rpc_fanout_workers', type=int, default=8)
+# Seconds to wait for all shards to answer an RPC forwarded to them.
+SHARD_RPC_FANOUT_TIMEOUT_SEC = global_config.global_config.get_config_value(
+        'SHARD', 'rpc_fanout_timeout_sec', type=int, default=600)
+
+# List results of more rows than this are encoded and sent this many rows at a
+# time, instead of all at once, see rpc_handler.
+STREAMING_ROWS = global_config.global_config.get_config_value(
+        'SERVER', 'rpc_streaming_rows', type=int, default=1000)
+
 def prepare_for_serialization(objects):
     """
     Prepare Python objects to be returned via RPC.
@@ -44,21 +65,85 @@ def prepare_rows_as_nested_dicts(query, nested_dict_column_names):
     Prepare a Django query to be returned via RPC as a sequence of nested
     dictionaries.
 
-    @param query - A Django model query object with a select_related() method.
-    @param nested_dict_column_names - A list of column/attribute names for the
+    @param query - A Django model query object.
+    @param nested_dict_column_names - A list of foreign key names of the
             rows returned by query to expand into nested dictionaries using
-            their get_object_dict() method when not None.
+            their get_object_dict() method when not None.  The objects all
+            the foreign keys refer to are loaded with one query per foreign
+            key.
 
     @returns An list suitable to returned in an RPC.
     """
+    return prepare_for_serialization(_get_nested_dicts(
+            query, list(query.iterator()), nested_dict_column_names))
+
+
+def iter_rows_as_nested_dicts(query, nested_dict_column_names):
+    """
+    Like prepare_rows_as_nested_dicts, but return an iterator of the
+    dictionaries, see iter_rows_as_dicts.
+
+    @param query - A Django model query object.
+    @param nested_dict_column_names - see prepare_rows_as_nested_dicts.
+
+    @returns An iterator of the dictionaries, suitable to be returned by the
+            iterRows of a StreamedServiceMethod.
+    """
+    return iter_rows_as_dicts(
+            query, lambda rows: _get_nested_dicts(query, rows,
+                                                  nested_dict_column_names))
+
+
+def iter_rows_as_dicts(query, get_dicts):
+    """
+    Iterate over a Django query STREAMING_ROWS rows at a time, yielding the
+    dictionaries of the rows, prepared to be returned via RPC like
+    prepare_for_serialization does.
+
+    @param query - A Django model query object.
+    @param get_dicts - A function taking a list of rows of the query, and
+            returning the list of their dictionaries.
+
+    @returns An iterator of the dictionaries.
+    """
+    rows = query.iterator()
+    ids = set()
+    while True:
+        chunk = list(itertools.islice(rows, STREAMING_ROWS))
+        if not chunk:
+            return
+        for row_dict in get_dicts(chunk):
+            if 'id' in row_dict:
+                if row_dict['id'] in ids:
+                    continue
+                ids.add(row_dict['id'])
+            yield _prepare_data(row_dict)
+
+
+def _get_nested_dicts(query, rows, nested_dict_column_names):
+    """
+    Get the nested dictionaries of rows of a query.
+
+    @param query - The Django model query object the rows are from.
+    @param rows - The model objects.
+    @param nested_dict_column_names - see prepare_rows_as_nested_dicts.
+
+    @returns A list of the dictionaries of the rows.
+    """
+    manager = query.model.objects
+    if isinstance(manager, model_logic.ExtendedManager):
+        manager.prefetch_relationships(
+                rows,
+                foreign_keys=manager.get_foreign_key_names(
+                        nested_dict_column_names))
     all_dicts = []
-    for row in query.select_related():
+    for row in rows:
         row_dict = row.get_object_dict()
         for column in nested_dict_column_names:
             if row_dict[column] is not None:
                 row_dict[column] = getattr(row, column).get_object_dict()
         all_dicts.append(row_dict)
-    return prepare_for_serialization(all_dicts)
+    return all_dicts
 
 
 def _prepare_data(data):
@@ -102,6 +187,16 @@ def raw_http_response(response_data, content_type=None):
     return response
 
 
+def streaming_http_response(response_chunks, content_type=None):
+    """Build a response sending its content as it is produced.
+
+    @param response_chunks: An iterable of the strings of the content.
+    @param content_type: The content type of the response.
+    """
+    return django.http.StreamingHttpResponse(response_chunks,
+                                             mimetype=content_type)
+
+
 def gather_unique_dicts(dict_iterable):
     """\
     Pick out unique objects (by ID) from an iterable of object dicts.
@@ -1086,8 +1181,10 @@ def find_records_for_shard(shard, known_job_ids, known_host_ids):
     """Find records that should be sent to a shard.
 
     @param shard: Shard to find records for.
-    @param known_job_ids: List of ids of jobs the shard already has.
-    @param known_host_ids: List of ids of hosts the shard already has.
+    @param known_job_ids: List of ids of jobs the shard already has, or None
+                          if it has all incomplete jobs assigned to it.
+    @param known_host_ids: List of ids of hosts the shard already has, or None
+                           if it has all hosts assigned to it.
 
     @returns: Tuple of three lists for hosts, jobs, and suite job keyvals:
               (hosts, jobs, suite_job_keyvals).
@@ -1104,6 +1201,53 @@ def find_records_for_shard(shard, known_job_ids, known_host_ids):
     return hosts, jobs, suite_job_keyvals
 
 
+def encode_heartbeat_payload(data):
+    """Encode the records of a heartbeat for protocol versions 2 and newer.
+
+    Serialized records repeat the same field names over and over, so they
+    compress well.
+
+    @param data: A JSON serializable dictionary.
+
+    @returns: A string of the compressed JSON of data, in base64.
+    """
+    encoded = json.dumps(data, cls=django_json.DjangoJSONEncoder,
+                         separators=(',', ':'))
+    return base64.b64encode(zlib.compress(encoded))
+
+
+def decode_heartbeat_payload(payload):
+    """Decode the records of a heartbeat encoded by encode_heartbeat_payload.
+
+    @param payload: The encoded string.
+
+    @returns: The decoded dictionary.
+    """
+    return json.loads(zlib.decompress(base64.b64decode(payload)))
+
+
+def start_heartbeat_sequence(shard, watermark):
+    """Start the next heartbeat sequence of a shard.
+
+    The sequence number is saved before any records are assigned to the
+    shard. If the response never makes it to the shard, the shard will send
+    an outdated watermark next time, and will be sent all its records again.
+
+    @param shard: The shard doing the heartbeat.
+    @param watermark: The sequence number of the last heartbeat response the
+                      shard persisted, or None if it doesn't know one.
+
+    @returns: Tuple (sequence, in_sync). sequence is the number of the new
+              heartbeat response. in_sync is True if the shard persisted the
+              last response, i.e. it has all records assigned to it.
+    """
+    heartbeat, _ = models.ShardHeartbeat.objects.get_or_create(shard=shard)
+    in_sync = watermark is not None and watermark == heartbeat.sequence
+    heartbeat.sequence += 1
+    heartbeat.save()
+    return heartbeat.sequence, in_sync
+
+
 def _persist_records_with_type_sent_from_shard(
     shard, records, record_type, *args, **kwargs):
     """
@@ -1117,16 +1261,19 @@ def _persist_records_with_type_sent_from_shard(
     @param kwargs: Additional arguments that will be passed on to the sanity
                   checks.
 
+    All records are retrieved with one query and checked before any of them
+    is updated. The updates are then applied with bulk UPDATEs.
+
     @raises error.UnallowedRecordsSentToMaster if any of the sanity checks fail.
 
     @returns: List of primary keys of the processed records.
     """
-    pks = []
+    pks = [serialized_record['id'] for serialized_record in records]
+    current_records = record_type.objects.in_bulk(pks)
     for serialized_record in records:
         pk = serialized_record['id']
-        try:
-            current_record = record_type.objects.get(pk=pk)
-        except record_type.DoesNotExist:
+        current_record = current_records.get(pk)
+        if current_record is None:
             raise error.UnallowedRecordsSentToMaster(
                 'Object with pk %s of type %s does not exist on master.' % (
                     pk, record_type))
@@ -1134,8 +1281,8 @@ def _persist_records_with_type_sent_from_shard(
         current_record.sanity_check_update_from_shard(
             shard, serialized_record, *args, **kwargs)
 
-        current_record.update_from_serialized(serialized_record)
-        pks.append(pk)
+    with transaction.commit_on_success():
+        record_type.bulk_update_from_serialized(records)
     return pks
 
 
@@ -1218,16 +1365,13 @@ def fanout_rpc(host_objs, rpc_name, include_hostnames=True, **kwargs):
             host_objs, rpc_hostnames=True)
 
     # Execute the rpc against the appropriate shards.
+    calls = []
     for shard, hostnames in shard_host_map.iteritems():
+        shard_kwargs = dict(kwargs)
         if include_hostnames:
-            kwargs['hosts'] = hostnames
-        try:
-            run_rpc_on_multiple_hostnames(rpc_name, [shard], **kwargs)
-        except:
-            ei = sys.exc_info()
-            new_exc = error.RPCException('RPC %s failed on shard %s due to '
-                    '%s: %s' % (rpc_name, shard, ei[0].__name__, ei[1]))
-            raise new_exc.__class__, new_exc, ei[2]
+            shard_kwargs['hosts'] = hostnames
+        calls.append((shard, shard_kwargs))
+    run_rpc_on_shards(rpc_name, calls)
 
 
 def run_rpc_on_multiple_hostnames(rpc_call, shard_hostnames, **kwargs):
@@ -1239,13 +1383,87 @@ def run_rpc_on_multiple_hostnames(rpc_call, shard_hostnames, **kwargs):
     @param rpc_call: Name of the rpc endpoint to call.
     @param shard_hostnames: List of hostnames to run the rpcs on.
     @param **kwargs: Keyword arguments to pass in the rpcs.
+
+    @raises error.RPCException: If the rpc failed on any of the shards.
+    """
+    run_rpc_on_shards(rpc_call, [(shard_hostname, kwargs)
+                                 for shard_hostname in shard_hostnames])
+
+
+def run_rpc_on_shards(rpc_call, calls):
+    """Runs an rpc on multiple shards at the same time.
+
+    Calls are made by a pool of up to SHARD_RPC_FANOUT_WORKERS threads, and
+    are given SHARD_RPC_FANOUT_TIMEOUT_SEC seconds in total to finish. Each
+    call also stops retrying after that time. The retries of a call can't be
+    interrupted outside of the main thread though, so every call to this
+    function uses its own pool, and the calls left running after the timeout
+    don't hold up other calls. A single call is made in the calling thread.
+
+    @param rpc_call: Name of the rpc endpoint to call.
+    @param calls: List of tuples (shard_hostname, kwargs), where kwargs are
+                  the keyword arguments of the rpc on that shard.
+
+    @raises error.RPCException: If the rpc failed or timed out on any of the
+            shards. The message lists every shard it failed on, the traceback
+            is the one of the first failure.
     """
     # Make sure this function is not called on shards but only on master.
     assert not server_utils.is_shard()
-    for shard_hostname in shard_hostnames:
-        afe = frontend_wrappers.RetryingAFE(server=shard_hostname,
-                                            user=thread_local.get_user())
-        afe.run(rpc_call, **kwargs)
+    # The user is stored per thread, so look it up before leaving this one.
+    user = thread_local.get_user()
+    timeout_min = SHARD_RPC_FANOUT_TIMEOUT_SEC / 60.0
+
+    def run(shard_hostname, kwargs):
+        try:
+            afe = frontend_wrappers.RetryingAFE(server=shard_hostname,
+                                                user=user,
+                                                timeout_min=timeout_min)
+            afe.run(rpc_call, **kwargs)
+        except Exception:
+            return sys.exc_info()
+        return None
+
+    failures = []
+    timer = autotest_stats.Timer('shard_rpc_fanout')
+    with timer.get_client(rpc_call):
+        if len(calls) <= 1 or SHARD_RPC_FANOUT_WORKERS <= 1:
+            for shard_hostname, kwargs in calls:
+                exc_info = run(shard_hostname, kwargs)
+                if exc_info:
+                    failures.append((shard_hostname, exc_info))
+        else:
+            pool = multiprocessing_pool.ThreadPool(
+                    min(SHARD_RPC_FANOUT_WORKERS, len(calls)))
+            results = [(shard_hostname,
+                        pool.apply_async(run, (shard_hostname, kwargs)))
+                       for shard_hostname, kwargs in calls]
+            # The workers exit once the calls are done, without waiting for
+            # them here.
+            pool.close()
+            deadline = time.time() + SHARD_RPC_FANOUT_TIMEOUT_SEC
+            for shard_hostname, result in results:
+                try:
+                    exc_info = result.get(max(0, deadline - time.time()))
+                except multiprocessing.TimeoutError:
+                    try:
+                        raise error.TimeoutException(
+                                'No answer within %d seconds' %
+                                SHARD_RPC_FANOUT_TIMEOUT_SEC)
+                    except error.TimeoutException:
+                        exc_info = sys.exc_info()
+                if exc_info:
+                    failures.append((shard_hostname, exc_info))
+
+    if failures:
+        autotest_stats.Counter('shard_rpc_fanout').increment(
+                'failures', len(failures))
+        new_exc = error.RPCException('; '.join(
+                'RPC %s failed on shard %s due to %s: %s' % (
+                        rpc_call, shard_hostname, exc_info[0].__name__,
+                        exc_info[1])
+                for shard_hostname, exc_info in failures))
+        raise new_exc.__class__, new_exc, failures[0][1][2]
 
 
 def get_label(name):
@@ -1,6 +1,7 @@
-import logging, logging.handlers, time, os
+import collections, logging, logging.handlers, time, os
 import common
 from autotest_lib.client.common_lib import global_config
+from autotest_lib.client.common_lib.cros.graphite import autotest_stats
 from autotest_lib.site_utils import rpc_logserver
 
 
@@ -9,6 +10,10 @@ LOGGING_ENABLED = config.get_config_value('SERVER', 'rpc_logging', type=bool)
 
 rpc_logger = None
 
+# Lookups in the RPC result cache, by RPC name.
+cache_hits = collections.Counter()
+cache_misses = collections.Counter()
+
 
 def configure_logging():
     logserver_enabled = config.get_config_value(
@@ -26,5 +31,22 @@ def configure_logging():
     rpc_logger.setLevel(logging.DEBUG)
 
 
+def record_cache_lookup(rpc_name, hit):
+    """Record a lookup in the RPC result cache.
+
+    @param rpc_name: Name of the RPC.
+    @param hit: True if the result was found in the cache.
+    """
+    if hit:
+        cache_hits[rpc_name] += 1
+    else:
+        cache_misses[rpc_name] += 1
+    outcome = 'hit' if hit else 'miss'
+    autotest_stats.Counter('rpc_cache').increment(
+            '%s.%s' % (outcome, rpc_name))
+    if rpc_logger:
+        rpc_logger.debug('cache %s: %s', outcome, rpc_name)
+
+
 if LOGGING_ENABLED:
     configure_logging()
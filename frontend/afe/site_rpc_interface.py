@@ -403,7 +403,8 @@ def get_host_history(start_time, end_time, hosts=None, board=None, pool=None):
 
 
 def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
-                    known_host_ids=(), known_host_statuses=()):
+                    known_host_ids=(), known_host_statuses=(),
+                    protocol_version=1, watermark=None, payload=None):
     """Receive updates for job statuses from shards and assign hosts and jobs.
 
     @param shard_hostname: Hostname of the calling shard
@@ -415,9 +416,20 @@ def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
     @param known_job_ids: List of ids of jobs the shard already has.
     @param known_host_ids: List of ids of hosts the shard already has.
     @param known_host_statuses: List of statuses of hosts the shard already has.
+    @param protocol_version: Version of the heartbeat protocol, see below.
+    @param watermark: Protocol version 2: The sequence number of the last
+                      heartbeat response the shard persisted, or None.
+    @param payload: Protocol version 2: jobs, hqes, known_host_ids and
+                    known_host_statuses, encoded by
+                    rpc_utils.encode_heartbeat_payload. known_job_ids is not
+                    sent and the host statuses are only those that changed
+                    since the last heartbeat.
 
     @returns: Serialized representations of hosts, jobs, suite job keyvals
               and their dependencies to be inserted into a shard's database.
+              Protocol version 2: A dictionary with the protocol_version, the
+              sequence number of this response and the records as payload,
+              encoded by rpc_utils.encode_heartbeat_payload.
     """
     # The following alternatives to sending host and job ids in every heartbeat
     # have been considered:
@@ -451,9 +463,25 @@ def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
     # A NOT IN query with 5000 ids took about 30ms in tests made.
     # These numbers seem low enough to outweigh the disadvantages of the
     # solutions described above.
+    #
+    # With O(1000) unfinished jobs per shard, the NOT IN query and resending
+    # the ids turned out to matter after all. Protocol version 2 therefore
+    # numbers the heartbeat responses of a shard. The shard sends the number
+    # of the last response it persisted as watermark. If that is the last
+    # response the master sent, the shard has all records assigned to it, and
+    # the master only sends records that weren't assigned yet. Otherwise, be
+    # it because a response was lost or the shard client restarted, all
+    # records the shard should have are sent again. Records are sent
+    # compressed in both directions.
     timer = autotest_stats.Timer('shard_heartbeat')
     with timer:
         shard_obj = rpc_utils.retrieve_shard(shard_hostname=shard_hostname)
+        if payload is not None:
+            request = rpc_utils.decode_heartbeat_payload(payload)
+            jobs = request['jobs']
+            hqes = request['hqes']
+            known_host_ids = request['known_host_ids']
+            known_host_statuses = request['known_host_statuses']
         rpc_utils.persist_records_sent_from_shard(shard_obj, jobs, hqes)
         assert len(known_host_ids) == len(known_host_statuses)
         for i in range(len(known_host_ids)):
@@ -462,13 +490,29 @@ def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
                 host_model.status = known_host_statuses[i]
                 host_model.save()
 
+        if protocol_version < 2:
+            hosts, jobs, suite_keyvals = rpc_utils.find_records_for_shard(
+                    shard_obj, known_job_ids=known_job_ids,
+                    known_host_ids=known_host_ids)
+            return {
+                'hosts': [host.serialize() for host in hosts],
+                'jobs': [job.serialize() for job in jobs],
+                'suite_keyvals': [kv.serialize() for kv in suite_keyvals],
+            }
+
+        sequence, in_sync = rpc_utils.start_heartbeat_sequence(shard_obj,
+                                                               watermark)
+        known_ids = None if in_sync else ()
         hosts, jobs, suite_keyvals = rpc_utils.find_records_for_shard(
-                shard_obj, known_job_ids=known_job_ids,
-                known_host_ids=known_host_ids)
+                shard_obj, known_job_ids=known_ids, known_host_ids=known_ids)
         return {
-            'hosts': [host.serialize() for host in hosts],
-            'jobs': [job.serialize() for job in jobs],
-            'suite_keyvals': [kv.serialize() for kv in suite_keyvals],
+            'protocol_version': 2,
+            'sequence': sequence,
+            'payload': rpc_utils.encode_heartbeat_payload({
+                'hosts': [host.serialize() for host in hosts],
+                'jobs': [job.serialize() for job in jobs],
+                'suite_keyvals': [kv.serialize() for kv in suite_keyvals],
+            }),
         }
 
 
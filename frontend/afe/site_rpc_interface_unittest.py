@@ -764,6 +764,60 @@ class SiteRpcInterfaceTest(mox.MoxTestBase,
                          ['Repair'])
 
 
+    def _do_delta_heartbeat_and_assert_response(self, watermark,
+                                                shard_hostname='shard1',
+                                                host_statuses={}, **kwargs):
+        payload = rpc_utils.encode_heartbeat_payload({
+                'jobs': [], 'hqes': [],
+                'known_host_ids': host_statuses.keys(),
+                'known_host_statuses': host_statuses.values()})
+        retval = site_rpc_interface.shard_heartbeat(
+                shard_hostname=shard_hostname, protocol_version=2,
+                watermark=watermark, payload=payload)
+
+        self.assertEqual(retval['protocol_version'], 2)
+        self._assert_shard_heartbeat_response(
+                shard_hostname,
+                rpc_utils.decode_heartbeat_payload(retval['payload']),
+                **kwargs)
+        return retval['sequence']
+
+
+    def testShardHeartbeatDeltaProtocol(self):
+        """Only send new records to shards that persisted the last response."""
+        shard1, host1, lumpy_label = self._createShardAndHostWithLabel()
+        job1 = self._createJobForLabel(lumpy_label)
+
+        sequence = self._do_delta_heartbeat_and_assert_response(
+                None, jobs=[job1], hqes=job1.hostqueueentry_set.all(),
+                hosts=[host1])
+        sequence = self._do_delta_heartbeat_and_assert_response(
+                sequence, host_statuses={host1.id: 'Repairing'})
+        self.assertEqual(models.Host.objects.get(pk=host1.id).status,
+                         'Repairing')
+
+        job2 = self._createJobForLabel(lumpy_label)
+        host2 = models.Host.objects.create(hostname='host2', leased=False)
+        host2.labels.add(lumpy_label)
+        lost_sequence = self._do_delta_heartbeat_and_assert_response(
+                sequence, jobs=[job2], hqes=job2.hostqueueentry_set.all(),
+                hosts=[host2])
+        self.assertEqual(lost_sequence, sequence + 1)
+
+        # The last response was lost, everything is sent again.
+        sequence = self._do_delta_heartbeat_and_assert_response(
+                sequence, jobs=[job1, job2],
+                hqes=list(job1.hostqueueentry_set.all()) +
+                     list(job2.hostqueueentry_set.all()),
+                hosts=[host1, host2])
+        sequence = self._do_delta_heartbeat_and_assert_response(sequence)
+
+        # Aborted jobs are sent again, until they complete.
+        job1.hostqueueentry_set.update(aborted=True)
+        self._do_delta_heartbeat_and_assert_response(
+                sequence, jobs=[job1], hqes=job1.hostqueueentry_set.all())
+
+
     def testCreateListShard(self):
         """Retrieve a list of all shards."""
         lumpy_label = models.Label.objects.create(name='board:lumpy',
@@ -0,0 +1,16 @@
+UP_SQL = """
+CREATE TABLE afe_shard_heartbeats (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  shard_id INT NOT NULL,
+  sequence INT NOT NULL DEFAULT 0,
+  UNIQUE KEY `shard_id_UNIQUE` (`shard_id`)
+) ENGINE=innodb;
+
+ALTER TABLE afe_shard_heartbeats ADD CONSTRAINT shard_heartbeats_shard_id_fk
+    FOREIGN KEY (shard_id) REFERENCES afe_shards(id) ON DELETE CASCADE;
+"""
+
+DOWN_SQL = """
+ALTER TABLE afe_shard_heartbeats DROP FOREIGN KEY shard_heartbeats_shard_id_fk;
+DROP TABLE afe_shard_heartbeats;
+"""
@@ -100,6 +100,9 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # Compresses the responses of clients accepting gzip, so it goes first to
+    # process the final responses.
+    'django.middleware.gzip.GZipMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'frontend.apache_auth.ApacheAuthMiddleware',
@@ -3,6 +3,7 @@ from django.db import models as dbmodels
 from autotest_lib.client.common_lib import priorities
 from autotest_lib.frontend.afe import rpc_utils, model_logic
 from autotest_lib.frontend.afe import models as afe_models, readonly_connection
+from autotest_lib.frontend.afe.json_rpc import serviceHandler
 from autotest_lib.frontend.tko import models, tko_rpc_utils, graphing_utils
 from autotest_lib.frontend.tko import preconfigs
 
@@ -178,9 +179,11 @@ def _job_keyvals_to_dict(keyvals):
     return dict((keyval.key, keyval.value) for keyval in keyvals)
 
 
-def get_detailed_test_views(**filter_data):
-    test_views = models.TestView.list_objects(filter_data)
+def _add_test_view_details(test_views):
+    """Add the details of their tests and jobs to test views.
 
+    @param test_views: A list of dictionaries of test views.
+    """
     tests_by_id = models.Test.objects.in_bulk([test_view['test_idx']
                                                for test_view in test_views])
     tests = tests_by_id.values()
@@ -208,6 +211,26 @@ def get_detailed_test_views(**filter_data):
         job = jobs_by_id[test_view['job_idx']]
         test_view['job_keyvals'] = _job_keyvals_to_dict(job.keyvals)
 
+
+def _iter_detailed_test_views(**filter_data):
+    """
+    Like get_detailed_test_views, but the test views are read from the
+    database as they are iterated.
+    """
+    query = models.TestView.query_objects(filter_data)
+    extra_fields = query.query.extra_select.keys()
+    def get_test_views(rows):
+        test_views = [row.get_object_dict(extra_fields=extra_fields)
+                      for row in rows]
+        _add_test_view_details(test_views)
+        return test_views
+    return rpc_utils.iter_rows_as_dicts(query, get_test_views)
+
+
+@serviceHandler.StreamedServiceMethod(_iter_detailed_test_views)
+def get_detailed_test_views(**filter_data):
+    test_views = models.TestView.list_objects(filter_data)
+    _add_test_view_details(test_views)
     return rpc_utils.prepare_for_serialization(test_views)
 
 
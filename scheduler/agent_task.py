@@ -273,13 +273,13 @@ class BaseAgentTask(object):
 
 
     def _parse_results(self, queue_entries):
-        for queue_entry in queue_entries:
-            queue_entry.set_status(models.HostQueueEntry.Status.PARSING)
+        scheduler_models.HostQueueEntry.set_status_bulk(
+                queue_entries, models.HostQueueEntry.Status.PARSING)
 
 
     def _archive_results(self, queue_entries):
-        for queue_entry in queue_entries:
-            queue_entry.set_status(models.HostQueueEntry.Status.ARCHIVING)
+        scheduler_models.HostQueueEntry.set_status_bulk(
+                queue_entries, models.HostQueueEntry.Status.ARCHIVING)
 
 
     def _command_line(self):
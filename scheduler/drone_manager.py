@@ -35,6 +35,20 @@ _THREADED_DRONE_MANAGER = global_config.global_config.get_config_value(
         scheduler_config.CONFIG_SECTION, 'threaded_drone_manager',
         type=bool, default=True)
 
+_INCREMENTAL_PIDFILE_REFRESH = global_config.global_config.get_config_value(
+        scheduler_config.CONFIG_SECTION, 'incremental_pidfile_refresh',
+        type=bool, default=False)
+
+_PIDFILE_EVENT_REPORTING = global_config.global_config.get_config_value(
+        scheduler_config.CONFIG_SECTION, 'pidfile_event_reporting',
+        type=bool, default=False)
+
+# Log that processes started by the drones append their pidfile contents to,
+# relative to the results directory. It lives in the drone's temporary
+# directory, so it is cleared whenever the drones are initialized.
+PIDFILE_EVENT_LOG = os.path.join(drone_utility._TEMPORARY_DIRECTORY,
+                                 'pidfile_events')
+
 
 class DroneManagerError(Exception):
     pass
@@ -174,6 +188,18 @@ class BaseDroneManager(object):
         self._pidfiles_second_read = {}
         # maps PidfileId to _PidfileInfo
         self._registered_pidfile_info = {}
+        # maps drone hostname to a dict mapping pidfile paths to the
+        # signature last reported by that drone, for incremental refreshes
+        self._pidfile_signatures = {}
+        # maps drone hostname to a dict mapping PidfileId to the
+        # PidfileContents last read on that drone, for incremental refreshes
+        self._cached_pidfiles = {}
+        # maps drone hostname to the offset in its pidfile event log up to
+        # which events have been read
+        self._pidfile_event_offsets = {}
+        # maps drone hostname to a dict mapping pidfile paths to the raw
+        # contents last reported through the drone's pidfile event log
+        self._reported_pidfiles = {}
         # used to generate unique temporary paths
         self._temporary_path_counter = 0
         # maps hostname to Drone object
@@ -251,6 +277,10 @@ class BaseDroneManager(object):
 
     def _remove_drone(self, hostname):
         self._drones.pop(hostname, None)
+        self._pidfile_signatures.pop(hostname, None)
+        self._cached_pidfiles.pop(hostname, None)
+        self._pidfile_event_offsets.pop(hostname, None)
+        self._reported_pidfiles.pop(hostname, None)
 
 
     def refresh_drone_configs(self):
@@ -394,6 +424,109 @@ class BaseDroneManager(object):
             store_in_dict[pidfile_id] = contents
 
 
+    def _get_pidfile_signatures(self, drone, pidfile_paths):
+        """Get the pidfile signatures to send with an incremental refresh.
+
+        Cached state of pidfiles that are no longer read is dropped.
+
+        @param drone: The drone that will be refreshed.
+        @param pidfile_paths: The paths of the pidfiles the drone will read.
+
+        @returns A dict mapping pidfile paths to the signature last reported
+            by the drone.
+        """
+        signatures = self._pidfile_signatures.setdefault(drone.hostname, {})
+        cached_pidfiles = self._cached_pidfiles.setdefault(drone.hostname, {})
+        pidfile_paths = set(pidfile_paths)
+        for pidfile_path in signatures.keys():
+            if pidfile_path not in pidfile_paths:
+                del signatures[pidfile_path]
+                cached_pidfiles.pop(PidfileId(pidfile_path), None)
+        return signatures
+
+
+    def _merge_pidfile_delta(self, drone, pidfiles, removed_paths,
+                             store_in_dict):
+        """Apply the result of an incremental pidfile read.
+
+        @param drone: The drone the pidfiles were read on.
+        @param pidfiles: A dict mapping the paths of changed pidfiles to their
+            raw contents.
+        @param removed_paths: The paths of pidfiles that no longer exist.
+        @param store_in_dict: The dict to store the drone's current pidfile
+            contents in.
+        """
+        cached_pidfiles = self._cached_pidfiles.setdefault(drone.hostname, {})
+        for pidfile_path in removed_paths:
+            cached_pidfiles.pop(PidfileId(pidfile_path), None)
+        self._process_pidfiles(drone, pidfiles, cached_pidfiles)
+        store_in_dict.update(cached_pidfiles)
+
+
+    def _update_pidfile_signatures(self, drone, new_signatures):
+        signatures = self._pidfile_signatures.setdefault(drone.hostname, {})
+        for pidfile_path, signature in new_signatures.iteritems():
+            if signature is None:
+                signatures.pop(pidfile_path, None)
+            else:
+                signatures[pidfile_path] = signature
+
+
+    def _get_reported_pidfile_paths(self):
+        """Get the paths of pidfiles that need not be read on the next refresh.
+
+        These are the registered pidfiles that reported their contents, except
+        for those reported as running by a process that is gone: that process
+        may have died without reporting its exit, so its pidfile is read
+        again. Must be called before the previous refresh's results are reset.
+
+        Reported contents of pidfiles that are no longer registered are
+        dropped.
+
+        @returns A set of pidfile paths.
+        """
+        reported_paths = set()
+        for reported_pidfiles in self._reported_pidfiles.itervalues():
+            for pidfile_path in reported_pidfiles.keys():
+                pidfile_id = PidfileId(pidfile_path)
+                if pidfile_id not in self._registered_pidfile_info:
+                    del reported_pidfiles[pidfile_path]
+                    continue
+                contents = self._pidfiles.get(pidfile_id)
+                if (contents and contents.process and
+                        contents.exit_status is None):
+                    process = contents.process
+                    if (process not in self._process_set and
+                            (process.hostname, process.pid)
+                            not in self._all_processes):
+                        continue
+                reported_paths.add(pidfile_path)
+        return reported_paths
+
+
+    def _merge_pidfile_events(self, drone, events, store_in_dict):
+        """Apply pidfile events reported by a drone.
+
+        @param drone: The drone the events were reported on.
+        @param events: A dict mapping pidfile paths to reported raw contents.
+        @param store_in_dict: The dict to store the contents of every pidfile
+            reported on the drone in.
+        """
+        reported_pidfiles = self._reported_pidfiles.setdefault(
+                drone.hostname, {})
+        for pidfile_path, contents in events.iteritems():
+            # Events of processes we do not track, like the autoserv running
+            # in a server-side packaging container, are ignored.
+            if PidfileId(pidfile_path) in self._registered_pidfile_info:
+                reported_pidfiles[pidfile_path] = contents
+        self._process_pidfiles(drone, reported_pidfiles, store_in_dict)
+
+
+    def _forget_reported_pidfile(self, pidfile_path):
+        for reported_pidfiles in self._reported_pidfiles.itervalues():
+            reported_pidfiles.pop(pidfile_path, None)
+
+
     def _add_process(self, drone, process_info):
         process = Process(drone.hostname, int(process_info['pid']),
                           int(process_info['ppid']))
@@ -462,10 +595,16 @@ class BaseDroneManager(object):
         @raises DroneManagerError: If a drone has un-executed calls.
             Since they will get clobbered when we queue refresh calls.
         """
+        if _PIDFILE_EVENT_REPORTING:
+            reported_paths = self._get_reported_pidfile_paths()
         self._reset()
         self._drop_old_pidfiles()
         pidfile_paths = [pidfile_id.path
                          for pidfile_id in self._registered_pidfile_info]
+        if _PIDFILE_EVENT_REPORTING:
+            # Pidfiles that reported their contents do not need to be read.
+            pidfile_paths = [pidfile_path for pidfile_path in pidfile_paths
+                             if pidfile_path not in reported_paths]
         drones = list(self.get_drones())
         for drone in drones:
             calls = drone.get_calls()
@@ -474,7 +613,16 @@ class BaseDroneManager(object):
                                         'which might get corrupted through '
                                         'this invocation' %
                                         (drone, [str(call) for call in calls]))
-            drone.queue_call('refresh', pidfile_paths)
+            refresh_kwargs = {}
+            if _INCREMENTAL_PIDFILE_REFRESH:
+                refresh_kwargs['pidfile_signatures'] = (
+                        self._get_pidfile_signatures(drone, pidfile_paths))
+            if _PIDFILE_EVENT_REPORTING:
+                refresh_kwargs['pidfile_event_log'] = self.absolute_path(
+                        PIDFILE_EVENT_LOG)
+                refresh_kwargs['pidfile_event_offset'] = (
+                        self._pidfile_event_offsets.get(drone.hostname, 0))
+            drone.queue_call('refresh', pidfile_paths, **refresh_kwargs)
         logging.info("Invoking drone refresh.")
         with self._timer.get_client('trigger_refresh'):
             self._refresh_task_queue.execute(drones, wait=False)
@@ -530,12 +678,43 @@ class BaseDroneManager(object):
                 for process_info in results['parse_processes']:
                     self._add_process(drone, process_info)
 
-            with self._timer.get_client('%s.pidfiles' % drone_hostname):
-                self._process_pidfiles(drone, results['pidfiles'],
-                                       self._pidfiles)
-            with self._timer.get_client('%s.pidfiles_second' % drone_hostname):
-                self._process_pidfiles(drone, results['pidfiles_second_read'],
-                                       self._pidfiles_second_read)
+            if 'pidfile_signatures' in results:
+                # An incremental refresh only returns the pidfiles that
+                # changed since the last one, so merge them into what we
+                # already know about this drone.
+                with self._timer.get_client('%s.pidfiles' % drone_hostname):
+                    self._merge_pidfile_delta(drone, results['pidfiles'],
+                                              results['removed_pidfiles'],
+                                              self._pidfiles)
+                with self._timer.get_client(
+                        '%s.pidfiles_second' % drone_hostname):
+                    self._merge_pidfile_delta(
+                            drone, results['pidfiles_second_read'],
+                            results['removed_pidfiles_second_read'],
+                            self._pidfiles_second_read)
+                self._update_pidfile_signatures(
+                        drone, results['pidfile_signatures'])
+            else:
+                with self._timer.get_client('%s.pidfiles' % drone_hostname):
+                    self._process_pidfiles(drone, results['pidfiles'],
+                                           self._pidfiles)
+                with self._timer.get_client(
+                        '%s.pidfiles_second' % drone_hostname):
+                    self._process_pidfiles(drone,
+                                           results['pidfiles_second_read'],
+                                           self._pidfiles_second_read)
+
+            if 'pidfile_event_offset' in results:
+                # Reported contents are applied last, the pidfiles that
+                # reported them were not read.
+                with self._timer.get_client('%s.events' % drone_hostname):
+                    self._merge_pidfile_events(drone, results['pidfile_events'],
+                                               self._pidfiles)
+                    self._merge_pidfile_events(
+                            drone, results['pidfile_events_second_read'],
+                            self._pidfiles_second_read)
+                self._pidfile_event_offsets[drone.hostname] = (
+                        results['pidfile_event_offset'])
 
             self._compute_active_processes(drone)
             if drone.enabled:
@@ -756,12 +935,21 @@ class BaseDroneManager(object):
         logging.info("command = %s", command)
         logging.info('log file = %s:%s', drone.hostname, log_file)
         self._write_attached_files(working_directory, drone)
-        drone.queue_call('execute_command', command, abs_working_directory,
-                         log_file, pidfile_name)
+        pidfile_path = os.path.join(abs_working_directory, pidfile_name)
+        if _PIDFILE_EVENT_REPORTING:
+            # Contents reported by an earlier process that used the same
+            # pidfile are stale now.
+            self._forget_reported_pidfile(pidfile_path)
+            drone.queue_call('execute_command', command,
+                             abs_working_directory, log_file, pidfile_name,
+                             pidfile_event_log=self.absolute_path(
+                                     PIDFILE_EVENT_LOG))
+        else:
+            drone.queue_call('execute_command', command,
+                             abs_working_directory, log_file, pidfile_name)
         drone.active_processes += num_processes
         self._reorder_drone_queue()
 
-        pidfile_path = os.path.join(abs_working_directory, pidfile_name)
         pidfile_id = PidfileId(pidfile_path)
         self.register_pidfile(pidfile_id)
         self._registered_pidfile_info[pidfile_id].num_processes = num_processes
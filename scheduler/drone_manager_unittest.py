@@ -10,7 +10,7 @@ from autotest_lib.client.common_lib.test_utils import mock
 from autotest_lib.frontend import setup_django_lite_environment
 from autotest_lib.scheduler import drone_manager, drone_utility, drones
 from autotest_lib.scheduler import scheduler_config, site_drone_manager
-from autotest_lib.scheduler import thread_lib
+from autotest_lib.scheduler import thread_lib, drone_task_queue
 from autotest_lib.scheduler import pidfile_monitor
 from autotest_lib.server.hosts import ssh_host
 
@@ -492,6 +492,125 @@ class ThreadedDroneTest(unittest.TestCase):
         self.god.check_playback()
 
 
+    def test_sync_refresh_incremental(self):
+        """Test that incremental refresh results are merged across ticks."""
+        mock_drone = self.create_drone('fakedrone1', 'fakehost1')
+        self.manager._drones[mock_drone.hostname] = mock_drone
+        pidfile_path = 'results/hosts/host_id/job_id-name/.autoserv_execute'
+        pidfile_id = drone_manager.PidfileId(pidfile_path)
+        self.manager.register_pidfile(pidfile_id)
+
+        def sync_refresh(pidfiles, removed_pidfiles, signatures):
+            drone_utility_results = {
+                    'pidfiles': pidfiles,
+                    'removed_pidfiles': removed_pidfiles,
+                    'autoserv_processes': {},
+                    'all_processes': {},
+                    'parse_processes': {},
+                    'pidfiles_second_read': {},
+                    'removed_pidfiles_second_read': [],
+                    'pidfile_signatures': signatures,
+            }
+            self.manager._reset()
+            self.manager._refresh_task_queue.results_queue.put(
+                    thread_lib.ThreadedTaskQueue.result(
+                        mock_drone, [drone_utility_results]))
+            self.manager.sync_refresh()
+
+        sync_refresh({pidfile_path: '123\n'}, [], {pidfile_path: (1, 4, 1.0)})
+        self.assertEqual(
+                123, self.manager.get_pidfile_contents(pidfile_id).process.pid)
+        self.assertEqual({pidfile_path: (1, 4, 1.0)},
+                         self.manager._get_pidfile_signatures(
+                                 mock_drone, [pidfile_path]))
+
+        # Nothing changed on the drone, the cached contents are served.
+        sync_refresh({}, [], {})
+        contents = self.manager.get_pidfile_contents(pidfile_id,
+                                                     use_second_read=True)
+        self.assertEqual(123, contents.process.pid)
+        self.assertEqual(None, contents.exit_status)
+
+        sync_refresh({pidfile_path: '123\n12\n0\n'}, [],
+                     {pidfile_path: (1, 9, 2.0)})
+        self.assertEqual(
+                12, self.manager.get_pidfile_contents(pidfile_id).exit_status)
+
+        sync_refresh({}, [pidfile_path], {pidfile_path: None})
+        self.assertEqual(
+                None, self.manager.get_pidfile_contents(pidfile_id).process)
+        self.assertEqual({}, self.manager._get_pidfile_signatures(
+                                 mock_drone, [pidfile_path]))
+
+        # Unregistered pidfiles are dropped from the cache.
+        sync_refresh({pidfile_path: '123\n'}, [], {pidfile_path: (2, 4, 3.0)})
+        self.manager.unregister_pidfile(pidfile_id)
+        self.assertEqual({}, self.manager._get_pidfile_signatures(
+                                 mock_drone, []))
+        self.assertEqual({}, self.manager._cached_pidfiles[mock_drone.hostname])
+        self.god.check_playback()
+
+
+    def test_sync_refresh_pidfile_events(self):
+        """Test that reported pidfiles are not read again."""
+        self.god.stub_with(drone_manager, '_PIDFILE_EVENT_REPORTING', True)
+        mock_drone = MockDrone('fakedrone1')
+        self.manager._drones[mock_drone.hostname] = mock_drone
+        pidfile_path = self.manager.absolute_path(
+                'job_id-name/.autoserv_execute')
+        pidfile_id = drone_manager.PidfileId(pidfile_path)
+        self.manager.register_pidfile(pidfile_id)
+        self.manager._refresh_task_queue = drone_task_queue.DroneTaskQueue()
+
+        def refresh(events, events_second_read, offset, all_processes=()):
+            self.manager.trigger_refresh()
+            refresh_call = mock_drone._recorded_calls['queue_call'].pop()
+            drone_utility_results = {
+                    'pidfiles': {},
+                    'pidfile_events': events,
+                    'pidfile_events_second_read': events_second_read,
+                    'pidfile_event_offset': offset,
+                    'autoserv_processes': {},
+                    'all_processes': all_processes,
+                    'parse_processes': {},
+                    'pidfiles_second_read': {},
+            }
+            self.manager._refresh_task_queue.results = {
+                    mock_drone: [drone_utility_results]}
+            self.manager.sync_refresh()
+            return refresh_call
+
+        method, args, kwargs = refresh({}, {pidfile_path: '123\n'}, 10)
+        self.assertEqual(([pidfile_path],), args)
+        self.assertEqual(0, kwargs['pidfile_event_offset'])
+        self.assertEqual(None, self.manager.get_pidfile_contents(
+                pidfile_id).process)
+        self.assertEqual(123, self.manager.get_pidfile_contents(
+                pidfile_id, use_second_read=True).process.pid)
+
+        autoserv_process = {'pid': '123', 'pgid': '123', 'ppid': '1',
+                            'comm': 'autoserv', 'args': ''}
+        method, args, kwargs = refresh({}, {}, 10, [autoserv_process])
+        self.assertEqual(([],), args)
+        self.assertEqual(10, kwargs['pidfile_event_offset'])
+        self.assertEqual(123, self.manager.get_pidfile_contents(
+                pidfile_id).process.pid)
+
+        # The process is gone without reporting its exit, read the pidfile.
+        method, args, kwargs = refresh({}, {}, 10)
+        method, args, kwargs = refresh({}, {}, 10)
+        self.assertEqual(([pidfile_path],), args)
+
+        refresh({pidfile_path: '123\n0\n0\n'}, {}, 20)
+        self.assertEqual(0, self.manager.get_pidfile_contents(
+                pidfile_id).exit_status)
+
+        # A new process using the same pidfile forgets the reported contents.
+        self.manager.execute_command(['true'], 'job_id-name',
+                                     '.autoserv_execute', 1)
+        self.assertFalse(self.manager._get_reported_pidfile_paths())
+
+
 class ThreadedLocalhostDroneTest(ThreadedDroneTest):
     _DRONE_CLASS = drones._LocalDrone
     _DRONE_HOST = local_host.LocalHost
@@ -8,15 +8,18 @@
 3. Each invocation is responsible for the initiation of a set of batched calls.
 4. The batched calls may be synchronous or asynchronous.
 5. The caller is responsible for monitoring asynchronous calls through pidfiles.
+6. With --persistent, a single invocation serves framed batches of calls (see
+   write_frame) until its stdin is closed.
 """
 
 
 import argparse
+import collections
 import pickle, subprocess, os, shutil, sys, time, signal, getpass
 import datetime, traceback, tempfile, itertools, logging
 import common
 from autotest_lib.client.common_lib import utils, global_config, error
-from autotest_lib.client.common_lib import logging_manager
+from autotest_lib.client.common_lib import logging_manager, pidfile
 from autotest_lib.client.common_lib.cros import retry
 from autotest_lib.client.common_lib.cros.graphite import autotest_stats
 from autotest_lib.scheduler import drone_logging_config
@@ -66,6 +69,38 @@ def call(method, *args, **kwargs):
     return _MethodCall(method, args, kwargs)
 
 
+class _ProcessSnapshot(object):
+    """A view of the process table taken once per refresh.
+
+    All process queries of a refresh are served from the same snapshot, so
+    the process table is only scanned once per tick.
+    """
+    def __init__(self, process_info):
+        """
+        @param process_info: An iterable of process info dicts as returned by
+            BaseDroneUtility._get_process_info.
+        """
+        self.processes = list(process_info)
+        self._processes_by_command = collections.defaultdict(list)
+        for info in self.processes:
+            self._processes_by_command[info['comm']].append(info)
+
+
+    def get_processes(self, command_name, site_check_parse=None):
+        """Get the processes running the given command.
+
+        @param command_name: The name of the command, eg 'autoserv'.
+        @param site_check_parse: Optional function taking a process info dict
+            and returning True if the process should also be included.
+
+        @returns A list of process info dicts, in process table order.
+        """
+        if not site_check_parse:
+            return list(self._processes_by_command.get(command_name, []))
+        return [info for info in self.processes
+                if info['comm'] == command_name or site_check_parse(info)]
+
+
 class BaseDroneUtility(object):
     """
     This class executes actual OS calls on the drone machine.
@@ -106,6 +141,18 @@ class BaseDroneUtility(object):
         self.warnings.append(warning)
 
 
+    @classmethod
+    def _filter_pids_with_dark_mark(cls, pids, open=open):
+        """Get the pids of the given processes that bear our dark mark.
+
+        @param pids: An iterable of process ids.
+
+        @returns A set of the pids whose environment contains the mark.
+        """
+        return set(pid for pid in pids
+                   if cls._check_pid_for_dark_mark(pid, open=open))
+
+
     @staticmethod
     def _check_pid_for_dark_mark(pid, open=open):
         try:
@@ -122,10 +169,53 @@ class BaseDroneUtility(object):
     _PS_ARGS = ('pid', 'pgid', 'ppid', 'comm', 'args')
 
 
+    _PROC_DIR = '/proc'
+
+
+    @classmethod
+    def _read_proc_process_info(cls):
+        """Read process information for our processes from /proc.
+
+        Like `ps x`, only processes owned by our effective user are listed.
+
+        @returns A generator of dicts in the format of _get_process_info.
+        """
+        uid = os.geteuid()
+        for entry in os.listdir(cls._PROC_DIR):
+            if not entry.isdigit():
+                continue
+            pid_dir = os.path.join(cls._PROC_DIR, entry)
+            try:
+                if os.stat(pid_dir).st_uid != uid:
+                    continue
+                with open(os.path.join(pid_dir, 'stat')) as stat_file:
+                    stat = stat_file.read()
+                with open(os.path.join(pid_dir, 'cmdline')) as cmdline_file:
+                    cmdline = cmdline_file.read()
+            except EnvironmentError:
+                # The process exited while we were looking at it.
+                continue
+            # The command name is in parentheses and may contain spaces and
+            # parentheses itself, the remaining fields are space separated:
+            # pid (comm) state ppid pgrp ...
+            comm_start = stat.find('(')
+            comm_end = stat.rfind(')')
+            fields = stat[comm_end + 1:].split()
+            if comm_start < 0 or len(fields) < 3:
+                continue
+            comm = stat[comm_start + 1:comm_end]
+            args = cmdline.replace('\0', ' ').strip() or '[%s]' % comm
+            yield {'pid': entry, 'pgid': fields[2], 'ppid': fields[1],
+                   'comm': comm, 'args': args}
+
+
     @classmethod
     @timer.decorate
     def _get_process_info(cls):
-        """Parse ps output for all process information.
+        """Get information about all of our running processes.
+
+        The process table is read from /proc when it is available, otherwise
+        ps output is parsed.
 
         @returns A generator of dicts with cls._PS_ARGS as keys and
             string values each representing a running process. eg:
@@ -137,6 +227,9 @@ class BaseDroneUtility(object):
                 'args': args the command was invoked with,
             }
         """
+        if os.path.isdir(os.path.join(cls._PROC_DIR, 'self')):
+            return cls._read_proc_process_info()
+
         @retry.retry(subprocess.CalledProcessError,
                      timeout_min=0.5, delay_sec=0.25)
         def run_ps():
@@ -144,20 +237,23 @@ class BaseDroneUtility(object):
                     ['/bin/ps', 'x', '-o', ','.join(cls._PS_ARGS)])
 
         ps_output = run_ps()
-        # split each line into the columns output by ps
-        split_lines = [line.split(None, 4) for line in ps_output.splitlines()]
+        # split each line into the columns output by ps, skipping the headers
+        split_lines = [line.split(None, 4)
+                       for line in ps_output.splitlines()[1:]]
         return (dict(itertools.izip(cls._PS_ARGS, line_components))
                 for line_components in split_lines)
 
 
     def _refresh_processes(self, command_name, open=open,
-                           site_check_parse=None):
+                           site_check_parse=None, snapshot=None):
         """Refreshes process info for the given command_name.
 
-        Examines ps output as returned by get_process_info and returns
+        Examines the process table as returned by get_process_info and returns
         the process dicts for processes matching the given command name.
 
         @param command_name: The name of the command, eg 'autoserv'.
+        @param snapshot: A _ProcessSnapshot to query. If None, the process
+            table is read again.
 
         @return: A list of process info dictionaries as returned by
             _get_process_info.
@@ -165,18 +261,23 @@ class BaseDroneUtility(object):
         # The open argument is used for test injection.
         check_mark = global_config.global_config.get_config_value(
             'SCHEDULER', 'check_processes_for_dark_mark', bool, False)
-        processes = []
-        for info in self._get_process_info():
-            is_parse = (site_check_parse and site_check_parse(info))
-            if info['comm'] == command_name or is_parse:
-                if (check_mark and not
-                        self._check_pid_for_dark_mark(info['pid'], open=open)):
-                    self._warn('%(comm)s process pid %(pid)s has no '
-                               'dark mark; ignoring.' % info)
-                    continue
-                processes.append(info)
-
-        return processes
+        if snapshot is None:
+            snapshot = _ProcessSnapshot(self._get_process_info())
+        processes = snapshot.get_processes(command_name,
+                                           site_check_parse=site_check_parse)
+        if not check_mark:
+            return processes
+
+        marked_pids = self._filter_pids_with_dark_mark(
+                set(info['pid'] for info in processes), open=open)
+        marked_processes = []
+        for info in processes:
+            if info['pid'] not in marked_pids:
+                self._warn('%(comm)s process pid %(pid)s has no '
+                           'dark mark; ignoring.' % info)
+                continue
+            marked_processes.append(info)
+        return marked_processes
 
 
     @timer.decorate
@@ -194,11 +295,113 @@ class BaseDroneUtility(object):
         return pidfiles
 
 
+    @staticmethod
+    def _get_pidfile_signature(stat_result):
+        """Get the signature used to detect changes to a pidfile.
+
+        Autoserv only ever appends to a pidfile once it has been created and
+        the drone removes stale pidfiles before starting a new process, so a
+        change of inode, size or modification time covers every update.
+
+        @param stat_result: The result of os.stat() on the pidfile.
+
+        @returns A tuple of (inode, size, mtime).
+        """
+        return (stat_result.st_ino, stat_result.st_size,
+                stat_result.st_mtime)
+
+
+    @timer.decorate
+    def _read_changed_pidfiles(self, pidfile_signatures):
+        """Read the pidfiles that changed since they were last seen.
+
+        @param pidfile_signatures: A dict mapping pidfile paths to the
+            signature recorded for them on the previous read, or None if
+            the pidfile has not been seen yet. It is updated in place with
+            the signatures seen by this read.
+
+        @returns A tuple (pidfiles, removed_paths), where pidfiles maps the
+            paths of new or changed pidfiles to their contents and
+            removed_paths lists the previously seen pidfiles that no longer
+            exist.
+        """
+        pidfiles = {}
+        removed_paths = []
+        for pidfile_path, old_signature in pidfile_signatures.items():
+            try:
+                signature = self._get_pidfile_signature(
+                        os.stat(pidfile_path))
+            except OSError:
+                if old_signature is not None:
+                    removed_paths.append(pidfile_path)
+                    pidfile_signatures[pidfile_path] = None
+                continue
+            if signature == old_signature:
+                continue
+            try:
+                file_object = open(pidfile_path, 'r')
+                pidfiles[pidfile_path] = file_object.read()
+                file_object.close()
+            except IOError:
+                continue
+            pidfile_signatures[pidfile_path] = signature
+        return pidfiles, removed_paths
+
+
+    @timer.decorate
+    def _read_pidfile_events(self, event_log, offset):
+        """Read the pidfile events appended to the event log since offset.
+
+        See client/common_lib/pidfile.py for the event format.
+
+        @param event_log: Path of the pidfile event log.
+        @param offset: Byte offset in the log to start reading at.
+
+        @returns A tuple (events, offset), where events maps pidfile paths to
+            their latest reported contents, in pidfile format, and offset is
+            where the next read should start.
+        """
+        events = {}
+        try:
+            log_file = open(event_log, 'r')
+        except IOError:
+            return events, 0
+        try:
+            log_file.seek(0, os.SEEK_END)
+            if log_file.tell() < offset:
+                # The log was recreated since we last read it.
+                offset = 0
+            log_file.seek(offset)
+            data = log_file.read()
+        finally:
+            log_file.close()
+        # Leave an event that is still being written for the next read.
+        end = data.rfind('\n') + 1
+        for line in data[:end].splitlines():
+            fields = line.split('\t')
+            if len(fields) < 2:
+                continue
+            events[fields[0]] = '\n'.join(fields[1:]) + '\n'
+        return events, offset + end
+
+
     @timer.decorate
-    def refresh(self, pidfile_paths):
+    def refresh(self, pidfile_paths, pidfile_signatures=None,
+                pidfile_event_log=None, pidfile_event_offset=0):
         """
         pidfile_paths should be a list of paths to check for pidfiles.
 
+        If pidfile_signatures is given, the refresh is incremental: it must
+        map each path in pidfile_paths to the signature returned for it by a
+        previous refresh (or None), and only pidfiles whose signature changed
+        are opened and returned.
+
+        If pidfile_event_log is given, the events reported to it since
+        pidfile_event_offset are returned, and only the pidfiles that have
+        not reported any event are read. The log is read once more after the
+        pidfiles, so that the events of every pidfile update we have seen are
+        returned by this refresh.
+
         Returns a dict containing:
         * pidfiles: dict mapping pidfile paths to file contents, for pidfiles
         that exist.
@@ -208,19 +411,64 @@ class BaseDroneUtility(object):
         * parse_processes: likewise, for parse processes.
         * pidfiles_second_read: same info as pidfiles, but gathered after the
         processes are scanned.
+
+        For an incremental refresh, pidfiles and pidfiles_second_read only
+        contain the pidfiles that changed since the previous read, and the
+        dict additionally contains:
+        * removed_pidfiles: paths of previously seen pidfiles that are gone.
+        * removed_pidfiles_second_read: likewise, for the second read.
+        * pidfile_signatures: dict mapping the paths whose signature changed
+        to their new signature (None if the pidfile was removed), to be sent
+        back with the next refresh.
+
+        When reading a pidfile event log, the dict additionally contains:
+        * pidfile_events: dict mapping pidfile paths to the contents last
+        reported for them since pidfile_event_offset.
+        * pidfile_events_second_read: likewise, for events reported after the
+        processes and pidfiles are scanned.
+        * pidfile_event_offset: the offset to pass to the next refresh.
         """
         site_check_parse = utils.import_site_function(
                 __file__, 'autotest_lib.scheduler.site_drone_utility',
                 'check_parse', lambda x: False)
-        results = {
-            'pidfiles' : self._read_pidfiles(pidfile_paths),
-            # element 0 of _get_process_info() is the headers from `ps`
-            'all_processes' : list(self._get_process_info())[1:],
-            'autoserv_processes' : self._refresh_processes('autoserv'),
-            'parse_processes' : self._refresh_processes(
-                    'parse', site_check_parse=site_check_parse),
-            'pidfiles_second_read' : self._read_pidfiles(pidfile_paths),
-        }
+        results = {}
+        if pidfile_event_log:
+            events, pidfile_event_offset = self._read_pidfile_events(
+                    pidfile_event_log, pidfile_event_offset)
+            results['pidfile_events'] = events
+            pidfile_paths = [path for path in pidfile_paths
+                             if path not in events]
+        if pidfile_signatures is None:
+            results['pidfiles'] = self._read_pidfiles(pidfile_paths)
+        else:
+            signatures = dict.fromkeys(pidfile_paths)
+            signatures.update((path, signature) for path, signature
+                              in pidfile_signatures.iteritems()
+                              if path in signatures)
+            results['pidfiles'], results['removed_pidfiles'] = (
+                    self._read_changed_pidfiles(signatures))
+        snapshot = _ProcessSnapshot(self._get_process_info())
+        results['all_processes'] = snapshot.processes
+        results['autoserv_processes'] = self._refresh_processes(
+                'autoserv', snapshot=snapshot)
+        results['parse_processes'] = self._refresh_processes(
+                'parse', site_check_parse=site_check_parse, snapshot=snapshot)
+        if pidfile_signatures is None:
+            results['pidfiles_second_read'] = self._read_pidfiles(
+                    pidfile_paths)
+        else:
+            (results['pidfiles_second_read'],
+             results['removed_pidfiles_second_read']) = (
+                    self._read_changed_pidfiles(signatures))
+            results['pidfile_signatures'] = dict(
+                    (path, signature)
+                    for path, signature in signatures.iteritems()
+                    if signature != pidfile_signatures.get(path))
+        if pidfile_event_log:
+            events, results['pidfile_event_offset'] = (
+                    self._read_pidfile_events(pidfile_event_log,
+                                              pidfile_event_offset))
+            results['pidfile_events_second_read'] = events
         return results
 
 
@@ -329,7 +577,7 @@ class BaseDroneUtility(object):
 
 
     def execute_command(self, command, working_directory, log_file,
-                        pidfile_name):
+                        pidfile_name, pidfile_event_log=None):
         out_file = None
         if log_file:
             self._ensure_directory_exists(os.path.dirname(log_file))
@@ -354,8 +602,16 @@ class BaseDroneUtility(object):
             self._warn('Pidfile %s already exists' % pidfile_path)
             os.remove(pidfile_path)
 
+        env = None
+        if pidfile_event_log:
+            # os.putenv() does not update os.environ, so the dark mark has to
+            # be added back explicitly.
+            env = dict(os.environ)
+            env[DARK_MARK_ENVIRONMENT_VAR] = str(os.getpid())
+            env[pidfile.EVENT_LOG_ENVIRONMENT_VAR] = pidfile_event_log
+
         subprocess.Popen(command, stdout=out_file, stderr=subprocess.STDOUT,
-                         stdin=in_devnull)
+                         stdin=in_devnull, env=env)
         out_file.close()
         in_devnull.close()
 
@@ -577,11 +833,52 @@ def parse_input():
                           separator))
 
 
+def write_frame(stream, data):
+    """Write a pickled object to a persistent drone_utility channel.
+
+    Each frame is the length of the pickled data on a line of its own,
+    followed by the pickled data.
+
+    @param stream: The file object to write to.
+    @param data: The object to pickle.
+    """
+    pickled_data = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    stream.write('%d\n' % len(pickled_data))
+    stream.write(pickled_data)
+    stream.flush()
+
+
+def read_frame(stream):
+    """Read an object written by write_frame.
+
+    @param stream: The file object to read from.
+
+    @returns The unpickled object, or None if the stream is at EOF.
+
+    @raises ValueError: If the frame is truncated or corrupt.
+    """
+    header = stream.readline()
+    if not header:
+        return None
+    try:
+        length = int(header)
+    except ValueError:
+        raise ValueError('Invalid frame header: %r' % header)
+    pickled_data = stream.read(length)
+    if len(pickled_data) != length:
+        raise ValueError('Truncated frame: expected %d bytes, got %d' %
+                         (length, len(pickled_data)))
+    return pickle.loads(pickled_data)
+
+
 def _parse_args(args):
     parser = argparse.ArgumentParser(description='Local drone process manager.')
     parser.add_argument('--call_time',
                         help='Time this process was invoked from the master',
                         default=None, type=float)
+    parser.add_argument('--persistent', action='store_true', default=False,
+                        help='Keep serving framed batches of calls from '
+                             'stdin until it is closed.')
     return parser.parse_args(args)
 
 
@@ -598,12 +895,43 @@ def return_data(data):
     print pickle.dumps(data)
 
 
+# Sent by a persistent drone_utility once it is ready to accept calls.
+WORKER_READY = 'ready'
+
+
+def serve_persistent():
+    """Execute batches of calls read from stdin until it is closed.
+
+    Every batch is answered on stdout with the return value of execute_calls,
+    using the framing of write_frame. Anything else that would be written to
+    stdout, by us or by our children, is redirected to stderr so that it
+    cannot corrupt the channel.
+    """
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    drone_utility = DroneUtility()
+    write_frame(channel, WORKER_READY)
+    while True:
+        with timer.get_client('decode'):
+            calls = read_frame(sys.stdin)
+        if calls is None:
+            break
+        return_value = drone_utility.execute_calls(calls)
+        with timer.get_client('encode'):
+            write_frame(channel, return_value)
+    channel.close()
+
+
 def main():
     logging_manager.configure_logging(
             drone_logging_config.DroneLoggingConfig())
+    args = _parse_args(sys.argv[1:])
+    if args.persistent:
+        serve_persistent()
+        return
     with timer.get_client('decode'):
         calls = parse_input()
-    args = _parse_args(sys.argv[1:])
     if args.call_time is not None:
         autotest_stats.Gauge(_STATS_KEY).send('invocation_overhead',
                                               time.time() - args.call_time)
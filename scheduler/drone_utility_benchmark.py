@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+"""Benchmark full versus incremental pidfile refreshes in drone_utility.
+
+Creates a results tree with a number of registered pidfiles, then simulates
+scheduler ticks in which a small fraction of the processes write their exit
+status, and reports the time spent in BaseDroneUtility.refresh() per tick for
+both refresh modes.
+
+Usage: drone_utility_benchmark.py [--pidfiles 5000] [--ticks 20]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import common
+from autotest_lib.scheduler import drone_utility
+
+
+def _create_pidfiles(results_dir, num_pidfiles):
+    paths = []
+    for i in xrange(num_pidfiles):
+        job_dir = os.path.join(results_dir, '%d-debug_user' % i)
+        os.makedirs(job_dir)
+        path = os.path.join(job_dir, '.autoserv_execute')
+        with open(path, 'w') as pidfile:
+            pidfile.write('%d\n' % (10000 + i))
+        paths.append(path)
+    return paths
+
+
+def _finish_some(paths, tick, changes_per_tick):
+    start = tick * changes_per_tick
+    for path in paths[start:start + changes_per_tick]:
+        with open(path, 'a') as pidfile:
+            pidfile.write('0\n0\n')
+
+
+def _run_ticks(utility, paths, ticks, changes_per_tick, incremental):
+    signatures = {}
+    durations = []
+    for tick in xrange(ticks):
+        _finish_some(paths, tick, changes_per_tick)
+        start = time.time()
+        if incremental:
+            results = utility.refresh(paths, pidfile_signatures=signatures)
+            for path, signature in results['pidfile_signatures'].iteritems():
+                signatures[path] = signature
+        else:
+            utility.refresh(paths)
+        durations.append(time.time() - start)
+    return durations
+
+
+def _report(name, durations):
+    # Skip the first tick, it reads every pidfile in both modes.
+    steady = durations[1:] or durations
+    print '%-12s first tick: %8.2f ms  steady state: %8.2f ms/tick' % (
+            name, durations[0] * 1000, sum(steady) / len(steady) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pidfiles', type=int, default=5000,
+                        help='Number of registered pidfiles.')
+    parser.add_argument('--ticks', type=int, default=20,
+                        help='Number of refreshes to time.')
+    parser.add_argument('--changes_per_tick', type=int, default=25,
+                        help='Number of pidfiles updated between ticks.')
+    args = parser.parse_args()
+
+    utility = drone_utility.DroneUtility()
+    for name, incremental in (('full', False), ('incremental', True)):
+        results_dir = tempfile.mkdtemp(prefix='drone_utility_benchmark')
+        try:
+            paths = _create_pidfiles(results_dir, args.pidfiles)
+            durations = _run_ticks(utility, paths, args.ticks,
+                                   args.changes_per_tick, incremental)
+            _report(name, durations)
+        finally:
+            shutil.rmtree(results_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,11 @@
 
 """Tests for drone_utility."""
 
-import os, sys, unittest
+import os, shutil, sys, tempfile, unittest
 from cStringIO import StringIO
 
 import common
-from autotest_lib.client.common_lib import global_config
+from autotest_lib.client.common_lib import global_config, pidfile
 from autotest_lib.client.common_lib.test_utils import mock
 from autotest_lib.scheduler import drone_utility
 
@@ -75,5 +75,167 @@ class TestDroneUtility(unittest.TestCase):
         self.god.check_playback()
 
 
+    def test_refresh_reads_process_table_once(self):
+        self._set_check_dark_mark(False)
+        autoserv_info = {'pid': '5', 'pgid': '5', 'ppid': '1',
+                         'comm': 'autoserv', 'args': 'autoserv -m host1'}
+        parse_info = {'pid': '6', 'pgid': '6', 'ppid': '1',
+                      'comm': 'parse', 'args': 'parse -l 2 job'}
+        proc_info_list = [self._fake_proc_info, autoserv_info, parse_info]
+        self.drone_utility._get_process_info.expect_call().and_return(
+                iter(proc_info_list))
+        results = self.drone_utility.refresh([])
+        self.assertEqual(proc_info_list, results['all_processes'])
+        self.assertEqual([autoserv_info], results['autoserv_processes'])
+        self.assertEqual([parse_info], results['parse_processes'])
+        self.god.check_playback()
+
+
+    def test_read_proc_process_info(self):
+        processes = dict(
+                (info['pid'], info)
+                for info in self.drone_utility._read_proc_process_info())
+        our_info = processes[str(os.getpid())]
+        self.assertEqual(str(os.getppid()), our_info['ppid'])
+        self.assertEqual(str(os.getpgrp()), our_info['pgid'])
+        self.assertTrue(sys.argv[0] in our_info['args'])
+
+
+class TestIncrementalPidfileRead(unittest.TestCase):
+    def setUp(self):
+        self.drone_utility = drone_utility.DroneUtility()
+        self.tmpdir = tempfile.mkdtemp()
+        self.pidfile_path = os.path.join(self.tmpdir, '.autoserv_execute')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def _write_pidfile(self, contents, mode='w'):
+        pidfile = open(self.pidfile_path, mode)
+        pidfile.write(contents)
+        pidfile.close()
+
+
+    def test_read_changed_pidfiles(self):
+        self._write_pidfile('123\n')
+        signatures = {self.pidfile_path: None}
+        pidfiles, removed = self.drone_utility._read_changed_pidfiles(
+                signatures)
+        self.assertEqual({self.pidfile_path: '123\n'}, pidfiles)
+        self.assertEqual([], removed)
+        self.assertNotEqual(None, signatures[self.pidfile_path])
+
+        # An unchanged pidfile is not read again.
+        pidfiles, removed = self.drone_utility._read_changed_pidfiles(
+                signatures)
+        self.assertEqual({}, pidfiles)
+        self.assertEqual([], removed)
+
+        self._write_pidfile('0\n0\n', mode='a')
+        pidfiles, removed = self.drone_utility._read_changed_pidfiles(
+                signatures)
+        self.assertEqual({self.pidfile_path: '123\n0\n0\n'}, pidfiles)
+
+        os.remove(self.pidfile_path)
+        pidfiles, removed = self.drone_utility._read_changed_pidfiles(
+                signatures)
+        self.assertEqual({}, pidfiles)
+        self.assertEqual([self.pidfile_path], removed)
+        self.assertEqual(None, signatures[self.pidfile_path])
+
+
+    def test_read_changed_pidfiles_missing(self):
+        signatures = {self.pidfile_path: None}
+        pidfiles, removed = self.drone_utility._read_changed_pidfiles(
+                signatures)
+        self.assertEqual({}, pidfiles)
+        self.assertEqual([], removed)
+
+
+class TestPidfileEvents(unittest.TestCase):
+    def setUp(self):
+        self.drone_utility = drone_utility.DroneUtility()
+        self.tmpdir = tempfile.mkdtemp()
+        self.event_log = os.path.join(self.tmpdir, 'pidfile_events')
+        self.pidfile_path = os.path.join(self.tmpdir, '.autoserv_execute')
+        self.god = mock.mock_god()
+        self.god.stub_with(os, 'environ', {
+                pidfile.EVENT_LOG_ENVIRONMENT_VAR: self.event_log})
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_read_pidfile_events(self):
+        manager = pidfile.PidFileManager('autoserv', self.tmpdir)
+        manager.open_file()
+        events, offset = self.drone_utility._read_pidfile_events(
+                self.event_log, 0)
+        self.assertEqual({self.pidfile_path: '%d\n' % os.getpid()}, events)
+
+        manager.num_tests_failed = 2
+        manager.close_file(1)
+        # An event that is still being written is left for the next read.
+        event_log = open(self.event_log, 'a')
+        event_log.write('/partial/event')
+        event_log.close()
+        events, offset = self.drone_utility._read_pidfile_events(
+                self.event_log, offset)
+        self.assertEqual(open(self.pidfile_path).read(),
+                         events[self.pidfile_path])
+        self.assertEqual('%d\n256\n2\n' % os.getpid(),
+                         events[self.pidfile_path])
+
+        events, new_offset = self.drone_utility._read_pidfile_events(
+                self.event_log, offset)
+        self.assertEqual({}, events)
+        self.assertEqual(offset, new_offset)
+
+
+    def test_read_missing_pidfile_events(self):
+        self.assertEqual(({}, 0), self.drone_utility._read_pidfile_events(
+                self.event_log, 10))
+
+
+    def test_refresh_skips_reported_pidfiles(self):
+        other_path = os.path.join(self.tmpdir, '.parser_execute')
+        open(other_path, 'w').write('456\n')
+        pidfile.PidFileManager('autoserv', self.tmpdir).open_file()
+        results = self.drone_utility.refresh(
+                [self.pidfile_path, other_path],
+                pidfile_event_log=self.event_log)
+        self.assertEqual({self.pidfile_path: '%d\n' % os.getpid()},
+                         results['pidfile_events'])
+        self.assertEqual({other_path: '456\n'}, results['pidfiles'])
+        self.assertEqual({}, results['pidfile_events_second_read'])
+        self.assertEqual(os.path.getsize(self.event_log),
+                         results['pidfile_event_offset'])
+
+
+class TestFraming(unittest.TestCase):
+    def test_frame_round_trip(self):
+        stream = StringIO()
+        calls = [drone_utility.call('refresh', ['/a/.autoserv_execute'])]
+        drone_utility.write_frame(stream, calls)
+        drone_utility.write_frame(stream, {'results': [], 'warnings': []})
+        stream.seek(0)
+        self.assertEqual(str(calls[0]),
+                         str(drone_utility.read_frame(stream)[0]))
+        self.assertEqual({'results': [], 'warnings': []},
+                         drone_utility.read_frame(stream))
+        self.assertEqual(None, drone_utility.read_frame(stream))
+
+
+    def test_truncated_frame(self):
+        stream = StringIO()
+        drone_utility.write_frame(stream, 'some data')
+        stream = StringIO(stream.getvalue()[:-1])
+        self.assertRaises(ValueError, drone_utility.read_frame, stream)
+
+
 if __name__ == '__main__':
     unittest.main()
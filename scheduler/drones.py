@@ -3,6 +3,8 @@
 import cPickle
 import logging
 import os
+import subprocess
+import threading
 import time
 
 import common
@@ -16,12 +18,95 @@ AUTOTEST_INSTALL_DIR = global_config.global_config.get_config_value('SCHEDULER',
                                                  'drone_installation_directory')
 DEFAULT_CONTAINER_PATH = global_config.global_config.get_config_value(
         'AUTOSERV', 'container_path')
+PERSISTENT_DRONE_UTILITY = global_config.global_config.get_config_value(
+        'SCHEDULER', 'persistent_drone_utility', type=bool, default=False)
 
 class DroneUnreachable(Exception):
     """The drone is non-sshable."""
     pass
 
 
+class DroneUtilityWorkerError(Exception):
+    """The persistent drone_utility process failed."""
+    pass
+
+
+class _DroneUtilityWorker(object):
+    """A drone_utility process that is kept running across ticks.
+
+    Batches of calls are written to the process's stdin and the results read
+    from its stdout, using the framing of drone_utility.write_frame.
+    """
+    def __init__(self, command):
+        """Start the worker and wait for it to be ready.
+
+        @param command: The shell command starting drone_utility --persistent.
+
+        @raises DroneUtilityWorkerError: If the worker failed to start.
+        """
+        try:
+            self._process = subprocess.Popen(
+                    command, shell=True, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, close_fds=True)
+        except OSError as e:
+            raise DroneUtilityWorkerError('Failed to run %s: %s' %
+                                          (command, e))
+        try:
+            ready = self.receive()
+        except DroneUtilityWorkerError:
+            self.close()
+            raise
+        if ready != drone_utility.WORKER_READY:
+            self.close()
+            raise DroneUtilityWorkerError('Unexpected greeting from %s: %r' %
+                                          (command, ready))
+
+
+    def is_alive(self):
+        return self._process.poll() is None
+
+
+    def send(self, calls):
+        """Send a batch of calls to the worker.
+
+        @raises DroneUtilityWorkerError: If the batch could not be sent.
+        """
+        try:
+            drone_utility.write_frame(self._process.stdin, calls)
+        except (IOError, OSError) as e:
+            raise DroneUtilityWorkerError('Failed to send calls: %s' % e)
+
+
+    def receive(self):
+        """Read the response to the last batch of calls.
+
+        @raises DroneUtilityWorkerError: If no valid response could be read.
+        """
+        try:
+            response = drone_utility.read_frame(self._process.stdout)
+        except Exception as e: # unpickling can throw all kinds of exceptions
+            raise DroneUtilityWorkerError('Invalid response: %s' % e)
+        if response is None:
+            raise DroneUtilityWorkerError(
+                    'drone_utility exited with status %s' %
+                    self._process.wait())
+        return response
+
+
+    def close(self):
+        """Ask the worker to exit, killing it if it does not."""
+        try:
+            self._process.stdin.close()
+        except IOError:
+            pass
+        for _ in xrange(10):
+            if not self.is_alive():
+                break
+            time.sleep(0.1)
+        utils.nuke_subprocess(self._process)
+        self._process.stdout.close()
+
+
 class _BaseAbstractDrone(object):
     """
     Attributes:
@@ -47,10 +132,16 @@ class _BaseAbstractDrone(object):
         # If drone supports server-side packaging. The property support_ssp will
         # init self._support_ssp later.
         self._support_ssp = None
+        # If true, calls are executed by a drone_utility process that is
+        # reused across ticks instead of starting one per batch.
+        self.use_persistent_worker = PERSISTENT_DRONE_UTILITY
+        self._worker = None
+        self._worker_lock = threading.Lock()
 
 
     def shutdown(self):
-        pass
+        with self._worker_lock:
+            self._stop_worker()
 
 
     @property
@@ -82,9 +173,60 @@ class _BaseAbstractDrone(object):
         return user in self.allowed_users
 
 
+    def _get_worker_command(self):
+        """Get the shell command starting a persistent drone_utility."""
+        return 'python %s --persistent' % self._drone_utility_path
+
+
+    def _stop_worker(self):
+        if self._worker:
+            self._worker.close()
+            self._worker = None
+
+
+    def _execute_calls_persistent(self, calls):
+        """Execute calls on the persistent drone_utility, starting it if needed.
+
+        @param calls: A list of drone_utility._MethodCall objects.
+
+        @returns The drone_utility response, or None if the calls could not
+            be handed to a worker. In that case none of the calls were
+            executed and the caller may retry them another way.
+
+        @raises DroneUtilityWorkerError: If the worker died after accepting
+            the calls.
+        """
+        with self._worker_lock:
+            if self._worker and not self._worker.is_alive():
+                logging.warning('drone_utility on %s exited, restarting it',
+                                self.hostname)
+                self._stop_worker()
+            try:
+                if not self._worker:
+                    self._worker = _DroneUtilityWorker(
+                            self._get_worker_command())
+                self._worker.send(calls)
+            except DroneUtilityWorkerError as e:
+                logging.warning('Persistent drone_utility on %s unavailable: '
+                                '%s', self.hostname, e)
+                self._stop_worker()
+                return None
+            try:
+                return self._worker.receive()
+            except DroneUtilityWorkerError:
+                self._stop_worker()
+                raise
+
+
     def _execute_calls_impl(self, calls):
         if not self._host:
             raise ValueError('Drone cannot execute calls without a host.')
+        if self.use_persistent_worker:
+            response = self._execute_calls_persistent(calls)
+            if response is not None:
+                return response
+            logging.warning('Falling back to one-shot drone_utility on %s',
+                            self.hostname)
         drone_utility_cmd = self._drone_utility_path
         if self.timestamp_remote_calls:
             drone_utility_cmd = '%s --call_time %s' % (
@@ -224,6 +366,12 @@ class _RemoteDrone(_AbstractDrone):
         self._host.close()
 
 
+    def _get_worker_command(self):
+        worker_command = super(_RemoteDrone, self)._get_worker_command()
+        return '%s "%s"' % (self._host.ssh_command(connect_timeout=300),
+                            utils.sh_escape(worker_command))
+
+
     def send_file_to(self, drone, source_path, destination_path,
                      can_fail=False):
         if drone.hostname == self.hostname:
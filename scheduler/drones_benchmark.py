@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+"""Measure per-tick drone call latency for one-shot and persistent drones.
+
+A local drone is used as a loopback: every simulated tick queues a refresh
+call and executes it, the way BaseDroneManager.trigger_refresh does. In
+one-shot mode a fresh drone_utility is started for each tick, in persistent
+mode the same drone_utility process serves every tick.
+
+Usage: drones_benchmark.py [--ticks 20] [--pidfiles 100]
+"""
+
+import argparse
+import os
+import time
+
+import common
+from autotest_lib.scheduler import drones
+
+
+def _measure(drone, ticks, pidfile_paths):
+    durations = []
+    for _ in xrange(ticks):
+        start = time.time()
+        drone.queue_call('refresh', pidfile_paths)
+        drone.execute_queued_calls()
+        durations.append(time.time() - start)
+    return durations
+
+
+def _report(name, durations):
+    durations = sorted(durations)
+    print '%-12s min: %8.2f ms  median: %8.2f ms  max: %8.2f ms' % (
+            name, durations[0] * 1000, durations[len(durations) / 2] * 1000,
+            durations[-1] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ticks', type=int, default=20,
+                        help='Number of ticks to time in each mode.')
+    parser.add_argument('--pidfiles', type=int, default=100,
+                        help='Number of (nonexistent) pidfiles to refresh.')
+    args = parser.parse_args()
+
+    pidfile_paths = ['/nonexistent/%d/.autoserv_execute' % i
+                     for i in xrange(args.pidfiles)]
+    for name, persistent in (('one-shot', False), ('persistent', True)):
+        drone = drones._LocalDrone(timestamp_remote_calls=False)
+        drone._autotest_install_dir = common.autotest_dir
+        drone.use_persistent_worker = persistent
+        try:
+            # The first persistent call includes the worker's startup.
+            _measure(drone, 1, pidfile_paths)
+            _report(name, _measure(drone, args.ticks, pidfile_paths))
+        finally:
+            drone.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -73,6 +73,60 @@ class RemoteDroneTest(unittest.TestCase):
         self.god.check_playback()
 
 
+    def _create_persistent_drone(self):
+        self.god.stub_with(drones._RemoteDrone, '_drone_utility_path',
+                           self.drone_utility_path)
+        drones.drone_utility.create_host.expect_call('fakehost').and_return(
+                self._mock_host)
+        self._mock_host.is_up.expect_call().and_return(True)
+        drone = drones._RemoteDrone('fakehost', timestamp_remote_calls=False)
+        drone.use_persistent_worker = True
+        self.god.stub_with(drone, '_get_worker_command',
+                           lambda: 'mock-worker-command')
+        return drone
+
+
+    def test_execute_calls_persistent(self):
+        drone = self._create_persistent_drone()
+        workers = []
+        class FakeWorker(object):
+            def __init__(self, command):
+                self.command = command
+                self.batches = []
+                workers.append(self)
+            def is_alive(self):
+                return True
+            def send(self, calls):
+                self.batches.append(calls)
+            def receive(self):
+                return 'mock return %d' % len(self.batches)
+            def close(self):
+                pass
+        self.god.stub_with(drones, '_DroneUtilityWorker', FakeWorker)
+
+        self.assertEqual('mock return 1', drone._execute_calls_impl(('foo',)))
+        self.assertEqual('mock return 2', drone._execute_calls_impl(('bar',)))
+        self.assertEqual(1, len(workers))
+        self.assertEqual('mock-worker-command', workers[0].command)
+        self.assertEqual([('foo',), ('bar',)], workers[0].batches)
+        self.god.check_playback()
+
+
+    def test_execute_calls_persistent_fallback(self):
+        drone = self._create_persistent_drone()
+        def fail_to_start(command):
+            raise drones.DroneUtilityWorkerError('no worker')
+        self.god.stub_with(drones, '_DroneUtilityWorker', fail_to_start)
+        mock_calls = ('foo',)
+        mock_result = utils.CmdResult(stdout=cPickle.dumps('mock return'))
+        self._mock_host.run.expect_call(
+                'python %s' % self.drone_utility_path,
+                stdin=cPickle.dumps(mock_calls), stdout_tee=None,
+                connect_timeout=mock.is_instance_comparator(int)).and_return(
+                        mock_result)
+        self.assertEqual('mock return', drone._execute_calls_impl(mock_calls))
+        self.god.check_playback()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -66,12 +66,14 @@ class EmailNotificationManager(object):
         """Send queued emails."""
         if not self._emails:
             return
+        # Take the queue first, emails may be enqueued by another thread
+        # while these are being sent.
+        emails, self._emails = self._emails, []
         subject = 'Scheduler notifications from ' + socket.gethostname()
         separator = '\n' + '-' * 40 + '\n'
-        body = separator.join(self._emails)
+        body = separator.join(emails)
 
         self.send_email(self._notify_address, subject, body)
-        self._emails = []
 
 
     def log_stacktrace(self, reason):
@@ -16,6 +16,7 @@ from autotest_lib.frontend.afe import models
 from autotest_lib.server.cros.dynamic_suite import constants
 from autotest_lib.scheduler import host_scheduler
 from autotest_lib.scheduler import monitor_db
+from autotest_lib.scheduler import query_managers
 from autotest_lib.scheduler import rdb
 from autotest_lib.scheduler import rdb_lib
 from autotest_lib.scheduler import rdb_testing_utils
@@ -59,6 +60,46 @@ class QueryManagerTests(rdb_testing_utils.AbstractBaseRDBTester,
         self.assertEqual(jobs_with_hosts[0].id, job2.id)
 
 
+    def testIncrementalPendingQueueEntries(self):
+        """Test tracking the pending queue entries between queries."""
+        self.god.stub_with(query_managers, '_incremental_pending_queue', True)
+        self.god.stub_with(query_managers, '_pending_queue_full_query_ticks',
+                           5)
+        self.god.stub_with(query_managers, '_pending_queue_lookback_ids', 0)
+        get_pending_ids = lambda: [
+                entry.id for entry in
+                self.job_query_manager.get_pending_queue_entries()]
+        job1 = self.create_job(deps=set(['a']))
+        hqe1 = job1.hostqueueentry_set.all()[0]
+        self.assertEqual(get_pending_ids(), [hqe1.id])
+
+        # New entries are found, and sorted with the tracked ones.
+        job2 = self.create_job(deps=set(['a']), priority=10)
+        hqe2 = job2.hostqueueentry_set.all()[0]
+        self.assertEqual(get_pending_ids(), [hqe2.id, hqe1.id])
+
+        # Entries that are no longer pending are dropped.
+        hqe1.status = models.HostQueueEntry.Status.VERIFYING
+        hqe1.active = True
+        hqe1.save()
+        self.assertEqual(get_pending_ids(), [hqe2.id])
+
+        # Entries the scheduler queues again are found again.
+        scheduler_models.HostQueueEntry(id=hqe1.id).set_status(
+                models.HostQueueEntry.Status.QUEUED)
+        self.assertEqual(get_pending_ids(), [hqe2.id, hqe1.id])
+
+        # Old entries queued by others are only found by a full query.
+        hqe1.active = True
+        hqe1.save()
+        self.assertEqual(get_pending_ids(), [hqe2.id])
+        hqe1.status = models.HostQueueEntry.Status.QUEUED
+        hqe1.active = False
+        hqe1.save()
+        self.assertEqual(get_pending_ids(), [hqe2.id])
+        self.assertEqual(get_pending_ids(), [hqe2.id, hqe1.id])
+
+
     def testHostQueries(self):
         """Verify that the host query manager maintains its data structures."""
         # Create a job and use the host_query_managers internal datastructures
@@ -4,14 +4,18 @@ Autotest scheduler
 """
 
 import datetime
+import functools
 import gc
 import logging
 import optparse
 import os
 import signal
 import sys
+import threading
 import time
 
+from multiprocessing import pool
+
 import common
 from autotest_lib.frontend import setup_django_environment
 
@@ -27,9 +31,11 @@ from autotest_lib.scheduler import email_manager, gc_stats, host_scheduler
 from autotest_lib.scheduler import monitor_db_cleanup, prejob_task
 from autotest_lib.scheduler import postjob_task
 from autotest_lib.scheduler import query_managers
+from autotest_lib.scheduler import rdb_hosts
 from autotest_lib.scheduler import scheduler_lib
 from autotest_lib.scheduler import scheduler_models
 from autotest_lib.scheduler import status_server, scheduler_config
+from autotest_lib.scheduler import tick_pipeline
 from autotest_lib.server import autoserv_utils
 from autotest_lib.server import system_utils
 from autotest_lib.server import utils as server_utils
@@ -75,6 +81,39 @@ _enable_ssp_container = global_config.global_config.get_config_value(
         'AUTOSERV', 'enable_ssp_container', type=bool,
         default=True)
 
+# Number of threads running the concurrent steps of a tick. If 0, every step
+# of the tick runs serially in the main thread.
+_tick_threads = global_config.global_config.get_config_value(
+        scheduler_config.CONFIG_SECTION, 'tick_threads', type=int, default=0)
+
+# If True, rows loaded by scheduler_models are cached for the rest of a tick.
+_tick_object_cache = global_config.global_config.get_config_value(
+        scheduler_config.CONFIG_SECTION, 'tick_object_cache', type=bool,
+        default=False)
+
+# Per thread state of the tick threads.
+_tick_thread_state = threading.local()
+
+def _initialize_tick_thread():
+    """Give a tick thread database connections of its own.
+
+    The scheduler's connection belongs to the main thread, and django opens a
+    separate connection for each thread, which needs the same setup as the
+    main thread's.
+    """
+    setup_django_environment.enable_autocommit()
+    _tick_thread_state.db = scheduler_lib.ConnectionManager.open_connection()
+
+
+def _get_tick_thread_db():
+    """Get the connection for scheduler_models queries of this thread.
+
+    @returns: The DatabaseConnection of the current tick thread, or None in
+            the main thread, meaning the scheduler's connection.
+    """
+    return getattr(_tick_thread_state, 'db', None)
+
+
 def _site_init_monitor_db_dummy():
     return {}
 
@@ -299,6 +338,10 @@ class BaseDispatcher(object):
         self._host_scheduler = (host_scheduler.BaseHostScheduler()
                                 if _inline_host_acquisition else
                                 host_scheduler.DummyHostScheduler())
+        self._tick_thread_pool = None
+        if _tick_threads > 0:
+            self._tick_thread_pool = pool.ThreadPool(
+                    _tick_threads, initializer=_initialize_tick_thread)
 
 
     def initialize(self, recover_hosts=True):
@@ -328,54 +371,121 @@ class BaseDispatcher(object):
 
     def tick(self):
         """
-        This is an altered version of tick() where we keep track of when each
-        major step begins so we can try to figure out where we are using most
-        of the tick time.
+        Run one tick of the scheduler.
+
+        The steps of the tick and the dependencies between them are declared
+        in _get_tick_pipeline. Each step is timed under scheduler.tick.
         """
         timer = autotest_stats.Timer('scheduler.tick')
         system_utils.DroneCache.refresh()
-        self._log_tick_msg('Calling new tick, starting garbage collection().')
-        self._garbage_collection()
-        self._log_tick_msg('Calling _drone_manager.trigger_refresh().')
-        _drone_manager.trigger_refresh()
-        self._log_tick_msg('Calling _process_recurring_runs().')
-        self._process_recurring_runs()
-        self._log_tick_msg('Calling _schedule_delay_tasks().')
-        self._schedule_delay_tasks()
-        self._log_tick_msg('Calling _schedule_running_host_queue_entries().')
-        self._schedule_running_host_queue_entries()
-        self._log_tick_msg('Calling _schedule_special_tasks().')
-        self._schedule_special_tasks()
-        self._log_tick_msg('Calling _schedule_new_jobs().')
-        self._schedule_new_jobs()
-        self._log_tick_msg('Calling _drone_manager.sync_refresh().')
-        _drone_manager.sync_refresh()
+        if _tick_object_cache:
+            scheduler_models.start_tick_cache()
+        try:
+            self._get_tick_pipeline(timer).run()
+        finally:
+            scheduler_models.end_tick_cache()
+        self._tick_count += 1
+
+
+    def _add_tick_step(self, pipeline, name, function, depends_on=(),
+                       concurrent=False):
+        """Declare a tick step that logs when it starts.
+
+        @param pipeline: The tick_pipeline.TickPipeline to add the step to.
+        @param name: The name of the step.
+        @param function: The callable run by the step.
+        @param depends_on: Names of the steps this step depends on.
+        @param concurrent: Whether the step may run in a tick thread.
+        """
+        def step():
+            self._log_tick_msg('Calling %s.' % name)
+            return function()
+        pipeline.add_step(name, step, depends_on=depends_on,
+                          concurrent=concurrent)
+
+
+    def _get_tick_pipeline(self, timer):
+        """Declare the steps of a tick.
+
+        Without tick threads the steps run in the order they are declared
+        here. With tick threads, the concurrent steps start as soon as their
+        dependencies are done. They are reads, which overlap with the drone
+        refresh and with each other, while everything acting on their results
+        stays in the serial order below.
+
+        Reads returning Django model instances get new objects, rows that
+        change after they were read are picked up on the next tick. Reads of
+        rows of scheduler_models, which has one live instance per row, must
+        depend on every step changing those rows: building instances from the
+        rows updates the live instances, and would revert the changes made
+        since the rows were read.
+
+        @param timer: The timer the steps are timed under.
+
+        @returns: A tick_pipeline.TickPipeline.
+        """
+        pipeline = tick_pipeline.TickPipeline(timer, self._tick_thread_pool)
+        add = functools.partial(self._add_tick_step, pipeline)
+        add('garbage_collection', self._garbage_collection)
+        add('trigger_refresh', _drone_manager.trigger_refresh)
+        add('get_recurring_runs', self._get_due_recurring_runs,
+            concurrent=True)
+        add('process_recurring_runs',
+            lambda: self._process_recurring_runs(
+                    pipeline.get_result('get_recurring_runs')),
+            depends_on=('get_recurring_runs',))
+        add('schedule_delay_tasks', self._schedule_delay_tasks)
+        add('schedule_running_host_queue_entries',
+            self._schedule_running_host_queue_entries)
+        add('get_special_tasks', self._get_prioritized_special_tasks,
+            concurrent=True)
+        add('schedule_special_tasks',
+            lambda: self._schedule_special_tasks(
+                    pipeline.get_result('get_special_tasks')),
+            depends_on=('get_special_tasks',))
+        add('schedule_new_jobs', self._schedule_new_jobs,
+            depends_on=('process_recurring_runs',))
+        add('sync_refresh', _drone_manager.sync_refresh,
+            depends_on=('trigger_refresh',))
         # _run_cleanup must be called between drone_manager.sync_refresh, and
         # drone_manager.execute_actions, as sync_refresh will clear the calls
         # queued in drones. Therefore, any action that calls drone.queue_call
         # to add calls to the drone._calls, should be after drone refresh is
         # completed and before drone_manager.execute_actions at the end of the
         # tick.
-        self._log_tick_msg('Calling _run_cleanup().')
-        self._run_cleanup()
-        self._log_tick_msg('Calling _find_aborting().')
-        self._find_aborting()
-        self._log_tick_msg('Calling _find_aborted_special_tasks().')
-        self._find_aborted_special_tasks()
-        self._log_tick_msg('Calling _handle_agents().')
-        self._handle_agents()
-        self._log_tick_msg('Calling _host_scheduler.tick().')
-        self._host_scheduler.tick()
-        self._log_tick_msg('Calling _drone_manager.execute_actions().')
-        _drone_manager.execute_actions()
-        self._log_tick_msg('Calling '
-                           'email_manager.manager.send_queued_emails().')
-        with timer.get_client('email_manager_send_queued_emails'):
-            email_manager.manager.send_queued_emails()
-        self._log_tick_msg('Calling django.db.reset_queries().')
-        with timer.get_client('django_db_reset_queries'):
-            django.db.reset_queries()
-        self._tick_count += 1
+        add('run_cleanup', self._run_cleanup, depends_on=('sync_refresh',))
+        add('get_aborting_entries', self._get_aborting_entry_rows,
+            depends_on=('process_recurring_runs', 'schedule_delay_tasks',
+                        'schedule_running_host_queue_entries',
+                        'schedule_special_tasks', 'schedule_new_jobs',
+                        'run_cleanup'),
+            concurrent=True)
+        add('find_aborting',
+            lambda: self._find_aborting(
+                    scheduler_models.HostQueueEntry.from_rows(
+                            pipeline.get_result('get_aborting_entries'))),
+            depends_on=('get_aborting_entries', 'sync_refresh'))
+        add('get_aborted_special_tasks', self._get_aborted_special_tasks,
+            concurrent=True)
+        add('find_aborted_special_tasks',
+            lambda: self._find_aborted_special_tasks(
+                    pipeline.get_result('get_aborted_special_tasks')),
+            depends_on=('get_aborted_special_tasks', 'sync_refresh'))
+        add('handle_agents', self._handle_agents,
+            depends_on=('sync_refresh', 'find_aborting',
+                        'find_aborted_special_tasks'))
+        add('host_scheduler_tick', self._host_scheduler.tick,
+            depends_on=('handle_agents',))
+        add('execute_actions', _drone_manager.execute_actions,
+            depends_on=('run_cleanup', 'handle_agents',
+                        'host_scheduler_tick'))
+        # Emails queued after the agents were handled go out with the next
+        # tick, so that sending them can overlap with the end of this one.
+        add('email_manager_send_queued_emails',
+            email_manager.manager.send_queued_emails,
+            depends_on=('handle_agents',), concurrent=True)
+        add('django_db_reset_queries', django.db.reset_queries)
+        return pipeline
 
 
     def _run_cleanup(self):
@@ -677,7 +787,21 @@ class BaseDispatcher(object):
                     (len(unrecovered_hqes), message))
 
 
-    def _schedule_special_tasks(self):
+    def _get_prioritized_special_tasks(self):
+        """Get the queued SpecialTasks, in the order they should run.
+
+        @returns: A list of afe.models.SpecialTask.
+        """
+        # When the host scheduler is responsible for acquisition we only want
+        # to run tasks with leased hosts. All hqe tasks will already have
+        # leased hosts, and we don't want to run frontend tasks till the host
+        # scheduler has vetted the assignment. Note that this doesn't include
+        # frontend tasks with hosts leased by other active hqes.
+        return self._job_query_manager.get_prioritized_special_tasks(
+                only_tasks_with_leased_hosts=not _inline_host_acquisition)
+
+
+    def _schedule_special_tasks(self, special_tasks=None):
         """
         Execute queued SpecialTasks that are ready to run on idle hosts.
 
@@ -686,14 +810,13 @@ class BaseDispatcher(object):
         This method translates SpecialTasks to the appropriate AgentTask and
         adds them to the dispatchers agents list, so _handle_agents can execute
         them.
+
+        @param special_tasks: The result of _get_prioritized_special_tasks,
+                if it has already been fetched this tick.
         """
-        # When the host scheduler is responsible for acquisition we only want
-        # to run tasks with leased hosts. All hqe tasks will already have
-        # leased hosts, and we don't want to run frontend tasks till the host
-        # scheduler has vetted the assignment. Note that this doesn't include
-        # frontend tasks with hosts leased by other active hqes.
-        for task in self._job_query_manager.get_prioritized_special_tasks(
-                only_tasks_with_leased_hosts=not _inline_host_acquisition):
+        if special_tasks is None:
+            special_tasks = self._get_prioritized_special_tasks()
+        for task in special_tasks:
             if self.host_has_agent(task.host):
                 continue
             self.add_agent_task(self._get_agent_task_for_special_task(task))
@@ -872,17 +995,35 @@ class BaseDispatcher(object):
                 self.add_agent_task(task)
 
 
-    def _find_aborting(self):
+    def _get_aborting_entry_rows(self):
+        """Get the rows of the aborted host queue entries to abort.
+
+        Only the rows are fetched, as HostQueueEntry instances must be created
+        in the main thread.
+
+        @returns: The rows, for scheduler_models.HostQueueEntry.from_rows.
+        """
+        return scheduler_models.HostQueueEntry.fetch_rows(
+                where='aborted=1 and complete=0', db=_get_tick_thread_db())
+
+
+    def _find_aborting(self, entries=None):
         """
         Looks through the afe_host_queue_entries for an aborted entry.
 
         The aborted bit is set on an HQE in many ways, the most common
         being when a user requests an abort through the frontend, which
         results in an rpc from the afe to abort_host_queue_entries.
+
+        @param entries: The aborted HostQueueEntries, if they have already
+                been fetched this tick.
         """
+        if entries is None:
+            entries = scheduler_models.HostQueueEntry.from_rows(
+                    self._get_aborting_entry_rows())
         jobs_to_stop = set()
-        for entry in scheduler_models.HostQueueEntry.fetch(
-                where='aborted=1 and complete=0'):
+        entries_to_abort = []
+        for entry in entries:
 
             # If the job is running on a shard, let the shard handle aborting
             # it and sync back the right status.
@@ -903,19 +1044,32 @@ class BaseDispatcher(object):
 
             for agent in self.get_agents_for_entry(entry):
                 agent.abort()
-            entry.abort(self)
+            entries_to_abort.append(entry)
             jobs_to_stop.add(entry.job)
+        scheduler_models.HostQueueEntry.abort_bulk(entries_to_abort, self)
         logging.debug('Aborting %d jobs this tick.', len(jobs_to_stop))
         for job in jobs_to_stop:
             job.stop_if_necessary()
 
 
-    def _find_aborted_special_tasks(self):
+    def _get_aborted_special_tasks(self):
+        """Get the active SpecialTasks that have been marked for abortion.
+
+        @returns: A list of afe.models.SpecialTask.
+        """
+        return list(models.SpecialTask.objects.filter(
+                is_active=True, is_aborted=True).select_related('host'))
+
+
+    def _find_aborted_special_tasks(self, aborted_tasks=None):
         """
         Find SpecialTasks that have been marked for abortion.
 
         Poll the database looking for SpecialTasks that are active
         and have been marked for abortion, then abort them.
+
+        @param aborted_tasks: The result of _get_aborted_special_tasks, if
+                it has already been fetched this tick.
         """
 
         # The completed and active bits are very important when it comes
@@ -927,8 +1081,8 @@ class BaseDispatcher(object):
         # task which completed will have is_active=0 is_complete=1. To check
         # aborts we directly check active because the complete bit is set in
         # several places, including the epilog of agent tasks.
-        aborted_tasks = models.SpecialTask.objects.filter(is_active=True,
-                                                          is_aborted=True)
+        if aborted_tasks is None:
+            aborted_tasks = self._get_aborted_special_tasks()
         for task in aborted_tasks:
             # There are 2 ways to get the agent associated with a task,
             # through the host and through the hqe. A special task
@@ -1031,9 +1185,24 @@ class BaseDispatcher(object):
                      num_started_this_tick)
 
 
-    def _process_recurring_runs(self):
-        recurring_runs = models.RecurringRun.objects.filter(
-            start_date__lte=datetime.datetime.now())
+    def _get_due_recurring_runs(self):
+        """Get the RecurringRuns whose next job should be created now.
+
+        @returns: A list of afe.models.RecurringRun.
+        """
+        return list(models.RecurringRun.objects.filter(
+                start_date__lte=datetime.datetime.now()).select_related(
+                        'job', 'owner'))
+
+
+    def _process_recurring_runs(self, recurring_runs=None):
+        """Create the jobs of the recurring runs that are due.
+
+        @param recurring_runs: The result of _get_due_recurring_runs, if it
+                has already been fetched this tick.
+        """
+        if recurring_runs is None:
+            recurring_runs = self._get_due_recurring_runs()
         for rrun in recurring_runs:
             # Create job from template
             job = rrun.job
@@ -1287,18 +1456,22 @@ class QueueTask(AbstractQueueTask):
 
         super(QueueTask, self).prolog()
 
-        for queue_entry in self.queue_entries:
-            self._write_host_keyvals(queue_entry.host)
-            queue_entry.host.set_status(models.Host.Status.RUNNING)
-            queue_entry.host.update_field('dirty', 1)
+        hosts = [queue_entry.host for queue_entry in self.queue_entries]
+        for host in hosts:
+            self._write_host_keyvals(host)
+        rdb_hosts.RDBClientHostWrapper.set_status_bulk(
+                hosts, models.Host.Status.RUNNING)
+        rdb_hosts.RDBClientHostWrapper.update_field_bulk(hosts, 'dirty', 1)
 
 
     def _finish_task(self):
         super(QueueTask, self)._finish_task()
 
-        for queue_entry in self.queue_entries:
-            queue_entry.set_status(models.HostQueueEntry.Status.GATHERING)
-            queue_entry.host.set_status(models.Host.Status.RUNNING)
+        scheduler_models.HostQueueEntry.set_status_bulk(
+                self.queue_entries, models.HostQueueEntry.Status.GATHERING)
+        rdb_hosts.RDBClientHostWrapper.set_status_bulk(
+                [queue_entry.host for queue_entry in self.queue_entries],
+                models.Host.Status.RUNNING)
 
 
     def _command_line(self):
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 import gc, time
+from multiprocessing import pool
 import common
 from autotest_lib.frontend import setup_django_environment
 from autotest_lib.frontend.afe import frontend_test_utils
@@ -157,6 +158,46 @@ class BaseSchedulerTest(unittest.TestCase,
             order_by=query_string))
 
 
+class DispatcherTickPipelineTest(BaseSchedulerTest):
+    def test_aborting_entries_read_after_changes(self):
+        """The aborting entries are read after the steps changing entries."""
+        steps = []
+        def record(name, result=None):
+            def step(*args):
+                steps.append(name)
+                # Leave time for the concurrent steps to start.
+                time.sleep(0.01)
+                return result
+            return step
+
+        changing_steps = ('_process_recurring_runs', '_schedule_delay_tasks',
+                          '_schedule_running_host_queue_entries',
+                          '_schedule_special_tasks', '_schedule_new_jobs',
+                          '_run_cleanup')
+        for name in changing_steps + (
+                '_garbage_collection', '_get_due_recurring_runs',
+                '_get_prioritized_special_tasks', '_find_aborting',
+                '_get_aborted_special_tasks', '_find_aborted_special_tasks',
+                '_handle_agents'):
+            self.god.stub_with(self._dispatcher, name, record(name))
+        self.god.stub_with(self._dispatcher, '_get_aborting_entry_rows',
+                           record('_get_aborting_entry_rows', []))
+        self.god.stub_with(self._dispatcher._host_scheduler, 'tick',
+                           record('tick'))
+        for name in ('trigger_refresh', 'sync_refresh', 'execute_actions'):
+            self.god.stub_with(monitor_db._drone_manager, name, record(name))
+        thread_pool = pool.ThreadPool(2)
+        self.god.stub_with(self._dispatcher, '_tick_thread_pool', thread_pool)
+        try:
+            self._dispatcher._get_tick_pipeline(
+                    monitor_db.autotest_stats.Timer('test')).run()
+        finally:
+            thread_pool.terminate()
+        aborting_index = steps.index('_get_aborting_entry_rows')
+        for name in changing_steps:
+            self.assertLess(steps.index(name), aborting_index)
+
+
 class DispatcherSchedulingTest(BaseSchedulerTest):
     _jobs_scheduled = []
 
@@ -13,8 +13,8 @@ import os
 from autotest_lib.client.common_lib.cros.graphite import autotest_stats
 from autotest_lib.frontend.afe import models, model_attributes
 from autotest_lib.scheduler import agent_task, drones, drone_manager
-from autotest_lib.scheduler import email_manager, pidfile_monitor
-from autotest_lib.scheduler import scheduler_config
+from autotest_lib.scheduler import email_manager, pidfile_monitor, rdb_hosts
+from autotest_lib.scheduler import scheduler_config, scheduler_models
 from autotest_lib.server import autoserv_utils
 
 
@@ -84,8 +84,8 @@ class PostJobTask(agent_task.AgentTask):
 
 
     def _set_all_statuses(self, status):
-        for queue_entry in self.queue_entries:
-            queue_entry.set_status(status)
+        scheduler_models.HostQueueEntry.set_status_bulk(self.queue_entries,
+                                                        status)
 
 
     def abort(self):
@@ -279,6 +279,7 @@ class GatherLogsTask(PostJobTask):
                     and final_success and num_tests_failed == 0)
                 or num_tests_failed > 0)
 
+        ready_hosts = []
         for queue_entry in self.queue_entries:
             if do_reboot:
                 # don't pass the queue entry to the CleanupTask. if the cleanup
@@ -288,7 +289,9 @@ class GatherLogsTask(PostJobTask):
                         task=models.SpecialTask.Task.CLEANUP,
                         requested_by=self._job.owner_model())
             else:
-                queue_entry.host.set_status(models.Host.Status.READY)
+                ready_hosts.append(queue_entry.host)
+        rdb_hosts.RDBClientHostWrapper.set_status_bulk(
+                ready_hosts, models.Host.Status.READY)
 
 
     def run(self):
@@ -12,14 +12,33 @@ import logging
 
 import common
 
+from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib.cros.graphite import autotest_stats
 from autotest_lib.frontend import setup_django_environment
 from autotest_lib.frontend.afe import models
 from autotest_lib.server.cros.dynamic_suite import constants
+from autotest_lib.scheduler import runnable_queue
+from autotest_lib.scheduler import scheduler_config
 from autotest_lib.scheduler import scheduler_models
 from autotest_lib.scheduler import scheduler_lib
 
 
+# If True, the pending queue entries are tracked between ticks, see
+# runnable_queue.
+_incremental_pending_queue = global_config.global_config.get_config_value(
+        scheduler_config.CONFIG_SECTION, 'incremental_pending_queue',
+        type=bool, default=False)
+# Number of incremental queries of the pending queue entries between queries
+# of all of them.
+_pending_queue_full_query_ticks = global_config.global_config.get_config_value(
+        scheduler_config.CONFIG_SECTION, 'pending_queue_full_query_ticks',
+        type=int, default=60)
+# Number of ids below the highest one seen before to scan for new pending
+# queue entries from, for the entries committed late.
+_pending_queue_lookback_ids = global_config.global_config.get_config_value(
+        scheduler_config.CONFIG_SECTION, 'pending_queue_lookback_ids',
+        type=int, default=100)
+
 _job_timer = autotest_stats.Timer('scheduler.job_query_manager')
 class AFEJobQueryManager(object):
     """Query manager for AFE Jobs."""
@@ -28,6 +47,11 @@ class AFEJobQueryManager(object):
     hostless_query = 'host_id IS NULL AND meta_host IS NULL'
 
 
+    def __init__(self):
+        # The runnable_queue.RunnableQueue of each value of only_hostless.
+        self._runnable_queues = {}
+
+
     @_job_timer.decorate
     def get_pending_queue_entries(self, only_hostless=False):
         """
@@ -99,8 +123,35 @@ class AFEJobQueryManager(object):
         # This works for now, but once O(#Jobs in shard) << O(#Jobs in Queued),
         # it might be more efficient to filter on the meta_host first, instead
         # of the status.
+        #
+        # With _incremental_pending_queue, most ticks only look at the entries
+        # that can be pending instead, see runnable_queue.
         if only_hostless:
             query = '%s AND (%s)' % (query, self.hostless_query)
+        if not _incremental_pending_queue:
+            return self._fetch_pending_queue_entries(query, sort_order)
+
+        if only_hostless not in self._runnable_queues:
+            self._runnable_queues[only_hostless] = runnable_queue.RunnableQueue(
+                    _pending_queue_full_query_ticks,
+                    _pending_queue_lookback_ids)
+        queue = self._runnable_queues[only_hostless]
+        full_query = queue.needs_full_query()
+        max_entry_id = scheduler_models.HostQueueEntry.get_max_id()
+        if not full_query:
+            candidates = 'afe_host_queue_entries.id > %d' % queue.scan_from_id
+            entry_ids = queue.get_entry_ids()
+            if entry_ids:
+                candidates += ' OR afe_host_queue_entries.id IN (%s)' % (
+                        ','.join(str(entry_id) for entry_id in entry_ids))
+            query = '%s AND (%s)' % (query, candidates)
+        queue_entries = self._fetch_pending_queue_entries(query, sort_order)
+        queue.update([entry.id for entry in queue_entries], max_entry_id,
+                     full_query)
+        return queue_entries
+
+
+    def _fetch_pending_queue_entries(self, query, sort_order):
         return list(scheduler_models.HostQueueEntry.fetch(
             joins=('INNER JOIN afe_jobs ON (job_id=afe_jobs.id) '
                    'LEFT JOIN afe_shards_labels ON ('
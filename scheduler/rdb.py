@@ -5,6 +5,7 @@
 """Rdb server module.
 """
 
+import itertools
 import logging
 
 import common
@@ -13,8 +14,11 @@ from django.core import exceptions as django_exceptions
 from django.db.models import fields
 from django.db.models import Q
 from autotest_lib.client.common_lib.cros.graphite import autotest_stats
+from autotest_lib.client.common_lib.global_config import global_config
 from autotest_lib.frontend.afe import models
+from autotest_lib.scheduler import rdb_assignment
 from autotest_lib.scheduler import rdb_cache_manager
+from autotest_lib.scheduler import rdb_host_index
 from autotest_lib.scheduler import rdb_hosts
 from autotest_lib.scheduler import rdb_requests
 from autotest_lib.scheduler import rdb_utils
@@ -23,6 +27,8 @@ from autotest_lib.server import utils
 
 _timer = autotest_stats.Timer(rdb_utils.RDB_STATS_KEY)
 _is_master = not utils.is_shard()
+_use_host_matching = global_config.get_config_value(
+        'RDB', 'use_host_matching', type=bool, default=False)
 
 
 # Qeury managers: Provide a layer of abstraction over the database by
@@ -32,6 +38,16 @@ class BaseHostQueryManager(object):
     """
 
     host_objects = models.Host.objects
+    # Whether find_hosts only returns unleased, unlocked hosts.
+    available_only = False
+
+
+    def __init__(self, host_index=None):
+        """
+        @param host_index: A rdb_host_index.HostIndex used to find matching
+                hosts without joins, or None to query for them directly.
+        """
+        self.host_index = host_index
 
 
     def update_hosts(self, host_ids, **kwargs):
@@ -44,6 +60,19 @@ class BaseHostQueryManager(object):
         self.host_objects.filter(id__in=host_ids).update(**kwargs)
 
 
+    def filter_host_ids(self, host_ids):
+        """Get the ids of the hosts this query manager can see.
+
+        @param host_ids: A list of host ids.
+
+        @returns: A list of the ids in host_ids of hosts managed by this query
+            manager, eg: unleased, unlocked hosts for the
+            AvailableHostQueryManager.
+        """
+        return list(self.host_objects.filter(
+                id__in=host_ids).values_list('id', flat=True))
+
+
     @rdb_hosts.return_rdb_host
     def get_hosts(self, ids):
         """Get host objects for the given ids.
@@ -66,6 +95,12 @@ class BaseHostQueryManager(object):
         @return: A set of matching hosts available.
         """
         hosts_available = self.host_objects.filter(invalid=0)
+        if self.host_index is not None:
+            host_ids = self.host_index.find_host_ids(
+                    deps, acls, available_only=self.available_only)
+            if not host_ids:
+                return set()
+            return set(hosts_available.filter(id__in=host_ids))
         queries = [Q(labels__id=dep) for dep in deps]
         queries += [Q(aclgroup__id__in=acls)]
         for query in queries:
@@ -78,6 +113,7 @@ class AvailableHostQueryManager(BaseHostQueryManager):
     """
 
     host_objects = models.Host.leased_objects
+    available_only = True
 
 
 # Request Handlers: Used in conjunction with requests in rdb_utils, these
@@ -239,7 +275,9 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
 
 
     def __init__(self):
-        self.host_query_manager = AvailableHostQueryManager()
+        self.host_index = rdb_host_index.get_host_index()
+        self.host_query_manager = AvailableHostQueryManager(
+                host_index=self.host_index)
         self.cache = rdb_cache_manager.RDBHostCacheManager()
         self.response_map = {}
         self.unsatisfied_requests = 0
@@ -266,9 +304,53 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
                 logging.error('Unable to lease host %s: %s', host.hostname, e)
             else:
                 leased_hosts.add(host)
+        self._record_leases(unleased_hosts, leased_hosts)
         return list(leased_hosts)
 
 
+    @_timer.decorate
+    def lease_hosts_in_batch(self, hosts):
+        """Leases a list of hosts with a single update.
+
+        Unlike lease_hosts, which checks and sets the leased bit host by host,
+        the leased bits of all the hosts are checked with one query and set
+        with another.
+
+        @param hosts: A list of RDBServerHostWrapper instances to lease.
+
+        @return: The list of RDBServerHostWrappers that were successfully
+            leased.
+        """
+        leasable_host_ids = set(self.host_query_manager.filter_host_ids(
+                [host.id for host in hosts]))
+        leased_hosts = []
+        for host in hosts:
+            if host.id in leasable_host_ids:
+                leased_hosts.append(host)
+            else:
+                logging.error('Unable to lease host %s: it is already leased '
+                              'or locked', host.hostname)
+        if leased_hosts:
+            self.host_query_manager.update_hosts(
+                    [host.id for host in leased_hosts], leased=True)
+            for host in leased_hosts:
+                host.leased = True
+        self._record_leases(hosts, leased_hosts)
+        return leased_hosts
+
+
+    def _record_leases(self, hosts, leased_hosts):
+        """Keep the host index and cache in step with an attempt to lease.
+
+        @param hosts: The hosts the rdb attempted to lease.
+        @param leased_hosts: The hosts that were successfully leased.
+        """
+        if self.host_index is not None:
+            self.host_index.mark_leased([host.id for host in leased_hosts])
+        # Hosts that failed leasing are already leased by someone else.
+        self.cache.remove_hosts([host.id for host in hosts])
+
+
     @classmethod
     def valid_host_assignment(cls, request, host):
         """Check if a host, request pairing is valid.
@@ -298,7 +380,8 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
 
 
     @classmethod
-    def _sort_hosts_by_preferred_deps(cls, hosts, preferred_deps):
+    def _sort_hosts_by_preferred_deps(cls, hosts, preferred_deps,
+                                      host_index=None):
         """Sort hosts in the order of how many preferred deps it has.
 
         This allows rdb always choose the hosts with the most preferred deps
@@ -309,10 +392,17 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
 
         @param hosts: A list of hosts to sort.
         @param preferred_deps: A list of deps that are preferred.
+        @param host_index: A rdb_host_index.HostIndex to count the preferred
+                deps of the hosts with, instead of their labels.
 
         @return: A list of sorted hosts.
 
         """
+        if host_index is not None:
+            counts = host_index.count_preferred_deps(
+                    [host.id for host in hosts], preferred_deps)
+            return sorted(hosts, key=lambda host: counts[host.id],
+                          reverse=True)
         hosts = sorted(
                 hosts,
                 key=lambda host: len(set(preferred_deps) & set(host.labels)),
@@ -349,7 +439,7 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
         # |   -leased_hosts-  |   -stale cached hosts-  | -unleased matching- |
         # --used this request---used by earlier request----------unused--------
         hosts = self._sort_hosts_by_preferred_deps(
-                hosts, request.preferred_deps)
+                hosts, request.preferred_deps, host_index=self.host_index)
         attempt_lease_hosts = min(len(hosts), hosts_required)
         leased_host_count = 0
         if attempt_lease_hosts:
@@ -379,6 +469,93 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
         return hosts[attempt_lease_hosts:]
 
 
+    def _get_candidate_hosts(self, request, candidates_by_key):
+        """Get the hosts matching a request, from the cache if possible.
+
+        @param request: The request for hosts.
+        @param candidates_by_key: A dictionary of the hosts found so far,
+            keyed on cache key. Updated with the hosts of the request.
+
+        @return: A list of RDBServerHostWrappers.
+        """
+        key = self.cache.get_key(request.deps, request.acls)
+        if key not in candidates_by_key:
+            try:
+                hosts = self.cache.get_line(key)
+            except rdb_utils.CacheMiss:
+                hosts = []
+            if not hosts:
+                hosts = self.host_query_manager.find_hosts(
+                        request.deps, request.acls)
+            candidates_by_key[key] = hosts
+        return candidates_by_key[key]
+
+
+    @_timer.decorate
+    def _acquire_hosts_by_matching(self):
+        """Acquire hosts for all the requests of the batch at once.
+
+        Hosts are assigned to requests through a rdb_assignment.HostAssignment,
+        asking for hosts in the same order, and with the same min_duts
+        accounting, as the two passes of batch_acquire_hosts. All the
+        assigned hosts are then leased together.
+        """
+        accountant = self.request_accountant
+        assignment = rdb_assignment.HostAssignment()
+        candidates_by_key = {}
+        hosts_by_id = {}
+        for request in accountant.requests:
+            hosts = self._sort_hosts_by_preferred_deps(
+                    self._get_candidate_hosts(request, candidates_by_key),
+                    request.preferred_deps, host_index=self.host_index)
+            for host in hosts:
+                hosts_by_id.setdefault(host.id, host)
+            assignment.add_request(request, [host.id for host in hosts])
+
+        hosts_required = 0
+        min_duts_acquisitions = []
+        for request in accountant.requests:
+            to_acquire = accountant.get_min_duts(request)
+            if to_acquire > 0:
+                min_duts_acquisitions.append(
+                        (request, to_acquire,
+                         assignment.assign(request, to_acquire)))
+                hosts_required += to_acquire
+        for request in accountant.requests:
+            to_acquire = accountant.get_duts(request)
+            if to_acquire > 0:
+                assignment.assign(request, to_acquire)
+                hosts_required += to_acquire
+
+        host_ids_by_request = dict(
+                (request, assignment.get_host_ids(request))
+                for request in accountant.requests)
+        assigned_host_ids = set(itertools.chain.from_iterable(
+                host_ids_by_request.itervalues()))
+        leased_host_ids = set(host.id for host in self.lease_hosts_in_batch(
+                [hosts_by_id[host_id] for host_id in assigned_host_ids]))
+        for request, host_ids in host_ids_by_request.iteritems():
+            hosts = [hosts_by_id[host_id] for host_id in host_ids
+                     if host_id in leased_host_ids]
+            if hosts:
+                self.update_response_map(request, hosts, append=True)
+
+        failed_leasing = len(assigned_host_ids) - len(leased_host_ids)
+        if failed_leasing > 0:
+            self.cache.stale_entries.append(
+                    (float(failed_leasing)/len(assigned_host_ids)) * 100)
+        for request, hosts_required_for_min_duts, assigned in (
+                min_duts_acquisitions):
+            accountant.record_acquire_min_duts(
+                    request, hosts_required_for_min_duts, assigned)
+        self.leased_hosts_count += len(leased_host_ids)
+        self.unsatisfied_requests += hosts_required - len(leased_host_ids)
+        # Cache the unassigned matching hosts.
+        for key, hosts in candidates_by_key.iteritems():
+            self.cache.set_line(key, [host for host in hosts
+                                      if host.id not in assigned_host_ids])
+
+
     @_timer.decorate
     def batch_acquire_hosts(self, host_requests):
         """Acquire hosts for a list of requests.
@@ -389,26 +566,32 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
 
         @param host_requests: A list of requests to acquire hosts.
         """
-        distinct_requests = 0
-
         logging.debug('Processing %s host acquisition requests',
                       len(host_requests))
 
+        if host_requests:
+            if self.host_index is not None:
+                self.host_index.refresh()
+            self.cache.synchronize()
         self.request_accountant = rdb_utils.RequestAccountant(host_requests)
-        # First pass tries to satisfy min_duts for each suite.
-        for request in self.request_accountant.requests:
-            to_acquire = self.request_accountant.get_min_duts(request)
-            if to_acquire > 0:
-                self._acquire_hosts(request, to_acquire,
-                                    is_acquire_min_duts=True)
-            distinct_requests += 1
-
-        # Second pass tries to allocate duts to the rest unsatisfied requests.
-        for request in self.request_accountant.requests:
-            to_acquire = self.request_accountant.get_duts(request)
-            if to_acquire > 0:
-                self._acquire_hosts(request, to_acquire,
-                                    is_acquire_min_duts=False)
+        distinct_requests = len(self.request_accountant.requests)
+        if _use_host_matching:
+            self._acquire_hosts_by_matching()
+        else:
+            # First pass tries to satisfy min_duts for each suite.
+            for request in self.request_accountant.requests:
+                to_acquire = self.request_accountant.get_min_duts(request)
+                if to_acquire > 0:
+                    self._acquire_hosts(request, to_acquire,
+                                        is_acquire_min_duts=True)
+
+            # Second pass tries to allocate duts to the rest unsatisfied
+            # requests.
+            for request in self.request_accountant.requests:
+                to_acquire = self.request_accountant.get_duts(request)
+                if to_acquire > 0:
+                    self._acquire_hosts(request, to_acquire,
+                                        is_acquire_min_duts=False)
 
         self.cache.record_stats()
         logging.debug('Host acquisition stats: distinct requests: %s, leased '
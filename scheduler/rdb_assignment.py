@@ -0,0 +1,133 @@
+"""Assignment of candidate hosts to the requests of an rdb request batch.
+
+Acquiring hosts request by request, each request takes the first unleased
+hosts matching it. When the candidate hosts of requests overlap, an earlier
+request can take the only hosts a later request could use, while hosts that
+only it could use stay idle. Eg: with r1(deps=[a]) and r2(deps=[a, b]), and
+hosts h1(a, b), h2(a), r1 may take h1 and leave r2 with nothing, though
+r1: h2, r2: h1 satisfies both.
+
+HostAssignment treats a batch as a bipartite graph between requests and
+their candidate hosts, and grows a matching one host at a time, in the order
+the caller asks for hosts. A request first takes a free candidate, if it has
+one. Otherwise it looks for an augmenting path: a chain of requests, each of
+which gives its host to the previous one and takes another candidate, ending
+with a free host. A request that gets a host never loses it again, it can
+only be moved to another of its candidates, so asking for hosts in priority
+order gives every request as many hosts as possible without taking any from
+requests asked for before it. Since the requests matchable this way form a
+transversal matroid, this greedy order also maximizes the total priority of
+the satisfied requests.
+"""
+
+import collections
+
+
+class HostAssignment(object):
+    """A matching between requests and their candidate hosts."""
+
+    def __init__(self):
+        # Candidate host ids of each request, in order of preference.
+        self._candidates = {}
+        # Index of the next candidate to check for being free.
+        self._next_candidate = {}
+        self._owners = {}
+        self._assigned = collections.defaultdict(set)
+        # Requests without augmenting paths. Augmenting other requests can't
+        # create one, so they need not be searched again.
+        self._exhausted = set()
+
+
+    def add_request(self, request, candidate_host_ids):
+        """Add a request and the hosts it can use.
+
+        @param request: A hashable request.
+        @param candidate_host_ids: A list of the ids of the hosts matching
+                the request, in the order the request prefers them.
+        """
+        self._candidates[request] = list(candidate_host_ids)
+        self._next_candidate[request] = 0
+
+
+    def _take_free_host(self, request):
+        candidates = self._candidates[request]
+        index = self._next_candidate[request]
+        # Hosts never become free again, so candidates before index are taken.
+        while index < len(candidates) and candidates[index] in self._owners:
+            index += 1
+        self._next_candidate[request] = index
+        if index == len(candidates):
+            return False
+        self._give(candidates[index], request)
+        return True
+
+
+    def _give(self, host_id, request):
+        owner = self._owners.get(host_id)
+        if owner is not None:
+            self._assigned[owner].discard(host_id)
+        self._owners[host_id] = request
+        self._assigned[request].add(host_id)
+
+
+    def _augment(self, request):
+        """Find the shortest augmenting path from the request and apply it.
+
+        @returns: True if the request got another host.
+        """
+        # For each visited host, the request that would take it.
+        taken_by = {}
+        # For each visited request but the first, the host it would give up.
+        given_up_by = {}
+        queue = collections.deque([request])
+        while queue:
+            current = queue.popleft()
+            for host_id in self._candidates[current]:
+                if host_id in taken_by:
+                    continue
+                taken_by[host_id] = current
+                owner = self._owners.get(host_id)
+                if owner is None:
+                    self._apply_path(host_id, taken_by, given_up_by)
+                    return True
+                if owner != request and owner not in given_up_by:
+                    given_up_by[owner] = host_id
+                    queue.append(owner)
+        return False
+
+
+    def _apply_path(self, host_id, taken_by, given_up_by):
+        """Move hosts along an augmenting path, starting from its free host."""
+        while host_id is not None:
+            taker = taken_by[host_id]
+            self._give(host_id, taker)
+            host_id = given_up_by.get(taker)
+
+
+    def assign(self, request, count):
+        """Assign up to count more hosts to a request.
+
+        @param request: A request added through add_request.
+        @param count: The number of additional hosts the request needs.
+
+        @returns: The number of hosts assigned.
+        """
+        assigned = 0
+        while assigned < count and request not in self._exhausted:
+            if not self._take_free_host(request) and not self._augment(request):
+                self._exhausted.add(request)
+                break
+            assigned += 1
+        return assigned
+
+
+    def get_host_ids(self, request):
+        """Get the ids of the hosts assigned to a request.
+
+        @param request: A request added through add_request.
+
+        @returns: A list of host ids, in the request's order of preference.
+        """
+        assigned = self._assigned.get(request, ())
+        return [host_id for host_id in self._candidates[request]
+                if host_id in assigned]
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+
+"""Replay rdb request batches through greedy and matching host assignment.
+
+Every batch is a list of host requests and the hosts available when it was
+made. Both strategies walk the requests of a batch the way
+AvailableHostRequestHandler.batch_acquire_hosts does, through a
+RequestAccountant, with a min_duts pass followed by a pass for the rest:
+    greedy:   each request takes its first free candidates, like
+              _acquire_hosts.
+    matching: requests are assigned hosts through rdb_assignment.
+The report is the number of hosts handed out, ie: jobs started, and the time
+spent assigning them.
+
+Batches are read from a JSON file of the form:
+    {"hosts": [{"id": 1, "labels": [1, 2], "acls": [1]}, ...],
+     "batches": [{"available_hosts": [1, ...],
+                  "requests": [{"deps": [1], "preferred_deps": [],
+                                "acls": [1], "priority": 0,
+                                "parent_job_id": 0, "suite_min_duts": 0,
+                                "count": 2}, ...]}, ...]}
+Without --batches, a synthetic lab where suites ask for boards, pools and
+extra labels of overlapping scope is generated, and can be saved with --dump
+for later replays.
+
+Usage: rdb_assignment_benchmark.py [--batches FILE] [--dump FILE]
+"""
+
+import argparse
+import json
+import random
+import time
+
+import common
+from autotest_lib.scheduler import rdb_assignment
+from autotest_lib.scheduler import rdb_requests
+from autotest_lib.scheduler import rdb_utils
+
+
+def _generate(num_hosts, num_batches, rng):
+    """Generate a synthetic lab and request batches.
+
+    @returns: A dictionary in the format of the --batches file.
+    """
+    boards = range(1, 21)
+    pools = range(21, 26)
+    extras = range(26, 46)
+    versions = range(46, 66)
+    hosts = []
+    for host_id in xrange(1, num_hosts + 1):
+        labels = [rng.choice(boards), rng.choice(pools), rng.choice(versions)]
+        labels.extend(rng.sample(extras, 3))
+        hosts.append({'id': host_id, 'labels': labels, 'acls': [1]})
+
+    batches = []
+    for _ in xrange(num_batches):
+        requests = []
+        for parent_job_id in xrange(1, 31):
+            deps = [rng.choice(boards)]
+            # Suites of wider scope overlap with the narrower ones.
+            if rng.random() < 0.7:
+                deps.append(rng.choice(pools))
+            if rng.random() < 0.4:
+                deps.append(rng.choice(extras))
+            requests.append({
+                    'deps': deps, 'preferred_deps': [rng.choice(versions)],
+                    'acls': [1], 'priority': rng.choice([10, 20, 30, 40, 50]),
+                    'parent_job_id': parent_job_id,
+                    'suite_min_duts': rng.randint(0, 2),
+                    'count': rng.randint(1, 8)})
+        available = [host['id'] for host in hosts if rng.random() < 0.3]
+        batches.append({'available_hosts': available, 'requests': requests})
+    return {'hosts': hosts, 'batches': batches}
+
+
+def _create_requests(batch):
+    requests = []
+    for spec in batch['requests']:
+        request = rdb_requests.AcquireHostRequest(
+                host_id=None, deps=spec['deps'],
+                preferred_deps=spec['preferred_deps'], acls=spec['acls'],
+                priority=spec['priority'],
+                parent_job_id=spec['parent_job_id'],
+                suite_min_duts=spec['suite_min_duts'])._request
+        requests.extend([request] * spec['count'])
+    return requests
+
+
+def _get_candidates(request, hosts):
+    """Get the ids of the matching hosts, in order of preference."""
+    matching = [host for host in hosts
+                if request.deps.issubset(host['labels']) and
+                request.acls.intersection(host['acls'])]
+    matching.sort(key=lambda host: len(request.preferred_deps.intersection(
+            host['labels'])), reverse=True)
+    return [host['id'] for host in matching]
+
+
+class _GreedyAssignment(object):
+    """Each request takes its first free candidates, like _acquire_hosts."""
+
+    def __init__(self):
+        self._candidates = {}
+        self._taken = set()
+
+
+    def add_request(self, request, candidate_host_ids):
+        self._candidates[request] = candidate_host_ids
+
+
+    def assign(self, request, count):
+        free = [host_id for host_id in self._candidates[request]
+                if host_id not in self._taken][:count]
+        self._taken.update(free)
+        return len(free)
+
+
+def _replay(batch, lab, assignment):
+    """Assign hosts to the requests of a batch.
+
+    @returns: The number of hosts assigned.
+    """
+    available = set(batch['available_hosts'])
+    hosts = [host for host in lab['hosts'] if host['id'] in available]
+    accountant = rdb_utils.RequestAccountant(_create_requests(batch))
+    for request in accountant.requests:
+        assignment.add_request(request, _get_candidates(request, hosts))
+    assigned = 0
+    for request in accountant.requests:
+        to_acquire = accountant.get_min_duts(request)
+        if to_acquire > 0:
+            assigned += assignment.assign(request, to_acquire)
+    for request in accountant.requests:
+        to_acquire = accountant.get_duts(request)
+        if to_acquire > 0:
+            assigned += assignment.assign(request, to_acquire)
+    return assigned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batches',
+                        help='JSON file of recorded request batches.')
+    parser.add_argument('--dump',
+                        help='Save the synthetic batches to this file.')
+    parser.add_argument('--hosts', type=int, default=2000,
+                        help='Number of hosts in the synthetic lab.')
+    parser.add_argument('--num_batches', type=int, default=20,
+                        help='Number of synthetic request batches.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic lab.')
+    args = parser.parse_args()
+
+    if args.batches:
+        with open(args.batches) as batches_file:
+            lab = json.load(batches_file)
+    else:
+        lab = _generate(args.hosts, args.num_batches, random.Random(args.seed))
+        if args.dump:
+            with open(args.dump, 'w') as dump_file:
+                json.dump(lab, dump_file)
+
+    requested = sum(spec['count'] for batch in lab['batches']
+                    for spec in batch['requests'])
+    print '%d batches, %d hosts requested' % (len(lab['batches']), requested)
+    for name, assignment_class in (
+            ('greedy', _GreedyAssignment),
+            ('matching', rdb_assignment.HostAssignment)):
+        assigned = 0
+        duration = 0
+        for batch in lab['batches']:
+            start = time.time()
+            assigned += _replay(batch, lab, assignment_class())
+            duration += time.time() - start
+        print '%-9s jobs started: %6d  (%.1f/batch)  %8.2f ms/batch' % (
+                name, assigned, float(assigned) / len(lab['batches']),
+                duration * 1000 / len(lab['batches']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+
+import unittest
+
+import common
+from autotest_lib.scheduler import rdb_assignment
+
+
+class HostAssignmentTests(unittest.TestCase):
+    """Tests for rdb_assignment.HostAssignment."""
+
+    def setUp(self):
+        self.assignment = rdb_assignment.HostAssignment()
+
+
+    def testFreeHostsInPreferredOrder(self):
+        """Requests take free candidates in the order they prefer them."""
+        self.assignment.add_request('r1', [3, 1, 2])
+        self.assertEqual(2, self.assignment.assign('r1', 2))
+        self.assertEqual([3, 1], self.assignment.get_host_ids('r1'))
+        self.assertEqual(1, self.assignment.assign('r1', 5))
+        self.assertEqual([3, 1, 2], self.assignment.get_host_ids('r1'))
+
+
+    def testAugmentingPathMovesEarlierRequests(self):
+        """A later request gets a host by moving an earlier one."""
+        # r1 prefers h1, the only host r2 can use.
+        self.assignment.add_request('r1', [1, 2])
+        self.assignment.add_request('r2', [1])
+        self.assertEqual(1, self.assignment.assign('r1', 1))
+        self.assertEqual([1], self.assignment.get_host_ids('r1'))
+        self.assertEqual(1, self.assignment.assign('r2', 1))
+        self.assertEqual([2], self.assignment.get_host_ids('r1'))
+        self.assertEqual([1], self.assignment.get_host_ids('r2'))
+
+
+    def testLongAugmentingPath(self):
+        """Hosts move along a chain of requests."""
+        self.assignment.add_request('r1', [1, 2])
+        self.assignment.add_request('r2', [2, 3])
+        self.assignment.add_request('r3', [3, 4])
+        self.assignment.add_request('r4', [1])
+        for request in ('r1', 'r2', 'r3'):
+            self.assertEqual(1, self.assignment.assign(request, 1))
+        self.assertEqual(1, self.assignment.assign('r4', 1))
+        self.assertEqual({'r1': [2], 'r2': [3], 'r3': [4], 'r4': [1]},
+                         dict((request, self.assignment.get_host_ids(request))
+                              for request in ('r1', 'r2', 'r3', 'r4')))
+
+
+    def testEarlierRequestsKeepTheirHosts(self):
+        """Requests never lose hosts to requests asked for after them."""
+        self.assignment.add_request('r1', [1])
+        self.assignment.add_request('r2', [1])
+        self.assertEqual(1, self.assignment.assign('r1', 1))
+        self.assertEqual(0, self.assignment.assign('r2', 1))
+        self.assertEqual([1], self.assignment.get_host_ids('r1'))
+        self.assertEqual([], self.assignment.get_host_ids('r2'))
+        # A request without an augmenting path stays without one.
+        self.assertEqual(0, self.assignment.assign('r2', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -73,6 +73,22 @@ Note that in the last case, even though the cache returns hosts that
 have already been assigned to request2, request3 cannot use them. This is
 acceptable because the number of hosts we lease per tick is << the number
 of requests, so it's faster to check leased bits real time than query for hosts.
+
+Cross tick caching: With RDB.cache_across_ticks set, condition 3 is relaxed
+and the lines of all request batches share a CrossTickCacheBackend, so a
+line populated in one tick can satisfy requests in the following ticks. For
+this to be correct the lines must always hold all the available hosts that
+match their key, which the backend ensures through invalidation:
+1. Hosts leased by the rdb are removed from every line as they are leased.
+2. At the start of every batch, the backend synchronizes with the database:
+   a. Cached hosts that are now leased, locked or invalid, eg: because they
+      were leased for a frontend task, are removed from their lines.
+   b. Hosts that became available since the last batch, eg: hosts released
+      by the host scheduler or unlocked, invalidate the lines matching them.
+   c. Hosts whose labels or acls changed invalidate the lines they are in,
+      and the lines matching their new labels and acls.
+Invalidated lines are deleted, so the next request for their key queries
+the database again.
 """
 
 
@@ -81,8 +97,10 @@ import collections
 import logging
 
 import common
+from django.db.models import Count, Max, Q
 from autotest_lib.client.common_lib.cros.graphite import autotest_stats
 from autotest_lib.client.common_lib.global_config import global_config
+from autotest_lib.frontend.afe import models
 from autotest_lib.scheduler import rdb_utils
 
 MEMOIZE_KEY = 'memoized_hosts'
@@ -187,6 +205,179 @@ class InMemoryCacheBackend(CacheBackend):
     def has_key(self, key):
         return key in self._cache
 
+class _MembershipTracker(object):
+    """Finds the hosts whose rows in a host many-to-many table changed."""
+
+    def __init__(self, through_model, group_field, get_host_groups):
+        """
+        @param through_model: The model of the many-to-many table.
+        @param group_field: The name of the label/acl column of the table.
+        @param get_host_groups: A function returning the ids of the labels/acls
+                of a cached host.
+        """
+        self._objects = through_model.objects
+        self._group_field = group_field
+        self._get_host_groups = get_host_groups
+        self._row_count = None
+        self._max_row_id = None
+
+
+    def get_changed_host_ids(self, cached_hosts):
+        """Find the hosts whose rows changed since the last call.
+
+        Rows added since the last call are found through their ids. Deleted
+        rows leave no trace, so if any were deleted the rows of the cached
+        hosts are compared with the cached hosts themselves. Changes to
+        hosts that aren't cached can't make a line hold a host it shouldn't.
+
+        @param cached_hosts: A dictionary mapping the id of each cached host
+                to the host.
+
+        @return: A set of host ids.
+        """
+        stats = self._objects.aggregate(row_count=Count('id'),
+                                        max_row_id=Max('id'))
+        last_row_count, last_max_row_id = self._row_count, self._max_row_id
+        self._row_count = stats['row_count']
+        self._max_row_id = stats['max_row_id']
+        if (last_row_count is None or
+                (last_row_count, last_max_row_id) ==
+                (stats['row_count'], stats['max_row_id'])):
+            return set()
+
+        new_row_host_ids = list(self._objects.filter(
+                id__gt=last_max_row_id or 0).values_list('host', flat=True))
+        changed_host_ids = set(new_row_host_ids)
+        if last_row_count + len(new_row_host_ids) == stats['row_count']:
+            return changed_host_ids
+        # Rows were deleted as well.
+        host_groups = collections.defaultdict(set)
+        for host_id, group_id in self._objects.filter(
+                host__in=cached_hosts.keys()).values_list(
+                        'host', self._group_field):
+            host_groups[host_id].add(group_id)
+        changed_host_ids.update(
+                host_id for host_id, host in cached_hosts.iteritems()
+                if set(self._get_host_groups(host)) != host_groups[host_id])
+        return changed_host_ids
+
+
+class CrossTickCacheBackend(InMemoryCacheBackend):
+    """In memory cache backend whose lines are shared by request batches.
+
+    Lines are sets of hosts keyed on (deps, acls), as set by the cache
+    manager. The backend keeps track of the lines each host is in, and
+    invalidates lines as described in the module docstring.
+    """
+
+    def __init__(self):
+        super(CrossTickCacheBackend, self).__init__()
+        self._keys_by_host_id = collections.defaultdict(set)
+        self._unavailable_host_ids = None
+        self._label_tracker = _MembershipTracker(
+                models.Host.labels.through, 'label', lambda host: host.labels)
+        self._acl_tracker = _MembershipTracker(
+                models.AclGroup.hosts.through, 'aclgroup',
+                lambda host: host.acls)
+
+
+    def set(self, key, value):
+        if self.has_key(key):
+            self.delete(key)
+        super(CrossTickCacheBackend, self).set(key, value)
+        for host in value:
+            self._keys_by_host_id[host.id].add(key)
+
+
+    def delete(self, key):
+        for host in self._cache.pop(key):
+            keys = self._keys_by_host_id[host.id]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_host_id[host.id]
+
+
+    def remove_hosts(self, host_ids):
+        """Remove hosts from the lines they are in.
+
+        The lines stay valid, since the hosts are no longer available.
+
+        @param host_ids: An iterable of host ids.
+        """
+        for host_id in host_ids:
+            for key in self._keys_by_host_id.pop(host_id, ()):
+                self._cache[key] = set(host for host in self._cache[key]
+                                       if host.id != host_id)
+
+
+    def invalidate_hosts(self, host_ids):
+        """Delete the lines that hold, or should hold, any of the hosts.
+
+        @param host_ids: A collection of ids of available hosts.
+
+        @return: The number of lines deleted.
+        """
+        if not host_ids or not self._cache:
+            return 0
+        host_labels = collections.defaultdict(set)
+        for host_id, label_id in models.Host.labels.through.objects.filter(
+                host__in=host_ids).values_list('host', 'label'):
+            host_labels[host_id].add(label_id)
+        host_acls = collections.defaultdict(set)
+        for host_id, acl_id in models.AclGroup.hosts.through.objects.filter(
+                host__in=host_ids).values_list('host', 'aclgroup'):
+            host_acls[host_id].add(acl_id)
+
+        keys = set()
+        for host_id in host_ids:
+            keys.update(self._keys_by_host_id.get(host_id, ()))
+        for key in self._cache:
+            if any(key.deps.issubset(host_labels[host_id]) and
+                   key.acls.intersection(host_acls[host_id])
+                   for host_id in host_ids):
+                keys.add(key)
+        for key in keys:
+            self.delete(key)
+        return len(keys)
+
+
+    def synchronize(self):
+        """Invalidate the lines affected by host changes since the last call.
+
+        @return: The number of lines deleted.
+        """
+        unavailable_host_ids = set(models.Host.objects.filter(
+                Q(leased=True) | Q(locked=True) | Q(invalid=True)).values_list(
+                        'id', flat=True))
+        cached_hosts = {}
+        for line in self._cache.itervalues():
+            for host in line:
+                cached_hosts[host.id] = host
+        self.remove_hosts(unavailable_host_ids.intersection(cached_hosts))
+
+        changed_host_ids = set()
+        if self._unavailable_host_ids is not None:
+            changed_host_ids.update(
+                    self._unavailable_host_ids - unavailable_host_ids)
+        self._unavailable_host_ids = unavailable_host_ids
+        changed_host_ids.update(
+                self._label_tracker.get_changed_host_ids(cached_hosts))
+        changed_host_ids.update(
+                self._acl_tracker.get_changed_host_ids(cached_hosts))
+        return self.invalidate_hosts(changed_host_ids - unavailable_host_ids)
+
+
+_cross_tick_backend = None
+
+
+def _get_cross_tick_backend():
+    """Get the cache backend shared by all request batches."""
+    global _cross_tick_backend
+    if _cross_tick_backend is None:
+        _cross_tick_backend = CrossTickCacheBackend()
+    return _cross_tick_backend
+
+
 # TODO: Implement a MemecacheBackend, invalidate when unleasing a host, refactor
 # the AcquireHostRequest to contain a core of (deps, acls) that we can use as
 # the key for population and invalidation. The caching manager is still valid,
@@ -198,13 +389,36 @@ class RDBHostCacheManager(object):
     key = collections.namedtuple('key', ['deps', 'acls'])
     use_cache = global_config.get_config_value(
             'RDB', 'use_cache', type=bool, default=True)
+    cache_across_ticks = global_config.get_config_value(
+            'RDB', 'cache_across_ticks', type=bool, default=False)
 
     def __init__(self):
-        self._cache_backend = (InMemoryCacheBackend()
-                               if self.use_cache else DummyCacheBackend())
+        self._across_ticks = self.use_cache and self.cache_across_ticks
+        if self._across_ticks:
+            self._cache_backend = _get_cross_tick_backend()
+        elif self.use_cache:
+            self._cache_backend = InMemoryCacheBackend()
+        else:
+            self._cache_backend = DummyCacheBackend()
         self.hits = 0
         self.misses = 0
         self.stale_entries = []
+        self.invalidated_lines = 0
+
+
+    def synchronize(self):
+        """Invalidate lines cached by earlier batches that are now stale."""
+        if self._across_ticks:
+            self.invalidated_lines += self._cache_backend.synchronize()
+
+
+    def remove_hosts(self, host_ids):
+        """Remove leased hosts from lines cached for later batches.
+
+        @param host_ids: The ids of the leased hosts.
+        """
+        if self._across_ticks:
+            self._cache_backend.remove_hosts(host_ids)
 
 
     def mean_staleness(self):
@@ -237,6 +451,11 @@ class RDBHostCacheManager(object):
                 'cache.hit_ratio', hit_ratio)
         autotest_stats.Gauge(rdb_utils.RDB_STATS_KEY).send(
                 'cache.stale_entries', staleness)
+        if self._across_ticks:
+            logging.debug('Cache stats: invalidated lines: %d.',
+                          self.invalidated_lines)
+            autotest_stats.Gauge(rdb_utils.RDB_STATS_KEY).send(
+                    'cache.invalidated_lines', self.invalidated_lines)
 
 
     @classmethod
@@ -339,3 +339,100 @@ class RDBCacheTest(test_utils.AbstractBaseRDBTester, unittest.TestCase):
                            'get_response', local_get_response)
         self.check_hosts(rdb_lib.acquire_hosts(queue_entries))
 
+
+
+class CrossTickCacheTest(test_utils.AbstractBaseRDBTester, unittest.TestCase):
+    """Unittests for caching hosts across request batches."""
+
+    def setUp(self):
+        super(CrossTickCacheTest, self).setUp()
+        self.god.stub_with(rdb_cache_manager.RDBHostCacheManager,
+                           'cache_across_ticks', True)
+        self.god.stub_with(rdb_cache_manager, '_cross_tick_backend', None)
+        self.hosts = [
+                self.db_helper.create_host(
+                        'h%s' % i, **test_utils.get_default_host_params())
+                for i in range(0, 3)]
+        cache = rdb_cache_manager.RDBHostCacheManager()
+        cache.synchronize()
+        self.key = cache.get_key(
+                [label.id for label in self.db_helper.get_labels(
+                        name__in=test_utils.DEFAULT_DEPS)],
+                [acl.id for acl in self.db_helper.get_acls(
+                        name__in=test_utils.DEFAULT_ACLS)])
+        self._cache_matching_hosts(cache)
+
+
+    def _cache_matching_hosts(self, cache):
+        hosts = rdb.AvailableHostQueryManager().find_hosts(self.key.deps,
+                                                           self.key.acls)
+        cache.set_line(self.key, hosts)
+        self.assertEqual(len(hosts), len(cache._cache_backend.get(self.key)))
+
+
+    def _get_line_of_next_batch(self):
+        """Get the cached hosts as the next batch would, and cache them again.
+
+        @return: A tuple of the cache manager of the batch and the sorted
+                hostnames of the cached hosts, or None on a cache miss.
+        """
+        cache = rdb_cache_manager.RDBHostCacheManager()
+        cache.synchronize()
+        try:
+            line = cache.get_line(self.key)
+        except rdb_utils.CacheMiss:
+            return cache, None
+        cache.set_line(self.key, line)
+        return cache, sorted(host.hostname for host in line)
+
+
+    def _update_host(self, host, **kwargs):
+        self.db_helper.get_host(id=host.id).update(**kwargs)
+
+
+    def testLinesOutliveBatches(self):
+        """Lines cached by a batch satisfy the next one."""
+        cache, hostnames = self._get_line_of_next_batch()
+        self.assertEqual(['h0', 'h1', 'h2'], hostnames)
+        self.assertEqual((1, 0, 0),
+                         (cache.hits, cache.misses, cache.invalidated_lines))
+
+
+    def testUnavailableHostsAreRemoved(self):
+        """Leased and locked hosts are removed from lines, but lines stay."""
+        self._update_host(self.hosts[0], leased=1)
+        self._update_host(self.hosts[1], locked=1)
+        cache, hostnames = self._get_line_of_next_batch()
+        self.assertEqual(['h2'], hostnames)
+        self.assertEqual(0, cache.invalidated_lines)
+
+        cache.remove_hosts([self.hosts[2].id])
+        cache, hostnames = self._get_line_of_next_batch()
+        self.assertEqual([], hostnames)
+
+
+    def testAvailableHostsInvalidateLines(self):
+        """Released and unlocked hosts invalidate the lines they match."""
+        self._update_host(self.hosts[0], leased=1)
+        self._update_host(self.hosts[1], locked=1)
+        self.assertEqual(['h2'], self._get_line_of_next_batch()[1])
+
+        self._update_host(self.hosts[0], leased=0)
+        cache, hostnames = self._get_line_of_next_batch()
+        self.assertIsNone(hostnames)
+        self.assertEqual(1, cache.invalidated_lines)
+
+
+    def testMembershipChangesInvalidateLines(self):
+        """New matching hosts and hosts losing labels invalidate lines."""
+        self.db_helper.create_host('h3',
+                                   **test_utils.get_default_host_params())
+        self.assertIsNone(self._get_line_of_next_batch()[1])
+
+        self._cache_matching_hosts(rdb_cache_manager.RDBHostCacheManager())
+        self.assertEqual(['h0', 'h1', 'h2', 'h3'],
+                         self._get_line_of_next_batch()[1])
+
+        self.hosts[0].labels.remove(self.db_helper.get_labels(
+                name=test_utils.DEFAULT_DEPS[0])[0])
+        self.assertIsNone(self._get_line_of_next_batch()[1])
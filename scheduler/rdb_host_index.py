@@ -0,0 +1,233 @@
+"""In-memory index of the labels and acls of hosts, for the rdb.
+
+The rdb looks for hosts matching a set of deps (every one of which the host
+must have) and acls (at least one of which the host must be in), and ranks
+the matching hosts by the number of preferred deps they have. Without an
+index, every distinct (deps, acls) pair of a tick costs a query joining the
+host, label and acl tables.
+
+The HostIndex keeps one bitset per label and one per acl group, in which bit
+N is set if the host with id N is a member, plus bitsets of the valid and of
+the available (unleased and unlocked) hosts. Bitsets are python longs, so a
+query is a handful of bitwise ands and ors over at most max(host id) bits.
+
+The index is refreshed once per rdb request batch:
+1. The leased/locked/invalid bits of all hosts are read with one query over
+   the host table, since they change on almost every tick.
+2. The label and acl membership tables are only read again if their row
+   count or highest row id changed. If the only change is new rows, just the
+   new rows are read, otherwise the memberships of that table are rebuilt.
+
+Matching host ids are only candidates: clients still read the hosts
+themselves from the database, which rechecks their leased bit.
+"""
+
+import binascii
+import collections
+
+import common
+from django.db.models import Count, Max
+from autotest_lib.client.common_lib.cros.graphite import autotest_stats
+from autotest_lib.client.common_lib.global_config import global_config
+from autotest_lib.frontend.afe import models
+from autotest_lib.scheduler import rdb_utils
+
+
+_timer = autotest_stats.Timer(rdb_utils.RDB_STATS_KEY + '.host_index')
+
+use_host_index = global_config.get_config_value(
+        'RDB', 'use_host_index', type=bool, default=False)
+
+
+def bits_from_ids(ids):
+    """Get the bitset of a collection of ids.
+
+    @param ids: An iterable of non-negative integers.
+
+    @returns: A long with the bits at the given positions set.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    bits = bytearray((max(ids) >> 3) + 1)
+    for bit in ids:
+        bits[bit >> 3] |= 1 << (bit & 7)
+    bits.reverse()
+    return long(binascii.hexlify(bits), 16)
+
+
+def ids_from_bits(bits):
+    """Get the positions of the bits set in a bitset.
+
+    @param bits: A bitset, as returned by bits_from_ids.
+
+    @returns: A list of the positions of the set bits, in increasing order.
+    """
+    ids = []
+    if not bits:
+        return ids
+    # Least significant bit first, without the '0b' prefix.
+    digits = bin(bits)[:1:-1]
+    bit = digits.find('1')
+    while bit != -1:
+        ids.append(bit)
+        bit = digits.find('1', bit + 1)
+    return ids
+
+
+class _MembershipIndex(object):
+    """Bitsets of the member hosts of each group in a many-to-many table."""
+
+    def __init__(self, through_model, host_field, group_field):
+        """
+        @param through_model: The model of the many-to-many table.
+        @param host_field: The name of the host column of the table.
+        @param group_field: The name of the label/acl column of the table.
+        """
+        self._objects = through_model.objects
+        self._fields = (host_field, group_field)
+        self._bits = {}
+        self._row_count = 0
+        self._max_row_id = None
+
+
+    def _add_rows(self, rows):
+        """Add (host id, group id) rows to the bitsets."""
+        hosts_by_group = collections.defaultdict(list)
+        for host_id, group_id in rows:
+            hosts_by_group[group_id].append(host_id)
+        for group_id, host_ids in hosts_by_group.iteritems():
+            self._bits[group_id] = (self._bits.get(group_id, 0) |
+                                    bits_from_ids(host_ids))
+
+
+    def refresh(self):
+        """Bring the bitsets up to date with the table.
+
+        @returns: True if the bitsets changed.
+        """
+        stats = self._objects.aggregate(row_count=Count('id'),
+                                        max_row_id=Max('id'))
+        if (stats['row_count'] == self._row_count and
+                stats['max_row_id'] == self._max_row_id):
+            return False
+        new_rows = None
+        if self._max_row_id is not None:
+            new_rows = list(self._objects.filter(
+                    id__gt=self._max_row_id).values_list(*self._fields))
+            if self._row_count + len(new_rows) != stats['row_count']:
+                # Rows were also deleted, the new rows are not enough.
+                new_rows = None
+        if new_rows is None:
+            self._bits = {}
+            new_rows = self._objects.values_list(*self._fields)
+        self._add_rows(new_rows)
+        self._row_count = stats['row_count']
+        self._max_row_id = stats['max_row_id']
+        return True
+
+
+    def get_bits(self, group_id):
+        """Get the bitset of the hosts in a group.
+
+        @param group_id: The id of the label/acl.
+        """
+        return self._bits.get(group_id, 0)
+
+
+class HostIndex(object):
+    """Bitset index answering rdb host queries without joins."""
+
+    def __init__(self):
+        self._labels = _MembershipIndex(models.Host.labels.through,
+                                        'host', 'label')
+        self._acls = _MembershipIndex(models.AclGroup.hosts.through,
+                                      'host', 'aclgroup')
+        self._valid_bits = 0
+        self._available_bits = 0
+
+
+    @_timer.decorate
+    def refresh(self):
+        """Bring the index up to date with the database."""
+        valid_ids = []
+        available_ids = []
+        for host_id, invalid, leased, locked in models.Host.objects.values_list(
+                'id', 'invalid', 'leased', 'locked'):
+            if invalid:
+                continue
+            valid_ids.append(host_id)
+            if not leased and not locked:
+                available_ids.append(host_id)
+        self._valid_bits = bits_from_ids(valid_ids)
+        self._available_bits = bits_from_ids(available_ids)
+        self._labels.refresh()
+        self._acls.refresh()
+
+
+    def mark_leased(self, host_ids):
+        """Record that hosts were leased since the last refresh.
+
+        @param host_ids: The ids of the leased hosts.
+        """
+        self._available_bits &= ~bits_from_ids(host_ids)
+
+
+    def _match(self, deps, acls, available_only):
+        """Get the bitset of the valid hosts matching deps and acls."""
+        bits = self._available_bits if available_only else self._valid_bits
+        for dep in deps:
+            if not bits:
+                return 0
+            bits &= self._labels.get_bits(dep)
+        acl_bits = 0
+        for acl in acls:
+            acl_bits |= self._acls.get_bits(acl)
+        return bits & acl_bits
+
+
+    def find_host_ids(self, deps, acls, available_only=False):
+        """Find the valid hosts with all the deps and at least one acl.
+
+        @param deps: An iterable of label ids.
+        @param acls: An iterable of acl group ids.
+        @param available_only: If True, only match unleased, unlocked hosts.
+
+        @returns: A list of host ids, in increasing order.
+        """
+        return ids_from_bits(self._match(deps, acls, available_only))
+
+
+    def count_preferred_deps(self, host_ids, preferred_deps):
+        """Count the preferred deps of each of a group of hosts.
+
+        @param host_ids: An iterable of host ids.
+        @param preferred_deps: An iterable of label ids.
+
+        @returns: A dictionary mapping each host id to the number of
+                preferred deps the host has.
+        """
+        host_ids = list(host_ids)
+        counts = dict.fromkeys(host_ids, 0)
+        host_bits = bits_from_ids(host_ids)
+        for dep in set(preferred_deps):
+            for host_id in ids_from_bits(host_bits &
+                                         self._labels.get_bits(dep)):
+                counts[host_id] += 1
+        return counts
+
+
+_host_index = None
+
+
+def get_host_index():
+    """Get the index shared by all rdb requests of this process.
+
+    @returns: A HostIndex, or None if the index is disabled.
+    """
+    global _host_index
+    if not use_host_index:
+        return None
+    if _host_index is None:
+        _host_index = HostIndex()
+    return _host_index
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+"""Benchmark rdb host lookups with and without the host index.
+
+Fills an in-memory test database with a synthetic lab, where every host has
+a board, a pool, a cros-version and a few other labels and is in one or two
+acl groups. Then runs a set of distinct (deps, acls) queries, like the ones
+of a busy tick, and reports the time spent matching hosts and ranking them
+by preferred deps:
+    sql:   the joined query of BaseHostQueryManager.find_hosts, and ranking
+           by the label sets of the hosts.
+    index: HostIndex.find_host_ids and HostIndex.count_preferred_deps.
+
+Usage: rdb_host_index_benchmark.py [--hosts 10000] [--labels 2000]
+"""
+
+import argparse
+import random
+import time
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import setup_test_environment
+from autotest_lib.frontend.afe import models
+from autotest_lib.scheduler import rdb_host_index
+from django.db.models import Q
+
+
+_BOARDS = 50
+_POOLS = 10
+_VERSIONS = 100
+_ACLS = 20
+_OTHER_LABELS_PER_HOST = 8
+
+
+def _create_lab(num_hosts, num_labels, rng):
+    """Create the hosts, labels and acls of the lab.
+
+    @returns: A tuple (boards, pools, versions, acls) of lists of ids.
+    """
+    models.Label.objects.bulk_create(
+            [models.Label(name='label%d' % i) for i in xrange(num_labels)])
+    label_ids = list(models.Label.objects.values_list('id', flat=True))
+    boards = label_ids[:_BOARDS]
+    pools = label_ids[_BOARDS:_BOARDS + _POOLS]
+    versions = label_ids[_BOARDS + _POOLS:_BOARDS + _POOLS + _VERSIONS]
+    others = label_ids[_BOARDS + _POOLS + _VERSIONS:]
+
+    models.AclGroup.objects.bulk_create(
+            [models.AclGroup(name='acl%d' % i) for i in xrange(_ACLS)])
+    acl_ids = list(models.AclGroup.objects.values_list('id', flat=True))
+
+    models.Host.objects.bulk_create(
+            [models.Host(hostname='host%d' % i, leased=rng.random() < 0.5)
+             for i in xrange(num_hosts)])
+    host_labels = []
+    host_acls = []
+    HostLabel = models.Host.labels.through
+    HostAcl = models.AclGroup.hosts.through
+    for host_id in models.Host.objects.values_list('id', flat=True):
+        labels = set([rng.choice(boards), rng.choice(pools),
+                      rng.choice(versions)])
+        labels.update(rng.sample(others, min(len(others),
+                                             _OTHER_LABELS_PER_HOST)))
+        host_labels.extend(HostLabel(host_id=host_id, label_id=label_id)
+                           for label_id in labels)
+        host_acls.extend(HostAcl(host_id=host_id, aclgroup_id=acl_id)
+                         for acl_id in rng.sample(acl_ids, rng.randint(1, 2)))
+    HostLabel.objects.bulk_create(host_labels)
+    HostAcl.objects.bulk_create(host_acls)
+    return boards, pools, versions, acl_ids
+
+
+def _sql_lookup(deps, acls, preferred_deps):
+    hosts = models.Host.leased_objects.filter(invalid=0)
+    for query in [Q(labels__id=dep) for dep in deps] + [
+            Q(aclgroup__id__in=acls)]:
+        hosts = hosts.filter(query)
+    host_ids = set(hosts.values_list('id', flat=True))
+    # find_hosts hands out hosts with their labels, rank them by those.
+    host_labels = {}
+    for host_id, label_id in models.Host.labels.through.objects.filter(
+            host__in=host_ids).values_list('host', 'label'):
+        host_labels.setdefault(host_id, []).append(label_id)
+    return sorted(host_ids, key=lambda host_id: len(
+            set(preferred_deps) & set(host_labels[host_id])), reverse=True)
+
+
+def _index_lookup(index, deps, acls, preferred_deps):
+    host_ids = index.find_host_ids(deps, acls, available_only=True)
+    counts = index.count_preferred_deps(host_ids, preferred_deps)
+    return sorted(host_ids, key=lambda host_id: counts[host_id], reverse=True)
+
+
+def _time_queries(lookup, queries):
+    start = time.time()
+    results = [lookup(*query) for query in queries]
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hosts', type=int, default=10000,
+                        help='Number of hosts in the lab.')
+    parser.add_argument('--labels', type=int, default=2000,
+                        help='Number of labels in the lab.')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of distinct (deps, acls) queries.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic lab.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    setup_test_environment.set_up()
+    print 'Creating %d hosts with %d labels...' % (args.hosts, args.labels)
+    boards, pools, versions, acl_ids = _create_lab(args.hosts, args.labels,
+                                                   rng)
+    queries = [([rng.choice(boards), rng.choice(pools)],
+                rng.sample(acl_ids, 3), [rng.choice(versions)])
+               for _ in xrange(args.queries)]
+
+    index = rdb_host_index.HostIndex()
+    start = time.time()
+    index.refresh()
+    print 'index first refresh: %8.2f ms' % ((time.time() - start) * 1000)
+    start = time.time()
+    index.refresh()
+    print 'index refresh:       %8.2f ms' % ((time.time() - start) * 1000)
+
+    sql_time, sql_results = _time_queries(_sql_lookup, queries)
+    index_time, index_results = _time_queries(
+            lambda *query: _index_lookup(index, *query), queries)
+    # Ties may be ordered differently, but the hosts must be the same.
+    assert ([sorted(result) for result in sql_results] ==
+            [sorted(result) for result in index_results])
+    for name, total in (('sql', sql_time), ('index', index_time)):
+        print '%-6s %8.2f ms total  %8.3f ms/query' % (
+                name, total * 1000, total * 1000 / len(queries))
+    setup_test_environment.tear_down()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+import unittest
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend.afe import frontend_test_utils
+from autotest_lib.scheduler import rdb
+from autotest_lib.scheduler import rdb_host_index
+from autotest_lib.scheduler import rdb_testing_utils
+
+
+class BitsetTests(unittest.TestCase):
+    """Tests for the bitset helpers."""
+
+    def testRoundTrip(self):
+        """Bitsets hold exactly the ids they were built from."""
+        ids = [0, 1, 7, 8, 63, 64, 65, 1000]
+        bits = rdb_host_index.bits_from_ids(reversed(ids))
+        self.assertEqual(sum(1 << bit for bit in ids), bits)
+        self.assertEqual(ids, rdb_host_index.ids_from_bits(bits))
+        self.assertEqual(0, rdb_host_index.bits_from_ids([]))
+        self.assertEqual([], rdb_host_index.ids_from_bits(0))
+
+
+class HostIndexTests(unittest.TestCase,
+                     frontend_test_utils.FrontendTestMixin):
+    """Tests for rdb_host_index.HostIndex."""
+
+    def setUp(self):
+        self.db_helper = rdb_testing_utils.DBHelper()
+        self._database = self.db_helper.database
+        self._frontend_common_setup(fill_data=False)
+        self.index = rdb_host_index.HostIndex()
+
+
+    def tearDown(self):
+        self._database.disconnect()
+        self._frontend_common_teardown()
+
+
+    def _label_ids(self, *names):
+        return [self.db_helper.create_label(name).id for name in names]
+
+
+    def _acl_ids(self, *names):
+        return [self.db_helper.create_acl_group(name).id for name in names]
+
+
+    def testFindHostIds(self):
+        """Hosts need every dep and any acl, available hosts are unleased."""
+        h1 = self.db_helper.create_host('h1', deps=set(['a', 'b']),
+                                        acls=set(['acl1']))
+        h2 = self.db_helper.create_host('h2', deps=set(['a']),
+                                        acls=set(['acl2']))
+        h3 = self.db_helper.create_host('h3', deps=set(['a', 'b']),
+                                        acls=set(['acl2']), leased=1)
+        self.index.refresh()
+
+        a, b = self._label_ids('a', 'b')
+        acl1, acl2 = self._acl_ids('acl1', 'acl2')
+        self.assertEqual([h1.id, h2.id, h3.id],
+                         self.index.find_host_ids([a], [acl1, acl2]))
+        self.assertEqual([h1.id, h3.id],
+                         self.index.find_host_ids([a, b], [acl1, acl2]))
+        self.assertEqual([h1.id],
+                         self.index.find_host_ids([a, b], [acl1, acl2],
+                                                  available_only=True))
+        self.assertEqual([h2.id, h3.id],
+                         self.index.find_host_ids([a], [acl2]))
+        self.assertEqual([], self.index.find_host_ids([a], []))
+
+        self.index.mark_leased([h1.id])
+        self.assertEqual([], self.index.find_host_ids([a, b], [acl1],
+                                                      available_only=True))
+
+
+    def testRefreshSeesMembershipChanges(self):
+        """Added and removed labels and acls show up after a refresh."""
+        h1 = self.db_helper.create_host('h1', deps=set(['a']),
+                                        acls=set(['acl1']))
+        self.index.refresh()
+        a, b = self._label_ids('a', 'b')
+        acl1, acl2 = self._acl_ids('acl1', 'acl2')
+        self.assertEqual([], self.index.find_host_ids([b], [acl1]))
+
+        # Additions only.
+        self.db_helper.add_labels_to_host(h1, label_names=set(['b']))
+        h2 = self.db_helper.create_host('h2', deps=set(['b']),
+                                        acls=set(['acl2']))
+        self.index.refresh()
+        self.assertEqual([h1.id], self.index.find_host_ids([a, b], [acl1]))
+        self.assertEqual([h1.id, h2.id],
+                         self.index.find_host_ids([b], [acl1, acl2]))
+
+        # Removals, with an addition that keeps the row count unchanged.
+        h1.labels.remove(self.db_helper.get_labels(name='a')[0])
+        self.db_helper.add_labels_to_host(h2, label_names=set(['a']))
+        self.db_helper.get_acls(name='acl2')[0].hosts.remove(h2)
+        self.index.refresh()
+        self.assertEqual([], self.index.find_host_ids([a], [acl1]))
+        self.assertEqual([h1.id], self.index.find_host_ids([b], [acl1, acl2]))
+        self.db_helper.add_host_to_aclgroup(h2, aclgroup_names=set(['acl1']))
+        self.index.refresh()
+        self.assertEqual([h2.id], self.index.find_host_ids([a, b], [acl1]))
+
+        # Host state changes.
+        self.db_helper.get_host(id=h1.id).update(locked=1)
+        self.index.refresh()
+        self.assertEqual([h1.id, h2.id],
+                         self.index.find_host_ids([b], [acl1]))
+        self.assertEqual([h2.id], self.index.find_host_ids(
+                [b], [acl1], available_only=True))
+
+
+    def testCountPreferredDeps(self):
+        """Preferred deps are counted per host."""
+        h1 = self.db_helper.create_host('h1', deps=set(['a', 'b', 'c']))
+        h2 = self.db_helper.create_host('h2', deps=set(['a']))
+        h3 = self.db_helper.create_host('h3', deps=set(['c']))
+        self.index.refresh()
+        a, b, c = self._label_ids('a', 'b', 'c')
+        self.assertEqual({h1.id: 2, h2.id: 1, h3.id: 0},
+                         self.index.count_preferred_deps(
+                                 [h1.id, h2.id, h3.id], [a, b, b]))
+
+
+    def testQueryManagerUsesIndex(self):
+        """Query managers with an index find the same hosts as without."""
+        deps = set(['a', 'b'])
+        acls = set(['acl1'])
+        self.db_helper.create_host('h1', deps=deps, acls=acls)
+        self.db_helper.create_host('h2', deps=deps, acls=acls, leased=1)
+        self.db_helper.create_host('h3', deps=set(['a']), acls=acls)
+        self.index.refresh()
+        dep_ids = self._label_ids(*deps)
+        acl_ids = self._acl_ids(*acls)
+        for manager_class in (rdb.BaseHostQueryManager,
+                              rdb.AvailableHostQueryManager):
+            expected = manager_class().find_hosts(dep_ids, acl_ids)
+            hosts = manager_class(host_index=self.index).find_hosts(dep_ids,
+                                                                    acl_ids)
+            self.assertEqual(sorted(host.hostname for host in expected),
+                             sorted(host.hostname for host in hosts))
+
+
+    def testSortHostsByPreferredDeps(self):
+        """Sorting with the index orders hosts like sorting by labels."""
+        self.db_helper.create_host('h1', deps=set(['a']), acls=set(['acl1']))
+        self.db_helper.create_host('h2', deps=set(['a', 'b', 'c']),
+                                   acls=set(['acl1']))
+        self.db_helper.create_host('h3', deps=set(['a', 'b']),
+                                   acls=set(['acl1']))
+        self.index.refresh()
+        a, b, c = self._label_ids('a', 'b', 'c')
+        hosts = rdb.BaseHostQueryManager().find_hosts([a],
+                                                      self._acl_ids('acl1'))
+        handler = rdb.AvailableHostRequestHandler
+        expected = handler._sort_hosts_by_preferred_deps(hosts, [b, c])
+        self.assertEqual(['h2', 'h3', 'h1'],
+                         [host.hostname for host in expected])
+        self.assertEqual(expected, handler._sort_hosts_by_preferred_deps(
+                hosts, [b, c], host_index=self.index))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -210,6 +210,44 @@ class RDBClientHostWrapper(RDBHost):
         super(RDBClientHostWrapper, self)._update_attributes(payload)
 
 
+    @classmethod
+    def _update_bulk(cls, hosts, payload):
+        """Send the same update of several hosts to rdb in a single request.
+
+        The rdb applies an update shared by several hosts with one UPDATE.
+
+        @param hosts: A list of RDBClientHostWrapper objects.
+        @param payload: A dictionary representing 'key':value of the update
+            required.
+
+        @raises RDBException: If the update fails on any of the hosts. The
+            update is still saved locally on the other hosts.
+        """
+        if not hosts:
+            return
+        # TODO(beeps): Remove this once we transition to urls
+        from autotest_lib.scheduler import rdb
+        update_request_manager = rdb_requests.RDBRequestManager(
+                rdb_requests.UpdateHostRequest, rdb.update_hosts)
+        for host in hosts:
+            logging.info('Host %s in %s updating %s through rdb on behalf '
+                         'of: %s ', host.hostname, host.status, payload,
+                         host.dbg_str)
+            update_request_manager.add_request(host_id=host.id,
+                                               payload=payload)
+        failures = []
+        for host, response in zip(hosts, update_request_manager.response()):
+            if response:
+                failures.append('%s on behalf of %s: %s' % (
+                        host.hostname, host.dbg_str, response))
+            else:
+                host._update_attributes(payload)
+        if failures:
+            raise rdb_utils.RDBException(
+                    'Hosts unable to perform update %s through rdb: %s' %
+                    (payload, '; '.join(failures)))
+
+
     def record_state(self, type_str, state, value):
         """Record metadata in elasticsearch.
 
@@ -240,6 +278,21 @@ class RDBClientHostWrapper(RDBHost):
         self.record_state('host_history', 'status', status)
 
 
+    @classmethod
+    def set_status_bulk(cls, hosts, status):
+        """Set the status of several hosts, like set_status does.
+
+        The hosts are updated through a single rdb request.
+
+        @param hosts: An iterable of RDBClientHostWrapper objects.
+        @param status: The new status.
+        """
+        hosts = list(hosts)
+        cls._update_bulk(hosts, {'status': status})
+        for host in hosts:
+            host.record_state('host_history', 'status', status)
+
+
     def update_field(self, fieldname, value):
         """Proxy for updating a field on the host.
 
@@ -249,6 +302,17 @@ class RDBClientHostWrapper(RDBHost):
         self._update({fieldname: value})
 
 
+    @classmethod
+    def update_field_bulk(cls, hosts, fieldname, value):
+        """Update a field on several hosts through a single rdb request.
+
+        @param hosts: An iterable of RDBClientHostWrapper objects.
+        @param fieldname: The fieldname as a string.
+        @param value: The value to assign to the field.
+        """
+        cls._update_bulk(list(hosts), {fieldname: value})
+
+
     def platform_and_labels(self):
         """Get the platform and labels on this host.
 
@@ -11,6 +11,7 @@ from autotest_lib.client.common_lib.test_utils import unittest
 from autotest_lib.frontend import setup_django_environment
 from autotest_lib.frontend.afe import frontend_test_utils
 from autotest_lib.frontend.afe import rdb_model_extensions as rdb_models
+from autotest_lib.scheduler import rdb
 from autotest_lib.scheduler import rdb_hosts
 from autotest_lib.scheduler import rdb_testing_utils
 from autotest_lib.scheduler import rdb_utils
@@ -166,5 +167,44 @@ class RDBHostTests(unittest.TestCase, frontend_test_utils.FrontendTestMixin):
                 new_status and client_host.status == new_status)
 
 
+    def testUpdateBulk(self):
+        """Test that several client hosts are updated in a single request.
+
+        @raises AssertionError: If the hosts aren't updated by a single rdb
+            request, or a bad update is processed without an exception.
+        """
+        client_hosts = []
+        for hostname in ('h1', 'h2'):
+            db_host = self.db_helper.create_host(hostname, dirty=False)
+            server_host_dict = rdb_hosts.RDBServerHostWrapper(
+                    db_host).wire_format()
+            client_hosts.append(
+                    rdb_hosts.RDBClientHostWrapper(**server_host_dict))
+        update_requests = []
+        update_hosts = rdb.update_hosts
+        def record_update_hosts(requests):
+            update_requests.append(requests)
+            return update_hosts(requests)
+        rdb.update_hosts = record_update_hosts
+        try:
+            rdb_hosts.RDBClientHostWrapper.set_status_bulk(client_hosts,
+                                                           'newstatus')
+            rdb_hosts.RDBClientHostWrapper.update_field_bulk(client_hosts,
+                                                             'dirty', True)
+        finally:
+            rdb.update_hosts = update_hosts
+        self.assertEqual([2, 2], [len(requests) for requests in
+                                  update_requests])
+        for client_host in client_hosts:
+            db_host = self.db_helper.get_host(hostname=client_host.hostname)[0]
+            self.assertEqual('newstatus', db_host.status)
+            self.assertTrue(db_host.dirty)
+            self.assertEqual('newstatus', client_host.status)
+            self.assertTrue(client_host.dirty)
+        self.assertRaises(rdb_utils.RDBException,
+                          rdb_hosts.RDBClientHostWrapper.update_field_bulk,
+                          client_hosts, 'Nonexist', 'Nonexist')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -254,5 +254,66 @@ class QueryManagerTests(unittest.TestCase,
         self.assertTrue(len(hosts) == 1 and not hosts[0].leased)
 
 
+class HostMatchingTests(unittest.TestCase,
+                        frontend_test_utils.FrontendTestMixin):
+    """Tests for acquiring hosts through a host assignment."""
+
+    def setUp(self):
+        self.db_helper = rdb_testing_utils.DBHelper()
+        self._database = self.db_helper.database
+        self._frontend_common_setup(fill_data=False)
+
+
+    def tearDown(self):
+        self._database.disconnect()
+        self._frontend_common_teardown()
+
+
+    def _create_request(self, deps, priority, preferred_deps=()):
+        label_ids = lambda names: [
+                label.id for label in self.db_helper.get_labels(
+                        name__in=names)]
+        return rdb_requests.AcquireHostRequest(
+                host_id=None, deps=label_ids(deps),
+                preferred_deps=label_ids(preferred_deps),
+                acls=[acl.id for acl in self.db_helper.get_acls(name='acl')],
+                priority=priority, parent_job_id=0,
+                suite_min_duts=0)._request
+
+
+    def _acquire(self, use_host_matching, requests):
+        handler = rdb.AvailableHostRequestHandler()
+        with mock.patch.object(rdb, '_use_host_matching', use_host_matching):
+            handler.batch_acquire_hosts(requests)
+        return dict((request, sorted(host.hostname for host in hosts))
+                    for request, hosts in handler.response_map.iteritems())
+
+
+    def testMatchingSatisfiesOverlappingRequests(self):
+        """Overlapping requests strand hosts greedily, but not by matching."""
+        self.db_helper.create_host('h1', deps=set(['a', 'b']),
+                                   acls=set(['acl']))
+        self.db_helper.create_host('h2', deps=set(['a']), acls=set(['acl']))
+        # The higher priority request prefers h1, the only host r2 can use.
+        r1 = self._create_request(['a'], 10, preferred_deps=['b'])
+        r2 = self._create_request(['a', 'b'], 0)
+
+        self.assertEqual({r1: ['h1']}, self._acquire(False, [r1, r2]))
+        self.db_helper.get_host().update(leased=0)
+        self.assertEqual({r1: ['h2'], r2: ['h1']},
+                         self._acquire(True, [r1, r2]))
+        self.assertEqual(2, self.db_helper.get_host(leased=1).count())
+
+
+    def testMatchingRespectsPriority(self):
+        """Higher priority requests are satisfied first."""
+        self.db_helper.create_host('h1', deps=set(['a']), acls=set(['acl']))
+        self.db_helper.create_host('h2', deps=set(['a']), acls=set(['acl']))
+        low = self._create_request(['a'], 0)
+        high = self._create_request(['a'], 10)
+        self.assertEqual({high: ['h1', 'h2']},
+                         self._acquire(True, [low, high, high, high]))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,112 @@
+"""Tracking of the queue entries the scheduler may run, between ticks.
+
+Finding the pending queue entries by their status scans all the queued
+entries, including those waiting for a shard, which are most of them on the
+master. A RunnableQueue keeps the ids of the pending entries found on the
+previous tick, so the next tick only needs to query, by primary key:
+    - the entries pending on the previous tick,
+    - the entries created since,
+    - the entries the scheduler queued again since, see note_queued_entries.
+New entries are scanned for from the highest id seen by the query before the
+previous one, less lookback_ids ids, since entries are not committed in the
+order of their ids. Entries committed later than that, and other changes
+making old entries pending, like a label leaving a shard, are picked up by a
+full query, run every full_query_ticks queries.
+"""
+
+import weakref
+
+
+# The queues to tell about the entries queued again.
+_queues = weakref.WeakSet()
+
+
+def note_queued_entries(entry_ids):
+    """Tell the runnable queues the scheduler queued entries again.
+
+    @param entry_ids: The ids of the queue entries.
+    """
+    for queue in list(_queues):
+        queue.add_entries(entry_ids)
+
+
+class RunnableQueue(object):
+    """The ids of the queue entries to query on the next tick."""
+
+    def __init__(self, full_query_ticks, lookback_ids=0):
+        """
+        @param full_query_ticks: The number of queries between full queries.
+        @param lookback_ids: The number of ids below the highest one seen by
+                the query before the previous one to scan for new entries
+                from.
+        """
+        self._full_query_ticks = full_query_ticks
+        self._lookback_ids = lookback_ids
+        self._queries_since_full_query = 0
+        # None until the first full query.
+        self._entry_ids = None
+        self._requeued_entry_ids = set()
+        # The requeued entries returned by get_entry_ids for the query.
+        self._queried_requeued_entry_ids = set()
+        self._scan_from_id = 0
+        self._max_entry_id = 0
+        _queues.add(self)
+
+
+    def needs_full_query(self):
+        """
+        @returns True if the next query must look at all the queue entries.
+        """
+        return (self._entry_ids is None or
+                self._queries_since_full_query >= self._full_query_ticks)
+
+
+    @property
+    def scan_from_id(self):
+        """Entries with a higher id may be new, and must be queried."""
+        return self._scan_from_id
+
+
+    def get_entry_ids(self):
+        """
+        Entries queued again after this call are kept for the next query.
+
+        @returns A sorted list of the ids of the known entries to query.
+        """
+        self._queried_requeued_entry_ids = set(self._requeued_entry_ids)
+        return sorted((self._entry_ids or set()) |
+                      self._queried_requeued_entry_ids)
+
+
+    def add_entries(self, entry_ids):
+        """Query entries on the next tick.
+
+        @param entry_ids: The ids of the queue entries.
+        """
+        self._requeued_entry_ids.update(entry_ids)
+
+
+    def update(self, pending_entry_ids, max_entry_id, full_query):
+        """Record the result of a query.
+
+        @param pending_entry_ids: The ids of the pending entries found.
+        @param max_entry_id: The highest queue entry id, read before the
+                query.
+        @param full_query: Whether the query looked at all the entries.
+        """
+        self._entry_ids = set(pending_entry_ids)
+        self._requeued_entry_ids.difference_update(
+                self._queried_requeued_entry_ids)
+        self._queried_requeued_entry_ids = set()
+        if full_query:
+            self._queries_since_full_query = 0
+        else:
+            self._queries_since_full_query += 1
+        # Entries are not committed in the order of their ids, an entry
+        # created before the previous query may still have been uncommitted
+        # then. Creating an entry usually takes less than a tick, so the
+        # entries created before the query preceding it were visible, but
+        # the look-back also covers entries committed a little later.
+        self._scan_from_id = max(
+                (self._max_entry_id or max_entry_id) - self._lookback_ids, 0)
+        self._max_entry_id = max_entry_id
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+"""Tests for the tracking of the runnable queue entries."""
+
+import unittest
+
+import common
+from autotest_lib.scheduler import runnable_queue
+
+
+class RunnableQueueTests(unittest.TestCase):
+    """Tests for RunnableQueue."""
+
+    def setUp(self):
+        self.queue = runnable_queue.RunnableQueue(full_query_ticks=2)
+
+
+    def testFullQueries(self):
+        """Test full queries are needed first, then every full_query_ticks."""
+        self.assertTrue(self.queue.needs_full_query())
+        self.queue.update([1], max_entry_id=1, full_query=True)
+        self.assertFalse(self.queue.needs_full_query())
+        self.queue.update([1], max_entry_id=1, full_query=False)
+        self.assertFalse(self.queue.needs_full_query())
+        self.queue.update([1], max_entry_id=1, full_query=False)
+        self.assertTrue(self.queue.needs_full_query())
+        self.queue.update([1], max_entry_id=1, full_query=True)
+        self.assertFalse(self.queue.needs_full_query())
+
+
+    def testScanFromId(self):
+        """Test new entries are scanned for up to the previous query."""
+        self.assertEqual(self.queue.scan_from_id, 0)
+        self.queue.update([], max_entry_id=5, full_query=True)
+        self.assertEqual(self.queue.scan_from_id, 5)
+        self.queue.update([], max_entry_id=8, full_query=False)
+        self.assertEqual(self.queue.scan_from_id, 5)
+        self.queue.update([], max_entry_id=9, full_query=False)
+        self.assertEqual(self.queue.scan_from_id, 8)
+
+
+    def testScanFromIdLookback(self):
+        """Test new entries are scanned for from below the previous query."""
+        queue = runnable_queue.RunnableQueue(full_query_ticks=2,
+                                             lookback_ids=3)
+        self.assertEqual(queue.scan_from_id, 0)
+        queue.update([], max_entry_id=2, full_query=True)
+        self.assertEqual(queue.scan_from_id, 0)
+        queue.update([], max_entry_id=8, full_query=False)
+        self.assertEqual(queue.scan_from_id, 0)
+        queue.update([], max_entry_id=9, full_query=False)
+        self.assertEqual(queue.scan_from_id, 5)
+
+
+    def testEntryIds(self):
+        """Test the pending and queued entries are queried once."""
+        self.queue.update([4, 2], max_entry_id=5, full_query=True)
+        runnable_queue.note_queued_entries([3, 4])
+        self.assertEqual(self.queue.get_entry_ids(), [2, 3, 4])
+        self.queue.update([3], max_entry_id=5, full_query=False)
+        self.assertEqual(self.queue.get_entry_ids(), [3])
+
+
+    def testEntriesQueuedDuringQuery(self):
+        """Test entries queued again during a query are queried next time."""
+        self.queue.update([], max_entry_id=5, full_query=True)
+        runnable_queue.note_queued_entries([3])
+        self.assertEqual(self.queue.get_entry_ids(), [3])
+        runnable_queue.note_queued_entries([4])
+        self.queue.update([], max_entry_id=5, full_query=False)
+        self.assertEqual(self.queue.get_entry_ids(), [4])
+        self.queue.update([], max_entry_id=5, full_query=False)
+        self.assertEqual(self.queue.get_entry_ids(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,9 +16,11 @@ _notify_email_statuses: list of HQE statuses.  each time a single HQE reaches
 _base_url: URL to the local AFE server, used to construct URLs for emails.
 _db: DatabaseConnection for this module.
 _drone_manager: reference to global DroneManager instance.
+_tick_cache: the TickCache of the current scheduler tick, if there is one.
 """
 
 import datetime, itertools, logging, os, re, sys, time, weakref
+from django.db import transaction
 from autotest_lib.client.common_lib import control_data
 from autotest_lib.client.common_lib import global_config, host_protections
 from autotest_lib.client.common_lib import time_utils
@@ -28,6 +30,7 @@ from autotest_lib.client.common_lib.cros.graphite import autotest_stats
 from autotest_lib.frontend.afe import models, model_attributes
 from autotest_lib.scheduler import drone_manager, email_manager
 from autotest_lib.scheduler import rdb_lib
+from autotest_lib.scheduler import runnable_queue
 from autotest_lib.scheduler import scheduler_config
 from autotest_lib.scheduler import scheduler_lib
 from autotest_lib.server.cros import provision
@@ -38,6 +41,7 @@ _base_url = None
 
 _db = None
 _drone_manager = None
+_tick_cache = None
 
 def initialize():
     global _db
@@ -152,6 +156,113 @@ class DelayedCallTask(object):
         self.aborted = True
 
 
+class TickCache(object):
+    """
+    Rows and query results loaded during a single scheduler tick.
+
+    While a tick cache is active, DBObjects constructed by id take their row
+    from the cache if it was loaded earlier in the tick, instead of querying
+    the database again. Rows are loaded into the cache by every query that
+    constructs DBObjects and in bulk by DBObject.prefetch. Writes through
+    update_field still go to the database right away, since most of the
+    scheduler reads the same rows through django, and are also applied to
+    the cached rows. Rows changed by anything other than scheduler_models
+    during the tick are only seen once the tick is over.
+    """
+
+    _STATS_KEY = 'scheduler_models.tick_cache'
+
+    def __init__(self):
+        # Mapping from (DBObject subclass, id) to a row of the class' table.
+        self._rows = {}
+        # Mapping from a key chosen by the caller to the result of a query.
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def get_row(self, cls, row_id):
+        """
+        @returns The cached row of the given class and id, or None.
+        """
+        row = self._rows.get((cls, row_id))
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+
+    def has_row(self, cls, row_id):
+        return (cls, row_id) in self._rows
+
+
+    def put_row(self, cls, row):
+        self._rows[(cls, row[0])] = list(row)
+
+
+    def update_row(self, cls, row_id, field_index, value):
+        """Apply a write to the cached row, if there is one."""
+        row = self._rows.get((cls, row_id))
+        if row is not None:
+            row[field_index] = value
+
+
+    def forget_row(self, cls, row_id):
+        self._rows.pop((cls, row_id), None)
+
+
+    def get_result(self, key, query_function):
+        """
+        Get the result of a query, running it if this is the first time.
+
+        @param key: A hashable identifying the query and its parameters.
+        @param query_function: A callable taking no arguments that runs the
+                query.
+
+        @returns The result of query_function.
+        """
+        if key in self._results:
+            self.hits += 1
+            return self._results[key]
+        self.misses += 1
+        result = self._results[key] = query_function()
+        return result
+
+
+    def report(self):
+        """Send the hit and miss counters of this tick to autotest_stats."""
+        counter = autotest_stats.Counter(self._STATS_KEY)
+        counter.increment('hits', self.hits)
+        counter.increment('misses', self.misses)
+
+
+def start_tick_cache():
+    """Start caching the rows loaded by DBObjects for a scheduler tick."""
+    global _tick_cache
+    _tick_cache = TickCache()
+
+
+def end_tick_cache():
+    """Drop the cache of the current tick, if there is one."""
+    global _tick_cache
+    if _tick_cache is not None:
+        _tick_cache.report()
+    _tick_cache = None
+
+
+def _get_cached_result(key, query_function):
+    """
+    Run a query, or get its result from the tick cache if there is one.
+
+    @param key: A hashable identifying the query and its parameters.
+    @param query_function: A callable taking no arguments that runs the query.
+    """
+    if _tick_cache is None:
+        return query_function()
+    return _tick_cache.get_result(key, query_function)
+
+
 class DBError(Exception):
     """Raised by the DBObject constructor when its select fails."""
 
@@ -203,7 +314,9 @@ class DBObject(object):
         self.__new_record = new_record
 
         if row is None:
-            row = self._fetch_row_from_db(id)
+            row = self._get_row(id)
+        elif _tick_cache is not None and not new_record:
+            _tick_cache.put_row(type(self), row)
 
         if self._initialized:
             differences = self._compare_fields_in_row(row)
@@ -221,6 +334,18 @@ class DBObject(object):
         cls._instances_by_type_and_id.clear()
 
 
+    def _get_row(self, row_id):
+        """Get our row from the tick cache, or from the database."""
+        if _tick_cache is not None:
+            row = _tick_cache.get_row(type(self), row_id)
+            if row is not None:
+                return row
+        row = self._fetch_row_from_db(row_id)
+        if _tick_cache is not None:
+            _tick_cache.put_row(type(self), row)
+        return row
+
+
     def _fetch_row_from_db(self, row_id):
         sql = 'SELECT * FROM %s WHERE ID=%%s' % self.__table
         rows = _db.execute(sql, (row_id,))
@@ -281,6 +406,8 @@ class DBObject(object):
     def update_from_database(self):
         assert self.id is not None
         row = self._fetch_row_from_db(self.id)
+        if _tick_cache is not None:
+            _tick_cache.put_row(type(self), row)
         self._update_fields_from_row(row)
 
 
@@ -306,8 +433,38 @@ class DBObject(object):
 
         query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table, field)
         _db.execute(query, (value, self.id))
+        self._set_field(field, value)
+
 
+    def _set_field(self, field, value):
+        """Record that a field has been written to the database."""
         setattr(self, field, value)
+        if _tick_cache is not None:
+            _tick_cache.update_row(type(self), self.id,
+                                   self._fields.index(field), value)
+
+
+    @classmethod
+    def update_field_bulk(cls, objects, field, value):
+        """
+        Like update_field, for several objects with a single UPDATE.
+
+        @param objects: An iterable of instances of our class. Those that
+                already have the value are skipped.
+        @param field: The name of the field to update.
+        @param value: The new value of the field on every object.
+        """
+        objects = [obj for obj in objects if getattr(obj, field) != value]
+        if not objects:
+            return
+        for obj in objects:
+            assert field in obj._valid_fields
+        ids = [obj.id for obj in objects]
+        query = 'UPDATE %s SET %s = %%s WHERE id IN (%s)' % (
+                cls._table_name, field, ','.join(['%s'] * len(ids)))
+        _db.execute(query, [value] + ids)
+        for obj in objects:
+            obj._set_field(field, value)
 
 
     def save(self):
@@ -333,6 +490,8 @@ class DBObject(object):
         self._instances_by_type_and_id.pop((type(self), id), None)
         self._initialized = False
         self._valid_fields.clear()
+        if _tick_cache is not None:
+            _tick_cache.forget_row(type(self), self.id)
         query = 'DELETE FROM %s WHERE id=%%s' % self.__table
         _db.execute(query, (self.id,))
 
@@ -345,11 +504,27 @@ class DBObject(object):
 
 
     @classmethod
-    def fetch(cls, where='', params=(), joins='', order_by=''):
+    def get_max_id(cls):
         """
-        Construct instances of our class based on the given database query.
+        @returns The highest id in our table, 0 if it is empty.
+        """
+        rows = _db.execute('SELECT MAX(id) FROM %s' % cls._table_name)
+        return rows[0][0] or 0
 
-        @yields One class instance for each row fetched.
+
+    @classmethod
+    def fetch_rows(cls, where='', params=(), joins='', order_by='', db=None):
+        """
+        Run the database query of fetch() without constructing instances.
+
+        Instances share state with the rest of the scheduler, so they are only
+        constructed in the main thread, but the query may run in any thread
+        that has a connection of its own.
+
+        @param db: The DatabaseConnection to query, or None to use the
+                scheduler's connection.
+
+        @returns The fetched rows, for from_rows.
         """
         order_by = cls._prefix_with(order_by, 'ORDER BY ')
         where = cls._prefix_with(where, 'WHERE ')
@@ -358,10 +533,52 @@ class DBObject(object):
                                              'joins' : joins,
                                              'where' : where,
                                              'order_by' : order_by})
-        rows = _db.execute(query, params)
+        return (db or _db).execute(query, params)
+
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Construct instances of our class from rows of our table.
+
+        @returns One class instance for each row.
+        """
         return [cls(id=row[0], row=row) for row in rows]
 
 
+    @classmethod
+    def prefetch(cls, ids):
+        """
+        Load the rows of the given ids into the tick cache with one query.
+
+        Rows which are already cached are not loaded again. Without a tick
+        cache this does nothing.
+
+        @param ids: An iterable of ids of rows of our table.
+        """
+        if _tick_cache is None:
+            return
+        ids = sorted(set(row_id for row_id in ids if row_id is not None and
+                         not _tick_cache.has_row(cls, row_id)))
+        if not ids:
+            return
+        query = 'SELECT * FROM %s WHERE id IN (%s)' % (
+                cls._table_name, ','.join(['%s'] * len(ids)))
+        for row in _db.execute(query, ids):
+            _tick_cache.put_row(cls, row)
+
+
+    @classmethod
+    def fetch(cls, where='', params=(), joins='', order_by=''):
+        """
+        Construct instances of our class based on the given database query.
+
+        @yields One class instance for each row fetched.
+        """
+        return cls.from_rows(cls.fetch_rows(where=where, params=params,
+                                            joins=joins, order_by=order_by))
+
+
 class IneligibleHostQueue(DBObject):
     _table_name = 'afe_ineligible_host_queues'
     _fields = ('id', 'job_id', 'host_id')
@@ -404,14 +621,16 @@ class Host(DBObject):
         """
         Returns a tuple (platform_name, list_of_all_label_names).
         """
-        rows = _db.execute("""
+        query = """
                 SELECT afe_labels.name, afe_labels.platform
                 FROM afe_labels
                 INNER JOIN afe_hosts_labels ON
                         afe_labels.id = afe_hosts_labels.label_id
                 WHERE afe_hosts_labels.host_id = %s
                 ORDER BY afe_labels.name
-                """, (self.id,))
+                """
+        rows = _get_cached_result(('platform_and_labels', self.id),
+                                  lambda: _db.execute(query, (self.id,)))
         platform = None
         all_labels = []
         for label_name, is_platform in rows:
@@ -461,6 +680,20 @@ class Host(DBObject):
             return cmp(lower_a, lower_b)
 
 
+def _unique_jobs(queue_entries):
+    """
+    @returns The jobs of the given queue entries, each one only once, in the
+            order of their first queue entry.
+    """
+    jobs = []
+    seen_ids = set()
+    for queue_entry in queue_entries:
+        if queue_entry.job.id not in seen_ids:
+            seen_ids.add(queue_entry.job.id)
+            jobs.append(queue_entry.job)
+    return jobs
+
+
 class HostQueueEntry(DBObject):
     _table_name = 'afe_host_queue_entries'
     _fields = ('id', 'job_id', 'host_id', 'status', 'meta_host',
@@ -488,6 +721,14 @@ class HostQueueEntry(DBObject):
             self.atomic_group = None
 
 
+    @classmethod
+    def from_rows(cls, rows):
+        # Every entry constructs its job, load all of them at once.
+        job_id_index = cls._fields.index('job_id')
+        Job.prefetch(row[job_id_index] for row in rows)
+        return super(HostQueueEntry, cls).from_rows(rows)
+
+
     @classmethod
     def clone(cls, template):
         """
@@ -517,10 +758,12 @@ class HostQueueEntry(DBObject):
         """
         if self.meta_host:
             yield Label(id=self.meta_host, always_query=False)
-        labels = Label.fetch(
-                joins="JOIN afe_jobs_dependency_labels AS deps "
-                      "ON (afe_labels.id = deps.label_id)",
-                where="deps.job_id = %d" % self.job.id)
+        labels = _get_cached_result(
+                ('job_dependency_labels', self.job.id),
+                lambda: Label.fetch(
+                        joins="JOIN afe_jobs_dependency_labels AS deps "
+                              "ON (afe_labels.id = deps.label_id)",
+                        where="deps.job_id = %d" % self.job.id))
         for label in labels:
             yield label
 
@@ -595,32 +838,88 @@ class HostQueueEntry(DBObject):
                  flags_str))
 
 
-    def record_state(self, type_str, state, value):
-        """Record metadata in elasticsearch.
-
-        If ES configured to use http, then we will time that http request.
-        Otherwise, it uses UDP, so we will not need to time it.
+    def _get_state_record(self, type_str, state, value):
+        """Get the elasticsearch metadata recording a state of this entry.
 
         @param type_str: sets the _type field in elasticsearch db.
         @param state: string representing what state we are recording,
                       e.g. 'status'
         @param value: value of the state, e.g. 'verifying'
+
+        @returns: A metadata dictionary, including its _type.
         """
         metadata = {
+            '_type': type_str,
             'time_changed': time.time(),
              state: value,
             'job_id': self.job_id,
         }
         if self.host:
             metadata['hostname'] = self.host.hostname
-        autotest_es.post(type_str=type_str, metadata=metadata)
+        return metadata
+
+
+    def record_state(self, type_str, state, value):
+        """Record metadata in elasticsearch.
+
+        If ES configured to use http, then we will time that http request.
+        Otherwise, it uses UDP, so we will not need to time it.
+
+        @param type_str: sets the _type field in elasticsearch db.
+        @param state: string representing what state we are recording,
+                      e.g. 'status'
+        @param value: value of the state, e.g. 'verifying'
+        """
+        metadata = self._get_state_record(type_str, state, value)
+        autotest_es.post(type_str=metadata.pop('_type'), metadata=metadata)
 
 
     @_timer.decorate
     def set_status(self, status):
-        logging.info("%s -> %s", self, status)
+        self._set_statuses([self], status)
+        self.record_state('hqe_status', 'status', status)
+
 
-        self.update_field('status', status)
+    @classmethod
+    @_timer.decorate
+    def set_status_bulk(cls, queue_entries, status):
+        """
+        Set the status of several queue entries, like set_status does.
+
+        Each field is written for all the entries with a single UPDATE, all
+        in one transaction. If ES is configured to use http, the state
+        records of the entries are sent to elasticsearch with a single bulk
+        post. Otherwise they are sent over UDP one by one, like set_status
+        does, which does not block.
+
+        @param queue_entries: An iterable of HostQueueEntry objects.
+        @param status: The new status of the entries.
+        """
+        queue_entries = list(queue_entries)
+        if not queue_entries:
+            return
+        with transaction.commit_on_success():
+            cls._set_statuses(queue_entries, status)
+        if autotest_es.ES_USE_HTTP:
+            autotest_es.bulk_post(
+                    [entry._get_state_record('hqe_status', 'status', status)
+                     for entry in queue_entries])
+        else:
+            for entry in queue_entries:
+                entry.record_state('hqe_status', 'status', status)
+
+
+    @classmethod
+    def _set_statuses(cls, queue_entries, status):
+        """Set the status of queue entries, without recording their state.
+
+        @param queue_entries: A list of HostQueueEntry objects.
+        @param status: The new status of the entries.
+        """
+        for queue_entry in queue_entries:
+            logging.info("%s -> %s", queue_entry, status)
+
+        cls.update_field_bulk(queue_entries, 'status', status)
         # Noticed some time jumps after last logging message.
         logging.debug('Update Field Complete')
 
@@ -628,7 +927,7 @@ class HostQueueEntry(DBObject):
         complete = (status in models.HostQueueEntry.COMPLETE_STATUSES)
         assert not (active and complete)
 
-        self.update_field('active', active)
+        cls.update_field_bulk(queue_entries, 'active', active)
 
         # The ordering of these operations is important. Once we set the
         # complete bit this job will become indistinguishable from all
@@ -641,36 +940,45 @@ class HostQueueEntry(DBObject):
         # This should be fine, because nothing critical checks finished_on,
         # and the scheduler should never be killed mid-tick.
         if complete:
-            self._on_complete(status)
-            if self.job.shard_id is not None:
-                # If shard_id is None, the job will be synced back to the master
-                self.job.update_field('shard_id', None)
-            self._email_on_job_complete()
-
-        self.update_field('complete', complete)
+            cls._on_complete(queue_entries, status)
+            # If shard_id is None, the job will be synced back to the master
+            Job.update_field_bulk(_unique_jobs(queue_entries), 'shard_id',
+                                  None)
+            for queue_entry in queue_entries:
+                queue_entry._email_on_job_complete()
+
+        cls.update_field_bulk(queue_entries, 'complete', complete)
+        if status == models.HostQueueEntry.Status.QUEUED:
+            runnable_queue.note_queued_entries(
+                    [queue_entry.id for queue_entry in queue_entries])
 
         should_email_status = (status.lower() in _notify_email_statuses or
                                'all' in _notify_email_statuses)
         if should_email_status:
-            self._email_on_status(status)
+            for queue_entry in queue_entries:
+                queue_entry._email_on_status(status)
         logging.debug('HQE Set Status Complete')
-        self.record_state('hqe_status', 'status', status)
-
 
 
-    def _on_complete(self, status):
+    @classmethod
+    def _on_complete(cls, queue_entries, status):
         if status is not models.HostQueueEntry.Status.ABORTED:
-            self.job.stop_if_necessary()
+            for job in _unique_jobs(queue_entries):
+                job.stop_if_necessary()
 
-        if self.started_on:
-            self.set_finished_on_now()
-        if not self.execution_subdir:
-            return
-        # unregister any possible pidfiles associated with this queue entry
-        for pidfile_name in drone_manager.ALL_PIDFILE_NAMES:
-            pidfile_id = _drone_manager.get_pidfile_id_from(
-                    self.execution_path(), pidfile_name=pidfile_name)
-            _drone_manager.unregister_pidfile(pidfile_id)
+        cls.update_field_bulk(
+                [queue_entry for queue_entry in queue_entries
+                 if queue_entry.started_on],
+                'finished_on', datetime.datetime.now())
+        for queue_entry in queue_entries:
+            if not queue_entry.execution_subdir:
+                continue
+            # unregister any possible pidfiles associated with this queue entry
+            for pidfile_name in drone_manager.ALL_PIDFILE_NAMES:
+                pidfile_id = _drone_manager.get_pidfile_id_from(
+                        queue_entry.execution_path(),
+                        pidfile_name=pidfile_name)
+                _drone_manager.unregister_pidfile(pidfile_id)
 
 
     def _get_status_email_contents(self, status, summary=None, hostname=None):
@@ -823,13 +1131,43 @@ class HostQueueEntry(DBObject):
 
 
     def abort(self, dispatcher):
+        if self._prepare_abort(dispatcher):
+            self.set_status(models.HostQueueEntry.Status.ABORTED)
+            self.job.abort_delay_ready_task()
+
+
+    @classmethod
+    def abort_bulk(cls, queue_entries, dispatcher):
+        """
+        Abort several queue entries, like abort does.
+
+        The entries are set to Aborted together through set_status_bulk.
+
+        @param queue_entries: An iterable of HostQueueEntry objects.
+        @param dispatcher: The dispatcher running the agents of the entries.
+        """
+        aborted_entries = [queue_entry for queue_entry in queue_entries
+                           if queue_entry._prepare_abort(dispatcher)]
+        cls.set_status_bulk(aborted_entries,
+                            models.HostQueueEntry.Status.ABORTED)
+        for job in _unique_jobs(aborted_entries):
+            job.abort_delay_ready_task()
+
+
+    def _prepare_abort(self, dispatcher):
+        """
+        Clean up after an aborted entry, before its status is set to Aborted.
+
+        @returns True if the status of the entry should be set to Aborted now,
+                False if its post-job tasks will do it.
+        """
         assert self.aborted and not self.complete
 
         Status = models.HostQueueEntry.Status
         if self.status in (Status.GATHERING, Status.PARSING, Status.ARCHIVING):
             # do nothing; post-job tasks will finish and then mark this entry
             # with status "Aborted" and take care of the host
-            return
+            return False
 
         if self.status in (Status.STARTING, Status.PENDING, Status.RUNNING,
                            Status.WAITING):
@@ -858,9 +1196,7 @@ class HostQueueEntry(DBObject):
                     task=models.SpecialTask.Task.REPAIR,
                     host=models.Host.objects.get(id=self.host.id),
                     requested_by=self.job.owner_model())
-
-        self.set_status(Status.ABORTED)
-        self.job.abort_delay_ready_task()
+        return True
 
 
     def get_group_name(self):
@@ -979,7 +1315,7 @@ class Job(DBObject):
                 SELECT * FROM afe_host_queue_entries
                 WHERE job_id= %s
         """, (self.id,))
-        entries = [HostQueueEntry(row=i) for i in rows]
+        entries = HostQueueEntry.from_rows(rows)
 
         assert len(entries)>0
 
@@ -1120,8 +1456,8 @@ class Job(DBObject):
         self.update_field('status',status)
 
         if update_queues:
-            for queue_entry in self.get_host_queue_entries():
-                queue_entry.set_status(status)
+            HostQueueEntry.set_status_bulk(self.get_host_queue_entries(),
+                                           status)
 
 
     def keyval_dict(self):
@@ -179,6 +179,66 @@ class DBObjectTest(BaseSchedulerModelsTest):
         self.assertEqual(hqe.finished_on, None)
 
 
+class TickCacheTest(BaseSchedulerModelsTest):
+    def setUp(self):
+        super(TickCacheTest, self).setUp()
+        scheduler_models.start_tick_cache()
+
+
+    def tearDown(self):
+        scheduler_models.end_tick_cache()
+        super(TickCacheTest, self).tearDown()
+
+
+    def test_rows_are_not_queried_again(self):
+        host = scheduler_models.Host(id=2)
+        self._do_query('UPDATE afe_hosts SET hostname="host2-updated" '
+                       'WHERE id=2')
+        scheduler_models.Host(id=2, always_query=True)
+        self.assertEqual(host.hostname, 'host2')
+        self.assertEqual(scheduler_models._tick_cache.hits, 1)
+
+        scheduler_models.end_tick_cache()
+        scheduler_models.Host(id=2, always_query=True)
+        self.assertEqual(host.hostname, 'host2-updated')
+
+
+    def test_writes_update_cached_rows(self):
+        host = scheduler_models.Host(id=2)
+        host.update_field('hostname', 'host2-renamed')
+        del host
+        scheduler_models.DBObject._clear_instance_cache()
+        self.assertEqual(scheduler_models.Host(id=2).hostname, 'host2-renamed')
+        self.assertEqual(scheduler_models._tick_cache.hits, 1)
+
+
+    def test_update_from_database_bypasses_cache(self):
+        host = scheduler_models.Host(id=2)
+        self._do_query('UPDATE afe_hosts SET hostname="host2-updated" '
+                       'WHERE id=2')
+        host.update_from_database()
+        self.assertEqual(host.hostname, 'host2-updated')
+
+
+    def test_prefetch(self):
+        self._create_job(hosts=[1])
+        self._create_job(hosts=[2])
+        scheduler_models.Job.prefetch([1, 2, 1])
+        for job_id in (1, 2):
+            self.assertEqual(scheduler_models.Job(id=job_id).id, job_id)
+        self.assertEqual(scheduler_models._tick_cache.hits, 2)
+        self.assertEqual(scheduler_models._tick_cache.misses, 0)
+
+
+    def test_entries_load_jobs_in_bulk(self):
+        self._create_job(hosts=[1, 2])
+        self.god.stub_function(scheduler_models.Job, 'prefetch')
+        scheduler_models.Job.prefetch.expect_any_call()
+        entries = scheduler_models.HostQueueEntry.fetch(where='job_id = 1')
+        self.assertEqual(len(entries), 2)
+        self.god.check_playback()
+
+
 class HostTest(BaseSchedulerModelsTest):
     def test_cmp_for_sort(self):
         expected_order = [
@@ -310,6 +370,74 @@ class HostQueueEntryTest(BaseSchedulerModelsTest):
                 self.assertEquals(hqe.job.shard_id, 3)
 
 
+    def test_set_status_bulk(self):
+        """Test that set_status_bulk completes several entries at once."""
+        posted_records = []
+        self.god.stub_with(scheduler_models.autotest_es, 'ES_USE_HTTP', True)
+        self.god.stub_with(scheduler_models.autotest_es, 'bulk_post',
+                           posted_records.extend)
+        self._create_job(hosts=[1, 2])
+        hqes = scheduler_models.HostQueueEntry.fetch('job_id = 1')
+        hqes[0].job.update_field('shard_id', 3)
+        for hqe in hqes:
+            hqe.update_field('started_on', datetime.datetime.now())
+
+        scheduler_models.HostQueueEntry.set_status_bulk(
+                hqes, models.HostQueueEntry.Status.COMPLETED)
+
+        for hqe in hqes:
+            hqe.update_from_database()
+            self.assertEqual(models.HostQueueEntry.Status.COMPLETED,
+                             hqe.status)
+            self.assertTrue(hqe.complete)
+            self.assertFalse(hqe.active)
+            self.assertIsNotNone(hqe.finished_on)
+        self.assertIsNone(scheduler_models.Job(id=1).shard_id)
+        self.assertEqual(len(hqes), len(posted_records))
+        for record in posted_records:
+            self.assertEqual(1, record['job_id'])
+            self.assertEqual(models.HostQueueEntry.Status.COMPLETED,
+                             record['status'])
+
+
+    def test_set_status_bulk_without_http(self):
+        """Test that set_status_bulk posts over UDP if ES does not use http."""
+        posted_records = []
+        def post(type_str, metadata):
+            posted_records.append((type_str, metadata))
+
+        self.god.stub_with(scheduler_models.autotest_es, 'ES_USE_HTTP', False)
+        self.god.stub_with(scheduler_models.autotest_es, 'post', post)
+        self.god.stub_with(scheduler_models.autotest_es, 'bulk_post', None)
+        self._create_job(hosts=[1, 2])
+        hqes = scheduler_models.HostQueueEntry.fetch('job_id = 1')
+
+        scheduler_models.HostQueueEntry.set_status_bulk(
+                hqes, models.HostQueueEntry.Status.PARSING)
+
+        self.assertEqual(len(hqes), len(posted_records))
+        for type_str, metadata in posted_records:
+            self.assertEqual('hqe_status', type_str)
+            self.assertEqual(models.HostQueueEntry.Status.PARSING,
+                             metadata['status'])
+
+
+    def test_update_field_bulk_skips_unchanged_objects(self):
+        """Only objects whose field differs from the value are updated."""
+        self._create_job(hosts=[1, 2])
+        hqes = scheduler_models.HostQueueEntry.fetch('job_id = 1')
+        hqes[0].update_field('status', 'Running')
+        queries = []
+        self.god.stub_with(
+                scheduler_models._db, 'execute',
+                lambda query, params=(): queries.append((query, params)))
+        scheduler_models.HostQueueEntry.update_field_bulk(hqes, 'status',
+                                                          'Running')
+        self.assertEqual(1, len(queries))
+        self.assertEqual(['Running', hqes[1].id], list(queries[0][1]))
+        self.assertEqual('Running', hqes[1].status)
+
+
 class JobTest(BaseSchedulerModelsTest):
     def setUp(self):
         super(JobTest, self).setUp()
@@ -6,6 +6,7 @@
 # found in the LICENSE file.
 
 import argparse
+import copy
 import httplib
 import logging
 import os
@@ -20,6 +21,7 @@ from autotest_lib.client.common_lib import error
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib.cros.graphite import autotest_stats
 from autotest_lib.frontend.afe import models
+from autotest_lib.frontend.afe import rpc_utils
 from autotest_lib.scheduler import email_manager
 from autotest_lib.scheduler import scheduler_lib
 from autotest_lib.server.cros.dynamic_suite import frontend_wrappers
@@ -81,6 +83,11 @@ On the client side, this will happen:
    ids of all hosts. This is used to not send objects repeatedly. For more
    information on this and alternatives considered
    see site_rpc_interface.shard_heartbeat.
+
+With heartbeat protocol version 2, the ids of incomplete jobs and hosts are
+not sent. Instead, the shard sends the sequence number of the last heartbeat
+response it persisted, and only the statuses of hosts that changed since the
+last heartbeat. Records are compressed in both directions.
 """
 
 
@@ -88,6 +95,9 @@ HEARTBEAT_AFE_ENDPOINT = 'shard_heartbeat'
 
 RPC_TIMEOUT_MIN = 5
 RPC_DELAY_SEC = 5
+# Number of records deserialized in one transaction. If any record of a chunk
+# fails, the chunk is deserialized again record by record.
+DESERIALIZATION_CHUNK_SIZE = 100
 
 STATS_KEY = 'shard_client.%s' % socket.gethostname()
 timer = autotest_stats.Timer(STATS_KEY)
@@ -101,25 +111,65 @@ class ShardClient(object):
     to retrieve new jobs from it and to report completed jobs back.
     """
 
-    def __init__(self, global_afe_hostname, shard_hostname, tick_pause_sec):
+    def __init__(self, global_afe_hostname, shard_hostname, tick_pause_sec,
+                 protocol_version=1):
         self.afe = frontend_wrappers.RetryingAFE(server=global_afe_hostname,
                                                  timeout_min=RPC_TIMEOUT_MIN,
                                                  delay_sec=RPC_DELAY_SEC)
         self.hostname = shard_hostname
         self.tick_pause_sec = tick_pause_sec
+        self.protocol_version = protocol_version
         self._shutdown = False
         self._shard = None
+        # Protocol version 2: The sequence number of the last heartbeat
+        # response that was persisted, and the host statuses the master got.
+        # Both start out empty, so the first heartbeat syncs everything.
+        self._watermark = None
+        self._acked_host_statuses = {}
 
 
     def _deserialize_many(self, serialized_list, djmodel, message):
         """Deserialize data in JSON format to database.
 
         Deserialize a list of JSON-formatted data to database using Django.
+        Records are deserialized in bulk, in chunks of
+        DESERIALIZATION_CHUNK_SIZE records with one transaction each.
 
         @param serialized_list: A list of JSON-formatted data.
         @param djmodel: Django model type.
         @param message: A string to be used in a logging message.
+
+        @returns: The number of records that failed to deserialize.
+        """
+        failures = 0
+        for i in xrange(0, len(serialized_list), DESERIALIZATION_CHUNK_SIZE):
+            chunk = serialized_list[i:i + DESERIALIZATION_CHUNK_SIZE]
+            try:
+                with transaction.commit_on_success():
+                    # Deserializing modifies the records, keep the originals
+                    # for deserializing them one by one.
+                    djmodel.deserialize_many(copy.deepcopy(chunk))
+            except Exception as e:
+                logging.warning('Deserializing %d %ss in bulk fails: %s. '
+                                'Deserializing them one by one.',
+                                len(chunk), message, e)
+                autotest_stats.Counter(STATS_KEY).increment(
+                        'bulk_deserialization_failures')
+                failures += self._deserialize_one_by_one(chunk, djmodel,
+                                                         message)
+        return failures
+
+
+    def _deserialize_one_by_one(self, serialized_list, djmodel, message):
+        """Deserialize records in a transaction each.
+
+        @param serialized_list: A list of JSON-formatted data.
+        @param djmodel: Django model type.
+        @param message: A string to be used in a logging message.
+
+        @returns: The number of records that failed to deserialize.
         """
+        failures = 0
         for serialized in serialized_list:
             with transaction.commit_on_success():
                 try:
@@ -129,6 +179,8 @@ class ShardClient(object):
                                   message, serialized, e)
                     autotest_stats.Counter(STATS_KEY).increment(
                             'deserialization_failures')
+                    failures += 1
+        return failures
 
 
     @timer.decorate
@@ -141,6 +193,8 @@ class ShardClient(object):
         @param heartbeat_response: A dictionary with keys 'hosts' and 'jobs',
                                    as returned by the `shard_heartbeat` rpc
                                    call.
+
+        @returns: True if all records were saved.
         """
         hosts_serialized = heartbeat_response['hosts']
         jobs_serialized = heartbeat_response['jobs']
@@ -153,10 +207,10 @@ class ShardClient(object):
         autotest_stats.Gauge(STATS_KEY).send(
                 'suite_keyvals_received', len(suite_keyvals_serialized))
 
-        self._deserialize_many(hosts_serialized, models.Host, 'host')
-        self._deserialize_many(jobs_serialized, models.Job, 'job')
-        self._deserialize_many(suite_keyvals_serialized, models.JobKeyval,
-                               'jobkeyval')
+        failures = self._deserialize_many(hosts_serialized, models.Host, 'host')
+        failures += self._deserialize_many(jobs_serialized, models.Job, 'job')
+        failures += self._deserialize_many(suite_keyvals_serialized,
+                                           models.JobKeyval, 'jobkeyval')
 
         host_ids = [h['id'] for h in hosts_serialized]
         logging.info('Heartbeat response contains hosts %s', host_ids)
@@ -179,6 +233,7 @@ class ShardClient(object):
             job_ids_repr = ', '.join([str(job.id) for job in job_models])
             logging.warn('Following completed jobs are reset shard_id to NULL '
                          'to be uploaded to master again: %s', job_ids_repr)
+        return failures == 0
 
 
     @property
@@ -241,7 +296,8 @@ class ShardClient(object):
         considerably small.
 
         For hosts, host status in addition to host id are sent to master
-        to sync the host status.
+        to sync the host status. With protocol version 2, only the hosts whose
+        status the master doesn't have yet are sent.
 
         @returns: Tuple of three lists. The first one contains job ids, the
                   second one host ids, and the third one host statuses.
@@ -252,6 +308,9 @@ class ShardClient(object):
         host_ids = []
         host_statuses = []
         for h in host_models:
+            if (self.protocol_version >= 2 and
+                    self._acked_host_statuses.get(h.id) == h.status):
+                continue
             host_ids.append(h.id)
             host_statuses.append(h.status)
         return job_ids, host_ids, host_statuses
@@ -274,6 +333,9 @@ class ShardClient(object):
         jobs = [job.serialize(include_dependencies=False) for job in job_objs]
         logging.info('Uploading jobs %s', [j['id'] for j in jobs])
 
+        if self.protocol_version >= 2:
+            # The master knows which jobs the shard has from the watermark.
+            known_job_ids = []
         return {'shard_hostname': self.hostname,
                 'known_job_ids': known_job_ids,
                 'known_host_ids': known_host_ids,
@@ -281,6 +343,22 @@ class ShardClient(object):
                 'jobs': jobs, 'hqes': hqes}
 
 
+    def _encode_packet(self, packet):
+        """Encode a heartbeat packet for protocol version 2.
+
+        @param packet: A packet as returned by _heartbeat_packet.
+
+        @returns: The keyword arguments of the `shard_heartbeat` rpc call.
+        """
+        return {'shard_hostname': packet['shard_hostname'],
+                'protocol_version': self.protocol_version,
+                'watermark': self._watermark,
+                'payload': rpc_utils.encode_heartbeat_payload({
+                        'jobs': packet['jobs'], 'hqes': packet['hqes'],
+                        'known_host_ids': packet['known_host_ids'],
+                        'known_host_statuses': packet['known_host_statuses']})}
+
+
     def _heartbeat_failure(self, log_message):
         logging.error("Heartbeat failed. %s", log_message)
         autotest_stats.Counter(STATS_KEY).increment('heartbeat_failures')
@@ -296,11 +374,14 @@ class ShardClient(object):
         """
         logging.info("Performing heartbeat.")
         packet = self._heartbeat_packet()
+        rpc_args = packet
+        if self.protocol_version >= 2:
+            rpc_args = self._encode_packet(packet)
         autotest_stats.Gauge(STATS_KEY).send(
-                'heartbeat.request_size', len(str(packet)))
+                'heartbeat.request_size', len(str(rpc_args)))
 
         try:
-            response = self.afe.run(HEARTBEAT_AFE_ENDPOINT, **packet)
+            response = self.afe.run(HEARTBEAT_AFE_ENDPOINT, **rpc_args)
         except urllib2.HTTPError as e:
             self._heartbeat_failure("HTTPError %d: %s" % (e.code, e.reason))
             return
@@ -317,7 +398,21 @@ class ShardClient(object):
         autotest_stats.Gauge(STATS_KEY).send(
                 'heartbeat.response_size', len(str(response)))
         self._mark_jobs_as_uploaded([job['id'] for job in packet['jobs']])
-        self.process_heartbeat_response(response)
+        if self.protocol_version < 2:
+            self.process_heartbeat_response(response)
+        else:
+            self._acked_host_statuses.update(
+                    zip(packet['known_host_ids'],
+                        packet['known_host_statuses']))
+            # Until the records of this response are saved, the shard is out
+            # of sync with the master.
+            self._watermark = None
+            records = rpc_utils.decode_heartbeat_payload(response['payload'])
+            if self.process_heartbeat_response(records):
+                self._watermark = response['sequence']
+            else:
+                # Records will be sent again, sync the host statuses again too.
+                self._acked_host_statuses = {}
         logging.info("Heartbeat completed.")
 
 
@@ -367,6 +462,12 @@ def _get_tick_pause_sec():
         'SHARD', 'heartbeat_pause_sec', type=float)
 
 
+def _get_heartbeat_protocol_version():
+    """Read the heartbeat protocol version from the global configuration."""
+    return global_config.global_config.get_config_value(
+        'SHARD', 'heartbeat_protocol_version', type=int, default=1)
+
+
 def get_shard_client():
     """Instantiate a shard client instance.
 
@@ -377,7 +478,8 @@ def get_shard_client():
     global_afe_hostname = server_utils.get_global_afe_hostname()
     shard_hostname = _get_shard_hostname_and_ensure_running_on_shard()
     tick_pause_sec = _get_tick_pause_sec()
-    return ShardClient(global_afe_hostname, shard_hostname, tick_pause_sec)
+    return ShardClient(global_afe_hostname, shard_hostname, tick_pause_sec,
+                       protocol_version=_get_heartbeat_protocol_version())
 
 
 def main():
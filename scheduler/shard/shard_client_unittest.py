@@ -11,6 +11,7 @@ import common
 from autotest_lib.frontend import setup_django_environment
 from autotest_lib.frontend.afe import frontend_test_utils
 from autotest_lib.frontend.afe import models
+from autotest_lib.frontend.afe import rpc_utils
 from autotest_lib.client.common_lib import error
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.server.cros.dynamic_suite import frontend_wrappers
@@ -289,6 +290,81 @@ class ShardClientTest(mox.MoxTestBase,
         self.mox.VerifyAll()
 
 
+    def expect_delta_heartbeat(self, watermark, known_host_ids=[],
+                               known_host_statuses=[], sequence=0,
+                               return_hosts=[], return_jobs=[]):
+        def payload_matches(payload):
+            request = rpc_utils.decode_heartbeat_payload(payload)
+            return (request['known_host_ids'] == known_host_ids and
+                    request['known_host_statuses'] == known_host_statuses)
+
+        self.afe.run(
+            'shard_heartbeat', shard_hostname='host1', protocol_version=2,
+            watermark=watermark, payload=mox.Func(payload_matches)
+            ).AndReturn({
+                'protocol_version': 2, 'sequence': sequence,
+                'payload': rpc_utils.encode_heartbeat_payload({
+                    'hosts': return_hosts, 'jobs': return_jobs,
+                    'suite_keyvals': []})})
+
+
+    def testDeltaHeartbeat(self):
+        """Send the watermark and changed host statuses only."""
+        self.setup_mocks()
+        self.setup_global_config()
+        global_config.global_config.override_config_value(
+                'SHARD', 'heartbeat_protocol_version', '2')
+
+        host_serialized = self._get_sample_serialized_host()
+        host_id = host_serialized['id']
+        self.expect_delta_heartbeat(
+                None, sequence=1, return_hosts=[host_serialized],
+                return_jobs=[self._get_sample_serialized_job()])
+        self.expect_delta_heartbeat(1, known_host_ids=[host_id],
+                                    known_host_statuses=['Ready'], sequence=2)
+        self.expect_delta_heartbeat(2, sequence=3)
+        self.expect_delta_heartbeat(3, known_host_ids=[host_id],
+                                    known_host_statuses=['Repairing'],
+                                    sequence=4, return_hosts=[{'id': 'bad'}])
+        # The last response wasn't saved, sync everything again.
+        self.expect_delta_heartbeat(None, known_host_ids=[host_id],
+                                    known_host_statuses=['Repairing'],
+                                    sequence=5)
+
+        self.mox.ReplayAll()
+        sut = shard_client.get_shard_client()
+        sut.do_heartbeat()
+        self.assertEqual(models.Host.objects.get(id=host_id).hostname,
+                         'host1')
+        self.assertEqual(models.Job.objects.count(), 1)
+        sut.do_heartbeat()
+        sut.do_heartbeat()
+        models.Host.objects.filter(id=host_id).update(status='Repairing')
+        sut.do_heartbeat()
+        sut.do_heartbeat()
+
+        self.mox.VerifyAll()
+
+
+    def testDeserializeFailingChunkOneByOne(self):
+        """Records of a chunk that fails in bulk are saved one by one."""
+        self.setup_mocks()
+        self.setup_global_config()
+        self.mox.ReplayAll()
+        sut = shard_client.get_shard_client()
+
+        host_serialized = self._get_sample_serialized_host()
+        self.assertFalse(sut.process_heartbeat_response(
+                {'hosts': [host_serialized, {'id': 'bad'}],
+                 'jobs': [self._get_sample_serialized_job()],
+                 'suite_keyvals': []}))
+        self.assertEqual(
+                models.Host.objects.get(id=host_serialized['id']).hostname,
+                'host1')
+        self.assertEqual(models.Job.objects.count(), 1)
+        self.mox.VerifyAll()
+
+
     def testHeartbeatNoShardMode(self):
         """Ensure an exception is thrown when run on a non-shard machine."""
         self.mox.ReplayAll()
@@ -47,8 +47,8 @@ class SiteAgentTask(object):
         else:
             status = self._final_status()
 
-        for queue_entry in self.queue_entries:
-            queue_entry.set_status(status)
+        scheduler_models.HostQueueEntry.set_status_bulk(self.queue_entries,
+                                                        status)
 
 
     def _check_queue_entry_statuses(self, queue_entries, allowed_hqe_statuses,
@@ -120,14 +120,14 @@ class SiteDispatcher(object):
             self._gauge.send('_run_cleanup', time.time() - self._tick_start)
 
     @_timer.decorate
-    def _find_aborting(self):
-        super(SiteDispatcher, self)._find_aborting()
+    def _find_aborting(self, entries=None):
+        super(SiteDispatcher, self)._find_aborting(entries)
         if self._tick_start:
             self._gauge.send('_find_aborting', time.time() - self._tick_start)
 
     @_timer.decorate
-    def _process_recurring_runs(self):
-        super(SiteDispatcher, self)._process_recurring_runs()
+    def _process_recurring_runs(self, recurring_runs=None):
+        super(SiteDispatcher, self)._process_recurring_runs(recurring_runs)
         if self._tick_start:
             self._gauge.send('_process_recurring_runs',
                              time.time() - self._tick_start)
@@ -147,8 +147,8 @@ class SiteDispatcher(object):
                              time.time() - self._tick_start)
 
     @_timer.decorate
-    def _schedule_special_tasks(self):
-        super(SiteDispatcher, self)._schedule_special_tasks()
+    def _schedule_special_tasks(self, special_tasks=None):
+        super(SiteDispatcher, self)._schedule_special_tasks(special_tasks)
         if self._tick_start:
             self._gauge.send('_schedule_special_tasks',
                              time.time() - self._tick_start)
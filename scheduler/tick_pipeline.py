@@ -0,0 +1,157 @@
+"""Run the steps of a scheduler tick, overlapping the independent ones.
+
+A tick is declared as a list of steps. Each step names the steps it depends
+on, and every dependency must be declared before the steps that need it, so
+the declaration order is always a valid serial order. Serial steps run in the
+calling thread, in declaration order. Concurrent steps are submitted to a
+thread pool as soon as all of their dependencies have finished, so they can
+overlap with the serial steps that come before them in the declaration.
+Without a thread pool every step runs in the calling thread, in declaration
+order, which is exactly the order of the old serial tick.
+
+Every step is timed under the given timer with the name of the step, so each
+step gets its own latency histogram.
+"""
+
+import logging
+
+
+class TickPipelineError(Exception):
+    """Raised when a tick pipeline is declared incorrectly."""
+
+
+class _Step(object):
+    """A single step of a tick pipeline."""
+
+    def __init__(self, name, function, depends_on, concurrent):
+        self.name = name
+        self.function = function
+        self.depends_on = tuple(depends_on)
+        self.concurrent = concurrent
+        # For concurrent steps, the AsyncResult of the submitted step.
+        self.async_result = None
+        self.done = False
+        self.result = None
+
+
+    def is_finished(self):
+        """Whether the step has finished, without blocking."""
+        if self.async_result is not None:
+            return self.async_result.ready()
+        return self.done
+
+
+class TickPipeline(object):
+    """A set of tick steps with the dependencies between them."""
+
+    def __init__(self, timer, thread_pool=None):
+        """
+        @param timer: An autotest_stats.Timer each step is timed under.
+        @param thread_pool: An object with an apply_async method, such as a
+                multiprocessing.pool.ThreadPool, that runs the concurrent
+                steps. If None, every step runs serially.
+        """
+        self._timer = timer
+        self._thread_pool = thread_pool
+        self._steps = []
+        self._steps_by_name = {}
+
+
+    def add_step(self, name, function, depends_on=(), concurrent=False):
+        """Declare a step of the tick.
+
+        @param name: A unique name for the step, also used for its timer.
+        @param function: A callable taking no arguments. Its return value
+                is available through get_result.
+        @param depends_on: Names of the steps that must finish before this
+                one starts. They must already have been declared.
+        @param concurrent: If True, the step may run in a worker thread,
+                overlapping with other steps. Concurrent steps must not
+                touch state that serial steps use without synchronization.
+
+        @raises TickPipelineError: If the name is taken or a dependency has
+                not been declared yet.
+        """
+        if name in self._steps_by_name:
+            raise TickPipelineError('Step %s is declared twice.' % name)
+        for dependency in depends_on:
+            if dependency not in self._steps_by_name:
+                raise TickPipelineError(
+                        'Step %s depends on %s, which must be declared '
+                        'first.' % (name, dependency))
+        step = _Step(name, function, depends_on, concurrent)
+        self._steps.append(step)
+        self._steps_by_name[name] = step
+
+
+    def get_result(self, name):
+        """Wait for a step to finish and return its result.
+
+        @param name: The name of the step.
+
+        @returns: The return value of the step's function.
+        @raises: Whatever the step raised.
+        """
+        step = self._steps_by_name[name]
+        if step.async_result is not None:
+            return step.async_result.get()
+        if not step.done:
+            raise TickPipelineError('Step %s has not run yet.' % name)
+        return step.result
+
+
+    def _call(self, step):
+        with self._timer.get_client(step.name):
+            return step.function()
+
+
+    def _run_inline(self, step):
+        for dependency in step.depends_on:
+            self.get_result(dependency)
+        step.result = self._call(step)
+        step.done = True
+
+
+    def _start(self, step):
+        """Start a concurrent step, or run it inline without a pool."""
+        if self._thread_pool is None:
+            self._run_inline(step)
+        else:
+            for dependency in step.depends_on:
+                self.get_result(dependency)
+            step.async_result = self._thread_pool.apply_async(self._call,
+                                                              (step,))
+
+
+    def _start_ready_steps(self):
+        """Start the concurrent steps whose dependencies have all finished."""
+        if self._thread_pool is None:
+            return
+        for step in self._steps:
+            if (step.concurrent and step.async_result is None and
+                    all(self._steps_by_name[dependency].is_finished()
+                        for dependency in step.depends_on)):
+                self._start(step)
+
+
+    def run(self):
+        """Run all the steps, and wait for the concurrent ones to finish.
+
+        @raises: The first exception raised by a step. Once a serial step
+                raises, no further steps are started.
+        """
+        self._start_ready_steps()
+        for step in self._steps:
+            if step.concurrent:
+                if step.async_result is None and not step.done:
+                    self._start(step)
+                continue
+            self._run_inline(step)
+            self._start_ready_steps()
+        for step in self._steps:
+            if step.concurrent:
+                try:
+                    self.get_result(step.name)
+                except Exception:
+                    logging.error('Tick step %s failed.', step.name)
+                    raise
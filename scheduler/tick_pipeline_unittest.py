@@ -0,0 +1,125 @@
+#!/usr/bin/python
+
+"""Tests for the scheduler tick pipeline."""
+
+import threading
+import unittest
+from multiprocessing import pool
+
+import common
+from autotest_lib.scheduler import tick_pipeline
+
+
+class _FakeTimerClient(object):
+    def __init__(self, timer, name):
+        self._timer = timer
+        self._name = name
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exn_type, exn_value, traceback):
+        self._timer.timed.append(self._name)
+
+
+class _FakeTimer(object):
+    """Records the steps that were timed, in the order they finished."""
+
+    def __init__(self):
+        self.timed = []
+
+
+    def get_client(self, name):
+        return _FakeTimerClient(self, name)
+
+
+class TickPipelineTest(unittest.TestCase):
+    """Tests for tick_pipeline.TickPipeline."""
+
+    def setUp(self):
+        self.timer = _FakeTimer()
+        self.calls = []
+        self.thread_pool = None
+
+
+    def tearDown(self):
+        if self.thread_pool:
+            self.thread_pool.close()
+            self.thread_pool.join()
+
+
+    def _step(self, name, result=None):
+        def step():
+            self.calls.append(name)
+            return result
+        return step
+
+
+    def _create_pipeline(self, threaded=False):
+        if threaded:
+            self.thread_pool = pool.ThreadPool(2)
+        return tick_pipeline.TickPipeline(self.timer, self.thread_pool)
+
+
+    def test_serial_order_without_thread_pool(self):
+        """Without a pool, all steps run in declaration order."""
+        pipeline = self._create_pipeline()
+        pipeline.add_step('a', self._step('a'))
+        pipeline.add_step('read', self._step('read', result=[1, 2]),
+                          concurrent=True)
+        pipeline.add_step('b', lambda: self.calls.append(
+                pipeline.get_result('read')), depends_on=('read',))
+        pipeline.run()
+        self.assertEqual(self.calls, ['a', 'read', [1, 2]])
+        self.assertEqual(self.timer.timed, ['a', 'read', 'b'])
+
+
+    def test_dependencies_must_be_declared_first(self):
+        """Dependencies on undeclared steps are rejected."""
+        pipeline = self._create_pipeline()
+        self.assertRaises(tick_pipeline.TickPipelineError, pipeline.add_step,
+                          'a', self._step('a'), depends_on=('b',))
+        pipeline.add_step('a', self._step('a'))
+        self.assertRaises(tick_pipeline.TickPipelineError, pipeline.add_step,
+                          'a', self._step('a'))
+
+
+    def test_concurrent_step_overlaps_earlier_serial_steps(self):
+        """A concurrent step without dependencies starts with the tick."""
+        read_started = threading.Event()
+        pipeline = self._create_pipeline(threaded=True)
+        pipeline.add_step('wait_for_read',
+                          lambda: read_started.wait(5) or read_started.is_set())
+        pipeline.add_step('read', read_started.set, concurrent=True)
+        pipeline.run()
+        self.assertTrue(pipeline.get_result('wait_for_read'))
+
+
+    def test_concurrent_step_waits_for_dependencies(self):
+        """A concurrent step starts only after the steps it depends on."""
+        pipeline = self._create_pipeline(threaded=True)
+        pipeline.add_step('a', self._step('a'))
+        pipeline.add_step('read', lambda: list(self.calls),
+                          depends_on=('a',), concurrent=True)
+        pipeline.add_step('b', self._step('b'), depends_on=('read',))
+        pipeline.run()
+        self.assertEqual(pipeline.get_result('read'), ['a'])
+        self.assertEqual(self.calls, ['a', 'b'])
+
+
+    def test_concurrent_step_failure_is_raised(self):
+        """Exceptions raised in the thread pool are raised by run."""
+        def fail():
+            raise ValueError('read failed')
+
+        pipeline = self._create_pipeline(threaded=True)
+        pipeline.add_step('read', fail, concurrent=True)
+        pipeline.add_step('a', self._step('a'))
+        self.assertRaises(ValueError, pipeline.run)
+        self.assertEqual(self.calls, ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -51,6 +51,30 @@ class RetryingAFE(frontend.AFE):
 
 
     def run(self, call, **dargs):
+        return self._run_with_retries(super(RetryingAFE, self).run, call,
+                                      **dargs)
+
+
+    def run_batch(self, rpcs):
+        """Make several RPC calls in a single request, retrying it.
+
+        Only failures of the request are retried, the RPCs failing in it are
+        given their exceptions.
+
+        @param rpcs: A list of frontend.BatchedRpc.
+        """
+        return self._run_with_retries(super(RetryingAFE, self).run_batch, rpcs)
+
+
+    def _run_with_retries(self, function, *args, **dargs):
+        """Call a function making RPCs, retrying it on failure.
+
+        @param function: The function to call.
+        @param args: Positional arguments of the function.
+        @param dargs: Keyword arguments of the function.
+
+        @returns: The return value of the function.
+        """
         # exc_retry: We retry if this exception is raised.
         # blacklist: Exceptions that we raise immediately if caught.
         exc_retry = Exception
@@ -60,9 +84,6 @@ class RetryingAFE(frontend.AFE):
         max_retry = convert_timeout_to_retry(backoff, self.timeout_min,
                                              self.delay_sec)
 
-        def _run(self, call, **dargs):
-            return super(RetryingAFE, self).run(call, **dargs)
-
         def handler(exc):
             """Check if exc is an exc_retry or if it's blacklisted.
 
@@ -82,18 +103,18 @@ class RetryingAFE(frontend.AFE):
                      delay_sec=self.delay_sec,
                      blacklist=[ImportError, error.RPCException,
                                 proxy.ValidationError])
-        def _run_in_child_thread(self, call, **dargs):
-            return super(RetryingAFE, self).run(call, **dargs)
+        def _run_in_child_thread(*args, **dargs):
+            return function(*args, **dargs)
 
         if isinstance(threading.current_thread(), threading._MainThread):
             # Set the keyword argument for GenericRetry
             dargs['sleep'] = self.delay_sec
             dargs['backoff_factor'] = backoff
             with timeout_util.Timeout(self.timeout_min * 60):
-                return retry_util.GenericRetry(handler, max_retry, _run,
-                                               self, call, **dargs)
+                return retry_util.GenericRetry(handler, max_retry, function,
+                                               *args, **dargs)
         else:
-            return _run_in_child_thread(self, call, **dargs)
+            return _run_in_child_thread(*args, **dargs)
 
 
 class RetryingTKO(frontend.TKO):
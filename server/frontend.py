@@ -13,6 +13,7 @@ For docs, see:
     http://docs.djangoproject.com/en/dev/ref/models/querysets/#queryset-api
 """
 
+import contextlib
 import getpass
 import os
 import re
@@ -36,6 +37,8 @@ form_ntuples_from_machines = server_utils.form_ntuples_from_machines
 
 GLOBAL_CONFIG = global_config.global_config
 DEFAULT_SERVER = 'autotest'
+# Number of results returned by each RPC of run_paged.
+DEFAULT_PAGE_SIZE = 500
 
 _tko_timer = autotest_stats.Timer('tko')
 
@@ -52,6 +55,66 @@ def dump_object(header, obj):
     return result
 
 
+class BatchedRpc(object):
+    """An RPC of an RpcBatch, giving its result once the batch is run."""
+
+    def __init__(self, call, dargs):
+        """
+        @param call: Name of the RPC.
+        @param dargs: Keyword arguments of the RPC.
+        """
+        self.call = call
+        self.dargs = dargs
+        self.done = False
+        self._result = None
+        self._exception = None
+
+
+    def set_result(self, result, exception=None):
+        """Set the outcome of the RPC.
+
+        @param result: The result of the RPC.
+        @param exception: The exception the RPC raised, if it failed.
+        """
+        self._result = result
+        self._exception = exception
+        self.done = True
+
+
+    def result(self):
+        """Get the result of the RPC.
+
+        @raises: The exception of the RPC, if it failed.
+        @raises RuntimeError: If the batch of the RPC was not run yet.
+        """
+        if not self.done:
+            raise RuntimeError('RPC %s was not run yet.' % self.call)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class RpcBatch(object):
+    """RPCs to make in a single request, see RpcClient.batch."""
+
+    def __init__(self):
+        self.rpcs = []
+
+
+    def run(self, call, **dargs):
+        """Add an RPC to the batch.
+
+        @param call: Name of the RPC.
+        @param dargs: Keyword arguments of the RPC.
+
+        @returns: A BatchedRpc, giving the result of the RPC once the batch
+                  is run.
+        """
+        rpc = BatchedRpc(call, dargs)
+        self.rpcs.append(rpc)
+        return rpc
+
+
 class RpcClient(object):
     """
     Abstract RPC class for communicating with the autotest frontend
@@ -109,6 +172,74 @@ class RpcClient(object):
             raise
 
 
+    def run_paged(self, call, page_size=DEFAULT_PAGE_SIZE, key='id', **dargs):
+        """
+        Make a list RPC page by page, yielding the results as they come.
+
+        Pages are requested through the query_after and query_limit filters,
+        so the call must take them, like the list RPCs of the AFE and TKO
+        taking query_start do. The results are sorted by primary key, and
+        results don't shift between pages as objects are added or removed.
+
+        @param call: Name of the list RPC.
+        @param page_size: Number of results requested by each RPC.
+        @param key: Name of the primary key of the results.
+        @param dargs: Keyword arguments of the RPC.
+        """
+        query_after = None
+        while True:
+            page = self.run(call, query_after=query_after,
+                            query_limit=page_size, **dargs)
+            for result in page:
+                yield result
+            if len(page) < page_size:
+                return
+            query_after = page[-1][key]
+
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Coalesce RPCs into a single request to the server.
+
+        RPCs are added through the run method of the yielded RpcBatch, and
+        are all made when the with block exits, eg:
+            with afe.batch() as batch:
+                rpcs = [batch.run('get_jobs', id=job_id, finished=True)
+                        for job_id in job_ids]
+            finished = [rpc.result() for rpc in rpcs]
+        A failing RPC doesn't fail the others, its exception is raised by
+        its result method. The server runs the RPCs in order, one after the
+        other.
+        """
+        batch = RpcBatch()
+        yield batch
+        if batch.rpcs:
+            self.run_batch(batch.rpcs)
+
+
+    def run_batch(self, rpcs):
+        """
+        Make several RPC calls to the server in a single request.
+
+        @param rpcs: A list of BatchedRpc, which are given their results.
+        """
+        if self.debug:
+            for rpc in rpcs:
+                print 'DEBUG: %s %s' % (rpc.call, rpc.dargs)
+        try:
+            results = self.proxy._call_batch(
+                    [(rpc.call, (), rpc.dargs) for rpc in rpcs])
+        except Exception:
+            print 'FAILED RPC BATCH: %s' % [rpc.call for rpc in rpcs]
+            raise
+        for rpc, (result, exception) in zip(rpcs, results):
+            result = utils.strip_unicode(result)
+            if self.reply_debug:
+                print result
+            rpc.set_result(result, exception)
+
+
     def log(self, message):
         if self.print_log:
             print message
@@ -174,6 +305,18 @@ class TKO(RpcClient):
         return [TestStatus(self, e) for e in test_status]
 
 
+    def iter_detailed_test_views(self, page_size=DEFAULT_PAGE_SIZE, **dargs):
+        """Get the get_detailed_test_views RPC results page by page.
+
+        @param page_size: Number of test views requested by each RPC.
+        @param dargs: Filters of the test views.
+
+        @returns: An iterator of test view dictionaries, sorted by test index.
+        """
+        return self.run_paged('get_detailed_test_views', page_size=page_size,
+                              key='test_idx', **dargs)
+
+
     def get_status_counts(self, job, **data):
         entries = self.run('get_status_counts',
                            group_by=['hostname', 'test_name', 'reason'],
@@ -225,6 +368,23 @@ class AFE(RpcClient):
         return [Host(self, h) for h in hosts]
 
 
+    def iter_hosts(self, hostnames=(), status=None, label=None,
+                   page_size=DEFAULT_PAGE_SIZE, **dargs):
+        """Like get_hosts(), but fetch the hosts page by page.
+
+        @param page_size: Number of hosts requested by each RPC.
+
+        @yields: Host objects, sorted by id.
+        """
+        query_args = dict(dargs)
+        query_args.update(self._dict_for_host_query(hostnames=hostnames,
+                                                    status=status,
+                                                    label=label))
+        for host in self.run_paged('get_hosts', page_size=page_size,
+                                   **query_args):
+            yield Host(self, host)
+
+
     def get_hostnames(self, status=None, label=None, **dargs):
         """Like get_hosts() but returns hostnames instead of Host objects."""
         # This implementation can be replaced with a more efficient one
@@ -304,6 +464,37 @@ class AFE(RpcClient):
 
     def get_host_queue_entries(self, **data):
         entries = self.run('get_host_queue_entries', **data)
+        return self._get_job_statuses(entries)
+
+
+    def iter_host_queue_entries(self, page_size=DEFAULT_PAGE_SIZE, **data):
+        """Like get_host_queue_entries(), but fetch the entries page by page.
+
+        @param page_size: Number of entries requested by each RPC.
+
+        @yields: JobStatus objects, sorted by entry id.
+        """
+        entries = []
+        for entry in self.run_paged('get_host_queue_entries',
+                                    page_size=page_size, **data):
+            entries.append(entry)
+            if len(entries) == page_size:
+                for status in self._get_job_statuses(entries):
+                    yield status
+                entries = []
+        if entries:
+            for status in self._get_job_statuses(entries):
+                yield status
+
+
+    def _get_job_statuses(self, entries):
+        """Build the JobStatus objects of host queue entries.
+
+        @param entries: A list of host queue entry dictionaries.
+
+        @returns: A list of JobStatus, of the entries with a host or a
+                  meta host.
+        """
         job_statuses = [JobStatus(self, e) for e in entries]
 
         # Sadly, get_host_queue_entries doesn't return platforms, we have
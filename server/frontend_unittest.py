@@ -44,6 +44,52 @@ class RpcClientTest(BaseRpcClientTest):
         self.god.check_playback()
 
 
+    def test_batch(self):
+        class FakeProxy(object):
+            def _call_batch(self, calls):
+                self.calls = calls
+                return [([u'a'], None), (None, ValueError('bad'))]
+
+        fake_proxy = FakeProxy()
+        GLOBAL_CONFIG.override_config_value('SERVER', 'hostname', 'test-host')
+        rpc_client_lib.get_proxy.expect_call(
+                'http://test-host/path',
+                headers={'AUTHORIZATION': 'unittest-user'}).and_return(
+                        fake_proxy)
+        client = frontend.RpcClient('/path', 'unittest-user', None, False,
+                                    False, False)
+        with client.batch() as batch:
+            rpc1 = batch.run('get_jobs', id=1)
+            rpc2 = batch.run('get_jobs', id=2, finished=True)
+            self.assertRaises(RuntimeError, rpc1.result)
+        self.god.check_playback()
+        self.assertEqual(fake_proxy.calls,
+                         [('get_jobs', (), {'id': 1}),
+                          ('get_jobs', (), {'id': 2, 'finished': True})])
+        self.assertEqual(rpc1.result(), ['a'])
+        self.assertEqual(type(rpc1.result()[0]), str)
+        self.assertRaises(ValueError, rpc2.result)
+
+
+    def test_run_paged(self):
+        rpc_client_lib.get_proxy.expect_call(
+                'http://test-host/path',
+                headers={'AUTHORIZATION': 'unittest-user'})
+        GLOBAL_CONFIG.override_config_value('SERVER', 'hostname', 'test-host')
+        client = frontend.RpcClient('/path', 'unittest-user', None, False,
+                                    False, False)
+        self.god.stub_function(client, 'run')
+        client.run.expect_call('get_hosts', query_after=None, query_limit=2,
+                               status='Ready').and_return([{'id': 1},
+                                                           {'id': 3}])
+        client.run.expect_call('get_hosts', query_after=3, query_limit=2,
+                               status='Ready').and_return([{'id': 4}])
+        hosts = client.run_paged('get_hosts', page_size=2, status='Ready')
+        self.assertEqual(next(hosts), {'id': 1})
+        self.assertEqual(list(hosts), [{'id': 3}, {'id': 4}])
+        self.god.check_playback()
+
+
 class AFETest(BaseRpcClientTest):
     def test_result_notify(self):
         class fake_job(object):
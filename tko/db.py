@@ -2,7 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-import re, os, sys, time, random
+import collections, re, os, struct, sys, time, random
 
 import common
 from autotest_lib.client.common_lib import global_config
@@ -12,10 +12,103 @@ from autotest_lib.server import site_utils
 from autotest_lib.tko import utils
 
 
+# Maximum number of rows inserted by a single statement of a BulkWriter.
+_BULK_INSERT_MAX_ROWS = 1000
+
+# If True, reparsing a job compares the results of its tests with those in
+# the database, and only writes the ones that changed, instead of deleting
+# and inserting them all again.
+_INCREMENTAL_REPARSE = global_config.global_config.get_config_value(
+        'AUTOTEST_WEB', 'tko_incremental_reparse', type=bool, default=False)
+
+# The tables holding the results of tests, with the columns identifying a
+# result of a test, and the columns holding its value.
+_TEST_RESULT_COLUMNS = collections.OrderedDict([
+        ('tko_iteration_attributes', (('iteration', 'attribute'), ('value',))),
+        ('tko_iteration_result', (('iteration', 'attribute'), ('value',))),
+        ('tko_iteration_perf_value',
+         (('iteration', 'description'),
+          ('value', 'stddev', 'units', 'higher_is_better', 'graph'))),
+        ('tko_test_attributes', (('attribute',), ('value',))),
+])
+# The values of the columns left out of inserted rows.
+_TEST_RESULT_DEFAULTS = {'higher_is_better': True}
+# Only these rows of the tables hold results of the parser.
+_PARSED_TEST_RESULTS = {'tko_test_attributes': {'user_created': 0}}
+# The significant digits of the values of FLOAT columns read back from MySQL
+# (FLT_DIG).
+_FLOAT_RESULT_DIGITS = 6
+
+
 class MySQLTooManyRows(Exception):
     pass
 
 
+class BulkWriter(object):
+    """Accumulates the rows to insert in tables, and inserts them in bulk.
+
+    Rows are grouped by table and fields, and each group is inserted with
+    multi-row statements, in a single transaction.
+    """
+
+    def __init__(self, db):
+        """
+        @param db: The db_sql to write to.
+        """
+        self._db = db
+        # Lists of rows by (table, fields), in the order of their first row.
+        self._rows = collections.OrderedDict()
+        # Lists of the values of the where clauses of the rows to delete, by
+        # delete statement.
+        self._deleted_rows = collections.OrderedDict()
+
+
+    def insert(self, table, data):
+        """Queue a row to insert.
+
+        @param table: The name of the table.
+        @param data: A dictionary of fields and data.
+        """
+        fields = tuple(sorted(data))
+        rows = self._rows.setdefault((table, fields), [])
+        rows.append(tuple(data[field] for field in fields))
+
+
+    def delete(self, table, where):
+        """Queue the deletion of rows, before the queued insertions.
+
+        @param table: The name of the table.
+        @param where: A dictionary of fields and values, see db_sql.delete.
+        """
+        where_clause, values = self._db._where_clause(where)
+        cmd = 'delete from %s%s' % (table, where_clause)
+        self._deleted_rows.setdefault(cmd, []).append(values)
+
+
+    def flush(self, commit=None):
+        """Delete, then insert, the queued rows.
+
+        @param commit: Whether to commit the transaction, when the db doesn't
+                autocommit.
+        """
+        statements = []
+        for cmd, rows in self._deleted_rows.iteritems():
+            self._db.dprint('%s [%d rows]' % (cmd, len(rows)))
+            statements.append((cmd, rows))
+        self._deleted_rows.clear()
+        for (table, fields), rows in self._rows.iteritems():
+            cmd = ('insert into %s (%s) values (%s)' %
+                   (table, ','.join(self._db._quote(field) for field in fields),
+                    ','.join('%s' for field in fields)))
+            self._db.dprint('%s [%d rows]' % (cmd, len(rows)))
+            for start in xrange(0, len(rows), _BULK_INSERT_MAX_ROWS):
+                statements.append(
+                        (cmd, rows[start:start + _BULK_INSERT_MAX_ROWS]))
+        self._rows.clear()
+        if statements:
+            self._db._exec_many_with_commit(statements, commit)
+
+
 class db_sql(object):
     def __init__(self, debug=False, autocommit=True, host=None,
                  database=None, user=None, password=None):
@@ -23,6 +116,14 @@ class db_sql(object):
         self.autocommit = autocommit
         self._load_config(host, database, user, password)
 
+        # The indexes of the machines and kernels, by hostname and kernel
+        # hash.
+        self._machine_idx_cache = {}
+        self._kernel_idx_cache = {}
+        # The (cache, key) of the entries written since the last commit, to
+        # drop if the transaction is rolled back.
+        self._uncommitted_cache_keys = []
+
         self.con = None
         self._init_db()
 
@@ -105,6 +206,8 @@ class db_sql(object):
         if self.con:
             self.con.close()
             self.con = None
+        # the uncommitted changes are lost with the connection
+        self._drop_uncommitted_cache_entries()
 
         try:
             # create the db connection and cursor
@@ -175,13 +278,34 @@ class db_sql(object):
 
     def commit(self):
         if self.autocommit:
-            return self.run_with_retry(self._commit)
+            result = self.run_with_retry(self._commit)
         else:
-            return self._commit()
+            result = self._commit()
+        del self._uncommitted_cache_keys[:]
+        return result
 
 
     def rollback(self):
         self.con.rollback()
+        self._drop_uncommitted_cache_entries()
+
+
+    def _cache_written_row(self, cache, key, value):
+        """Cache a value written to the database, until a rollback.
+
+        @param cache: The cache dictionary.
+        @param key: The key of the value.
+        @param value: The value.
+        """
+        cache[key] = value
+        self._uncommitted_cache_keys.append((cache, key))
+
+
+    def _drop_uncommitted_cache_entries(self):
+        """Drop the cached values written since the last commit."""
+        for cache, key in self._uncommitted_cache_keys:
+            cache.pop(key, None)
+        del self._uncommitted_cache_keys[:]
 
 
     def get_last_autonumber_value(self):
@@ -303,6 +427,29 @@ class db_sql(object):
                 self.con.commit()
 
 
+    def _exec_many_with_commit(self, statements, commit):
+        """Execute statements for many rows each, in one transaction.
+
+        @param statements: A list of (sql, list of rows of values) tuples.
+        @param commit: Whether to commit, when the db doesn't autocommit.
+        """
+        def exec_sql():
+            for sql, rows in statements:
+                self.cur.executemany(sql, rows)
+
+        if self.autocommit:
+            # re-run the whole transaction until it succeeds
+            def exec_transaction():
+                exec_sql()
+                self.con.commit()
+            self.run_with_retry(exec_transaction)
+        else:
+            # take one shot at running the statements
+            exec_sql()
+            if commit:
+                self.con.commit()
+
+
     def insert(self, table, data, commit=None):
         """\
                 'insert into table (keys) values (%s ... %s)', values
@@ -404,24 +551,105 @@ class db_sql(object):
         else:
             self.insert('tko_jobs', data, commit=commit)
             job.index = self.get_last_autonumber_value()
-        self.update_job_keyvals(job, commit=commit)
+        writer = BulkWriter(self)
+        self.update_job_keyvals(job, commit=commit, writer=writer)
+        old_results = None
+        if is_update and _INCREMENTAL_REPARSE:
+            old_results = self.load_test_results(
+                    [test.test_idx for test in job.tests
+                     if hasattr(test, 'test_idx')])
         for test in job.tests:
-            self.insert_test(job, test, commit=commit)
+            self.insert_test(job, test, commit=commit, writer=writer,
+                             old_results=old_results)
+        writer.flush(commit=commit)
 
 
-    def update_job_keyvals(self, job, commit=None):
+    def update_job_keyvals(self, job, commit=None, writer=None):
+        """Insert or update the keyvals of a job.
+
+        @param job: The job.
+        @param commit: Whether to commit, when the db doesn't autocommit.
+        @param writer: A BulkWriter to queue the new keyvals in, for the
+                caller to flush. If None, they are inserted before returning.
+        """
+        if writer is None:
+            writer = BulkWriter(self)
+            self.update_job_keyvals(job, commit=commit, writer=writer)
+            writer.flush(commit=commit)
+            return
+
+        old_keyvals = collections.defaultdict(set)
+        for key, value in self.select('`key`, value', 'tko_job_keyvals',
+                                      {'job_id': job.index}):
+            old_keyvals[key].add(value)
         for key, value in job.keyval_dict.iteritems():
             where = {'job_id': job.index, 'key': key}
             data = dict(where, value=value)
-            exists = self.select('id', 'tko_job_keyvals', where=where)
-
-            if exists:
+            if key not in old_keyvals:
+                writer.insert('tko_job_keyvals', data)
+            elif old_keyvals[key] != set([_to_string(value)]):
                 self.update('tko_job_keyvals', data, where=where, commit=commit)
-            else:
-                self.insert('tko_job_keyvals', data, commit=commit)
 
 
-    def insert_test(self, job, test, commit = None):
+    def load_test_results(self, test_idxs):
+        """Load the results of tests, as written by insert_test.
+
+        @param test_idxs: The indexes of the tests.
+
+        @returns A dictionary, by test index, of dictionaries by table, of
+                dictionaries of the sorted lists of the values of the results,
+                by the values of the columns identifying them. See
+                _TEST_RESULT_COLUMNS.
+        """
+        results = {}
+        if not test_idxs:
+            return results
+        for table, (key_columns, value_columns) in (
+                _TEST_RESULT_COLUMNS.iteritems()):
+            where = 'test_idx IN (%s)' % ','.join(['%s'] * len(test_idxs))
+            values = list(test_idxs)
+            for field, value in _PARSED_TEST_RESULTS.get(table, {}).iteritems():
+                where += ' AND %s = %%s' % self._quote(field)
+                values.append(value)
+            fields = ('test_idx',) + key_columns + value_columns
+            rows = self.select(','.join(self._quote(field) for field in fields),
+                               table, (where, values))
+            for row in rows:
+                key = tuple(row[1:len(key_columns) + 1])
+                row_values = tuple(_normalize_result_value(value) for value
+                                   in row[len(key_columns) + 1:])
+                test_results = results.setdefault(row[0], {})
+                table_results = test_results.setdefault(table, {})
+                table_results.setdefault(key, []).append(row_values)
+        for test_results in results.itervalues():
+            for table_results in test_results.itervalues():
+                for row_values in table_results.itervalues():
+                    row_values.sort()
+        return results
+
+
+    def insert_test(self, job, test, commit=None, writer=None,
+                    old_results=None):
+        """Insert or update a test, and its results.
+
+        @param job: The job of the test.
+        @param test: The test.
+        @param commit: Whether to commit, when the db doesn't autocommit.
+        @param writer: A BulkWriter to queue the results of the test in, for
+                the caller to flush. If None, they are inserted before
+                returning.
+        @param old_results: The results of the tests of the job in the
+                database, from load_test_results. When updating a test, only
+                its results that differ from them are written. If None, all
+                its results are deleted and inserted again.
+        """
+        if writer is None:
+            writer = BulkWriter(self)
+            self.insert_test(job, test, commit=commit, writer=writer,
+                             old_results=old_results)
+            writer.flush(commit=commit)
+            return
+
         kver = self.insert_kernel(test.kernel, commit=commit)
         data = {'job_idx':job.index, 'test':test.testname,
                 'subdir':test.subdir, 'kernel_idx':kver,
@@ -434,15 +662,41 @@ class db_sql(object):
             test_idx = test.test_idx
             self.update('tko_tests', data,
                         {'test_idx': test_idx}, commit=commit)
-            where = {'test_idx': test_idx}
-            self.delete('tko_iteration_result', where)
-            self.delete('tko_iteration_perf_value', where)
-            self.delete('tko_iteration_attributes', where)
-            where['user_created'] = 0
-            self.delete('tko_test_attributes', where)
+            if old_results is None:
+                where = {'test_idx': test_idx}
+                self.delete('tko_iteration_result', where)
+                self.delete('tko_iteration_perf_value', where)
+                self.delete('tko_iteration_attributes', where)
+                where['user_created'] = 0
+                self.delete('tko_test_attributes', where)
         else:
             self.insert('tko_tests', data, commit=commit)
             test_idx = test.test_idx = self.get_last_autonumber_value()
+
+        results = self._get_test_results(test, test_idx)
+        if is_update and old_results is not None:
+            self._update_test_results(test_idx, results,
+                                      old_results.get(test_idx, {}), writer)
+        else:
+            for table in _TEST_RESULT_COLUMNS:
+                for row in results[table]:
+                    writer.insert(table, row)
+
+        if not is_update:
+            for label_index in test.labels:
+                data = {'test_id': test_idx, 'testlabel_id': label_index}
+                writer.insert('tko_test_labels_tests', data)
+
+
+    def _get_test_results(self, test, test_idx):
+        """Get the rows of the results of a test.
+
+        @param test: The test.
+        @param test_idx: The index of the test.
+
+        @returns A dictionary of the lists of rows to insert, by table.
+        """
+        results = dict((table, []) for table in _TEST_RESULT_COLUMNS)
         data = {'test_idx': test_idx}
 
         for i in test.iterations:
@@ -450,13 +704,11 @@ class db_sql(object):
             for key, value in i.attr_keyval.iteritems():
                 data['attribute'] = key
                 data['value'] = value
-                self.insert('tko_iteration_attributes', data,
-                            commit=commit)
+                results['tko_iteration_attributes'].append(dict(data))
             for key, value in i.perf_keyval.iteritems():
                 data['attribute'] = key
                 data['value'] = value
-                self.insert('tko_iteration_result', data,
-                            commit=commit)
+                results['tko_iteration_result'].append(dict(data))
 
         data = {'test_idx': test_idx}
         for i in test.perf_values:
@@ -474,17 +726,48 @@ class db_sql(object):
                 if perf_dict['higher_is_better'] is not None:
                     data['higher_is_better'] = perf_dict['higher_is_better']
                 data['graph'] = perf_dict['graph']
-                self.insert('tko_iteration_perf_value', data, commit=commit)
+                results['tko_iteration_perf_value'].append(dict(data))
 
         for key, value in test.attributes.iteritems():
             data = {'test_idx': test_idx, 'attribute': key,
                     'value': value}
-            self.insert('tko_test_attributes', data, commit=commit)
+            results['tko_test_attributes'].append(data)
+        return results
 
-        if not is_update:
-            for label_index in test.labels:
-                data = {'test_id': test_idx, 'testlabel_id': label_index}
-                self.insert('tko_test_labels_tests', data, commit=commit)
+
+    def _update_test_results(self, test_idx, results, old_results, writer):
+        """Write the results of a test that differ from those in the database.
+
+        @param test_idx: The index of the test.
+        @param results: The rows of the results of the test, by table.
+        @param old_results: The results of the test in the database, see
+                load_test_results.
+        @param writer: The BulkWriter to queue the changes in.
+        """
+        for table, (key_columns, value_columns) in (
+                _TEST_RESULT_COLUMNS.iteritems()):
+            rows_by_key = collections.defaultdict(list)
+            for row in results[table]:
+                rows_by_key[tuple(row[field] for field in key_columns)].append(
+                        row)
+            old_values_by_key = old_results.get(table, {})
+            for key in set(rows_by_key) | set(old_values_by_key):
+                rows = rows_by_key.get(key, [])
+                values = sorted(
+                        tuple(_normalize_result_value(
+                                row.get(field,
+                                        _TEST_RESULT_DEFAULTS.get(field)))
+                              for field in value_columns)
+                        for row in rows)
+                old_values = old_values_by_key.get(key)
+                if values == old_values:
+                    continue
+                if old_values:
+                    where = dict(zip(key_columns, key), test_idx=test_idx)
+                    where.update(_PARSED_TEST_RESULTS.get(table, {}))
+                    writer.delete(table, where)
+                for row in rows:
+                    writer.insert(table, row)
 
 
     def read_machine_map(self):
@@ -512,29 +795,46 @@ class db_sql(object):
     def insert_machine(self, job, commit = None):
         machine_info = self.machine_info_dict(job)
         self.insert('tko_machines', machine_info, commit=commit)
-        return self.get_last_autonumber_value()
+        machine_idx = self.get_last_autonumber_value()
+        hostname = machine_info['hostname']
+        self._cache_written_row(self._machine_idx_cache, hostname, machine_idx)
+        return machine_idx
 
 
     def update_machine_information(self, job, commit = None):
         machine_info = self.machine_info_dict(job)
+        hostname = machine_info['hostname']
+        # Other parser processes write the machines too, so compare with the
+        # row rather than with what this one last wrote.
+        rows = self.select('machine_group,owner', 'tko_machines',
+                           {'hostname': hostname})
+        if rows and tuple(rows[0]) == (machine_info['machine_group'],
+                                       machine_info['owner']):
+            return
         self.update('tko_machines', machine_info,
-                    where={'hostname': machine_info['hostname']},
+                    where={'hostname': hostname},
                     commit=commit)
 
 
     def lookup_machine(self, hostname):
+        if hostname in self._machine_idx_cache:
+            return self._machine_idx_cache[hostname]
         where = { 'hostname' : hostname }
         rows = self.select('machine_idx', 'tko_machines', where)
         if rows:
+            self._machine_idx_cache[hostname] = rows[0][0]
             return rows[0][0]
         else:
             return None
 
 
     def lookup_kernel(self, kernel):
+        if kernel.kernel_hash in self._kernel_idx_cache:
+            return self._kernel_idx_cache[kernel.kernel_hash]
         rows = self.select('kernel_idx', 'tko_kernels',
                                 {'kernel_hash':kernel.kernel_hash})
         if rows:
+            self._kernel_idx_cache[kernel.kernel_hash] = rows[0][0]
             return rows[0][0]
         else:
             return None
@@ -570,6 +870,8 @@ class db_sql(object):
 
         for patch in kernel.patches:
             self.insert_patch(kver, patch, commit=commit)
+        self._cache_written_row(self._kernel_idx_cache, kernel.kernel_hash,
+                                kver)
         return kver
 
 
@@ -610,6 +912,36 @@ class db_sql(object):
             return None
 
 
+def _to_string(value):
+    """Convert a value to the string stored in a VARCHAR column."""
+    if isinstance(value, basestring):
+        return value
+    return str(value)
+
+
+def _normalize_result_value(value):
+    """Convert a value of a result to how it is read back, to compare them.
+
+    The values of results are stored in FLOAT columns, of single precision,
+    which MySQL returns rounded to _FLOAT_RESULT_DIGITS significant digits,
+    and booleans are stored as integers. Values read from the database are
+    normalized too, so that those read with more precision compare equal.
+
+    @param value: The value of a column of a result.
+
+    @returns The value, converted.
+    """
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        try:
+            value = struct.unpack('f', struct.pack('f', value))[0]
+        except OverflowError:
+            return value
+        return float('%.*g' % (_FLOAT_RESULT_DIGITS, value))
+    return value
+
+
 def _get_db_type():
     """Get the database type name to use from the global config."""
     get_value = global_config.global_config.get_config_value_with_fallback
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+"""Benchmark inserting the results of a job in the tko db, row by row versus
+in bulk.
+
+Builds a synthetic job with a number of tests, each with one iteration of
+perf keyvals, and inserts its tests through db_sql.insert_test, once inserting
+each result row with its own statement and once with a BulkWriter. The
+database connection is simulated, each statement sent to it waits for a
+configurable round trip latency, so the benchmark needs no database server.
+
+Usage: db_benchmark.py [--tests 50] [--keyvals 2000] [--latency_ms 0.2]
+"""
+
+import argparse
+import datetime
+import time
+
+import common
+from autotest_lib.tko import db, models
+
+
+class _SimulatedCursor(object):
+    """Counts the statements sent, waiting for their round trips."""
+
+    def __init__(self, latency_sec):
+        self._latency_sec = latency_sec
+        self._results = []
+        self._last_id = 0
+        self.round_trips = 0
+
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self._latency_sec:
+            time.sleep(self._latency_sec)
+
+
+    def execute(self, sql, values):
+        self._round_trip()
+        if sql.startswith('select status_idx'):
+            self._results = [(1, 'GOOD')]
+        elif sql.startswith('SELECT LAST_INSERT_ID'):
+            self._results = [(self._last_id,)]
+        else:
+            if sql.startswith('insert'):
+                self._last_id += 1
+            self._results = []
+        return len(self._results)
+
+
+    def executemany(self, sql, rows):
+        # MySQLdb sends a single multi-row insert.
+        self._round_trip()
+        self._last_id += len(rows)
+
+
+    def fetchall(self):
+        return self._results
+
+
+class _SimulatedConnection(object):
+    def __init__(self, latency_sec):
+        self._cursor = _SimulatedCursor(latency_sec)
+
+
+    def cursor(self):
+        return self._cursor
+
+
+    def commit(self):
+        self._cursor._round_trip()
+
+
+    def close(self):
+        pass
+
+
+class _RowWriter(object):
+    """A BulkWriter inserting each row with its own statement."""
+
+    def __init__(self, tko_db):
+        self._db = tko_db
+
+
+    def insert(self, table, data):
+        self._db.insert(table, data)
+
+
+    def flush(self, commit=None):
+        pass
+
+
+def _make_job(num_tests, num_keyvals):
+    now = datetime.datetime.now()
+    job = models.job('/results/1-benchmark', 'benchmark', 'benchmark',
+                     'host1', now, now, now, None, None, None, None, {})
+    job.index = 1
+    job.machine_idx = 1
+    kernel = models.kernel('3.8.11', [], 'benchmark_kernel')
+    perf_keyval = dict(('perf_key_%d' % i, float(i))
+                       for i in xrange(num_keyvals))
+    for i in xrange(num_tests):
+        iteration = models.iteration(1, {}, perf_keyval)
+        job.tests.append(models.test(
+                'test%d' % i, 'benchmark_test%d' % i, 'GOOD', '', kernel,
+                'host1', now, now, [iteration], {'version': '1'}, [], []))
+    return job
+
+
+def _time_insert_tests(job, latency_sec, bulk):
+    class simulated_db(db.db_sql):
+        def connect(self, host, database, user, password, port):
+            return _SimulatedConnection(latency_sec)
+
+    tko_db = simulated_db(autocommit=False)
+    tko_db.cur.round_trips = 0
+    start = time.time()
+    writer = db.BulkWriter(tko_db) if bulk else _RowWriter(tko_db)
+    for test in job.tests:
+        tko_db.insert_test(job, test, writer=writer)
+    writer.flush()
+    tko_db.commit()
+    return time.time() - start, tko_db.cur.round_trips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tests', type=int, default=50,
+                        help='Number of tests in the job.')
+    parser.add_argument('--keyvals', type=int, default=2000,
+                        help='Number of perf keyvals of each test.')
+    parser.add_argument('--latency_ms', type=float, default=0.2,
+                        help='Simulated round trip latency of a statement.')
+    args = parser.parse_args()
+
+    for name, bulk in (('row by row', False), ('bulk', True)):
+        job = _make_job(args.tests, args.keyvals)
+        duration, round_trips = _time_insert_tests(
+                job, args.latency_ms / 1000.0, bulk)
+        print '%-12s %8.2f s  %8d round trips' % (name, duration, round_trips)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/python
+
+import datetime, sqlite3, unittest
+
+import common
+from autotest_lib.tko import db, models
+
+
+_SCHEMA = """
+CREATE TABLE tko_status (status_idx INTEGER PRIMARY KEY, word VARCHAR(10));
+INSERT INTO tko_status VALUES (1, 'GOOD');
+INSERT INTO tko_status VALUES (2, 'FAIL');
+CREATE TABLE tko_machines (machine_idx INTEGER PRIMARY KEY, hostname TEXT,
+                           machine_group TEXT, owner TEXT);
+CREATE TABLE tko_kernels (kernel_idx INTEGER PRIMARY KEY, kernel_hash TEXT,
+                          base TEXT, printable TEXT);
+CREATE TABLE tko_tests (test_idx INTEGER PRIMARY KEY, job_idx INT, test TEXT,
+                        subdir TEXT, kernel_idx INT, status INT, reason TEXT,
+                        machine_idx INT, started_time TIMESTAMP,
+                        finished_time TIMESTAMP);
+CREATE TABLE tko_iteration_attributes (test_idx INT, iteration INT,
+                                       attribute TEXT, value TEXT);
+CREATE TABLE tko_iteration_result (test_idx INT, iteration INT,
+                                   attribute TEXT, value FLOAT);
+CREATE TABLE tko_iteration_perf_value (
+        test_idx INT, iteration INT, description TEXT, value FLOAT,
+        stddev FLOAT, units TEXT, higher_is_better BOOLEAN NOT NULL DEFAULT 1,
+        graph TEXT);
+CREATE TABLE tko_test_attributes (id INTEGER PRIMARY KEY, test_idx INT,
+                                  attribute TEXT, value TEXT,
+                                  user_created BOOLEAN NOT NULL DEFAULT 0);
+CREATE TABLE tko_test_labels_tests (test_id INT, testlabel_id INT);
+CREATE TABLE tko_job_keyvals (id INTEGER PRIMARY KEY, job_id INT, `key` TEXT,
+                              value TEXT);
+"""
+
+
+class fake_cursor(object):
+    """Runs the statements in sqlite, recording them."""
+
+    def __init__(self, connection):
+        self._cursor = connection.cursor()
+        self.statements = []
+
+
+    def _to_sqlite(self, sql):
+        return sql.replace('%s', '?').replace('LAST_INSERT_ID()',
+                                              'last_insert_rowid()')
+
+
+    def execute(self, sql, values):
+        self.statements.append((sql, list(values)))
+        self._cursor.execute(self._to_sqlite(sql), values)
+        return self._cursor.rowcount
+
+
+    def executemany(self, sql, rows):
+        self.statements.append((sql, list(rows)))
+        self._cursor.executemany(self._to_sqlite(sql), rows)
+
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+
+class fake_connection(object):
+    def __init__(self):
+        self._connection = sqlite3.connect(':memory:')
+        self._connection.executescript(_SCHEMA)
+        self.cursor_ = fake_cursor(self._connection)
+        self.commits = 0
+
+
+    def cursor(self):
+        return self.cursor_
+
+
+    def commit(self):
+        self._connection.commit()
+        self.commits += 1
+
+
+    def rollback(self):
+        self._connection.rollback()
+
+
+class fake_db(db.db_sql):
+    def connect(self, host, database, user, password, port):
+        return fake_connection()
+
+
+def make_test(subdir, perf_keyvals):
+    """Make a test with one iteration of perf keyvals."""
+    kernel = models.kernel('2.6.24', [], 'hash')
+    iteration = models.iteration(1, {'attr': 'value'}, perf_keyvals)
+    return models.test(subdir, 'test_' + subdir, 'GOOD', '', kernel,
+                       'host1', datetime.datetime.now(),
+                       datetime.datetime.now(), [iteration],
+                       {'version': '1'}, [], [])
+
+
+class db_test_case(unittest.TestCase):
+    def setUp(self):
+        self.db = fake_db(autocommit=False)
+        self.cur = self.db.cur
+        del self.cur.statements[:]
+        self.job = models.job('/results/1-user', 'user', 'label', 'host1',
+                              None, None, None, None, None, None, None, {})
+        self.job.index = 1
+        self.job.machine_idx = 1
+
+
+    def _statements(self, verb, table):
+        return [rows for sql, rows in self.cur.statements
+                if sql.startswith('%s %s ' % (verb, table))]
+
+
+    def _inserts(self, table):
+        return self._statements('insert into', table)
+
+
+class insert_test_test(db_test_case):
+    def test_results_inserted_in_bulk(self):
+        test = make_test('test1', dict(('key%d' % i, float(i))
+                                       for i in xrange(5)))
+        self.db.insert_test(self.job, test)
+
+        self.assertEquals(len(self._inserts('tko_tests')), 1)
+        inserts = self._inserts('tko_iteration_result')
+        self.assertEquals(len(inserts), 1)
+        self.assertEquals(sorted(inserts[0]),
+                          [('key%d' % i, 1, test.test_idx, float(i))
+                           for i in xrange(5)])
+        self.assertEquals(self._inserts('tko_iteration_attributes'),
+                          [[('attr', 1, test.test_idx, 'value')]])
+        self.assertEquals(self._inserts('tko_test_attributes'),
+                          [[('version', test.test_idx, '1')]])
+
+
+    def test_large_inserts_split(self):
+        self.job.tests = [make_test('test%d' % i,
+                                    dict(('key%d' % j, float(j))
+                                         for j in xrange(700)))
+                          for i in xrange(3)]
+        writer = db.BulkWriter(self.db)
+        for test in self.job.tests:
+            self.db.insert_test(self.job, test, writer=writer)
+        self.assertEquals(self._inserts('tko_iteration_result'), [])
+        writer.flush(commit=True)
+
+        inserts = self._inserts('tko_iteration_result')
+        self.assertEquals([len(rows) for rows in inserts], [1000, 1000, 100])
+        self.assertEquals(set(row[2] for rows in inserts for row in rows),
+                          set(test.test_idx for test in self.job.tests))
+        self.assertEquals(self.db.con.commits, 1)
+
+
+class lookup_cache_test(db_test_case):
+    def setUp(self):
+        super(lookup_cache_test, self).setUp()
+        self.job.machine_group = 'group1'
+        self.job.machine_owner = 'owner1'
+
+
+    def test_kernel_looked_up_once(self):
+        kernel = models.kernel('2.6.24', [], 'hash')
+        kernel_idx = self.db.insert_kernel(kernel)
+        self.db.commit()
+        del self.cur.statements[:]
+        self.assertEquals(self.db.insert_kernel(kernel), kernel_idx)
+        self.assertEquals(self.cur.statements, [])
+
+        self.db._kernel_idx_cache.clear()
+        self.assertEquals(self.db.insert_kernel(kernel), kernel_idx)
+        self.assertEquals(self.db.insert_kernel(kernel), kernel_idx)
+        self.assertEquals(len(self.cur.statements), 1)
+
+
+    def test_rolled_back_kernel_inserted_again(self):
+        kernel = models.kernel('2.6.24', [], 'hash')
+        self.db.insert_kernel(kernel)
+        self.db.rollback()
+        del self.cur.statements[:]
+        self.db.insert_kernel(kernel)
+        self.assertEquals(len(self._inserts('tko_kernels')), 1)
+
+
+    def test_unchanged_machine_not_updated(self):
+        machine_idx = self.db.insert_machine(self.job)
+        self.db.commit()
+        del self.cur.statements[:]
+        self.assertEquals(self.db.lookup_machine('host1'), machine_idx)
+        self.db.update_machine_information(self.job)
+        self.assertEquals(self._statements('update', 'tko_machines'), [])
+
+        # Another parser process updates the machine.
+        self.db.con._connection.execute(
+                "update tko_machines set owner = 'owner2'")
+        self.db.update_machine_information(self.job)
+        self.assertEquals(len(self._statements('update', 'tko_machines')), 1)
+        self.assertEquals(self.db.select('owner', 'tko_machines', {}),
+                          [('owner1',)])
+
+
+class reparse_test(db_test_case):
+    def _deletes(self, table):
+        return [rows for sql, rows in self.cur.statements
+                if sql.startswith('delete from %s ' % table)]
+
+
+    def _rows(self, table, fields):
+        return sorted(self.db.con._connection.execute(
+                'select %s from %s' % (fields, table)).fetchall())
+
+
+    def _reparse(self, test):
+        """Reparse a test, returning the statements run on its results."""
+        old_results = self.db.load_test_results([test.test_idx])
+        del self.cur.statements[:]
+        self.db.insert_test(self.job, test, old_results=old_results)
+
+
+    def test_unchanged_results_not_written(self):
+        test = make_test('test1', {'key1': 0.1, 'key2': 2.0})
+        test.perf_values = [models.perf_value_iteration(1, [
+                {'description': 'perf', 'value': 0.3, 'stddev': 0.1,
+                 'units': 'ms', 'higher_is_better': None, 'graph': None}])]
+        self.db.insert_test(self.job, test)
+        self._reparse(test)
+
+        for table in ('tko_iteration_attributes', 'tko_iteration_result',
+                      'tko_iteration_perf_value', 'tko_test_attributes'):
+            self.assertEquals(self._inserts(table), [])
+            self.assertEquals(self._deletes(table), [])
+
+
+    def test_rounded_float_results_not_written(self):
+        test = make_test('test1', {'key1': 1234.5678, 'key2': 0.123456789})
+        test.perf_values = [models.perf_value_iteration(1, [
+                {'description': 'perf', 'value': 98765.4321,
+                 'stddev': 1.23456789, 'units': 'ms',
+                 'higher_is_better': None, 'graph': None}])]
+        self.db.insert_test(self.job, test)
+        fetchall = self.cur.fetchall
+        def rounded_fetchall():
+            # MySQL returns FLOAT columns with 6 significant digits.
+            return [tuple(float('%.6g' % value) if isinstance(value, float)
+                          else value for value in row)
+                    for row in fetchall()]
+        self.cur.fetchall = rounded_fetchall
+        self._reparse(test)
+
+        for table in ('tko_iteration_result', 'tko_iteration_perf_value'):
+            self.assertEquals(self._inserts(table), [])
+            self.assertEquals(self._deletes(table), [])
+
+
+    def test_changed_results_written(self):
+        test = make_test('test1', {'same': 1.0, 'changed': 2.0, 'gone': 3.0})
+        self.db.insert_test(self.job, test)
+        reparsed = make_test('test1', {'same': 1.0, 'changed': 2.5,
+                                       'new': 4.0})
+        reparsed.test_idx = test.test_idx
+        self._reparse(reparsed)
+
+        self.assertEquals(
+                sorted(row[0] for rows in self._deletes('tko_iteration_result')
+                       for row in rows),
+                ['changed', 'gone'])
+        self.assertEquals(
+                sorted(row[0] for rows in self._inserts('tko_iteration_result')
+                       for row in rows),
+                ['changed', 'new'])
+        self.assertEquals(self._inserts('tko_iteration_attributes'), [])
+        self.assertEquals(self._rows('tko_iteration_result',
+                                     'attribute, value'),
+                          [('changed', 2.5), ('new', 4.0), ('same', 1.0)])
+
+
+    def test_user_created_attributes_kept(self):
+        test = make_test('test1', {})
+        self.db.insert_test(self.job, test)
+        self.db.insert('tko_test_attributes',
+                       {'test_idx': test.test_idx, 'attribute': 'version',
+                        'value': 'mine', 'user_created': 1})
+        test.attributes = {}
+        self._reparse(test)
+
+        self.assertEquals(self._rows('tko_test_attributes',
+                                     'attribute, value, user_created'),
+                          [('version', 'mine', 1)])
+
+
+    def test_changed_keyvals_written(self):
+        self.job.keyval_dict = {'same': '1', 'changed': '2'}
+        self.db.update_job_keyvals(self.job)
+        self.job.keyval_dict = {'same': '1', 'changed': '3', 'new': 4}
+        del self.cur.statements[:]
+        self.db.update_job_keyvals(self.job)
+
+        self.assertEquals(len(self.cur.statements), 3)
+        self.assertEquals(self._rows('tko_job_keyvals', '`key`, value'),
+                          [('changed', '3'), ('new', '4'), ('same', '1')])
+
+
+if __name__ == '__main__':
+    unittest.main()
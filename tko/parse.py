@@ -1,7 +1,10 @@
 #!/usr/bin/python -u
 
+import contextlib
+import cPickle
 import datetime
 import json
+import multiprocessing
 import os, sys, optparse, fcntl, errno, traceback, socket
 
 import common
@@ -16,6 +19,20 @@ from autotest_lib.tko import models, status_lib
 from autotest_lib.tko.perf_upload import perf_uploader
 
 
+# The state of the streaming parse of a job, saved in its results directory.
+_PARSE_STATE_FILE = 'job.parse_state'
+# Number of bytes of the status log before the parsed ones kept in the state,
+# to check the log wasn't replaced.
+_PARSE_STATE_TAIL_BYTES = 256
+
+# Bounds the number of parse processes writing to the database at once, see
+# _init_worker. None if it isn't bounded.
+_db_semaphore = None
+# The database handle and the command line options of a parse process.
+_worker_db = None
+_worker_options = None
+
+
 def parse_args():
     """Parse args."""
     # build up our options parser and parse sys.argv
@@ -43,6 +60,21 @@ def parse_args():
                       help="write pidfile (.parser_execute)",
                       dest="write_pidfile", action="store_true",
                       default=False)
+    parser.add_option("--streaming",
+                      help=("Only parse the status lines appended since the "
+                            "previous streaming parse of the job, and save "
+                            "the state of the parser for the next one until "
+                            "the job finishes. Implies -r"),
+                      dest="streaming", action="store_true", default=False)
+    parser.add_option("--processes",
+                      help=("Number of processes parsing jobs in parallel "
+                            "(default 1)"),
+                      dest="processes", type="int", default=1)
+    parser.add_option("--db-concurrency",
+                      help=("Maximum number of processes writing to the "
+                            "database at once, with --processes (default: "
+                            "no limit)"),
+                      dest="db_concurrency", type="int", default=0)
     parser.add_option("--record-duration",
                       help="Record timing to metadata db",
                       dest="record_duration", action="store_true",
@@ -177,7 +209,148 @@ def _invalidate_original_tests(orig_job_idx, retry_job_idx):
     tko_utils.dprint('DEBUG: Invalidated tests associated to job: ' + msg)
 
 
-def parse_one(db, jobname, path, reparse, mail_on_failure):
+def _load_parse_state(path, status_log, status_version):
+    """Load the state of the streaming parse of a job.
+
+    @param path: The path to the results of the job.
+    @param status_log: The path to the status log of the job.
+    @param status_version: The version of the status log.
+
+    @returns The state saved by _save_parse_state, or None if there is none,
+             or it doesn't match the status log.
+    """
+    state_file = os.path.join(path, _PARSE_STATE_FILE)
+    if not os.path.exists(state_file):
+        return None
+    try:
+        with open(state_file) as f:
+            state = cPickle.load(f)
+    except Exception, e:
+        tko_utils.dprint("! Ignoring unreadable parser state %s: %s"
+                         % (state_file, e))
+        return None
+    if (state['status_log'] != os.path.basename(status_log) or
+        state['status_version'] != status_version):
+        return None
+    tail = state['tail']
+    with open(status_log) as f:
+        f.seek(state['offset'] - len(tail))
+        if f.read(len(tail)) != tail:
+            tko_utils.dprint("! Status log changed, parsing it all again")
+            return None
+    return state
+
+
+def _save_parse_state(path, state):
+    """Save the state of the streaming parse of a job.
+
+    @param path: The path to the results of the job.
+    @param state: A dictionary with the checkpoint of the parser, the tests
+                  it returned, the keys of the tests reported, and the offset
+                  and tail of the status log parsed.
+    """
+    state_file = os.path.join(path, _PARSE_STATE_FILE)
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temp_file, state_file)
+
+
+def _get_test_key(test):
+    """Get the key identifying a test of a job across streaming parses."""
+    return test.testname, test.subdir
+
+
+def parse_status_log(parser, job, path, status_log, status_version,
+                     streaming=False):
+    """Parse the status log of a job.
+
+    In streaming mode, only the lines appended to the status log since the
+    previous streaming parse are parsed, starting from the saved state of the
+    parser. Until the job is finished, the last line is left for the next
+    parse if it is incomplete, and the state of the parser is saved instead
+    of ending the parse.
+
+    The tests to report, by mail and to the perf dashboard, are the tests
+    that completed since the previous streaming parse, or all the tests not
+    reported yet once the job is finished. They are recorded as reported in
+    the saved state, so a test is reported at most once.
+
+    @param parser: The status log parser.
+    @param job: The job model made by the parser.
+    @param path: The path to the results of the job.
+    @param status_log: The path to the status log.
+    @param status_version: The version of the status log.
+    @param streaming: Whether to parse in streaming mode.
+
+    @returns A tuple (tests, tests_to_report) of lists of the tests in the
+             status log, without duplicates, and of the tests among them to
+             report.
+    """
+    state = None
+    if streaming:
+        state = _load_parse_state(path, status_log, status_version)
+    if state:
+        tko_utils.dprint("+ Resuming the parse at offset %d" % state['offset'])
+        parser.start(job, state['checkpoint'])
+        tests = state['tests']
+        offset = state['offset']
+        reported_tests = state.get('reported_tests', set())
+    else:
+        parser.start(job)
+        tests = []
+        offset = 0
+        reported_tests = set()
+
+    with open(status_log) as f:
+        f.seek(offset)
+        status_lines = f.readlines()
+    finished = not streaming or job.finished_time is not None
+    if not finished and status_lines and not status_lines[-1].endswith('\n'):
+        # Leave the line being written for the next parse.
+        status_lines.pop()
+    if finished:
+        tests += parser.end(status_lines)
+    else:
+        tests += parser.process_lines(status_lines)
+
+    # the parser can return the same object multiple times, so filter out dups
+    unique_tests = []
+    already_added = set()
+    for test in tests:
+        if test not in already_added:
+            already_added.add(test)
+            unique_tests.append(test)
+    tests_to_report = [test for test in unique_tests
+                       if _get_test_key(test) not in reported_tests and
+                       (finished or test.status != 'RUNNING')]
+
+    if streaming:
+        checkpoint = parser.get_checkpoint()
+        state_file = os.path.join(path, _PARSE_STATE_FILE)
+        if checkpoint is not None:
+            offset += sum(len(line) for line in status_lines)
+            with open(status_log) as f:
+                tail_start = max(0, offset - _PARSE_STATE_TAIL_BYTES)
+                f.seek(tail_start)
+                tail = f.read(offset - tail_start)
+            # The tests and the checkpoint share objects, they must be
+            # pickled together.
+            _save_parse_state(path, {'status_log': os.path.basename(status_log),
+                                     'status_version': status_version,
+                                     'offset': offset,
+                                     'tail': tail,
+                                     'checkpoint': checkpoint,
+                                     'tests': unique_tests,
+                                     'reported_tests': reported_tests.union(
+                                             _get_test_key(test) for test
+                                             in tests_to_report)})
+        elif os.path.exists(state_file):
+            os.remove(state_file)
+    return unique_tests, tests_to_report
+
+
+def parse_one(db, jobname, path, reparse, mail_on_failure, streaming=False):
     """Parse a single job. Optionally send email on failure.
 
     @param db: database object.
@@ -186,6 +359,9 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
     @param path: The path to the results to be parsed.
     @param reparse: True/False, whether this is reparsing of the job.
     @param mail_on_failure: whether to send email on FAILED test.
+    @param streaming: True/False, whether to only parse the status lines
+                      appended since the previous streaming parse, and only
+                      report the tests completed since, see parse_status_log.
 
 
     """
@@ -220,17 +396,9 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
 
     # parse the status logs
     tko_utils.dprint("+ Parsing dir=%s, jobname=%s" % (path, jobname))
-    status_lines = open(status_log).readlines()
-    parser.start(job)
-    tests = parser.end(status_lines)
-
-    # parser.end can return the same object multiple times, so filter out dups
-    job.tests = []
-    already_added = set()
-    for test in tests:
-        if test not in already_added:
-            already_added.add(test)
-            job.tests.append(test)
+    job.tests, tests_to_report = parse_status_log(
+            parser, job, path, status_log, status_version, streaming)
+    finished = not streaming or job.finished_time is not None
 
     # try and port test_idx over from the old tests, but if old tests stop
     # matching up with new ones just give up
@@ -244,14 +412,6 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
                 tko_utils.dprint("! Reparse returned new test "
                                  "testname=%r subdir=%r" %
                                  (test.testname, test.subdir))
-        for test_idx in old_tests.itervalues():
-            where = {'test_idx' : test_idx}
-            db.delete('tko_iteration_result', where)
-            db.delete('tko_iteration_perf_value', where)
-            db.delete('tko_iteration_attributes', where)
-            db.delete('tko_test_attributes', where)
-            db.delete('tko_test_labels_tests', {'test_id': test_idx})
-            db.delete('tko_tests', where)
 
     # check for failures
     message_lines = [""]
@@ -263,6 +423,8 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
                          % (test.subdir, test.status, test.reason))
         if test.status != 'GOOD':
             job_successful = False
+            if test not in tests_to_report:
+                continue
             message_lines.append(format_failure_message(
                 jobname, test.kernel.base, test.subdir,
                 test.status, test.reason))
@@ -276,19 +438,29 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
         mailfailure(jobname, job, message)
 
     # write the job into the database.
-    db.insert_job(jobname, job,
-                  parent_job_id=job_keyval.get(constants.PARENT_JOB_ID, None))
+    with _db_writes():
+        # delete the old tests the reparse didn't return
+        for test_idx in old_tests.itervalues():
+            where = {'test_idx' : test_idx}
+            db.delete('tko_iteration_result', where)
+            db.delete('tko_iteration_perf_value', where)
+            db.delete('tko_iteration_attributes', where)
+            db.delete('tko_test_attributes', where)
+            db.delete('tko_test_labels_tests', {'test_id': test_idx})
+            db.delete('tko_tests', where)
+        db.insert_job(jobname, job, parent_job_id=job_keyval.get(
+                constants.PARENT_JOB_ID, None))
+
+        # Although the cursor has autocommit, we still need to force it to
+        # commit existing changes before we can use django models, otherwise
+        # it will go into deadlock when django models try to start a new
+        # trasaction while the current one has not finished yet.
+        db.commit()
 
     # Upload perf values to the perf dashboard, if applicable.
-    for test in job.tests:
+    for test in tests_to_report:
         perf_uploader.upload_test(job, test)
 
-    # Although the cursor has autocommit, we still need to force it to commit
-    # existing changes before we can use django models, otherwise it
-    # will go into deadlock when django models try to start a new trasaction
-    # while the current one has not finished yet.
-    db.commit()
-
     # Handle retry job.
     orig_afe_job_id = job_keyval.get(constants.RETRY_ORIGINAL_JOB_ID, None)
     if orig_afe_job_id:
@@ -305,7 +477,7 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
         binary_file_name = os.path.join(path, "job.serialize")
         serializer.serialize_to_binary(job, jobname, binary_file_name)
 
-        if reparse:
+        if reparse and finished:
             site_export_file = "autotest_lib.tko.site_export"
             site_export = utils.import_site_function(__file__,
                                                      site_export_file,
@@ -360,6 +532,7 @@ def _get_job_subdirs(path):
     # if this dir contains ONLY subdirectories, return them
     contents = set(os.listdir(path))
     contents.discard(".parse.lock")
+    contents.discard(_PARSE_STATE_FILE)
     subdirs = set(sub for sub in contents if
                   os.path.isdir(os.path.join(path, sub)))
     if len(contents) == len(subdirs) != 0:
@@ -369,7 +542,8 @@ def _get_job_subdirs(path):
     return None
 
 
-def parse_leaf_path(db, path, level, reparse, mail_on_failure):
+def parse_leaf_path(db, path, level, reparse, mail_on_failure,
+                    streaming=False):
     """Parse a leaf path.
 
     @param db: database handle.
@@ -377,6 +551,7 @@ def parse_leaf_path(db, path, level, reparse, mail_on_failure):
     @param level: Integer, level of subdirectories to include in the job name.
     @param reparse: True/False, whether this is reparsing of the job.
     @param mail_on_failure: whether to send email on FAILED test.
+    @param streaming: True/False, whether to parse in streaming mode.
 
     @returns: The job name of the parsed job, e.g. '123-chromeos-test/host1'
     """
@@ -384,13 +559,13 @@ def parse_leaf_path(db, path, level, reparse, mail_on_failure):
     jobname = "/".join(job_elements)
     try:
         db.run_with_retry(parse_one, db, jobname, path, reparse,
-                          mail_on_failure)
+                          mail_on_failure, streaming)
     except Exception:
         traceback.print_exc()
     return jobname
 
 
-def parse_path(db, path, level, reparse, mail_on_failure):
+def parse_path(db, path, level, reparse, mail_on_failure, streaming=False):
     """Parse a path
 
     @param db: database handle.
@@ -398,6 +573,7 @@ def parse_path(db, path, level, reparse, mail_on_failure):
     @param level: Integer, level of subdirectories to include in the job name.
     @param reparse: True/False, whether this is reparsing of the job.
     @param mail_on_failure: whether to send email on FAILED test.
+    @param streaming: True/False, whether to parse in streaming mode.
 
     @returns: A set of job names of the parsed jobs.
               set(['123-chromeos-test/host1', '123-chromeos-test/host2'])
@@ -409,16 +585,19 @@ def parse_path(db, path, level, reparse, mail_on_failure):
         # synchronous server side tests record output in this directory. without
         # this check, we do not parse these results.
         if os.path.exists(os.path.join(path, 'status.log')):
-            new_job = parse_leaf_path(db, path, level, reparse, mail_on_failure)
+            new_job = parse_leaf_path(db, path, level, reparse,
+                                      mail_on_failure, streaming)
             processed_jobs.add(new_job)
         # multi-machine job
         for subdir in job_subdirs:
             jobpath = os.path.join(path, subdir)
-            new_jobs = parse_path(db, jobpath, level + 1, reparse, mail_on_failure)
+            new_jobs = parse_path(db, jobpath, level + 1, reparse,
+                                  mail_on_failure, streaming)
             processed_jobs.update(new_jobs)
     else:
         # single machine job
-        new_job = parse_leaf_path(db, path, level, reparse, mail_on_failure)
+        new_job = parse_leaf_path(db, path, level, reparse, mail_on_failure,
+                                  streaming)
         processed_jobs.add(new_job)
     return processed_jobs
 
@@ -444,13 +623,181 @@ def record_parsing(processed_jobs, duration_secs):
                     duration_secs)
 
 
-def main():
-    """Main entrance."""
+@contextlib.contextmanager
+def _db_writes():
+    """Wait until this process may write to the database, see _init_worker."""
+    if _db_semaphore is None:
+        yield
+    else:
+        with _db_semaphore:
+            yield
+
+
+@contextlib.contextmanager
+def _parse_lock(path, noblock):
+    """Hold the parse lock of a results directory.
+
+    @param path: The path to the results directory.
+    @param noblock: If True, don't wait for a parse holding the lock.
+
+    @yields True if the lock is held, False if it is held by another parse
+            and noblock is set.
+    """
+    lockfile = open(os.path.join(path, ".parse.lock"), "w")
+    flags = fcntl.LOCK_EX
+    if noblock:
+        flags |= fcntl.LOCK_NB
+    try:
+        try:
+            fcntl.flock(lockfile, flags)
+        except IOError, e:
+            # lock is not available and nonblock has been requested
+            if e.errno == errno.EWOULDBLOCK:
+                yield False
+                return
+            else:
+                raise # something unexpected happened
+        try:
+            yield True
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+    finally:
+        lockfile.close()
+
+
+def _connect_db(options):
+    """Connect to the tko database.
+
+    @param options: The command line options.
+
+    @returns A database handle.
+    """
+    return tko_db.db(autocommit=False, host=options.db_host,
+                     user=options.db_user, password=options.db_pass,
+                     database=options.db_name)
+
+
+def _parse_results_dir(db, options, path, level, lock=True, leaf=False):
+    """Parse a results directory.
+
+    @param db: database handle.
+    @param options: The command line options.
+    @param path: The path to the results to be parsed.
+    @param level: Integer, level of subdirectories to include in the job name.
+    @param lock: True/False, whether to hold the parse lock of the directory.
+    @param leaf: True/False, whether to only parse the job in the directory,
+                 and not the jobs in its subdirectories.
+
+    @returns: A tuple of the set of the job names of the parsed jobs, and of
+              the time spent parsing them, in seconds. The set is empty if
+              the directory is locked by another parse and options.noblock
+              is set.
+    """
+    if lock:
+        with _parse_lock(path, options.noblock) as locked:
+            if not locked:
+                return set(), 0
+            return _parse_results_dir(db, options, path, level, lock=False,
+                                      leaf=leaf)
+
     start_time = datetime.datetime.now()
-    # Record the processed jobs so that
-    # we can send the duration of parsing to metadata db.
-    processed_jobs = set()
+    reparse = options.reparse or options.streaming
+    if leaf:
+        processed_jobs = set([parse_leaf_path(db, path, level, reparse,
+                                              options.mailit,
+                                              options.streaming)])
+    else:
+        processed_jobs = parse_path(db, path, level, reparse, options.mailit,
+                                    options.streaming)
+    duration = datetime.datetime.now() - start_time
+    return processed_jobs, duration.total_seconds()
+
+
+def _init_worker(options, db_semaphore):
+    """Initialize a parse process.
+
+    @param options: The command line options.
+    @param db_semaphore: A semaphore bounding the number of processes writing
+                         to the database at once, or None.
+    """
+    global _db_semaphore, _worker_db, _worker_options
+    # Don't share the django connection of the parent process.
+    from django.db import connection
+    connection.close()
+    _db_semaphore = db_semaphore
+    _worker_db = _connect_db(options)
+    _worker_options = options
 
+
+def _parse_in_worker(args):
+    """Parse a results directory in a parse process.
+
+    @param args: A tuple of the arguments of _parse_results_dir after the
+                 database handle and the options.
+
+    @returns: See _parse_results_dir.
+    """
+    return _parse_results_dir(_worker_db, _worker_options, *args)
+
+
+def _run_pool(options, units):
+    """Parse results directories in a pool of processes.
+
+    @param options: The command line options.
+    @param units: A list of tuples of arguments of _parse_in_worker.
+
+    @returns: A list of the results of _parse_results_dir.
+    """
+    db_semaphore = None
+    if options.db_concurrency > 0:
+        db_semaphore = multiprocessing.BoundedSemaphore(options.db_concurrency)
+    pool = multiprocessing.Pool(min(options.processes, len(units)) or 1,
+                                _init_worker, (options, db_semaphore))
+    try:
+        results = list(pool.imap_unordered(_parse_in_worker, units))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def _parse_in_parallel(options, results_dir, jobs_list):
+    """Parse job directories in parallel.
+
+    Each job directory is parsed by a process holding its parse lock. A
+    single directory of a multi-machine job is parsed one machine per
+    process instead, while this process holds its parse lock.
+
+    @param options: The command line options.
+    @param results_dir: The results directory given on the command line.
+    @param jobs_list: The list of the paths of the job directories to parse.
+
+    @returns: A list of the results of _parse_results_dir.
+    """
+    job_subdirs = None
+    if options.singledir:
+        job_subdirs = _get_job_subdirs(results_dir)
+    if job_subdirs is None:
+        return _run_pool(options, [(path, options.level)
+                                   for path in jobs_list])
+
+    with _parse_lock(results_dir, options.noblock) as locked:
+        if not locked:
+            return []
+        units = []
+        if os.path.exists(os.path.join(results_dir, 'status.log')):
+            units.append((results_dir, options.level, False, True))
+        units.extend((os.path.join(results_dir, subdir), options.level + 1,
+                      False)
+                     for subdir in sorted(job_subdirs))
+        return _run_pool(options, units)
+
+
+def main():
+    """Main entrance."""
     options, args = parse_args()
     results_dir = os.path.abspath(args[0])
     assert os.path.exists(results_dir)
@@ -468,43 +815,23 @@ def main():
             jobs_list = [os.path.join(results_dir, subdir)
                          for subdir in os.listdir(results_dir)]
 
-        # build up the database
-        db = tko_db.db(autocommit=False, host=options.db_host,
-                       user=options.db_user, password=options.db_pass,
-                       database=options.db_name)
-
-        # parse all the jobs
-        for path in jobs_list:
-            lockfile = open(os.path.join(path, ".parse.lock"), "w")
-            flags = fcntl.LOCK_EX
-            if options.noblock:
-                flags |= fcntl.LOCK_NB
-            try:
-                fcntl.flock(lockfile, flags)
-            except IOError, e:
-                # lock is not available and nonblock has been requested
-                if e.errno == errno.EWOULDBLOCK:
-                    lockfile.close()
-                    continue
-                else:
-                    raise # something unexpected happened
-            try:
-                new_jobs = parse_path(db, path, options.level, options.reparse,
-                           options.mailit)
-                processed_jobs.update(new_jobs)
-
-            finally:
-                fcntl.flock(lockfile, fcntl.LOCK_UN)
-                lockfile.close()
+        # parse all the jobs, recording the parsed jobs and the time spent on
+        # them so that we can send the duration of parsing to metadata db.
+        if options.processes > 1:
+            results = _parse_in_parallel(options, results_dir, jobs_list)
+        else:
+            db = _connect_db(options)
+            results = [_parse_results_dir(db, options, path, options.level)
+                       for path in jobs_list]
 
     except:
         pid_file_manager.close_file(1)
         raise
     else:
         pid_file_manager.close_file(0)
-    duration_secs = (datetime.datetime.now() - start_time).total_seconds()
     if options.record_duration:
-        record_parsing(processed_jobs, duration_secs)
+        for processed_jobs, duration_secs in results:
+            record_parsing(processed_jobs, duration_secs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+#!/usr/bin/python
+
+import fcntl, optparse, os, shutil, tempfile, unittest
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import setup_test_environment
+from autotest_lib.client.common_lib.test_utils import mock
+from autotest_lib.tko import parse, status_lib
+
+
+_STATUS_LOG = (
+        'START\t----\t----\ttimestamp=100\tlocaltime=Jan 01 00:00:00\t\n'
+        '\tSTART\tsleeptest\tsleeptest\ttimestamp=101\t'
+        'localtime=Jan 01 00:00:01\t\n'
+        '\t\tGOOD\tsleeptest\tsleeptest\ttimestamp=102\t'
+        'localtime=Jan 01 00:00:02\tcompleted successfully\n'
+        '\tEND GOOD\tsleeptest\tsleeptest\ttimestamp=102\t'
+        'localtime=Jan 01 00:00:02\t\n'
+        '\tSTART\tdummy_Fail\tdummy_Fail\ttimestamp=103\t'
+        'localtime=Jan 01 00:00:03\t\n'
+        '\t\tFAIL\tdummy_Fail\tdummy_Fail\ttimestamp=104\t'
+        'localtime=Jan 01 00:00:04\tfailed\n'
+        '\tEND FAIL\tdummy_Fail\tdummy_Fail\ttimestamp=104\t'
+        'localtime=Jan 01 00:00:04\t\n'
+        'END GOOD\t----\t----\ttimestamp=105\tlocaltime=Jan 01 00:00:05\t\n')
+
+
+class parse_status_log_test(unittest.TestCase):
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        self.status_log = os.path.join(self.job_dir, 'status.log')
+        self._write('keyval', 'hostname=host1\nuser=debug_user\n')
+        self._write('status.log', '')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.job_dir)
+
+
+    def _write(self, name, data, mode='w'):
+        with open(os.path.join(self.job_dir, name), mode) as f:
+            f.write(data)
+
+
+    def _parse(self, streaming):
+        parser = status_lib.parser(1)
+        job = parser.make_job(self.job_dir)
+        tests, _ = parse.parse_status_log(parser, job, self.job_dir,
+                                          self.status_log, 1, streaming)
+        return [(test.testname, test.status, test.reason) for test in tests]
+
+
+    def _state_exists(self):
+        return os.path.exists(os.path.join(self.job_dir,
+                                           parse._PARSE_STATE_FILE))
+
+
+    def test_streaming_matches_full_parse(self):
+        # Stop in the middle of the START line of the second test.
+        split = _STATUS_LOG.index('\tSTART\tdummy_Fail') + 10
+        self._write('status.log', _STATUS_LOG[:split])
+        self.assertEquals(
+                self._parse(streaming=True),
+                [('SERVER_JOB', 'RUNNING', ''),
+                 ('CLIENT_JOB.0', 'RUNNING', ''),
+                 ('sleeptest', 'GOOD', 'completed successfully')])
+        self.assertTrue(self._state_exists())
+
+        self._write('status.log', _STATUS_LOG[split:], mode='a')
+        self._write('keyval', 'job_finished=106\n', mode='a')
+        tests = self._parse(streaming=True)
+        self.assertFalse(self._state_exists())
+        self.assertEquals(tests, self._parse(streaming=False))
+        self.assertEquals([test[:2] for test in tests[1:]],
+                          [('CLIENT_JOB.0', 'GOOD'),
+                           ('sleeptest', 'GOOD'),
+                           ('dummy_Fail', 'FAIL')])
+
+
+    def test_replaced_status_log_parsed_again(self):
+        self._write('status.log', _STATUS_LOG)
+        self._parse(streaming=True)
+        self._write('status.log', _STATUS_LOG.replace('sleeptest', 'sleeptst'))
+        self.assertEquals([test[0] for test in self._parse(streaming=True)],
+                          ['SERVER_JOB', 'CLIENT_JOB.0', 'sleeptst',
+                           'dummy_Fail'])
+
+
+class fake_db(object):
+    """Records the jobs inserted, without their tests."""
+
+    def __init__(self):
+        self.jobs = {}
+
+
+    def find_job(self, tag):
+        return self.jobs.get(tag)
+
+
+    def select(self, fields, table, where):
+        return []
+
+
+    def insert_job(self, tag, job, parent_job_id=None):
+        job.index = self.jobs.setdefault(tag, len(self.jobs) + 1)
+
+
+    def commit(self):
+        pass
+
+
+class streaming_report_test(parse_status_log_test):
+    def setUp(self):
+        super(streaming_report_test, self).setUp()
+        self._write('keyval', 'status_version=1\n', mode='a')
+        self.god = mock.mock_god()
+        self.uploaded = []
+        self.mailed = []
+        self.god.stub_with(parse.perf_uploader, 'upload_test',
+                           lambda job, test: self.uploaded.append(
+                                   test.testname))
+        self.god.stub_with(parse, 'mailfailure',
+                           lambda jobname, job, message: self.mailed.append(
+                                   message))
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+        super(streaming_report_test, self).tearDown()
+
+
+    def test_tests_reported_once(self):
+        db = fake_db()
+        # Stop after the end of the failed test.
+        split = _STATUS_LOG.index('END GOOD\t----')
+        self._write('status.log', _STATUS_LOG[:split])
+        parse.parse_one(db, '1-user/host1', self.job_dir, True, True,
+                        streaming=True)
+        self.assertEquals(sorted(self.uploaded), ['dummy_Fail', 'sleeptest'])
+        self.assertEquals(len(self.mailed), 1)
+        self.assertIn('dummy_Fail', self.mailed[0])
+
+        self._write('status.log', _STATUS_LOG[split:], mode='a')
+        self._write('keyval', 'job_finished=106\n', mode='a')
+        parse.parse_one(db, '1-user/host1', self.job_dir, True, True,
+                        streaming=True)
+        self.assertEquals(sorted(self.uploaded),
+                          ['CLIENT_JOB.0', 'SERVER_JOB', 'dummy_Fail',
+                           'sleeptest'])
+        # Only the failure of the job ending is new.
+        self.assertEquals(len(self.mailed), 2)
+        self.assertNotIn('dummy_Fail', self.mailed[1])
+        self.assertIn('ABORT', self.mailed[1])
+
+
+class parallel_parse_test(unittest.TestCase):
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.results_dir = tempfile.mkdtemp()
+        self.options = optparse.Values(dict(
+                noblock=True, reparse=True, streaming=False, mailit=False,
+                singledir=False, level=1, processes=2, db_concurrency=1))
+        self.god.stub_with(parse, '_connect_db', lambda options: None)
+        self.god.stub_with(parse, 'parse_path', self._parse_path)
+        self.god.stub_with(parse, 'parse_leaf_path', self._parse_leaf_path)
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.results_dir)
+
+
+    def _parse_leaf_path(self, db, path, level, reparse, mail_on_failure,
+                         streaming):
+        return (os.path.basename(path), level, os.getpid())
+
+
+    def _parse_path(self, db, path, level, reparse, mail_on_failure,
+                    streaming):
+        return set([self._parse_leaf_path(db, path, level, reparse,
+                                          mail_on_failure, streaming)])
+
+
+    def _make_dirs(self, *names):
+        paths = []
+        for name in names:
+            path = os.path.join(self.results_dir, name)
+            os.makedirs(path)
+            paths.append(path)
+        return paths
+
+
+    def test_locked_directory_skipped(self):
+        path, = self._make_dirs('1-user')
+        with open(os.path.join(path, '.parse.lock'), 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            self.assertEquals(
+                    parse._parse_results_dir(None, self.options, path, 1),
+                    (set(), 0))
+        processed_jobs, _ = parse._parse_results_dir(None, self.options, path,
+                                                     1)
+        self.assertEquals([job[:2] for job in processed_jobs],
+                          [('1-user', 1)])
+
+
+    def test_jobs_parsed_in_processes(self):
+        paths = self._make_dirs(*['%d-user' % i for i in xrange(4)])
+        results = parse._parse_in_parallel(self.options, self.results_dir,
+                                           paths)
+        jobs = [job for processed_jobs, _ in results for job in processed_jobs]
+        self.assertEquals(sorted(job[:2] for job in jobs),
+                          [('%d-user' % i, 1) for i in xrange(4)])
+        self.assertNotIn(os.getpid(), [job[2] for job in jobs])
+
+
+    def test_machines_parsed_in_processes(self):
+        self._make_dirs('host1', 'host2')
+        with open(os.path.join(self.results_dir, '.machines'), 'w') as f:
+            f.write('host1\nhost2\n')
+        with open(os.path.join(self.results_dir, 'status.log'), 'w'):
+            pass
+        self.options.singledir = True
+        results = parse._parse_in_parallel(self.options, self.results_dir,
+                                           [self.results_dir])
+        jobs = [job for processed_jobs, _ in results for job in processed_jobs]
+        self.assertEquals(
+                sorted(job[:2] for job in jobs),
+                [('host1', 2), ('host2', 2),
+                 (os.path.basename(self.results_dir), 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,13 +9,16 @@ class parser(object):
     standard parser interfaction functions. The derived classes must
     implement a state_iterator method for this class to be useful.
     """
-    def start(self, job):
+    def start(self, job, checkpoint=None):
         """ Initialize the parser for processing the results of
-        'job'."""
+        'job'. If 'checkpoint' is given, resume the parsing where the
+        parser that made it, with get_checkpoint, stopped."""
         # initialize all the basic parser parameters
         self.job = job
         self.finished = False
         self.line_buffer = status_lib.line_buffer()
+        self.resumed_checkpoint = checkpoint
+        self.checkpoint = None
         # create and prime the parser state machine
         self.state = self.state_iterator(self.line_buffer)
         self.state.next()
@@ -57,6 +60,15 @@ class parser(object):
             return []
 
 
+    def get_checkpoint(self):
+        """ Return the state of the parser after the lines processed so
+        far, as a picklable object to resume parsing from with start, or
+        None if the parser doesn't support resuming."""
+        if self.finished:
+            return None
+        return self.checkpoint
+
+
     @staticmethod
     def make_job(dir):
         """ Create a new instance of the job model used by the
@@ -66,5 +78,7 @@ class parser(object):
 
     def state_iterator(self, buffer):
         """ A generator method that implements the actual parser
-        state machine. """
+        state machine. To support resuming, it starts from
+        self.resumed_checkpoint if it is set, and sets self.checkpoint
+        whenever it waits for more lines. """
         raise NotImplementedError
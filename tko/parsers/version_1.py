@@ -291,25 +291,34 @@ class parser(base.parser):
 
 
     def state_iterator(self, buffer):
-        line = None
         new_tests = []
-        job_count, boot_count = 0, 0
-        min_stack_size = 0
-        stack = status_lib.status_stack()
-        current_kernel = kernel("", [])  # UNKNOWN
-        current_status = status_lib.statuses[-1]
-        current_reason = None
-        started_time_stack = [None]
-        subdir_stack = [None]
-        running_test = None
-        running_reasons = set()
-        yield []   # We're ready to start running.
-
-        # Create a RUNNING SERVER_JOB entry to represent the entire test.
-        running_job = test.parse_partial_test(self.job, '----', 'SERVER_JOB',
-                                              '', current_kernel,
-                                              self.job.started_time)
-        new_tests.append(running_job)
+        if self.resumed_checkpoint:
+            (line, job_count, boot_count, min_stack_size, stack,
+             current_kernel, current_status, current_reason,
+             started_time_stack, subdir_stack, running_test, running_reasons,
+             running_job, running_client) = self.resumed_checkpoint
+            yield []   # We're ready to resume running.
+        else:
+            line = None
+            job_count, boot_count = 0, 0
+            min_stack_size = 0
+            stack = status_lib.status_stack()
+            current_kernel = kernel("", [])  # UNKNOWN
+            current_status = status_lib.statuses[-1]
+            current_reason = None
+            started_time_stack = [None]
+            subdir_stack = [None]
+            running_test = None
+            running_reasons = set()
+            running_client = None
+            yield []   # We're ready to start running.
+
+            # Create a RUNNING SERVER_JOB entry to represent the entire test.
+            running_job = test.parse_partial_test(self.job, '----',
+                                                  'SERVER_JOB', '',
+                                                  current_kernel,
+                                                  self.job.started_time)
+            new_tests.append(running_job)
 
         while True:
             # Are we finished with parsing?
@@ -339,6 +348,12 @@ class parser(base.parser):
 
             # Stop processing once the buffer is empty.
             if buffer.size() == 0:
+                # The state kept between lines, to resume parsing from.
+                self.checkpoint = (line, job_count, boot_count, min_stack_size,
+                                   stack, current_kernel, current_status,
+                                   current_reason, started_time_stack,
+                                   subdir_stack, running_test, running_reasons,
+                                   running_job, running_client)
                 yield new_tests
                 new_tests = []
                 continue